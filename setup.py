@@ -84,6 +84,7 @@ BUILD_REQUIRES = [
 ]
 
 DP_REQUIRES = [
+    "orjson>=3.8.0",
     "pyngrok>=6.0.0",
     "superai-dataclient~=0.1.0",
     "superai-schema~=0.7",
@@ -105,7 +106,12 @@ TEST_REQUIRES = [
     "vcrpy>=4.1.1",
 ]
 
+ASYNC_REQUIRES = [
+    "aiohttp>=3.8",
+]
+
 LLM_REQUIRES = [
+    "regex",
     "tabulate~=0.9.0",
     "tiktoken~=0.4.0",
     "openai~=0.27.2",
@@ -162,12 +168,14 @@ setup(
         "dp": DP_REQUIRES,
         "ai": AI_REQUIRES + DP_REQUIRES,
         "llm": LLM_REQUIRES + AI_REQUIRES + AI_EXPERIMENTAL_REQUIRES + DP_REQUIRES,
-        "test": LLM_REQUIRES + TEST_REQUIRES + DP_REQUIRES + AI_REQUIRES + AI_EXPERIMENTAL_REQUIRES,
+        "async": ASYNC_REQUIRES,
+        "test": ASYNC_REQUIRES + LLM_REQUIRES + TEST_REQUIRES + DP_REQUIRES + AI_REQUIRES + AI_EXPERIMENTAL_REQUIRES,
         "complete": BUILD_REQUIRES
         + DP_REQUIRES
         + AI_REQUIRES
         + AI_EXPERIMENTAL_REQUIRES
         + LLM_REQUIRES
+        + ASYNC_REQUIRES
         + TEST_REQUIRES,
     },
     packages=find_packages(),
@@ -0,0 +1,283 @@
+"""Bulk submission of jobs: inputs read lazily, packed in batches, submitted concurrently, with a resumable checkpoint.
+
+Inputs are indexed by their position in the input stream, e.g. their line in a JSON lines file. They are packed in
+batches of at most `max_batch_inputs` inputs and `max_batch_bytes` bytes of JSON, each one submitted by a
+`create_jobs` request. Every acknowledged batch is appended to the checkpoint file; a submission given the same inputs
+and checkpoint skips the inputs already submitted. A batch whose request succeeded but which wasn't checkpointed yet
+when the process stopped is submitted again on resume.
+"""
+import asyncio
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from attr import define
+
+from superai.config import settings
+from superai.log import logger
+
+log = logger.get_logger(__name__)
+
+__all__ = [
+    "Batch",
+    "BulkOptions",
+    "Checkpoint",
+    "SubmittedJob",
+    "async_submit_batches",
+    "pack_batches",
+    "read_inputs",
+    "submit_batches",
+]
+
+Inputs = Union[str, os.PathLike, Iterable[dict]]
+
+
+@define(frozen=True)
+class SubmittedJob:
+    """Submission of an input: the ID of its batch, and the UUID of its job, returned for batches of a single input."""
+
+    batch_id: Optional[str] = None
+    job_id: Optional[str] = None
+
+
+@define
+class Batch:
+    indices: List[int]
+    inputs: List[dict]
+
+
+def read_inputs(inputs: Inputs) -> Iterator[dict]:
+    """Inputs of a JSON lines (`.jsonl`, `.ndjson`) or CSV file, read lazily, or of a JSON file holding a list of
+    inputs, which is loaded at once. An iterable of inputs is returned as is."""
+    if not isinstance(inputs, (str, os.PathLike)):
+        yield from inputs
+        return
+    extension = os.path.splitext(inputs)[1].lower()
+    with open(inputs, newline="" if extension == ".csv" else None) as file:
+        if extension == ".csv":
+            yield from csv.DictReader(file)
+        elif extension == ".json":
+            yield from json.load(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def pack_batches(
+    inputs: Iterable[dict], max_batch_inputs: int, max_batch_bytes: int, skip: Dict[int, SubmittedJob] = None
+) -> Iterator[Batch]:
+    """Packs the inputs not in `skip` in batches of at most `max_batch_inputs` inputs and `max_batch_bytes` bytes of
+    JSON. An input larger than `max_batch_bytes` is sent alone."""
+    batch, size = Batch([], []), 0
+    for index, input in enumerate(inputs):
+        if skip and index in skip:
+            continue
+        input_size = len(json.dumps(input)) + 1
+        if batch.inputs and (len(batch.inputs) >= max_batch_inputs or size + input_size > max_batch_bytes):
+            yield batch
+            batch, size = Batch([], []), 0
+        batch.indices.append(index)
+        batch.inputs.append(input)
+        size += input_size
+    if batch.inputs:
+        yield batch
+
+
+def _ranges(indices: List[int]) -> List[Tuple[int, int]]:
+    """`[start, stop)` ranges of consecutive indices."""
+    ranges = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([index, index + 1])
+    return ranges
+
+
+class Checkpoint:
+    """JSON lines file of the submitted batches, appended and synced to disk as each batch is acknowledged."""
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[int, SubmittedJob]:
+        """Submissions of the inputs recorded in the file, if it exists."""
+        submitted = {}
+        if not os.path.exists(self.path):
+            return submitted
+        end, last_line = 0, b""
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.strip():
+                    end += len(line)
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last record is cut if the process stopped while writing it, it is removed
+                    log.warning(f"Ignoring the incomplete last record of checkpoint {self.path}")
+                    break
+                job = SubmittedJob(record.get("batch_id"), record.get("job_id"))
+                for start, stop in record["ranges"]:
+                    submitted.update(dict.fromkeys(range(start, stop), job))
+                end += len(line)
+                last_line = line
+        if end < os.path.getsize(self.path):
+            os.truncate(self.path, end)
+        elif end and not last_line.endswith(b"\n"):
+            # The record is complete but its line isn't, the next one must start on a line of its own
+            with open(self.path, "a") as file:
+                file.write("\n")
+        return submitted
+
+    def record(self, batch: Batch, job: SubmittedJob):
+        line = json.dumps({"ranges": _ranges(batch.indices), "batch_id": job.batch_id, "job_id": job.job_id})
+        with self._lock, open(self.path, "a") as file:
+            file.write(line + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class _RateLimit:
+    """Spaces the submissions `1 / rate` seconds apart, across the submitting threads or tasks."""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Seconds to wait before the next submission."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + self.interval
+            return start - now
+
+
+def _submitted_job(batch: Batch, response: Optional[dict]) -> SubmittedJob:
+    response = response or {}
+    return SubmittedJob(response.get("batchId"), response.get("uuid") if len(batch.inputs) == 1 else None)
+
+
+@define
+class BulkOptions:
+    """Options of a bulk submission, the ones left to `None` are read from the `bulk_jobs` settings."""
+
+    max_batch_inputs: Optional[int] = None
+    max_batch_bytes: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    max_batches_per_second: Optional[float] = None
+    checkpoint: Optional[Union[str, os.PathLike]] = None
+
+    def __attrs_post_init__(self):
+        self.max_batch_inputs = self.max_batch_inputs or int(settings.get("bulk_jobs.max_batch_inputs", 500))
+        self.max_batch_bytes = self.max_batch_bytes or int(settings.get("bulk_jobs.max_batch_bytes", 5242880))
+        self.max_concurrency = self.max_concurrency or int(settings.get("bulk_jobs.max_concurrency", 4))
+        if self.max_batches_per_second is None:
+            self.max_batches_per_second = settings.get("bulk_jobs.max_batches_per_second", None)
+
+    def start(self, inputs: Inputs) -> Tuple[Optional[Checkpoint], Dict[int, SubmittedJob], Iterator[Batch]]:
+        """Checkpoint, inputs already submitted and batches left to submit."""
+        checkpoint = Checkpoint(self.checkpoint) if self.checkpoint is not None else None
+        submitted = checkpoint.load() if checkpoint is not None else {}
+        if submitted:
+            log.info(f"Resuming the submission after {len(submitted)} inputs recorded in {self.checkpoint}")
+        batches = pack_batches(read_inputs(inputs), self.max_batch_inputs, self.max_batch_bytes, skip=submitted)
+        return checkpoint, submitted, batches
+
+
+def submit_batches(
+    inputs: Inputs, submit: Callable[[List[dict]], Optional[dict]], options: BulkOptions
+) -> Dict[int, SubmittedJob]:
+    """Submits the inputs in batches with `submit` from `options.max_concurrency` threads.
+
+    If a batch fails, no more batches are submitted, the ones in flight are completed and checkpointed, and the error is
+    raised.
+
+    Returns:
+        The submission of every input, by index.
+    """
+    checkpoint, submitted, batches = options.start(inputs)
+    rate_limit = _RateLimit(options.max_batches_per_second)
+
+    def send(batch: Batch) -> SubmittedJob:
+        time.sleep(rate_limit.reserve())
+        job = _submitted_job(batch, submit(batch.inputs))
+        if checkpoint is not None:
+            checkpoint.record(batch, job)
+        return job
+
+    def collect(futures) -> Optional[Exception]:
+        error = None
+        for future in futures:
+            batch = in_flight.pop(future)
+            try:
+                submitted.update(dict.fromkeys(batch.indices, future.result()))
+            except Exception as e:
+                log.error(f"Batch of inputs {batch.indices[0]} to {batch.indices[-1]} failed: {e}")
+                error = error or e
+        return error
+
+    in_flight = {}
+    error = None
+    with ThreadPoolExecutor(options.max_concurrency, thread_name_prefix="bulk-jobs") as pool:
+        for batch in batches:
+            # Inputs are read as batches are sent, only a few batches are held in memory
+            if len(in_flight) >= 2 * options.max_concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                error = collect(done)
+                if error is not None:
+                    break
+            in_flight[pool.submit(send, batch)] = batch
+        error = collect(list(in_flight)) or error
+    if error is not None:
+        raise error
+    return submitted
+
+
+async def async_submit_batches(inputs: Inputs, submit: Callable, options: BulkOptions) -> Dict[int, SubmittedJob]:
+    """Async version of `submit_batches`, `submit` returns an awaitable of the response."""
+    loop = asyncio.get_running_loop()
+    checkpoint, submitted, batches = options.start(inputs)
+    rate_limit = _RateLimit(options.max_batches_per_second)
+
+    async def send(batch: Batch) -> SubmittedJob:
+        await asyncio.sleep(rate_limit.reserve())
+        job = _submitted_job(batch, await submit(batch.inputs))
+        if checkpoint is not None:
+            await loop.run_in_executor(None, checkpoint.record, batch, job)
+        return job
+
+    def collect(tasks) -> Optional[BaseException]:
+        error = None
+        for task in tasks:
+            batch = in_flight.pop(task)
+            if task.exception() is None:
+                submitted.update(dict.fromkeys(batch.indices, task.result()))
+            else:
+                log.error(f"Batch of inputs {batch.indices[0]} to {batch.indices[-1]} failed: {task.exception()}")
+                error = error or task.exception()
+        return error
+
+    in_flight = {}
+    error = None
+    for batch in batches:
+        if len(in_flight) >= options.max_concurrency:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            error = collect(done)
+            if error is not None:
+                break
+        in_flight[asyncio.ensure_future(send(batch))] = batch
+    if in_flight:
+        await asyncio.wait(in_flight)
+        error = collect(list(in_flight)) or error
+    if error is not None:
+        raise error
+    return submitted
@@ -1,12 +1,14 @@
+import os
 from abc import ABC, abstractmethod
-from typing import BinaryIO, Generator, List
-
-import requests
+from typing import BinaryIO, Callable, List, Optional, Union
 
+from superai.apis.http_session import SessionMixin
+from superai.apis.pagination import PageCursor, PageIterator, PaginationMixin
+from superai.apis.transfer import TransferOptions, download_file, upload_file
 from superai.exceptions import SuperAIStorageError
 
 
-class DataApiMixin(ABC):
+class DataApiMixin(SessionMixin, PaginationMixin, ABC):
     _resource = "data"
 
     @abstractmethod
@@ -68,8 +70,10 @@ class DataApiMixin(ABC):
         recursive: bool = False,
         signed_url: bool = False,
         seconds_ttl: int = 600,
-    ) -> Generator[dict, None, None]:
-        """Generator that retrieves all data filtered using an array of IDs or an array of paths.
+        prefetch: int = None,
+        cursor: PageCursor = None,
+    ) -> PageIterator:
+        """Iterator that retrieves all data filtered using an array of IDs or an array of paths.
 
         Args:
             data_ids: Array of data IDs.
@@ -77,14 +81,14 @@ class DataApiMixin(ABC):
             recursive: Get all datasets from recursive path (only takes first path of array).
             signed_url: Get signed URL for each dataset.
             seconds_ttl: Time to live for signed URL.
+            prefetch: Number of pages fetched ahead, by default the `http.prefetch_pages` setting.
+            cursor: `cursor` of a previous iterator, to resume the listing where it stopped.
 
         Returns:
-            Generator that yields complete list of dicts with data objects.
+            Iterator that yields complete list of dicts with data objects.
         """
-        page = 0
-        paginated_data = {"last": False}
-        while not paginated_data["last"]:
-            paginated_data = self.list_data(
+        return self._paginate(
+            lambda page: self.list_data(
                 data_ids=data_ids,
                 paths=paths,
                 recursive=recursive,
@@ -92,9 +96,11 @@ class DataApiMixin(ABC):
                 seconds_ttl=seconds_ttl,
                 page=page,
                 size=500,
-            )
-            yield from paginated_data["content"]
-            page = page + 1
+            ),
+            "content",
+            prefetch=prefetch,
+            cursor=cursor,
+        )
 
     def get_signed_url(self, path: str, seconds_ttl: int = 600) -> dict:
         """Gets signed URL for a dataset given its path.
@@ -116,7 +122,7 @@ class DataApiMixin(ABC):
         )
 
     def download_data(self, path: str, timeout: int = 5):
-        """Downloads data given a `"data://..."` or URL path.
+        """Downloads data given a `"data://..."` or URL path. Use `download_data_to_file` for large datasets.
 
         Args:
         path: Dataset's path.
@@ -125,13 +131,40 @@ class DataApiMixin(ABC):
             URL content.
         """
         signed_url = self.get_signed_url(path)
-        res = requests.get(signed_url.get("signedUrl"), timeout=timeout)
+        res = self.session.get(signed_url.get("signedUrl"), timeout=timeout)
 
         if res.status_code == 200:
             return res.json()
         else:
             raise SuperAIStorageError(res.reason)
 
+    def download_data_to_file(
+        self,
+        path: str,
+        destination: Union[str, os.PathLike],
+        md5: Optional[str] = None,
+        part_size: int = None,
+        max_concurrency: int = None,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    ) -> str:
+        """Downloads a dataset to a file, streamed to disk in parts fetched in parallel. A download interrupted before
+        is resumed from the parts already written.
+
+        Args:
+            path: Dataset's path e.g., `"data://.."`.
+            destination: Path of the file.
+            md5: Expected MD5 of the dataset, checked in addition to the ETag of the stored object.
+            part_size: Bytes of each ranged request, by default the `transfer.part_size` setting.
+            max_concurrency: Parts downloaded at once, by default the `transfer.max_concurrency` setting.
+            progress: Called with the bytes downloaded and the size of the dataset.
+
+        Returns:
+            The path of the file.
+        """
+        signed_url = self.get_signed_url(path)
+        options = TransferOptions(part_size=part_size, max_concurrency=max_concurrency)
+        return download_file(self.session, signed_url["signedUrl"], destination, options, md5=md5, progress=progress)
+
     def delete_data(self, path: str) -> dict:
         """Deletes a dataset given its path.
 
@@ -143,14 +176,15 @@ class DataApiMixin(ABC):
         """
         return self.request(self.resource, method="DELETE", query_params={"path": path}, required_api_key=True)
 
-    def upload_data(self, path: str, description: str, mime_type: str, file: BinaryIO) -> dict:
-        """Creates or updates a dataset given its path using file and mimeType.
+    def upload_data(self, path: str, description: str, mime_type: str, file: Union[BinaryIO, str, os.PathLike]) -> dict:
+        """Creates or updates a dataset given its path using file and mimeType. The file is streamed from disk and its
+        MD5 checked against the stored object.
 
         Args:
             path: Path of dataset.
             description: Description of dataset.
             mime_type: Type of file.
-            file: Binary File value.
+            file: Binary File value, or path of the file.
 
         Returns:
             The dataset created or updated.
@@ -162,14 +196,8 @@ class DataApiMixin(ABC):
             required_api_key=True,
         )
         try:
-            resp = requests.put(dataset.pop("uploadUrl"), data=file.read(), headers={"Content-Type": mime_type})
-            if resp.status_code in [200, 201]:
-                return dataset
-            else:
-                raise SuperAIStorageError(
-                    f'File {str(file)} referenced by dataset {dataset["path"]} couldn\'t be uploaded to super.AI '
-                    f"Storage"
-                )
+            upload_file(self.session, dataset.pop("uploadUrl"), file, mime_type)
+            return dataset
         except Exception as e:
             raise SuperAIStorageError(
                 f'File {str(file)} referenced by dataset {dataset["path"]} couldn\'t be uploaded to super.AI Storage '
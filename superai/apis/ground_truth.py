@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Generator
 
+from superai.apis.pagination import PageCursor, PageIterator, PaginationMixin
 
-class GroundTruthApiMixin(ABC):
+
+class GroundTruthApiMixin(PaginationMixin, ABC):
     @abstractmethod
     def request(self, uri, method, body_params=None, query_params=None, required_api_key=False, header_params=None):
         pass
@@ -85,21 +86,23 @@ class GroundTruthApiMixin(ABC):
             q_params["size"] = size
         return self.request(uri, "GET", required_api_key=True, query_params=q_params)
 
-    def get_all_ground_truth_data(self, app_id: str) -> Generator[dict, None, None]:
-        """Generator that retrieves all ground truth data given an application ID.
+    def get_all_ground_truth_data(self, app_id: str, prefetch: int = None, cursor: PageCursor = None) -> PageIterator:
+        """Iterator that retrieves all ground truth data given an application ID.
 
         Args:
             app_id: Application ID.
+            prefetch: Number of pages fetched ahead, by default the `http.prefetch_pages` setting.
+            cursor: `cursor` of a previous iterator, to resume the listing where it stopped.
 
         Yields:
-            A generator that yields a complete list of dicts with ground truth data objects.
+            An iterator that yields a complete list of dicts with ground truth data objects.
         """
-        page = 0
-        paginated_ground_truth = {"last": False}
-        while not paginated_ground_truth["last"]:
-            paginated_ground_truth = self.list_ground_truth_data(app_id, page=page, size=500)
-            yield from paginated_ground_truth["content"]
-            page = page + 1
+        return self._paginate(
+            lambda page: self.list_ground_truth_data(app_id, page=page, size=500),
+            "content",
+            prefetch=prefetch,
+            cursor=cursor,
+        )
 
     def get_ground_truth_data(self, ground_truth_data_id: str) -> dict:
         """Fetches a single ground truth data object.
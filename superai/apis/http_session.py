@@ -0,0 +1,133 @@
+"""Pooled keep-alive HTTP session shared by the REST API mixins of `superai.client.Client`.
+
+`requests.request` opens a new connection, with its TCP and TLS handshakes, for every call. The session keeps the
+connections of each host alive in a pool sized for the threads using the client, asks for gzip-compressed responses,
+applies default timeouts, and retries failed requests with a jittered exponential backoff when it is safe to do so.
+"""
+import random
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from superai.config import settings
+
+__all__ = [
+    "IDEMPOTENT_METHODS",
+    "RETRY_STATUSES",
+    "JitteredRetry",
+    "PooledHTTPAdapter",
+    "SessionMixin",
+    "create_session",
+    "default_session",
+]
+
+# Requests which can be sent twice without changing their effect, the only ones retried after a read error or a
+# gateway error, as the server may have processed them
+IDEMPOTENT_METHODS = frozenset({"DELETE", "GET", "HEAD", "OPTIONS", "PUT", "TRACE"})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class JitteredRetry(Retry):
+    """Retry policy of the API session.
+
+    Connection errors are retried for every method since the request never reached the server, read errors and gateway
+    errors only for idempotent methods. A request rejected by the rate limit wasn't processed either, so a 429 is
+    retried whatever the method. The exponential backoff is jittered, half of it at random, so that the clients failing
+    together don't retry together; a `Retry-After` header takes precedence.
+    """
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429 and self.status_forcelist and status_code in self.status_forcelist:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """`HTTPAdapter` applying a default timeout to the requests sent without one."""
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["timeout"]
+
+    def __init__(self, timeout: Optional[Timeout] = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+def create_session(
+    pool_connections: int = None,
+    pool_maxsize: int = None,
+    host_pool_maxsize: Dict[str, int] = None,
+    timeout: Optional[Timeout] = None,
+    retries: int = None,
+    backoff_factor: float = None,
+) -> requests.Session:
+    """Creates a pooled keep-alive session, the arguments left to `None` are read from the `http` settings.
+
+    Args:
+        pool_connections: Number of hosts whose connection pool is kept.
+        pool_maxsize: Connections kept alive per host, should be at least the number of threads using the session.
+        host_pool_maxsize: Connections kept alive for specific hosts, by URL prefix, e.g. `{"https://api.super.ai": 64}`.
+        timeout: Default `(connect, read)` timeout in seconds of the requests sent without one.
+        retries: Maximum number of retries of a request.
+        backoff_factor: Base of the exponential backoff between retries in seconds.
+
+    Returns:
+        The session, to be used like `requests`.
+    """
+    pool_connections = pool_connections or int(settings.get("http.pool_connections", 10))
+    pool_maxsize = pool_maxsize or int(settings.get("http.pool_maxsize", 32))
+    if host_pool_maxsize is None:
+        host_pool_maxsize = dict(settings.get("http.host_pool_maxsize", None) or {})
+    if timeout is None:
+        timeout = (float(settings.get("http.connect_timeout", 10)), float(settings.get("http.read_timeout", 300)))
+    retry = JitteredRetry(
+        total=int(settings.get("http.retries", 3)) if retries is None else retries,
+        allowed_methods=IDEMPOTENT_METHODS,
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=float(settings.get("http.backoff_factor", 0.5)) if backoff_factor is None else backoff_factor,
+        # The last response is returned once the retries are exhausted, for the client to report the error
+        raise_on_status=False,
+    )
+
+    session = requests.Session()
+    for prefix, maxsize in [("https://", pool_maxsize), ("http://", pool_maxsize), *host_pool_maxsize.items()]:
+        adapter = PooledHTTPAdapter(
+            timeout=timeout, pool_connections=pool_connections, pool_maxsize=int(maxsize), max_retries=retry
+        )
+        session.mount(prefix, adapter)
+    return session
+
+
+_default_session: Optional[requests.Session] = None
+_default_session_lock = threading.Lock()
+
+
+def default_session() -> requests.Session:
+    """Process-wide session, created on first use, shared by the clients which weren't given their own."""
+    global _default_session
+    if _default_session is None:
+        with _default_session_lock:
+            if _default_session is None:
+                _default_session = create_session()
+    return _default_session
+
+
+class SessionMixin:
+    """Gives the API mixins the session of the client, or the process-wide one when a mixin is used on its own."""
+
+    _session: Optional[requests.Session] = None
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session or default_session()
@@ -3,18 +3,22 @@ import time
 from abc import ABC, abstractmethod
 from datetime import datetime
 from io import BytesIO
-from typing import Generator, List, Optional
+from typing import Dict, List, Optional
 from zipfile import ZipFile
 
-import requests
 from rich.console import Console
 
+from superai.apis.bulk import BulkOptions, Inputs, SubmittedJob, submit_batches
+from superai.apis.http_session import SessionMixin
+from superai.apis.pagination import PageCursor, PageIterator, PaginationMixin
 from superai.log import logger
 
 log = logger.get_logger(__name__)
 
 
-class JobsApiMixin(ABC):
+class JobsApiMixin(SessionMixin, PaginationMixin, ABC):
+    _submit_batches = staticmethod(submit_batches)
+
     @abstractmethod
     def request(self, uri, method, body_params=None, query_params=None, required_api_key=False, header_params=None):
         pass
@@ -62,6 +66,52 @@ class JobsApiMixin(ABC):
         uri = f"apps/{app_id}/jobs"
         return self.request(uri, method="POST", body_params=body_json, required_api_key=True)
 
+    def bulk_create_jobs(
+        self,
+        app_id: str,
+        inputs: Inputs,
+        callback_url: str = None,
+        metadata: dict = None,
+        worker: str = None,
+        parked: bool = None,
+        tags: str = None,
+        max_batch_inputs: int = None,
+        max_batch_bytes: int = None,
+        max_concurrency: int = None,
+        max_batches_per_second: float = None,
+        checkpoint: str = None,
+    ) -> Dict[int, SubmittedJob]:
+        """Submits jobs from a stream of inputs of any size, in batches sent concurrently. The options left to `None`
+        are read from the `bulk_jobs` settings.
+
+        Args:
+            app_id: Application ID
+            inputs: Path of a JSON lines or CSV file of inputs, read lazily, of a JSON file holding a list of inputs, or
+                an iterable of inputs.
+            callback_url: A URL that should be sent a POST request once the job is completed for the response data.
+            metadata: Object you can attach to job.
+            worker:
+            parked: Whether the job should be created in the parked (pending) state
+            tags: Tags of the jobs.
+            max_batch_inputs: Maximum number of inputs of a batch.
+            max_batch_bytes: Maximum size of the JSON inputs of a batch.
+            max_concurrency: Number of batches sent at once.
+            max_batches_per_second: Maximum rate of batches sent, unlimited by default.
+            checkpoint: Path of a file recording the submitted batches. The submission of the same inputs with the same
+                checkpoint skips the inputs already submitted.
+        Returns:
+            Submission of each input by index: the ID of its batch, and the UUID of its job when its batch has a single
+            input, e.g. with `max_batch_inputs=1`.
+        """
+        options = BulkOptions(max_batch_inputs, max_batch_bytes, max_concurrency, max_batches_per_second, checkpoint)
+        return self._submit_batches(
+            inputs,
+            lambda batch: self.create_jobs(
+                app_id, callback_url, batch, metadata=metadata, worker=worker, parked=parked, tags=tags
+            ),
+            options,
+        )
+
     def fetch_job(self, job_id: str) -> dict:
         """Gets job given job ID.
 
@@ -297,8 +347,10 @@ class JobsApiMixin(ABC):
         completed_start_date: datetime = None,
         completed_end_date: datetime = None,
         status_in: List[str] = None,
-    ) -> Generator[dict, None, None]:
-        """Generator that retrieves all jobs (without job responses) given an application ID.
+        prefetch: int = None,
+        cursor: PageCursor = None,
+    ) -> PageIterator:
+        """Iterator that retrieves all jobs (without job responses) given an application ID.
 
         Args:
 
@@ -310,14 +362,14 @@ class JobsApiMixin(ABC):
             completed_start_date: Completed start date.
             completed_end_date: Completed end date.
             status_in: Status of jobs.
+            prefetch: Number of pages fetched ahead, by default the `http.prefetch_pages` setting.
+            cursor: `cursor` of a previous iterator, to resume the listing where it stopped.
 
         Returns:
-            Generator that yields complete list of dicts with jobs data.
+            Iterator that yields complete list of dicts with jobs data.
         """
-        page = 0
-        paginated_jobs = {"pages": 1}
-        while page <= paginated_jobs["pages"] - 1:
-            paginated_jobs = self.list_jobs(
+        return self._paginate(
+            lambda page: self.list_jobs(
                 app_id,
                 page=page,
                 size=500,
@@ -328,9 +380,11 @@ class JobsApiMixin(ABC):
                 completed_start_date=completed_start_date,
                 completed_end_date=completed_end_date,
                 status_in=status_in,
-            )
-            yield from paginated_jobs["jobs"]
-            page += 1
+            ),
+            "jobs",
+            prefetch=prefetch,
+            cursor=cursor,
+        )
 
     def get_jobs_operation(self, app_id: str, operation_id: int):
         """Fetch status of job operation given application id and operation id
@@ -416,7 +470,7 @@ class JobsApiMixin(ABC):
                 return None
             status.update(status="[green]Downloading jobs...")
             download_jobs_url = self.generates_downloaded_jobs_url(app_id, operation_id)["downloadUrl"]
-            resp = requests.get(download_jobs_url)
+            resp = self.session.get(download_jobs_url)
             zipfile = ZipFile(BytesIO(resp.content))
             return json.load(zipfile.open(zipfile.namelist()[0]))
 
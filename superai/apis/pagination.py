@@ -0,0 +1,192 @@
+"""Iteration over all the items of a paginated endpoint, with the next pages fetched while the current one is consumed.
+
+The first page gives the number of pages, `pages` or `totalPages` in the response, after which the next `prefetch` pages
+are requested concurrently. Items are yielded in order, and at most `prefetch + 1` pages are held in memory. The
+`cursor` of an iterator is the position of its next item, an iterator created with it resumes the listing there, e.g.
+after an error:
+
+    jobs = client.get_all_jobs(app_id)
+    try:
+        for job in jobs:
+            ...
+    except SuperAIError:
+        jobs = client.get_all_jobs(app_id, cursor=jobs.cursor)
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Optional, Tuple
+
+from attr import define
+
+from superai.config import settings
+
+__all__ = ["AsyncPageIterator", "PageCursor", "PageIterator", "PaginationMixin"]
+
+
+@define(frozen=True)
+class PageCursor:
+    """Position in a paginated listing: a page, and the number of its items already yielded."""
+
+    page: int = 0
+    offset: int = 0
+
+
+def _total_pages(response: dict) -> Optional[int]:
+    for key in ("pages", "totalPages"):
+        if response.get(key) is not None:
+            return int(response[key])
+    return None
+
+
+class _Pages:
+    def __init__(
+        self,
+        fetch_page: Callable[[int], Any],
+        items_key: str,
+        prefetch: int = None,
+        cursor: PageCursor = None,
+    ):
+        self.fetch_page = fetch_page
+        self.items_key = items_key
+        self.prefetch = int(settings.get("http.prefetch_pages", 4)) if prefetch is None else prefetch
+        cursor = cursor or PageCursor()
+        self._page, self._offset = cursor.page, cursor.offset
+        self._items: Optional[list] = None
+        # Number of pages, given by the first response, otherwise the listing stops at the last or at an empty page
+        self._pages: Optional[int] = None
+        self._last = False
+        # Pages requested ahead of the current one, in order
+        self._pending: Deque[Tuple[int, Any]] = deque()
+
+    @property
+    def cursor(self) -> PageCursor:
+        return PageCursor(self._page, self._offset)
+
+    def _finished(self) -> bool:
+        return self._last or self._pages is not None and self._page >= self._pages
+
+    def _receive(self, response: dict):
+        self._items = response[self.items_key]
+        if self._pages is None:
+            self._pages = _total_pages(response)
+            self._last = self._pages is None and (response.get("last", False) or not self._items)
+
+    def _next_item(self):
+        """`(item, True)` for the item at the cursor, or `(None, False)` with the cursor moved to the next page when the
+        current one is consumed."""
+        if self._offset < len(self._items):
+            self._offset += 1
+            return self._items[self._offset - 1], True
+        self._page, self._offset, self._items = self._page + 1, 0, None
+        return None, False
+
+    def _pop_pending(self, page: int):
+        while self._pending and self._pending[0][0] != page:
+            self._pending.popleft()[1].cancel()
+        return self._pending.popleft()[1] if self._pending else None
+
+    def _prefetch(self, submit: Callable[[int], Any]):
+        if self._pages is None:
+            return
+        page = self._pending[-1][0] + 1 if self._pending else self._page + 1
+        while len(self._pending) < self.prefetch and page < self._pages:
+            self._pending.append((page, submit(page)))
+            page += 1
+
+    def _cancel_pending(self):
+        while self._pending:
+            self._pending.popleft()[1].cancel()
+
+
+class PageIterator(_Pages):
+    """Iterator over the items of a paginated endpoint, whose next pages are fetched by a pool of `prefetch` threads.
+
+    Args:
+        fetch_page: Function returning a page given its number, from 0.
+        items_key: Key of the items in a page.
+        prefetch: Number of pages fetched ahead of the current one, by default the `http.prefetch_pages` setting.
+        cursor: Position to resume the listing from.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    def __iter__(self) -> "PageIterator":
+        return self
+
+    def __next__(self):
+        while True:
+            if self._items is None:
+                if self._finished():
+                    self.close()
+                    raise StopIteration
+                future = self._pop_pending(self._page)
+                self._receive(future.result() if future is not None else self.fetch_page(self._page))
+                self._prefetch(self._submit)
+            item, found = self._next_item()
+            if found:
+                return item
+
+    def _submit(self, page: int):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.prefetch, thread_name_prefix="page")
+        return self._executor.submit(self.fetch_page, page)
+
+    def close(self):
+        """Cancels the pages fetched ahead, the iterator shouldn't be used anymore."""
+        self._cancel_pending()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> "PageIterator":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncPageIterator(_Pages):
+    """Async iterator over the items of a paginated endpoint, whose next pages are fetched by `prefetch` tasks.
+
+    Args:
+        fetch_page: Function returning an awaitable of a page given its number, from 0.
+        items_key: Key of the items in a page.
+        prefetch: Number of pages fetched ahead of the current one, by default the `http.prefetch_pages` setting.
+        cursor: Position to resume the listing from.
+    """
+
+    def __aiter__(self) -> "AsyncPageIterator":
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self._items is None:
+                if self._finished():
+                    await self.aclose()
+                    raise StopAsyncIteration
+                task = self._pop_pending(self._page)
+                self._receive(await (task if task is not None else self.fetch_page(self._page)))
+                self._prefetch(lambda page: asyncio.ensure_future(self.fetch_page(page)))
+            item, found = self._next_item()
+            if found:
+                return item
+
+    async def aclose(self):
+        """Cancels the pages fetched ahead, the iterator shouldn't be used anymore."""
+        self._cancel_pending()
+
+    async def __aenter__(self) -> "AsyncPageIterator":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class PaginationMixin:
+    """Gives the API mixins the page iterator of their client, `AsyncClient` uses `AsyncPageIterator`."""
+
+    _page_iterator = PageIterator
+
+    def _paginate(self, fetch_page: Callable[[int], Any], items_key: str, prefetch: int = None, cursor=None):
+        return self._page_iterator(fetch_page, items_key, prefetch=prefetch, cursor=cursor)
@@ -6,14 +6,13 @@ from io import BytesIO
 from typing import List, Optional
 from zipfile import ZipFile
 
-import requests
-
+from superai.apis.http_session import SessionMixin
 from superai.log import logger
 
 log = logger.get_logger(__name__)
 
 
-class TasksApiMixin(ABC):
+class TasksApiMixin(SessionMixin, ABC):
     @abstractmethod
     def request(self, uri, method, body_params=None, query_params=None, required_api_key=False, header_params=None):
         pass
@@ -133,6 +132,6 @@ class TasksApiMixin(ABC):
         if not operation_completed:
             return None
         download_tasks_url = self.generates_downloaded_tasks_url(app_id, operation_id)["downloadUrl"]
-        resp = requests.get(download_tasks_url)
+        resp = self.session.get(download_tasks_url)
         zipfile = ZipFile(BytesIO(resp.content))
         return json.load(zipfile.open(zipfile.namelist()[0]))
@@ -0,0 +1,394 @@
+"""Transfers of data objects to and from their signed URLs: parallel ranged downloads and streamed uploads.
+
+A download requests the object in parts of `part_size` bytes with `Range` GETs sent from `max_concurrency` threads,
+each part streamed into its place in a `<destination>.part` file. The first request doubles as the probe of the object
+size and ETag. The completed parts are appended to a `<destination>.part.json` state file once synced to disk, so a
+download given the same destination after a failure or a crash only fetches the missing parts, as long as the object
+didn't change. The file is checked against the expected MD5, or the ETag when it is likely to be the MD5 of the object,
+and renamed to its destination.
+
+An upload streams the file to its signed URL in chunks, computing its MD5 on the way, which is checked against the ETag
+of the response.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Mapping, Optional, Set, Union
+
+import requests
+from attr import define, evolve
+
+from superai.config import settings
+from superai.exceptions import SuperAIStorageError
+from superai.log import logger
+
+log = logger.get_logger(__name__)
+
+__all__ = ["TransferOptions", "download_file", "upload_file"]
+
+Progress = Callable[[int, Optional[int]], None]
+
+_MD5_ETAG = re.compile(r"^[0-9a-f]{32}$")
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+_SSE_CUSTOMER_ALGORITHM = "x-amz-server-side-encryption-customer-algorithm"
+
+
+@define
+class TransferOptions:
+    """Options of a transfer, the ones left to `None` are read from the `transfer` settings."""
+
+    part_size: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    chunk_size: Optional[int] = None
+    part_retries: Optional[int] = None
+
+    def __attrs_post_init__(self):
+        self.part_size = self.part_size or int(settings.get("transfer.part_size", 8388608))
+        self.max_concurrency = self.max_concurrency or int(settings.get("transfer.max_concurrency", 8))
+        self.chunk_size = self.chunk_size or int(settings.get("transfer.chunk_size", 262144))
+        if self.part_retries is None:
+            self.part_retries = int(settings.get("transfer.part_retries", 3))
+
+
+def _etag_md5(headers: Mapping[str, str]) -> Optional[str]:
+    """MD5 of the object given by the ETag of a response about it, which is the case for the objects not uploaded in
+    parts nor encrypted with KMS or a customer key. `None` otherwise."""
+    if headers.get("x-amz-server-side-encryption", "").startswith("aws:kms") or _SSE_CUSTOMER_ALGORITHM in headers:
+        # The ETag of these objects is 32 hexadecimal digits too, but not their MD5
+        return None
+    etag = (headers.get("ETag") or "").strip().strip('"').lower()
+    return etag if _MD5_ETAG.match(etag) else None
+
+
+def _file_md5(path: str, chunk_size: int) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class _TransferState:
+    """JSON lines state of a download: a header with the object size, ETag, MD5 given by the ETag and part size, then
+    the index of every part synced to disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header = None
+        self.done: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """Whether the file holds the state of a download, which is then loaded."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last record is cut if the process stopped while writing it
+                    break
+                if self.header is None:
+                    self.header = record
+                else:
+                    self.done.add(record["part"])
+        if self.header is None:
+            return False
+        # Records are appended after the complete ones
+        self._write("w", [self.header] + [{"part": part} for part in sorted(self.done)])
+        return True
+
+    def start(self, size: int, etag: Optional[str], etag_md5: Optional[str], part_size: int):
+        self.header = {"size": size, "etag": etag, "etag_md5": etag_md5, "part_size": part_size}
+        self.done = set()
+        self._write("w", [self.header])
+
+    def record(self, part: int):
+        with self._lock:
+            self.done.add(part)
+            self._write("a", [{"part": part}])
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write(self, mode: str, records: list):
+        with open(self.path, mode) as file:
+            file.write("".join(json.dumps(record) + "\n" for record in records))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class _Download:
+    def __init__(self, session: requests.Session, url: str, destination: str, options: TransferOptions, progress):
+        self.session = session
+        self.url = url
+        self.destination = destination
+        self.part_path = destination + ".part"
+        self.options = options
+        self.state = _TransferState(destination + ".part.json")
+        self.progress = progress
+        self.size = None
+        self.etag = None
+        self.etag_md5 = None
+        self.completed = 0
+        self._lock = threading.Lock()
+        self._failed = threading.Event()
+
+    def get(self, start: int, end: int, etag: Optional[str] = None) -> requests.Response:
+        # Responses are not compressed so that the ranges are ranges of the object bytes
+        headers = {"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"}
+        if etag:
+            headers["If-Match"] = etag
+        return self.session.get(self.url, headers=headers, stream=True)
+
+    def part_range(self, part: int):
+        start = part * self.options.part_size
+        return start, min(start + self.options.part_size, self.size) - 1
+
+    def report(self, size: int):
+        if self.progress is not None:
+            with self._lock:
+                self.completed += size
+                self.progress(self.completed, self.size)
+
+    def run(self) -> Optional[str]:
+        """Downloads the object into the part file, returns the MD5 of the object if computed on the way."""
+        resumed = self.state.load() and os.path.exists(self.part_path)
+        if resumed:
+            self.size, self.etag = self.state.header["size"], self.state.header["etag"]
+            self.etag_md5 = self.state.header.get("etag_md5")
+            if self.state.header["part_size"] != self.options.part_size:
+                self.options = evolve(self.options, part_size=self.state.header["part_size"])
+            missing = [part for part in range(self._parts()) if part not in self.state.done]
+            log.info(f"Resuming the download of {self.destination}, {len(missing)} parts of {self._parts()} missing")
+            if not missing:
+                return None
+            start, end = self.part_range(missing[0])
+            response = self.get(start, end, self.etag)
+            if response.status_code == 412 or not self._matches(response):
+                log.info(f"The object changed since the download of {self.destination} started, restarting it")
+                response.close()
+                resumed = False
+        if not resumed:
+            response = self.get(0, self.options.part_size - 1)
+            if response.status_code == 416:
+                # Empty object, which has no range
+                response.close()
+                open(self.part_path, "wb").close()
+                self.size = 0
+                return hashlib.md5().hexdigest()
+            if response.status_code == 200:
+                return self._stream(response)
+            self._check(response)
+            content_range = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+            self.size, self.etag = int(content_range.group(3)), response.headers.get("ETag")
+            self.etag_md5 = _etag_md5(response.headers)
+            with open(self.part_path, "wb") as file:
+                file.truncate(self.size)
+            self.state.start(self.size, self.etag, self.etag_md5, self.options.part_size)
+            missing = list(range(self._parts()))
+        self.report(sum(self._part_length(part) for part in self.state.done))
+
+        with ThreadPoolExecutor(self.options.max_concurrency, thread_name_prefix="transfer") as pool:
+            futures = [pool.submit(self._fetch, missing[0], response)]
+            futures += [pool.submit(self._fetch, part) for part in missing[1:]]
+            errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise errors[0]
+        return None
+
+    def _parts(self) -> int:
+        return max(1, -(-self.size // self.options.part_size))
+
+    def _part_length(self, part: int) -> int:
+        start, end = self.part_range(part)
+        return end - start + 1
+
+    def _matches(self, response: requests.Response) -> bool:
+        """Whether the response is a part of the object being downloaded."""
+        content_range = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        return (
+            response.status_code == 206
+            and content_range is not None
+            and int(content_range.group(3)) == self.size
+            and response.headers.get("ETag") == self.etag
+        )
+
+    @staticmethod
+    def _check(response: requests.Response):
+        if response.status_code != 206 or not _CONTENT_RANGE.match(response.headers.get("Content-Range", "")):
+            response.close()
+            raise SuperAIStorageError(f"Download failed with status {response.status_code} {response.reason}")
+
+    def _stream(self, response: requests.Response) -> str:
+        """Streams the object of a server which doesn't support ranges, returns its MD5."""
+        log.info(f"Ranges are not supported for {self.destination}, downloading it in one stream")
+        self.state.remove()
+        md5 = hashlib.md5()
+        self.etag_md5 = _etag_md5(response.headers)
+        self.size = int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None
+        with response, open(self.part_path, "wb") as file:
+            for chunk in response.iter_content(self.options.chunk_size):
+                file.write(chunk)
+                md5.update(chunk)
+                self.report(len(chunk))
+        return md5.hexdigest()
+
+    def _fetch(self, part: int, response: Optional[requests.Response] = None):
+        """Streams a part into the part file, retrying from the last byte written if the connection is lost."""
+        start, end = self.part_range(part)
+        offset = start
+        retries = self.options.part_retries
+        with open(self.part_path, "r+b") as file:
+            while offset <= end:
+                if self._failed.is_set():
+                    return
+                try:
+                    if response is None:
+                        response = self.get(offset, end, self.etag)
+                        if response.status_code == 412:
+                            raise SuperAIStorageError(f"The object of {self.destination} changed during the download")
+                        self._check(response)
+                    file.seek(offset)
+                    with response:
+                        for chunk in response.iter_content(self.options.chunk_size):
+                            file.write(chunk[: end + 1 - offset])
+                            self.report(min(len(chunk), end + 1 - offset))
+                            offset += len(chunk)
+                            if self._failed.is_set():
+                                return
+                    if offset <= end:
+                        raise requests.exceptions.ChunkedEncodingError(f"Part {part} ended at byte {offset}")
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                    if retries == 0:
+                        self._failed.set()
+                        raise
+                    log.warning(f"Part {part} of {self.destination} interrupted at byte {offset}, retrying: {e}")
+                    retries -= 1
+                except Exception:
+                    self._failed.set()
+                    raise
+                response = None
+            file.flush()
+            os.fsync(file.fileno())
+        self.state.record(part)
+
+
+def download_file(
+    session: requests.Session,
+    url: str,
+    destination: Union[str, os.PathLike],
+    options: TransferOptions = None,
+    md5: Optional[str] = None,
+    progress: Optional[Progress] = None,
+) -> str:
+    """Downloads the object of a URL to a file with parallel ranged requests, resuming a former download of the same
+    destination. Falls back to a single stream if the server doesn't support ranges.
+
+    Args:
+        session: Session sending the requests, its connection pool should hold `options.max_concurrency` connections.
+        url: URL of the object, e.g. a signed URL.
+        destination: Path of the file.
+        options: Part size and concurrency of the download.
+        md5: Expected MD5 of the object, by default the ETag of the object if it is likely to be its MD5.
+        progress: Called with the bytes downloaded and the size of the object, if known, as parts of it are written.
+
+    Returns:
+        The path of the file.
+
+    Raises:
+        SuperAIStorageError: If the object can't be downloaded or doesn't match its checksum. The file is removed if it
+            doesn't match `md5`, and kept if it only doesn't match the ETag, which may not be an MD5 after all.
+    """
+    destination = os.fspath(destination)
+    download = _Download(session, url, destination, options or TransferOptions(), progress)
+    computed = download.run()
+    expected = (md5 or download.etag_md5 or "").lower()
+    if expected:
+        computed = computed or _file_md5(download.part_path, download.options.chunk_size)
+        if computed != expected and md5 is not None:
+            os.remove(download.part_path)
+            download.state.remove()
+            raise SuperAIStorageError(f"Checksum of {destination} is {computed}, expected {expected}")
+    os.replace(download.part_path, destination)
+    download.state.remove()
+    if expected and computed != expected:
+        raise SuperAIStorageError(f"Checksum of {destination} is {computed}, its ETag {download.etag} was expected")
+    return destination
+
+
+class _HashingReader:
+    """File object computing the MD5 of the bytes read from the current position, rewound when a request is retried.
+
+    Positions are relative to the position of the file when the upload started, which is 0 for the reader.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.start = file.tell()
+        self.size = os.fstat(file.fileno()).st_size - self.start
+        self.md5 = hashlib.md5()
+
+    def __len__(self) -> int:
+        # requests sends `len - tell` as the Content-Length, signed URLs don't accept chunked requests
+        return self.size
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.file.read(size)
+        self.md5.update(chunk)
+        return chunk
+
+    def tell(self) -> int:
+        return self.file.tell() - self.start
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            offset += self.start
+        position = self.file.seek(offset, whence) - self.start
+        if position == 0:
+            self.md5 = hashlib.md5()
+        return position
+
+
+def upload_file(
+    session: requests.Session, url: str, file: Union[BinaryIO, str, os.PathLike], mime_type: str, verify: bool = True
+) -> requests.Response:
+    """Uploads a file to a signed URL with a single PUT request streaming its content from disk.
+
+    Args:
+        session: Session sending the request.
+        url: Signed upload URL.
+        file: Path of the file, or file object opened in binary mode.
+        mime_type: Content type of the upload, as signed in the URL.
+        verify: Whether to check the MD5 of the uploaded bytes against the ETag of the response, when it is likely to be
+            an MD5.
+
+    Returns:
+        The response of the upload.
+
+    Raises:
+        SuperAIStorageError: If the upload fails or the stored object doesn't match the file.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as opened:
+            return upload_file(session, url, opened, mime_type, verify)
+    try:
+        body = _HashingReader(file)
+    except (AttributeError, io.UnsupportedOperation):
+        # In-memory file objects are sent as is
+        body = file.read()
+    response = session.put(url, data=body, headers={"Content-Type": mime_type})
+    if response.status_code not in [200, 201]:
+        raise SuperAIStorageError(f"Upload failed with status {response.status_code} {response.reason}")
+    stored = _etag_md5(response.headers)
+    if verify and stored is not None:
+        md5 = body.md5.hexdigest() if isinstance(body, _HashingReader) else hashlib.md5(body).hexdigest()
+        if md5 != stored:
+            raise SuperAIStorageError(f"Checksum of the stored object is {stored}, {md5} was uploaded")
+    return response
@@ -0,0 +1,326 @@
+"""Asynchronous client of the super.AI REST API, for workloads sending many requests at once.
+
+`AsyncClient` exposes the methods of `JobsApiMixin`, `DataApiMixin`, `GroundTruthApiMixin` and `TasksApiMixin` as
+awaitables, e.g. `await client.fetch_job(job_id)`, and their `get_all_*` iterators as async iterators:
+
+    async with AsyncClient(api_key) as client:
+        jobs = await asyncio.gather(*(client.fetch_job(job_id) for job_id in job_ids))
+
+The requests share a keep-alive connection pool, at most `max_concurrency` of them are in flight at once, and they are
+retried with the policy of the synchronous client, see `superai.apis.http_session`. Requires `aiohttp`, installed with
+the `async` extra.
+"""
+import asyncio
+import functools
+import json
+import os
+import random
+from datetime import datetime
+from io import BytesIO
+from typing import BinaryIO, Callable, List, Optional, Union
+from zipfile import ZipFile
+
+import aiohttp
+
+from superai.apis.bulk import async_submit_batches
+from superai.apis.data import DataApiMixin
+from superai.apis.ground_truth import GroundTruthApiMixin
+from superai.apis.http_session import (
+    IDEMPOTENT_METHODS,
+    RETRY_STATUSES,
+    default_session,
+)
+from superai.apis.jobs import JobsApiMixin
+from superai.apis.pagination import AsyncPageIterator
+from superai.apis.tasks import TasksApiMixin
+from superai.apis.transfer import TransferOptions, download_file, upload_file
+from superai.config import settings
+from superai.exceptions import (
+    SuperAIAuthorizationError,
+    SuperAIEntityDuplicatedError,
+    SuperAIError,
+    SuperAIStorageError,
+)
+from superai.log import logger
+from superai.utils import update_cognito_credentials
+
+logger = logger.get_logger(__name__)
+
+__all__ = ["AsyncClient"]
+
+
+def _query_params(query_params: Optional[dict]) -> List[tuple]:
+    """Query parameters encoded like `requests` does: `None` values dropped, lists repeated, booleans as `True`."""
+    params = []
+    for key, value in (query_params or {}).items():
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            if item is not None:
+                params.append((key, str(item) if isinstance(item, bool) else item))
+    return params
+
+
+class AsyncClient(JobsApiMixin, DataApiMixin, GroundTruthApiMixin, TasksApiMixin):
+    _page_iterator = AsyncPageIterator
+    _submit_batches = staticmethod(async_submit_batches)
+
+    def __init__(
+        self,
+        api_key: str = None,
+        auth_token: str = None,
+        id_token: str = None,
+        base_url: str = None,
+        max_concurrency: int = None,
+        session: aiohttp.ClientSession = None,
+    ):
+        """
+        Args:
+            max_concurrency: Maximum number of requests in flight at once, the others wait for their turn.
+            session: Session sending the requests, by default one is created on first use and closed by `close`.
+        """
+        self.api_key = api_key
+        self.auth_token = auth_token
+        self.id_token = id_token
+        self.base_url = base_url or settings.get("base_url")
+        self.max_concurrency = max_concurrency or int(settings.get("http.async_max_concurrency", 64))
+        self.retries = int(settings.get("http.retries", 3))
+        self.backoff_factor = float(settings.get("http.backoff_factor", 0.5))
+        self._session = session
+        self._owns_session = session is None
+        # Created on first use, in the event loop of the requests
+        self._limiter: Optional[asyncio.Semaphore] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    @classmethod
+    def from_credentials(cls, **kwargs) -> "AsyncClient":
+        """Instantiate a client from the credentials stored in the config file."""
+        from superai.utils import load_api_key, load_auth_token, load_id_token
+
+        return cls(api_key=load_api_key(), auth_token=load_auth_token(), id_token=load_id_token(), **kwargs)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=float(settings.get("http.connect_timeout", 10)),
+                    sock_read=float(settings.get("http.read_timeout", 300)),
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(
+        self,
+        endpoint: str,
+        method: str = "GET",
+        query_params: dict = None,
+        body_params: dict = None,
+        required_api_key: bool = False,
+        required_auth_token: bool = False,
+        required_id_token: bool = False,
+        header_params: Optional[dict] = None,
+    ) -> Optional[dict]:
+        if self._limiter is None:
+            self._limiter = asyncio.Semaphore(self.max_concurrency)
+        async with self._limiter:
+            refreshed = False
+            attempt = 0
+            while True:
+                headers = dict(header_params or {})
+                if required_api_key:
+                    if not self.api_key:
+                        logger.warning("API key is required, but not present")
+                    headers["API-KEY"] = self.api_key
+                if required_auth_token:
+                    if not self.auth_token:
+                        logger.warning("AUTH token is required, but not present")
+                    headers["AUTH-TOKEN"] = self.auth_token
+                if required_id_token:
+                    if not self.id_token:
+                        logger.warning("ID token is required, but not present")
+                    headers["ID-TOKEN"] = self.id_token
+                tokens = self.auth_token, self.id_token
+
+                try:
+                    async with self.session.request(
+                        method,
+                        f"{self.base_url}/{endpoint}",
+                        params=_query_params(query_params),
+                        json=body_params,
+                        headers=headers,
+                    ) as resp:
+                        status = resp.status
+                        retry_after = resp.headers.get("Retry-After")
+                        if status < 400:
+                            return None if status == 204 else await resp.json(content_type=None)
+                        text = await resp.text()
+                except (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError, aiohttp.ServerTimeoutError) as e:
+                    # The request never reached the server, or its response didn't come through
+                    connect_error = isinstance(e, aiohttp.ClientConnectorError)
+                    if attempt < self.retries and (connect_error or method.upper() in IDEMPOTENT_METHODS):
+                        await asyncio.sleep(self._backoff(attempt))
+                        attempt += 1
+                        continue
+                    raise
+
+                try:
+                    message = json.loads(text)["message"]
+                except Exception:
+                    message = text
+
+                if status == 401 and message == "Token is expired." and not refreshed:
+                    # The token might be refreshed, once, before retrying the request
+                    await self._refresh_credentials(tokens)
+                    refreshed = True
+                    continue
+                if (
+                    status in RETRY_STATUSES
+                    and (status == 429 or method.upper() in IDEMPOTENT_METHODS)
+                    and attempt < self.retries
+                ):
+                    await asyncio.sleep(self._backoff(attempt, retry_after))
+                    attempt += 1
+                    continue
+
+                if status == 401:
+                    raise SuperAIAuthorizationError(message, status, endpoint=f"{self.base_url}/{endpoint}")
+                elif status == 409:
+                    raise SuperAIEntityDuplicatedError(message, status, base_url=self.base_url, endpoint=endpoint)
+                raise SuperAIError(message, status)
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        """Seconds to wait before a retry, given by the server or a jittered exponential backoff."""
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        backoff = 0 if attempt == 0 else self.backoff_factor * 2**attempt
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    async def _refresh_credentials(self, expired_tokens: tuple):
+        """Refreshes the tokens once for all the requests which were rejected with the same expired tokens."""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if (self.auth_token, self.id_token) == expired_tokens:
+                loop = asyncio.get_running_loop()
+                self.auth_token, self.id_token = await loop.run_in_executor(None, update_cognito_credentials)
+
+    async def download_data(self, path: str, timeout: int = 5):
+        """Coroutine of `DataApiMixin.download_data`."""
+        signed_url = await self.get_signed_url(path)
+        async with self.session.get(signed_url.get("signedUrl"), timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+            if res.status == 200:
+                return await res.json(content_type=None)
+            raise SuperAIStorageError(res.reason)
+
+    async def download_data_to_file(
+        self,
+        path: str,
+        destination: Union[str, os.PathLike],
+        md5: Optional[str] = None,
+        part_size: int = None,
+        max_concurrency: int = None,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    ) -> str:
+        """Coroutine of `DataApiMixin.download_data_to_file`, the parts are written to disk from the threads of the
+        transfer run in the executor."""
+        signed_url = await self.get_signed_url(path)
+        options = TransferOptions(part_size=part_size, max_concurrency=max_concurrency)
+        download = functools.partial(
+            download_file, default_session(), signed_url["signedUrl"], destination, options, md5=md5, progress=progress
+        )
+        return await asyncio.get_running_loop().run_in_executor(None, download)
+
+    async def upload_data(
+        self, path: str, description: str, mime_type: str, file: Union[BinaryIO, str, os.PathLike]
+    ) -> dict:
+        """Coroutine of `DataApiMixin.upload_data`, the file is streamed from the executor."""
+        dataset = await self.request(
+            self.resource,
+            method="POST",
+            query_params={"path": path, "description": description, "mimeType": mime_type, "uploadUrl": True},
+            required_api_key=True,
+        )
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, upload_file, default_session(), dataset.pop("uploadUrl"), file, mime_type
+            )
+            return dataset
+        except Exception as e:
+            raise SuperAIStorageError(
+                f'File {str(file)} referenced by dataset {dataset["path"]} couldn\'t be uploaded to super.AI Storage '
+            ) from e
+
+    async def download_jobs_full_flow(
+        self,
+        app_id: str,
+        created_start_date: datetime = None,
+        created_end_date: datetime = None,
+        completed_start_date: datetime = None,
+        completed_end_date: datetime = None,
+        status_in: List[str] = None,
+        timeout: int = 120,
+        poll_interval: int = 3,
+    ) -> Optional[List[dict]]:
+        """Coroutine of `JobsApiMixin.download_jobs_full_flow`."""
+        operation = await self.download_jobs(
+            app_id, created_start_date, created_end_date, completed_start_date, completed_end_date, status_in, False
+        )
+        if not await self._wait_for_operation(
+            self.get_jobs_operation, app_id, operation["operationId"], timeout, poll_interval
+        ):
+            return None
+        url = await self.generates_downloaded_jobs_url(app_id, operation["operationId"])
+        return await self._download_operation(url["downloadUrl"])
+
+    async def download_tasks_full_flow(
+        self,
+        app_id: str,
+        created_start_date: datetime = None,
+        created_end_date: datetime = None,
+        completed_start_date: datetime = None,
+        completed_end_date: datetime = None,
+        status_in: List[str] = None,
+        timeout: int = 120,
+        poll_interval: int = 3,
+    ) -> Optional[List[dict]]:
+        """Coroutine of `TasksApiMixin.download_tasks_full_flow`."""
+        operation = await self.download_tasks(
+            app_id, created_start_date, created_end_date, completed_start_date, completed_end_date, status_in
+        )
+        if not await self._wait_for_operation(
+            self.get_tasks_operation, app_id, operation["operationId"], timeout, poll_interval
+        ):
+            return None
+        url = await self.generates_downloaded_tasks_url(app_id, operation["operationId"])
+        return await self._download_operation(url["downloadUrl"])
+
+    @staticmethod
+    async def _wait_for_operation(get_operation, app_id: str, operation_id: int, timeout: int, poll_interval: int):
+        """Polls an operation until it completes, returns whether it did before `timeout` seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            operation = await get_operation(app_id, operation_id)
+            logger.info(f"Poll result: Operation {operation['id']} in status: {operation['status']}")
+            if operation["status"] == "COMPLETED":
+                return True
+            if loop.time() + poll_interval > deadline:
+                return False
+            await asyncio.sleep(poll_interval)
+
+    async def _download_operation(self, url: str) -> List[dict]:
+        async with self.session.get(url) as resp:
+            content = await resp.read()
+        zipfile = ZipFile(BytesIO(content))
+        return json.load(zipfile.open(zipfile.namelist()[0]))
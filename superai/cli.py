@@ -134,12 +134,60 @@ pass_client = click.make_pass_decorator(Client, ensure=True)
 @click.option("--app_id", "-a", help="Application id", required=True)
 @click.option("--callback_url", "-c", help="Callback URL for post when jobs finish")
 @click.option("--inputs", "-i", help="Json list with inputs")
-@click.option("--inputs_file", "-if", help="URL pointing to JSON file")
+@click.option(
+    "--inputs_file",
+    "-if",
+    help="URL pointing to JSON file, or local JSON lines, CSV or JSON file whose inputs are submitted in batches",
+)
+@click.option("--checkpoint", help="File recording the batches submitted from a local file, to resume the submission")
+@click.option(
+    "--output", "-o", help="File to write the batch and job IDs of the inputs of a local file to, as JSON lines"
+)
+@click.option("--batch_size", "-b", help="Maximum number of inputs per batch of a local file", type=int)
+@click.option("--concurrency", help="Number of batches of a local file submitted at once", type=int)
 @click.pass_context
-def create_jobs(ctx, app_id: str, callback_url: str, inputs: str, inputs_file: str):
+def create_jobs(
+    ctx,
+    app_id: str,
+    callback_url: str,
+    inputs: str,
+    inputs_file: str,
+    checkpoint: str,
+    output: str,
+    batch_size: int,
+    concurrency: int,
+):
     """Submits jobs"""
     client = ctx.obj["client"]
+    local_file = inputs_file is not None and os.path.isfile(inputs_file)
+    if local_file and inputs is not None:
+        raise click.UsageError("--inputs can't be combined with a local --inputs_file")
+    batch_options = {
+        "--checkpoint": checkpoint,
+        "--output": output,
+        "--batch_size": batch_size,
+        "--concurrency": concurrency,
+    }
+    if not local_file and any(value is not None for value in batch_options.values()):
+        used = ", ".join(name for name, value in batch_options.items() if value is not None)
+        raise click.UsageError(f"{used} only apply to the inputs of a local --inputs_file")
     print("Submitting jobs")
+    if local_file:
+        submitted = client.bulk_create_jobs(
+            app_id,
+            inputs_file,
+            callback_url,
+            max_batch_inputs=batch_size,
+            max_concurrency=concurrency,
+            checkpoint=checkpoint,
+        )
+        print(f"Submitted {len(submitted)} inputs in {len({job.batch_id for job in submitted.values()})} batches")
+        if output is not None:
+            with open(output, "w") as file:
+                for index in sorted(submitted):
+                    job = submitted[index]
+                    file.write(json.dumps({"index": index, "batch_id": job.batch_id, "job_id": job.job_id}) + "\n")
+        return
     json_inputs = None
     if inputs is not None:
         try:
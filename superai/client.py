@@ -6,6 +6,7 @@ from superai.apis.auth import AuthApiMixin
 from superai.apis.data import DataApiMixin
 from superai.apis.data_program import DataProgramApiMixin
 from superai.apis.ground_truth import GroundTruthApiMixin
+from superai.apis.http_session import default_session
 from superai.apis.jobs import JobsApiMixin
 from superai.apis.meta_ai import AiApiMixin
 from superai.apis.operations import OperationsApiMixin
@@ -51,12 +52,25 @@ class Client(
     SuperTaskApiMixin,
     OperationsApiMixin
 ):
-    def __init__(self, api_key: str = None, auth_token: str = None, id_token: str = None, base_url: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        auth_token: str = None,
+        id_token: str = None,
+        base_url: str = None,
+        session: requests.Session = None,
+    ):
+        """
+        Args:
+            session: Session sending the requests, by default the pooled keep-alive session shared by all the clients
+                of the process, see `superai.apis.http_session.create_session` to configure another one.
+        """
         super(Client, self).__init__()
         self.api_key = api_key
         self.auth_token = auth_token
         self.id_token = id_token
         self.base_url = base_url or settings.get("base_url")
+        self._session = session or default_session()
 
     @classmethod
     def from_credentials(cls) -> "Client":
@@ -94,7 +108,7 @@ class Client(
                 logger.warning("ID token is required, but not present")
             headers["ID-TOKEN"] = self.id_token
 
-        resp = requests.request(
+        resp = self.session.request(
             method, f"{self.base_url}/{endpoint}", params=query_params, json=body_params, headers=headers
         )
         try:
@@ -1 +1 @@
-from .memoization import async_memo, delete_all_objects, forget_memo, memo
+from .memoization import async_memo, delete_all_objects, flush_memo, forget_memo, memo
@@ -0,0 +1,107 @@
+"""Bulk deletion of every object version under an S3 prefix, used to purge the memo entries of a job."""
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Thread
+from typing import Any, Callable, Iterator, List, Optional
+
+from superai.log import logger
+
+log = logger.get_logger(__name__)
+
+# Upper bound of keys accepted by a single `delete_objects` request
+MAX_DELETE_BATCH = 1000
+
+
+class PrefixPurger:
+    """Deletes all object versions and delete markers under S3 prefixes, off the calling thread.
+
+    Each purge lists its prefix page by page on its own thread and hands batches of up to 1000 keys to a worker pool
+    shared by all purges, which bounds the number of concurrent `delete_objects` requests. A purge has at most
+    `2 * max_workers` batches waiting for a worker, listing pauses until one completes.
+
+    Args:
+        client: Returns the S3 client to use.
+    """
+
+    def __init__(self, client: Callable, max_workers: int = 8, name: str = "memo-purge"):
+        self._client = client
+        self._max_pending = 2 * max_workers
+        self._name = name
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+
+    def purge(
+        self,
+        bucket: str,
+        prefix: str,
+        page_size: int = 1000,
+        key_marker: Optional[str] = None,
+        before: Optional[Callable[[], Any]] = None,
+    ) -> Future:
+        """Starts deleting everything under `prefix`.
+
+        Args:
+            page_size: Versions listed per page.
+            key_marker: Key to start listing after.
+            before: Called on the listing thread before listing, e.g. to wait for the uploads under `prefix`.
+
+        Returns:
+            A future resolving with the number of deleted object versions and delete markers.
+        """
+        result = Future()
+        Thread(
+            target=self._purge,
+            args=(result, bucket, prefix, page_size, key_marker, before),
+            name=f"{self._name}-lister",
+            daemon=True,
+        ).start()
+        return result
+
+    def _purge(
+        self,
+        result: Future,
+        bucket: str,
+        prefix: str,
+        page_size: int,
+        key_marker: Optional[str],
+        before: Optional[Callable[[], Any]],
+    ):
+        if not result.set_running_or_notify_cancel():
+            return
+        slots = BoundedSemaphore(self._max_pending)
+        batches = []
+        try:
+            if before is not None:
+                before()
+            for objects in self._list(bucket, prefix, page_size, key_marker):
+                slots.acquire()
+                batch = self._executor.submit(self._delete, bucket, objects)
+                batch.add_done_callback(lambda _: slots.release())
+                batches.append(batch)
+            deleted = sum(batch.result() for batch in batches)
+        except Exception as e:
+            log.error(f"Could not purge Bucket={bucket} Prefix={prefix}: {e}")
+            result.set_exception(e)
+            return
+        log.info(f"Purged {deleted} object versions from Bucket={bucket} Prefix={prefix}")
+        result.set_result(deleted)
+
+    def _list(self, bucket: str, prefix: str, page_size: int, key_marker: Optional[str]) -> Iterator[List[dict]]:
+        """Yields the versions under `prefix` in batches of at most `MAX_DELETE_BATCH` keys."""
+        params = dict(Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": page_size})
+        if key_marker:
+            params["KeyMarker"] = key_marker
+        objects = []
+        for page in self._client().get_paginator("list_object_versions").paginate(**params):
+            for version in page.get("Versions", []) + page.get("DeleteMarkers", []):
+                objects.append({"Key": version["Key"], "VersionId": version["VersionId"]})
+                if len(objects) == MAX_DELETE_BATCH:
+                    yield objects
+                    objects = []
+        if objects:
+            yield objects
+
+    def _delete(self, bucket: str, objects: List[dict]) -> int:
+        response = self._client().delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+        errors = response.get("Errors", [])
+        if errors:
+            log.warning(f"Could not delete {len(errors)} of {len(objects)} objects from Bucket={bucket}: {errors[:5]}")
+        return len(objects) - len(errors)
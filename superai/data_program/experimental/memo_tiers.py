@@ -0,0 +1,237 @@
+"""Building blocks of the memo cache tiers: in-process LRU, single-flight loads and the S3 write-behind queue."""
+import asyncio
+import pickle
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+from superai.log import logger
+
+log = logger.get_logger(__name__)
+
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe cache keeping the `max_entries` most recently used values.
+
+    Values are kept pickled, so callers never share a mutable result.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                return default
+            self._entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key: Hashable, value: Any):
+        if self._max_entries <= 0:
+            return
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def pop_prefix(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls: callers asking for a key already being loaded wait for that load instead.
+
+    The result is shared pickled, so like with `LRUCache` each caller gets its own copy of it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return pickle.loads(call.result())
+
+        try:
+            result = fn()
+            call.set_result(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        except BaseException as e:
+            if not call.done():
+                call.set_exception(e)
+            raise
+        else:
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for coroutines, callers on the same event loop asking for a key being loaded await that load.
+
+    Cancelling one of the callers does not cancel the load for the others. Each caller gets its own copy of the result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        call = self._calls.get((loop, key))
+        if call is None:
+            call = self._calls[(loop, key)] = asyncio.ensure_future(self._pickled(fn))
+            call.add_done_callback(lambda _: self._calls.pop((loop, key), None))
+        return pickle.loads(await asyncio.shield(call))
+
+    @staticmethod
+    async def _pickled(fn: Callable[[], Awaitable[Any]]) -> bytes:
+        return pickle.dumps(await fn(), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class S3WriteBehind:
+    """Uploads memo entries to S3 in the background.
+
+    Writes queue up until one of `max_workers` daemon threads uploads them, queued writes to the same key are
+    coalesced and the latest one wins. Writes to a key being uploaded wait for that upload, so the last write always
+    lands last. Failed uploads are retried with exponential backoff up to `max_attempts` times.
+
+    Args:
+        upload: Called with bucket, key and serialized entry, raises on failure.
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str, str, bytes], None],
+        max_workers: int = 4,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        name: str = "memo-s3-writer",
+    ):
+        self._upload = upload
+        self._max_workers = max_workers
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._name = name
+        self._condition = Condition()
+        self._pending = OrderedDict()  # (bucket, key) -> serialized entry
+        self._in_flight = set()
+        self._workers = []
+        self._failed = 0
+
+    def put(self, bucket: str, key: str, data: bytes):
+        with self._condition:
+            self._pending.pop((bucket, key), None)
+            self._pending[(bucket, key)] = data
+            if len(self._workers) < self._max_workers:
+                worker = Thread(target=self._work, name=f"{self._name}-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify()
+
+    def get(self, bucket: str, key: str) -> Optional[bytes]:
+        """Returns the entry queued for `key`, if its upload has not started yet."""
+        with self._condition:
+            return self._pending.get((bucket, key))
+
+    def discard(self, bucket: str, key: str):
+        with self._condition:
+            self._pending.pop((bucket, key), None)
+
+    def discard_prefix(self, bucket: str, prefix: str):
+        """Drops the queued writes under `prefix`, the uploads already started still land, see `flush_prefix`."""
+        with self._condition:
+            for pending in [
+                pending for pending in self._pending if pending[0] == bucket and pending[1].startswith(prefix)
+            ]:
+                del self._pending[pending]
+
+    def flush_prefix(self, bucket: str, prefix: str, timeout: Optional[float] = None) -> bool:
+        """Drops the queued writes under `prefix` and blocks until the uploads under it already started are done.
+
+        Returns:
+            False if the timeout expired first.
+        """
+        self.discard_prefix(bucket, prefix)
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not any(key.startswith(prefix) for in_bucket, key in self._in_flight if in_bucket == bucket),
+                timeout,
+            )
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until all queued writes are uploaded or given up.
+
+        Returns:
+            False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    @property
+    def failed(self) -> int:
+        """Number of writes given up after `max_attempts` failed uploads."""
+        return self._failed
+
+    def _next_write(self):
+        """Oldest queued write whose key is not being uploaded, must be called with the condition held."""
+        for destination in self._pending:
+            if destination not in self._in_flight:
+                return destination
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                destination = self._condition.wait_for(self._next_write)
+                data = self._pending.pop(destination)
+                self._in_flight.add(destination)
+
+            self._upload_with_retry(destination, data)
+
+            with self._condition:
+                self._in_flight.discard(destination)
+                self._condition.notify_all()
+
+    def _upload_with_retry(self, destination: Tuple[str, str], data: bytes):
+        bucket, key = destination
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                self._upload(bucket, key, data)
+                return
+            except Exception as e:
+                if attempt == self._max_attempts:
+                    log.error(f"Giving up memo upload of {bucket}/{key} after {attempt} attempts: {e}")
+                    with self._condition:
+                        self._failed += 1
+                    return
+                delay = self._backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                log.warning(f"Memo upload of {bucket}/{key} failed, retrying in {delay:.2f}s: {e}")
+                time.sleep(delay)
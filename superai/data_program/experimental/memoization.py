@@ -1,11 +1,14 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import asyncio
+import atexit
 import os
 import tempfile
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
 from time import time
+from typing import Optional
 
 import boto3
 import botocore
@@ -15,6 +18,15 @@ from diskcache import Cache
 from superai.config import settings
 from superai.log import logger
 
+from .memo_purge import PrefixPurger
+from .memo_tiers import (
+    MISSING,
+    AsyncSingleFlight,
+    LRUCache,
+    S3WriteBehind,
+    SingleFlight,
+)
+
 MAX_BOTO_POOL_CONNECTIONS = 30
 
 log = logger.get_logger(__name__)
@@ -58,6 +70,14 @@ def _init_s3_client():
 _init_s3_client()
 
 
+# Tiers in front of S3: the in-process LRU, then the disk cache
+_lru = LRUCache(settings.get("memo_lru_size", 1024))
+_single_flight = SingleFlight()
+_async_single_flight = AsyncSingleFlight()
+# Runs the blocking disk and S3 access of `async_memo`
+_async_executor = ThreadPoolExecutor(settings.get("memo_async_workers", 16), thread_name_prefix="memo-async")
+
+
 # TODO removing push function
 def _push_to_s3(filename, object, s3_bucket):
     _s3_client.upload_fileobj(
@@ -65,23 +85,115 @@ def _push_to_s3(filename, object, s3_bucket):
     )
 
 
+def _upload_to_s3(s3_bucket, filename, data: bytes):
+    with BytesIO(data) as fileobj:
+        _push_to_s3(filename, fileobj, s3_bucket)
+
+
+_purger = PrefixPurger(lambda: _s3_client, max_workers=settings.get("memo_purge_workers", 8))
+
+_s3_writer = S3WriteBehind(
+    _upload_to_s3,
+    max_workers=settings.get("memo_s3_writers", 4),
+    max_attempts=settings.get("memo_s3_max_attempts", 5),
+)
+# Give queued memo writes a chance to reach S3 before the process exits
+atexit.register(_s3_writer.flush, 30)
+
+
 def _pull_from_s3(object, filename, s3_bucket) -> object:
     return _s3_client.download_fileobj(
         Bucket=s3_bucket, Key=filename, Fileobj=object, Config=boto3.s3.transfer.TransferConfig(use_threads=False)
     )
 
 
-def _refresh_push_to_s3(method, filepath, s3_bucket) -> object:
-    result = method()
-    cache[filepath] = result
+def _serialize(result) -> bytes:
     with BytesIO() as tmpfile:
         joblib.dump(result, tmpfile)
-        _push_to_s3(filepath, tmpfile, s3_bucket)
+        return tmpfile.getvalue()
+
+
+def _store_locally(filepath, result):
+    _lru.set(filepath, result)
+    cache[filepath] = result
+
+
+def _get_locally(filepath):
+    """Looks `filepath` up in the LRU, then in the disk cache, returns `MISSING` if neither has it."""
+    result = _lru.get(filepath)
+    if result is MISSING:
+        result = cache.get(filepath, default=MISSING)
+        if result is not MISSING:
+            _lru.set(filepath, result)
     return result
 
 
+def _store(filepath, s3_bucket, result):
+    _store_locally(filepath, result)
+    _s3_writer.put(s3_bucket, filepath, _serialize(result))
+
+
+def _refresh_push_to_s3(method, filepath, s3_bucket) -> object:
+    result = method()
+    _store(filepath, s3_bucket, result)
+    return result
+
+
+def _load_from_s3(filepath, s3_bucket) -> object:
+    """Loads `filepath` from S3, or from the queued upload, into the local tiers, returns `MISSING` if S3 has no entry."""
+    data = _s3_writer.get(s3_bucket, filepath)
+    if data is None:
+        try:
+            with BytesIO() as tmpfile:
+                _pull_from_s3(tmpfile, filepath, s3_bucket)
+                data = tmpfile.getvalue()
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return MISSING
+            raise
+    with BytesIO(data) as tmpfile:
+        result = joblib.load(tmpfile)
+    log.info(f"Write to local cache for {filepath}")
+    _store_locally(filepath, result)
+    return result
+
+
+def _load_or_refresh(method, filepath, s3_bucket) -> object:
+    # A concurrent load may have filled the local tiers meanwhile
+    result = _get_locally(filepath)
+    if result is not MISSING:
+        return result
+
+    try:  # try checking s3 for cache first, if exist, then return the value
+        result = _load_from_s3(filepath, s3_bucket)
+    except botocore.exceptions.ClientError as e:
+        log.error(f"Could not access s3: {e}")  # other s3 errors, should not lead to internal error in the DP
+        return method()
+    except Exception as e:
+        log.error(f"Could not access memo: {e}")
+        return method()
+    if result is MISSING:  # no local/s3 cache, produce the task, cache it
+        log.debug("The S3 and local cache does not exist.")
+        return _refresh_push_to_s3(method, filepath, s3_bucket)
+    return result
+
+
+def flush_memo(timeout=None) -> bool:
+    """Blocks until the memo entries written so far are uploaded to S3.
+
+    Returns:
+        False if the timeout expired first.
+    """
+    return _s3_writer.flush(timeout)
+
+
 # TODO: This is an experimental implementation of memoization for api calls. This is mainly used to support recovery
 def memo(method, filename, folder=None, refresh=False):
+    """Returns the memoized result of `method`, looked up in memory, on disk and in S3, in that order.
+
+    On a miss in all tiers `method` is called and its result stored in all of them, the S3 upload happens in the
+    background. Concurrent calls for the same entry share a single lookup.
+    """
     start_time = time()
     try:
         if folder is None:
@@ -95,148 +207,103 @@ def memo(method, filename, folder=None, refresh=False):
         if refresh:  # if forced refresh, then redo the method
             log.info(f"Refresh True {method.__name__}")
             return _refresh_push_to_s3(method, filepath, s3_bucket)
-        if filepath in cache:  # if have local cache, great, then continue
+        result = _get_locally(filepath)
+        if result is not MISSING:  # if have local cache, great, then continue
             log.info(f"Cache hit for {filepath}")
-            return cache.get(filepath)
-        else:  # if local cache does not exist,
-            try:  # try checking s3 for cache first, if exist, then return the value
-                with BytesIO() as tmpfile:
-                    _pull_from_s3(tmpfile, filename, s3_bucket)
-                    result = joblib.load(tmpfile)
-                log.info(f"Write to local cache for {filepath}")
-                cache[filepath] = result
-                return result
-            except botocore.exceptions.ClientError as e:
-                if e.response["Error"]["Code"] == "404":  # no local/s3 cache, produce the task, cache in local and s3
-                    log.debug("The S3 and local cache does not exist.")
-                    return _refresh_push_to_s3(method, filepath, s3_bucket)
-                else:
-                    log.error(
-                        f"Could not access s3: {e}"
-                    )  # other s3 errors, should not lead to internal error in the DP
-            except Exception as e:
-                log.error(f"Could not access memo: {e}")
-
+            return result
+        return _single_flight.do(filepath, lambda: _load_or_refresh(method, filepath, s3_bucket))
     finally:
         log.debug(f"Memo elapsed time: {time() - start_time} secs")
-    return method()
 
 
-# TODO: this is hacky way of implementing memoization of random task
+async def _async_refresh_push_to_s3(method, filepath, s3_bucket) -> object:
+    result = await method()
+    await asyncio.get_running_loop().run_in_executor(_async_executor, _store, filepath, s3_bucket, result)
+    return result
+
+
+async def _async_load_or_refresh(method, filepath, s3_bucket) -> object:
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(_async_executor, _get_locally, filepath)
+    if result is MISSING:  # try checking s3 for cache first, other s3 errors are raised
+        result = await loop.run_in_executor(_async_executor, _load_from_s3, filepath, s3_bucket)
+    if result is MISSING:  # no local/s3 cache, produce the task, cache it
+        log.debug("The S3 and local cache does not exist.")
+        return await _async_refresh_push_to_s3(method, filepath, s3_bucket)
+    return result
+
+
 async def async_memo(method, filename, folder=None, refresh=False):
-    """TODO(veselin/purnawirman): is this something we want to support and use going forward vs snapshot?"""
+    """Async counterpart of `memo` for coroutine functions, backed by the same tiers and S3 client.
+
+    Disk and S3 access runs on a bounded executor shared by all calls, so many memoized coroutines can be gathered at
+    once. Concurrent calls for the same entry share a single lookup.
+    """
     start_time = time()
     try:
         if folder is None:
             folder = f"memo/{settings.name}"
-        log.info(f"Executing memo of {settings.name}/{filename}...")
-        session = boto3.session.Session()
-        client = session.resource("s3")
-        s3_bucket = settings.memo_bucket
+        log.debug(f"Executing memo of {settings.name}/{filename}...")
 
+        s3_bucket = settings.memo_bucket
         filepath = os.path.join(folder, filename)
-        if not os.path.isdir(os.path.dirname(filepath)):
-            os.makedirs(os.path.dirname(filepath))
-
-        # TODO removing push function
-        def push_to_s3(filename, client):
-            # client.upload_file
-            client.meta.client.upload_file(filename, s3_bucket, filename)
-
-        async def pull_from_s3(filename, client):
-            dest_folder = os.path.dirname(filename)
-            if not os.path.isdir(dest_folder):
-                os.makedirs(dest_folder)
-            bucket = client.Bucket(s3_bucket)
-            await asyncio.get_event_loop().run_in_executor(None, bucket.download_file, filename, filename)
-
-        async def refresh_push_to_s3(method, filepath, client):
-            result = await method()
-            joblib.dump(result, filepath)
-            await asyncio.get_event_loop().run_in_executor(None, push_to_s3, filepath, client)
-            return result
 
         # logic
         if refresh:  # if forced refresh, then redo the method
             log.info(f"Refresh True {method.__name__}")
-            return await refresh_push_to_s3(method, filepath, client)
-
-        if os.path.isfile(filepath):
-            return joblib.load(filepath)
-        try:  # try checking s3 for cache first, if exist, then return the value
-            await pull_from_s3(filepath, client)
-            return joblib.load(filepath)
-        except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] == "404":  # no local/s3 cache, produce the task, cache in local and s3
-                log.warning("The S3 and local cache does not exist.")
-                return await refresh_push_to_s3(method, filepath, client)
-            else:
-                raise  # other s3 errors
+            return await _async_refresh_push_to_s3(method, filepath, s3_bucket)
+        result = _lru.get(filepath)
+        if result is not MISSING:
+            log.info(f"Cache hit for {filepath}")
+            return result
+        return await _async_single_flight.do(filepath, lambda: _async_load_or_refresh(method, filepath, s3_bucket))
     finally:
-        log.info(f"Memo elapsed time: {time() - start_time} secs")
+        log.debug(f"Memo elapsed time: {time() - start_time} secs")
+
 
+def forget_memo(filename, folder=None, prefix: str = None) -> Optional[Future]:
+    """Removes a memo entry, or all entries under `prefix`, from every tier.
 
-def forget_memo(filename, folder=None, prefix: str = None):
+    Entries under a prefix are deleted from S3 in the background.
+
+    Returns:
+        With a prefix, a future resolving with the number of deleted S3 object versions.
+    """
     s3_bucket = settings.memo_bucket
     if folder is None:
         folder = f"memo/{settings.name}"
 
     if filename:
         filepath = os.path.join(folder, filename)
+        _lru.pop(filepath)
+        _s3_writer.discard(s3_bucket, filepath)
         if filepath in cache:  # if have local cache, great, then continue
             cache.pop(filepath)
         try:
             log.info(f"Removing s3 memo for {s3_bucket}/{folder}/{filename}")
-            session = boto3.session.Session()
-            client = session.resource("s3")
-            client.Object(s3_bucket, filepath).delete()
+            _s3_client.delete_object(Bucket=s3_bucket, Key=filepath)
         except botocore.exceptions.ClientError as e:
             log.warning(f"S3 Error: {e}")
 
     if prefix:
-        try:
-            s3_prefix = f"{folder}/{prefix}" if prefix.endswith("/") else f"{folder}/{prefix}/"
-            log.info(f"Removing s3 memo for Bucket={s3_bucket} Prefix={s3_prefix}")
-            delete_all_objects(Bucket=s3_bucket, Prefix=s3_prefix)
-        except botocore.exceptions.ClientError as e:
-            log.info(f"S3 Error: {e}")
+        s3_prefix = f"{folder}/{prefix}" if prefix.endswith("/") else f"{folder}/{prefix}/"
+        _lru.pop_prefix(s3_prefix)
+        _s3_writer.discard_prefix(s3_bucket, s3_prefix)
+        log.info(f"Removing s3 memo for Bucket={s3_bucket} Prefix={s3_prefix}")
+        # An upload already started would land after the listing, the purge waits for it
+        return _purger.purge(s3_bucket, s3_prefix, before=lambda: _s3_writer.flush_prefix(s3_bucket, s3_prefix))
 
 
-def delete_all_objects(Bucket, Prefix, MaxKeys=50, KeyMarker=None):
-    """TODO: Doesn't support pagination in case that a lot of keys need to be removed.
+def delete_all_objects(Bucket, Prefix, MaxKeys=1000, KeyMarker=None) -> int:
+    """Deletes all versions of the objects under a prefix, following the listing pagination.
 
     Args:
         Bucket: Bucket name
         Prefix: Key prefix
-        MaxKeys: Max number of keys to return
-        KeyMarker: AWS KeyMarker
-    """
-    client = boto3.client("s3")
-    version_list = (
-        client.list_object_versions(Bucket=Bucket, MaxKeys=MaxKeys, KeyMarker=KeyMarker, Prefix=Prefix)
-        if KeyMarker
-        else client.list_object_versions(Bucket=Bucket, MaxKeys=MaxKeys, Prefix=Prefix)
-    )
-    try:
-        objects = []
-        versions = version_list.get("Versions", [])
-        for v in versions:
-            objects.append({"VersionId": v["VersionId"], "Key": v["Key"]})
-            response = client.delete_objects(Bucket=Bucket, Delete={"Objects": objects})
-            log.info(response)
-
-        log.info(f"Deleted Memo Bucket={Bucket}, Delete='Objects': {objects}")
+        MaxKeys: Max number of keys listed per page
+        KeyMarker: AWS KeyMarker to start listing after
 
-    except Exception:
-        try:
-            objects = []
-            delete_markers = version_list["DeleteMarkers"]
-            for d in delete_markers:
-                objects.append({"VersionId": d["VersionId"], "Key": d["Key"]})
-                response = client.delete_objects(Bucket=Bucket, Delete={"Objects": objects})
-                log.info(response)
-
-            log.info(f"Deleted Memo Bucket={Bucket}, Delete='Objects': {objects}")
-        except Exception:
-            IsTruncated = version_list["IsTruncated"]  # noqa
-            KeyMarker = version_list["NextKeyMarker"]
+    Returns:
+        The number of deleted object versions and delete markers.
+    """
+    return _purger.purge(Bucket, Prefix, page_size=MaxKeys, key_marker=KeyMarker).result()
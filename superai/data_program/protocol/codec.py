@@ -0,0 +1,160 @@
+"""JSON codecs used to (de)serialize the messages exchanged with the agent.
+
+The stdlib `json` module is always available, `orjson` and `msgspec` are used when installed since they encode and
+decode the large task payloads several times faster. All codecs produce compact JSON and accept `str` or `bytes`.
+Given the jsonpickle flattening hook of the transport, they all encode a message like `jsonpickle.encode(message,
+unpicklable=False)` did.
+"""
+import json
+from typing import Any, Callable, Optional, Union
+
+from superai.log import logger
+
+logger = logger.get_logger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+_PLAIN_SCALARS = frozenset({str, int, bool, type(None)})
+
+
+def _is_plain(obj) -> bool:
+    """Whether `obj` only holds JSON values every codec encodes alike: dicts with str keys, lists, tuples, str, int,
+    finite floats, bools and None. Subclasses, e.g. `IntEnum` members, are not plain."""
+    try:
+        return _plain(obj)
+    except RecursionError:
+        # Too deep or cyclic, left to the flattening
+        return False
+
+
+def _plain(obj) -> bool:
+    kind = type(obj)
+    if kind is dict:
+        for key in obj:
+            if type(key) is not str:
+                return False
+        values = obj.values()
+    elif kind is list or kind is tuple:
+        values = obj
+    else:
+        return kind in _PLAIN_SCALARS or (kind is float and obj - obj == 0.0)
+    # Scalars are checked inline, this walk runs on every message
+    for value in values:
+        kind = type(value)
+        if kind in _PLAIN_SCALARS:
+            continue
+        if kind is float:
+            if value - value != 0.0:
+                return False
+        elif not _plain(value):
+            return False
+    return True
+
+
+class JsonCodec:
+    """Codec backed by the stdlib `json` module.
+
+    With a `default` hook, the documents holding values which are not plain JSON, e.g. objects, enums, UUIDs, NaN or
+    non-str keys, are flattened as a whole by it and encoded by the stdlib encoder, which the fast codecs would encode
+    differently. Plain documents are encoded by the codec itself.
+    """
+
+    name = "json"
+
+    def __init__(self, default: Optional[Callable[[Any], Any]] = None):
+        self._encoder = json.JSONEncoder(separators=(",", ":"), default=default)
+        self._decoder = json.JSONDecoder()
+        self._flatten = default
+
+    def dumps(self, obj) -> str:
+        if self._flatten is not None and not _is_plain(obj):
+            return self._encoder.encode(self._flatten(obj))
+        return self._encode(obj)
+
+    def _encode(self, obj) -> str:
+        return self._encoder.encode(obj)
+
+    def loads(self, data: Union[str, bytes]):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return self._decoder.decode(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """Codec backed by `orjson`.
+
+    Values orjson refuses to encode (e.g. integers over 64 bits) are encoded by the stdlib codec instead, and so are
+    decoded the documents it refuses, e.g. holding `NaN`.
+    """
+
+    name = "orjson"
+
+    def __init__(self, default: Optional[Callable[[Any], Any]] = None):
+        if orjson is None:
+            raise ImportError("orjson is not installed. Please install it with `pip install orjson`")
+        super().__init__(default)
+
+    def _encode(self, obj) -> str:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            return super()._encode(obj)
+
+    def loads(self, data: Union[str, bytes]):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super().loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    """Codec backed by `msgspec.json`, values or documents it refuses are handled by the stdlib codec instead."""
+
+    name = "msgspec"
+
+    def __init__(self, default: Optional[Callable[[Any], Any]] = None):
+        if msgspec is None:
+            raise ImportError("msgspec is not installed. Please install it with `pip install msgspec`")
+        super().__init__(default)
+        self._msgspec_encoder = msgspec.json.Encoder()
+        self._msgspec_decoder = msgspec.json.Decoder()
+
+    def _encode(self, obj) -> str:
+        try:
+            return self._msgspec_encoder.encode(obj).decode("utf-8")
+        except (TypeError, OverflowError, msgspec.EncodeError):
+            return super()._encode(obj)
+
+    def loads(self, data: Union[str, bytes]):
+        try:
+            return self._msgspec_decoder.decode(data)
+        except msgspec.DecodeError:
+            return super().loads(data)
+
+
+CODECS = {codec.name: codec for codec in (OrjsonCodec, MsgspecCodec, JsonCodec)}
+
+
+def get_codec(name: str = "auto", default: Optional[Callable[[Any], Any]] = None) -> JsonCodec:
+    """Creates the codec called `name`, `auto` picks the fastest installed one.
+
+    Args:
+        name: One of `auto`, `orjson`, `msgspec` or `json`.
+        default: Called with values the codec cannot encode, must return an encodable replacement.
+    """
+    if name == "auto":
+        name = "orjson" if orjson else "msgspec" if msgspec else "json"
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec {name}, expected one of auto, {', '.join(CODECS)}")
+    codec = CODECS[name](default)
+    logger.debug(f"Using the {name} codec for agent messages")
+    return codec
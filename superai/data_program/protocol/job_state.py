@@ -0,0 +1,92 @@
+"""State of the jobs handled by the transport, kept in one object per job."""
+from threading import Lock
+from typing import Callable, Optional
+
+
+class JobState:
+    """All futures a job can wait on, plus its termination flag.
+
+    Insertions into the futures table take the per-job lock, the single-valued futures are only assigned by the job
+    itself.
+    """
+
+    __slots__ = (
+        "id",
+        "lock",
+        "task_futures",
+        "job_input",
+        "job_input_data",
+        "snapshot",
+        "snapshot_data",
+        "child_job",
+        "terminated",
+    )
+
+    def __init__(self, id, job_input):
+        self.id = id
+        self.lock = Lock()
+        self.task_futures = {}  # sequence -> future
+        self.job_input = job_input
+        self.job_input_data = None
+        self.snapshot = None
+        self.snapshot_data = None
+        self.child_job = None
+        self.terminated = False
+
+    def future(self, sequence, factory: Callable):
+        """Returns the future registered for `sequence`, creating it with `factory` if it does not exist yet."""
+        f = self.task_futures.get(sequence)
+        if f is not None:
+            return f
+        with self.lock:
+            f = self.task_futures.get(sequence)
+            if f is None:
+                f = self.task_futures[sequence] = factory()
+            return f
+
+    def terminate(self):
+        """Flags the job as terminated and cancels every future it could be waiting on."""
+        self.terminated = True
+        with self.lock:
+            futures = list(self.task_futures.values())
+        futures.extend(
+            f
+            for f in (self.job_input, self.job_input_data, self.snapshot, self.snapshot_data, self.child_job)
+            if f is not None
+        )
+        for f in futures:
+            f.cancel()
+
+
+class JobStateRegistry:
+    """Job states by job id, spread over independently locked shards to keep lock contention low under high job
+    churn."""
+
+    def __init__(self, shards: int = 64):
+        self._shards = tuple((Lock(), {}) for _ in range(shards))
+
+    def _shard(self, id):
+        return self._shards[hash(id) % len(self._shards)]
+
+    def create(self, id, job_input) -> JobState:
+        """Registers a fresh state for job `id`, replacing any previous one."""
+        state = JobState(id, job_input)
+        lock, states = self._shard(id)
+        with lock:
+            states[id] = state
+        return state
+
+    def get(self, id) -> Optional[JobState]:
+        # Single dict lookups are atomic, only mutations take the shard lock
+        return self._shards[hash(id) % len(self._shards)][1].get(id)
+
+    def remove(self, id) -> Optional[JobState]:
+        lock, states = self._shard(id)
+        with lock:
+            return states.pop(id, None)
+
+    def __contains__(self, id) -> bool:
+        return self.get(id) is not None
+
+    def __len__(self) -> int:
+        return sum(len(states) for _, states in self._shards)
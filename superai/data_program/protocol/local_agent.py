@@ -0,0 +1,410 @@
+"""Local stand-in for the Canotic agent, used to exercise the transport of a data program under load.
+
+The agent creates the `/tmp/canotic.in.<id>` and `/tmp/canotic.out.<id>` FIFOs, starts the data program with
+`CANOTIC_AGENT` and `CANOTIC_SERVE` set and, once its workflows are subscribed, sends EXECUTE messages at the rate of a
+`LoadProfile`. Requests of the data program are answered like the real agent would after a delay drawn from the
+profile latencies, jobs can be cancelled while they run:
+
+    with LocalAgent() as agent:
+        agent.start([sys.executable, "my_workflows.py"])
+        report = agent.run(LoadProfile(suffixes=["my_workflow"], jobs=1000, rate=200))
+    print(report.summary())
+
+Random draws come from generators seeded with `LoadProfile.seed`, the index of the job and the sequence of the message
+they apply to, so repeated runs of a profile send the same messages with the same delays whatever the interleaving of
+the jobs.
+"""
+import heapq
+import io
+import itertools
+import math
+import os
+import random
+import subprocess
+import time
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from attr import Factory, define, field, validators
+
+from superai.log import logger
+
+from .codec import get_codec
+
+logger = logger.get_logger(__name__)
+
+# Messages ending a job, the data program waits for a RESPONSE to each of them
+TERMINAL_MESSAGES = ("RESOLVE_JOB", "FAIL_JOB", "INTERNAL_ERROR", "EXPIRE_JOB", "SUSPEND_JOB")
+CANCELLED = "CANCEL"
+
+
+@define
+class Latency:
+    """Distribution of a delay in seconds.
+
+    `constant` always waits `mean`, `uniform` draws from `mean ± spread`, `exponential` has mean `mean` and `lognormal`
+    has median `mean` and shape parameter `spread`.
+    """
+
+    mean: float = 0.0
+    kind: str = field(default="constant", validator=validators.in_(("constant", "uniform", "exponential", "lognormal")))
+    spread: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean <= 0 or self.kind == "constant":
+            return max(self.mean, 0.0)
+        if self.kind == "uniform":
+            return max(rng.uniform(self.mean - self.spread, self.mean + self.spread), 0.0)
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.mean)
+        return rng.lognormvariate(math.log(self.mean), self.spread)
+
+
+def _echo_task_input(task: dict) -> Any:
+    return task.get("payload", {}).get("input")
+
+
+@define
+class LoadProfile:
+    """Load generated by `LocalAgent.run`.
+
+    Attributes:
+        suffixes: Workflows receiving the jobs, in round robin.
+        jobs: Number of EXECUTE messages to send.
+        rate: EXECUTE messages per second, all jobs are sent at once if None.
+        poisson: Draw exponential inter-arrival times averaging `1 / rate` instead of a fixed interval.
+        task_latency: Delay before answering an EVALUATE_TASK or EXECUTE_JOB.
+        snapshot_latency: Delay before answering a RESTORE_SNAPSHOT or LOAD_SNAPSHOT_DATA.
+        cancel_ratio: Fraction of the jobs receiving a CANCEL.
+        cancel_after: Delay between the EXECUTE and the CANCEL of a job, no CANCEL is sent once the job ended.
+        subject: Subject of the job with the given index.
+        task_values: Values of the TASK_RESPONSE to an EVALUATE_TASK message body, defaults to the task input.
+        seed: Seed of all random draws.
+        timeout: Seconds to wait for all jobs to end.
+    """
+
+    suffixes: Sequence[str]
+    jobs: int = 100
+    rate: Optional[float] = None
+    poisson: bool = False
+    task_latency: Latency = Factory(Latency)
+    snapshot_latency: Latency = Factory(Latency)
+    cancel_ratio: float = 0.0
+    cancel_after: Latency = Factory(Latency)
+    subject: Callable[[int], Any] = lambda index: {"value": index}
+    task_values: Callable[[dict], Any] = _echo_task_input
+    seed: int = 0
+    timeout: float = 300.0
+
+
+@define
+class LoadReport:
+    """Outcome of a `LocalAgent.run`, times are in seconds.
+
+    Attributes:
+        outcomes: Number of jobs by type of their last message, `CANCEL` for the jobs cancelled before they ended.
+        latencies: Sorted times between the EXECUTE and the last message of the jobs that ended on their own.
+        unfinished: Jobs still running when the run timed out or the data program exited.
+    """
+
+    jobs: int
+    outcomes: Dict[str, int]
+    tasks: int
+    duration: float
+    latencies: List[float]
+    unfinished: int
+
+    @property
+    def jobs_per_second(self) -> float:
+        return len(self.latencies) / self.duration if self.duration else 0.0
+
+    def percentile(self, p: float) -> float:
+        """Latency below which `p` percent of the jobs ended."""
+        if not self.latencies:
+            return float("nan")
+        return self.latencies[min(len(self.latencies) - 1, int(len(self.latencies) * p / 100))]
+
+    def summary(self) -> str:
+        outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(self.outcomes.items()))
+        return (
+            f"{self.jobs} jobs in {self.duration:.2f}s ({outcomes}, {self.unfinished} unfinished), {self.tasks} tasks, "
+            f"{self.jobs_per_second:.1f} jobs/s, latency p50 {self.percentile(50) * 1000:.1f}ms "
+            f"p90 {self.percentile(90) * 1000:.1f}ms p99 {self.percentile(99) * 1000:.1f}ms"
+        )
+
+
+@define
+class _Job:
+    index: int
+    suffix: str
+    sent_at: Optional[float] = None
+    ended_at: Optional[float] = None
+    outcome: Optional[str] = None
+
+
+def _open_fifo(path: str, mode: str, process: subprocess.Popen, timeout: float):
+    """Opens our end of a FIFO, which blocks until the data program opened the other end."""
+    opened = []
+    opener = Thread(target=lambda: opened.append(io.open(path, mode, encoding="utf-8")), daemon=True)
+    opener.start()
+    deadline = time.monotonic() + timeout
+    while opener.is_alive():
+        opener.join(0.05)
+        if opener.is_alive() and (process.poll() is not None or time.monotonic() > deadline):
+            # Unblock the opener by opening the other end ourselves
+            with io.open(path, "r" if mode == "w" else "w", encoding="utf-8"):
+                opener.join()
+            opened[0].close()
+            raise RuntimeError(f"Data program did not open {path}, exit code {process.poll()}")
+    return opened[0]
+
+
+class LocalAgent:
+    """Plays the agent side of the transport pipes for a data program started by `start`."""
+
+    _instances = itertools.count()
+
+    def __init__(self, agent_id: Optional[str] = None):
+        self.agent_id = agent_id or f"{os.getpid()}{next(self._instances)}"
+        self.in_path = f"/tmp/canotic.in.{self.agent_id}"
+        self.out_path = f"/tmp/canotic.out.{self.agent_id}"
+        self.process = None
+        self._codec = get_codec()
+        self._in = None
+        self._out = None
+        self._threads = []
+        self._condition = Condition()
+        self._outbox = []  # heap of (due time, order, message)
+        self._order = itertools.count()
+        self._subscribed = set()
+        self._snapshots = {}
+        self._jobs = {}
+        self._next_job_id = 0
+        self._profile = None
+        self._running = 0
+        self._tasks = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self, command: List[str], env: Optional[Dict[str, str]] = None, timeout: float = 60):
+        """Starts the data program `command` and connects to its pipes."""
+        for path in (self.in_path, self.out_path):
+            if os.path.exists(path):
+                os.unlink(path)
+            os.mkfifo(path)
+
+        env = {**os.environ, **(env or {}), "CANOTIC_AGENT": self.agent_id, "CANOTIC_SERVE": "1"}
+        self.process = subprocess.Popen(command, env=env)
+        # Same order as the transport, which opens its input pipe first
+        self._in = _open_fifo(self.in_path, "w", self.process, timeout)
+        self._out = _open_fifo(self.out_path, "r", self.process, timeout)
+
+        self._threads = [
+            Thread(target=self._read, name=f"local-agent-{self.agent_id}-reader", daemon=True),
+            Thread(target=self._send, name=f"local-agent-{self.agent_id}-sender", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wait_for_subscriptions(self, suffixes: Sequence[str], timeout: float = 60):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._closed or self._subscribed.issuperset(suffixes), timeout):
+                raise TimeoutError(f"Workflows {set(suffixes) - self._subscribed} were not subscribed")
+            if self._closed:
+                raise RuntimeError(f"Data program exited before subscribing, exit code {self.process.poll()}")
+
+    def run(self, profile: LoadProfile) -> LoadReport:
+        """Sends the jobs of `profile` and waits for all of them to end."""
+        self.wait_for_subscriptions(profile.suffixes, profile.timeout)
+
+        arrivals = self._rng(profile, "arrival", 0)
+        start = time.perf_counter()
+        at = start
+        ids = []
+        with self._condition:
+            self._profile = profile
+            self._tasks = 0
+            for index in range(profile.jobs):
+                id = self._next_job_id
+                self._next_job_id += 1
+                ids.append(id)
+                suffix = profile.suffixes[index % len(profile.suffixes)]
+                self._jobs[id] = _Job(index, suffix)
+                self._running += 1
+                if index and profile.rate:
+                    at += arrivals.expovariate(profile.rate) if profile.poisson else 1 / profile.rate
+                execute = {
+                    "type": "EXECUTE",
+                    "id": id,
+                    "uuid": f"{self.agent_id}-{id}",
+                    "suffix": suffix,
+                    "projectId": f"local-{self.agent_id}",
+                    "child": False,
+                    "subject": profile.subject(index),
+                }
+                self._post(at, execute)
+
+                cancel = self._rng(profile, "cancel", index)
+                if profile.cancel_ratio and cancel.random() < profile.cancel_ratio:
+                    self._post(at + profile.cancel_after.sample(cancel), {"type": CANCELLED, "id": id})
+
+            self._condition.wait_for(lambda: self._closed or not self._running, profile.timeout)
+            duration = time.perf_counter() - start
+            jobs = [self._jobs.pop(id) for id in ids]
+            self._running = 0
+            self._profile = None
+
+        outcomes = {}
+        for job in jobs:
+            if job.outcome is not None:
+                outcomes[job.outcome] = outcomes.get(job.outcome, 0) + 1
+        return LoadReport(
+            jobs=profile.jobs,
+            outcomes=outcomes,
+            tasks=self._tasks,
+            duration=duration,
+            latencies=sorted(job.ended_at - job.sent_at for job in jobs if job.outcome not in (None, CANCELLED)),
+            unfinished=sum(1 for job in jobs if job.outcome is None),
+        )
+
+    def stop(self, timeout: float = 10):
+        """Closes the pipes, which stops the transport pump, and waits for the data program to exit."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._threads:
+            self._threads[1].join(timeout)
+        if self._in is not None:
+            self._in.close()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Data program {self.process.pid} did not exit, killing it")
+                self.process.kill()
+                self.process.wait()
+        if self._threads:
+            # The reader stops at the end of the output of the data program
+            self._threads[0].join(timeout)
+        if self._out is not None:
+            self._out.close()
+        for path in (self.in_path, self.out_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    @staticmethod
+    def _rng(profile: LoadProfile, purpose: str, *keys) -> random.Random:
+        return random.Random(":".join(map(str, (profile.seed, purpose) + keys)))
+
+    def _job_index(self, id) -> int:
+        """Index of job `id` in the current run, which keys its random draws independently of the job ids."""
+        job = self._jobs.get(id)
+        return job.index if job is not None else id
+
+    def _post(self, delay_or_time: float, message: dict, relative: bool = False):
+        """Queues `message` for sending at `delay_or_time`, must be called with the condition held."""
+        due = time.perf_counter() + delay_or_time if relative else delay_or_time
+        heapq.heappush(self._outbox, (due, next(self._order), message))
+        self._condition.notify_all()
+
+    def _send(self):
+        """Writes the due messages, all messages due at once are written with a single write."""
+        while True:
+            with self._condition:
+                while not self._closed and (not self._outbox or self._outbox[0][0] > time.perf_counter()):
+                    self._condition.wait(self._outbox[0][0] - time.perf_counter() if self._outbox else None)
+                if self._closed:
+                    return
+                now = time.perf_counter()
+                lines = []
+                while self._outbox and self._outbox[0][0] <= now:
+                    _, _, message = heapq.heappop(self._outbox)
+                    if self._prepare(message, now):
+                        lines.append(self._codec.dumps(message))
+            if lines:
+                lines.append("")
+                try:
+                    self._in.write("\n".join(lines))
+                    self._in.flush()
+                except (BrokenPipeError, ValueError):
+                    logger.warning("Data program closed its input pipe")
+                    return
+
+    def _prepare(self, message: dict, now: float) -> bool:
+        """Updates the job bookkeeping for a message about to be sent, returns False to drop the message."""
+        job = self._jobs.get(message["id"])
+        if message["type"] == "EXECUTE" and job is not None:
+            job.sent_at = now
+        elif message["type"] == CANCELLED:
+            if job is None or job.outcome is not None:
+                return False
+            self._end(job, CANCELLED, now)
+        elif "timestamp" in message:
+            message["timestamp"] = int(time.time() * 1000)
+        return True
+
+    def _end(self, job: _Job, outcome: str, now: float):
+        job.outcome = outcome
+        job.ended_at = now
+        self._running -= 1
+        if not self._running:
+            self._condition.notify_all()
+
+    def _read(self):
+        for line in self._out:
+            try:
+                body = self._codec.loads(line)["body"]
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Ignoring unexpected output of the data program: {line!r}")
+                continue
+            with self._condition:
+                self._handle(body, time.perf_counter())
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _handle(self, body: dict, now: float):
+        """Answers a message of the data program, must be called with the condition held."""
+        type, id, sequence = body.get("type"), body.get("id"), body.get("sequence")
+        profile = self._profile
+        index = self._job_index(id)
+
+        if type == "SUBSCRIBE":
+            self._subscribed.add(body["suffix"])
+            self._condition.notify_all()
+        elif type in TERMINAL_MESSAGES:
+            self._post(now, {"type": "RESPONSE", "id": id, "sequence": sequence})
+            job = self._jobs.get(id)
+            if job is not None and job.outcome is None:
+                self._end(job, type, now)
+        elif profile is None:
+            logger.warning(f"Ignoring {type} of job {id} received outside of a run")
+        elif type == "EVALUATE_TASK":
+            self._tasks += 1
+            delay = profile.task_latency.sample(self._rng(profile, "task", index, sequence))
+            response = {"type": "TASK_RESPONSE", "id": id, "sequence": sequence, "timestamp": None}
+            response["values"] = profile.task_values(body)
+            self._post(delay, response, relative=True)
+        elif type == "EXECUTE_JOB":
+            self._tasks += 1
+            delay = profile.task_latency.sample(self._rng(profile, "task", index, sequence))
+            response = {"type": "CHILD_RESPONSE", "id": id, "sequence": sequence, "timestamp": None}
+            response.update(status="COMPLETED", response=body.get("subject"))
+            self._post(delay, response, relative=True)
+        elif type == "SNAPSHOT":
+            self._snapshots[id] = body.get("snapshot")
+        elif type == "RESTORE_SNAPSHOT":
+            delay = profile.snapshot_latency.sample(self._rng(profile, "snapshot", index, sequence))
+            self._post(delay, {"type": "SNAPSHOT", "id": id, "snapshot": self._snapshots.get(id)}, relative=True)
+        elif type == "LOAD_SNAPSHOT_DATA":
+            delay = profile.snapshot_latency.sample(self._rng(profile, "snapshot_data", index))
+            self._post(delay, {"type": "SNAPSHOT_DATA", "id": id, "data": None}, relative=True)
+        elif type == "LOAD_JOB_DATA":
+            self._post(now, {"type": "JOB_DATA", "id": id, "data": None})
+        elif type == "LOAD_CHILD_DATA":
+            self._post(now, {"type": "CHILD_JOB_DATA", "id": id, "data": None})
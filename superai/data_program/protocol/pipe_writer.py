@@ -0,0 +1,91 @@
+"""Batched writer for the outbound agent pipe."""
+import time
+from queue import Empty, SimpleQueue
+from threading import Event, Thread
+from typing import Optional, TextIO
+
+import sentry_sdk
+
+from superai.log import logger
+
+logger = logger.get_logger(__name__)
+
+
+class _Stop:
+    pass
+
+
+class PipeWriter:
+    """Single writer of newline delimited messages to a pipe.
+
+    Callers only enqueue their message, a dedicated thread drains the queue and writes the collected batch with a
+    single `write` and `flush`. A batch is written once `max_batch_bytes` are collected or `linger` seconds after its
+    first message arrived, whichever comes first. Messages are written in the order they were enqueued.
+    """
+
+    def __init__(self, pipe: TextIO, max_batch_bytes: int = 1 << 20, linger: float = 0.001, name: str = "pipe-writer"):
+        self._pipe = pipe
+        self._max_batch_bytes = max_batch_bytes
+        self._linger = linger
+        self._queue = SimpleQueue()
+        self._thread = Thread(target=self._drain, name=name, daemon=True)
+        self._thread.start()
+
+    def write(self, line: str):
+        """Enqueues `line`, the newline is appended by the writer."""
+        self._queue.put(line)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until all messages enqueued so far are written to the pipe.
+
+        Returns:
+            False if the timeout expired first.
+        """
+        written = Event()
+        self._queue.put(written)
+        return written.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Writes the pending messages and stops the writer thread."""
+        self._queue.put(_Stop)
+        self._thread.join(timeout)
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            size = 0
+            deadline = time.monotonic() + self._linger
+            while isinstance(item, str):
+                batch.append(item)
+                size += len(item) + 1
+                if size >= self._max_batch_bytes:
+                    item = None
+                    break
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except Empty:
+                    item = None
+
+            if batch:
+                batch.append("")
+                self._write("\n".join(batch))
+
+            if isinstance(item, Event):
+                item.set()
+            elif item is _Stop:
+                return
+
+    def _write(self, data: str):
+        try:
+            self._pipe.write(data)
+            self._pipe.flush()
+        except BrokenPipeError as bp:
+            sentry_sdk.capture_exception(bp)
+            logger.exception(
+                f"[BrokenPipeError] {str(bp)} \nfilename {bp.filename if bp.filename else None} \nfilename2 {bp.filename2 if bp.filename2 else None} \nstrerror {bp.strerror if bp.strerror else None}"
+            )
+        except Exception as e:
+            logger.exception("Exception writing text_data to pipe")
+            sentry_sdk.capture_exception(e)
@@ -1,45 +1,113 @@
-import datetime
+import asyncio
 import os
 import tempfile
+import time
+from typing import Callable, Optional
 
 import diskcache as dc
+from attr import define
 
 cache = dc.Cache(os.path.join(tempfile.gettempdir(), "rate"))
 
 
-def compute_api_wait_time(entity: str, max_tpm: int, current_increase: int = 1):
-    """Uses in memory cache to keep track of how many TPM were done to a given entity,
-    returns the number of seconds that you need to wait in order to not exceed the
-    TPM that you provide. It's used to throttle API requests across threads.
+@define
+class Limit:
+    """Allows `rate` units per period for `entity`, a request takes `cost` units.
 
-    Args:
-        entity (str): A unique name for the API you're throttling.
-        max_tpm (int): The max TMP.
-        current_increase (int, optional): The amount of transactions that would
-        increase with the current request. Defaults to 1.
+    `burst` is the number of units that can be taken at once after being idle, `rate` by default.
+    """
 
-    Returns:
-        int: The number of seconds to wait in order to send the request successfully, 0
-        if the request can be performed. The reccomanded use is to wait the time if != 0
-        + a random additional time, and call this function again, since other services could
-        be filling the max TPM for the following minute before you.
+    entity: str
+    rate: float
+    cost: float = 1
+    burst: Optional[float] = None
+
+
+class RateLimiter:
+    """Token bucket rate limiter shared by all threads and processes using the same cache directory.
+
+    Each entity has a bucket refilled continuously at `rate` units per `period` seconds. The bucket state is stored as
+    the time at which it will be full again (GCRA), so a reservation reads and updates a single cache entry per limit.
+    A reservation over several limits, e.g. requests and tokens per minute, happens in one cache transaction, which is
+    atomic across processes.
+
+    Args:
+        cache: Cache holding the bucket state.
+        period: Period of the rates in seconds.
+        clock: Wall clock shared by the processes.
     """
 
-    now = datetime.datetime.now()
-    current_minute = now.minute
-    time_until_next_minute = 60 - now.second
-    current_key = f"{entity}:{str(current_minute)}"
+    def __init__(self, cache: dc.Cache, period: float = 60.0, clock: Callable[[], float] = time.time):
+        self._cache = cache
+        self._period = period
+        self._clock = clock
+
+    def reserve(self, *limits: Limit, commit_if_waiting: bool = True) -> float:
+        """Reserves the units of all `limits` for the earliest time all of them are available.
+
+        Args:
+            commit_if_waiting: Whether to keep the reservation when it is not available right away, otherwise nothing
+                is reserved and the caller is expected to try again after the returned time.
 
-    saved_tpm = cache.get(current_key)
+        Returns:
+            The number of seconds until the reservation can be used, 0 if it can be used right away.
+        """
+        with self._cache.transact():
+            now = self._clock()
+            buckets = []
+            start = now
+            for limit in limits:
+                key = f"{limit.entity}:tat"
+                interval = self._period / limit.rate
+                burst = limit.rate if limit.burst is None else limit.burst
+                tat = max(self._cache.get(key, now), now)
+                # The bucket must have room for the cost once `burst` units worth of time have been given back
+                start = max(start, tat + min(limit.cost, burst) * interval - burst * interval)
+                buckets.append((key, tat, limit.cost * interval))
 
-    if not saved_tpm:
-        cache.set(current_key, current_increase, time_until_next_minute)
-        return 0
+            wait = start - now
+            if wait <= 0 or commit_if_waiting:
+                for key, tat, cost in buckets:
+                    new_tat = max(tat, start) + cost
+                    self._cache.set(key, new_tat, expire=new_tat - now + 1)
+        return max(wait, 0.0)
 
-    tpm_when_requested = saved_tpm + current_increase
+    def acquire(self, *limits: Limit) -> float:
+        """Reserves the units of all `limits` and sleeps until they can be used.
 
-    if tpm_when_requested < max_tpm:
-        cache.incr(current_key, current_increase)
-        return 0
+        Returns:
+            The number of seconds waited.
+        """
+        wait = self.reserve(*limits)
+        if wait:
+            time.sleep(wait)
+        return wait
 
-    return time_until_next_minute
+    async def async_acquire(self, *limits: Limit) -> float:
+        """Async version of `acquire`, waits without blocking the event loop."""
+        wait = await asyncio.get_running_loop().run_in_executor(None, self.reserve, *limits)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+rate_limiter = RateLimiter(cache)
+
+
+def compute_api_wait_time(entity: str, max_tpm: int, current_increase: int = 1) -> float:
+    """Uses a shared cache to keep track of how many TPM were done to a given entity,
+    returns the number of seconds that you need to wait in order to not exceed the
+    TPM that you provide. It's used to throttle API requests across threads and processes.
+
+    Args:
+        entity (str): A unique name for the API you're throttling.
+        max_tpm (int): The max TPM.
+        current_increase (int, optional): The amount of transactions that would
+        increase with the current request. Defaults to 1.
+
+    Returns:
+        float: The number of seconds to wait in order to send the request successfully, 0
+        if the request can be performed. Nothing is reserved when the wait is not 0, so call
+        this function again after waiting, or use `rate_limiter.acquire` to reserve and wait at once.
+    """
+    return rate_limiter.reserve(Limit(entity, max_tpm, current_increase), commit_if_waiting=False)
@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import functools
+import inspect
 import json
 import logging
 import os
@@ -812,6 +813,20 @@ def schema_wrapper(subject, context, function, uses_new_schema: Optional[bool] =
     logger.debug(f"FUNCTION KWARGS = {kwargs}")
     f_output = function(subject) if not kwargs and subject is not None else function(**kwargs)
 
+    if inspect.isawaitable(f_output):
+        # `async def` workflows, the output can only be validated once the coroutine completed
+        async def validated_output(awaitable=f_output):
+            output = await awaitable
+            _validate_output(output, function, can_validate_input_output)
+            return output
+
+        return validated_output()
+
+    _validate_output(f_output, function, can_validate_input_output)
+    return f_output
+
+
+def _validate_output(f_output, function, can_validate_input_output: bool):
     if hasattr(function, "__output_param__") and can_validate_input_output:
         schema = function.__output_param__
         if type(f_output) == tuple:
@@ -821,8 +836,6 @@ def schema_wrapper(subject, context, function, uses_new_schema: Optional[bool] =
             validate(f_output, schema, validate_remote=True, client=DataHelper())
             logger.debug(f"VALIDATING OUTPUT_VALS: \n{f_output} \nSCHEMA: \n{schema}")
 
-    return f_output
-
 
 def _init_workflow_decorator(function, suffix, prefix):
     function.get_suffix = lambda: suffix
@@ -889,12 +902,23 @@ def workflow(suffix, prefix=None, workflow_type: Optional[WorkflowType] = None,
             schema["example"] = function.__example_data__
             logger.debug(f"EXAMPLE DATA\n{schema['example']}")
 
-        def function(subject, params, f=function):
-            logger.debug(f"FUNCTION_SUBJECT: {subject}")
-            logger.debug(f"FUNCTION_PARAMS: {params}")
-            logger.debug(f"FUNCTION_F: {f}")
+        if inspect.iscoroutinefunction(function):
+            # Keep coroutine workflows recognizable, so the transport can run them on its event loop
+            async def function(subject, params, f=function):
+                logger.debug(f"FUNCTION_SUBJECT: {subject}")
+                logger.debug(f"FUNCTION_PARAMS: {params}")
+                logger.debug(f"FUNCTION_F: {f}")
+
+                return await schema_wrapper(subject, params, f, uses_new_schema=uses_new_schema)
+
+        else:
+
+            def function(subject, params, f=function):
+                logger.debug(f"FUNCTION_SUBJECT: {subject}")
+                logger.debug(f"FUNCTION_PARAMS: {params}")
+                logger.debug(f"FUNCTION_F: {f}")
 
-            return schema_wrapper(subject, params, f, uses_new_schema=uses_new_schema)
+                return schema_wrapper(subject, params, f, uses_new_schema=uses_new_schema)
 
         logger.debug(f"WORFLOW_function: {function}")
         logger.debug(f"WORFLOW_suffix: {suffix}")
@@ -1,28 +1,38 @@
 """A transport layer for communicating with the Agent"""
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import asyncio
+import atexit
 import concurrent
+import contextvars
 import enum
 import functools
+import inspect
 import io
-import json
 import os
 import signal
 import sys
 from logging import FATAL, WARN
-from threading import Lock, Thread, local
-from typing import Optional
+from threading import Lock, Thread, get_ident
+from types import SimpleNamespace
+from typing import Dict, Optional
 
 import jsonpickle
 import sentry_sdk
 from futures_then import ThenableFuture as Future
 from jsonschema.exceptions import ValidationError
 
+from superai.config import settings
 from superai.data_program.Exceptions import *
 from superai.data_program.experimental import forget_memo
 from superai.log import logger
 from superai.utils import sentry_helper
 
+from .codec import get_codec
+from .job_state import JobStateRegistry
+from .pipe_writer import PipeWriter
+from .workflow_pool import AsyncWorkflowPool, WorkflowPool, WorkflowPoolStats
+
 sentry_helper.init()
 
 logger = logger.get_logger(__name__)
@@ -54,9 +64,32 @@ class message:
         self.meta_info = self.metaInfo(version, operation_status)
         self.body = body
 
+    def to_dict(self) -> dict:
+        return {
+            "meta_info": {"version": self.meta_info.version, "operation_status": self.meta_info.operation_status},
+            "body": self.body,
+        }
+
     @property
     def to_json(self):
-        return jsonpickle.encode(self, unpicklable=False)
+        return _codec.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "message":
+        meta_info = data["meta_info"]
+        return cls(data["body"], OperationStatus(meta_info["operation_status"]), meta_info["version"])
+
+    @classmethod
+    def from_json(cls, data) -> "message":
+        return cls.from_dict(_codec.loads(data))
+
+
+def _flatten(obj):
+    """Fallback for values the JSON codec cannot encode, flattened like `jsonpickle.encode(unpicklable=False)`."""
+    return jsonpickle.Pickler(unpicklable=False).flatten(obj)
+
+
+_codec = get_codec(settings.get("transport.codec", "auto"), default=_flatten)
 
 
 class future(Future):
@@ -70,33 +103,73 @@ class future(Future):
     def cookie(self):
         return self._cookie
 
+    def result(self, timeout=None):
+        if not self.done() and _pump_thread_id == get_ident():
+            # The response can only be delivered by the pump running on this very thread
+            raise RuntimeError("Blocking on an agent response from the transport event loop, use `await` instead")
+        return super().result(timeout)
 
-# Dictionary to store all local workflows
-_workflow_functions = {}
-_workflow_functions_lock = Lock()  # Lock to protect _workflow_callbacks logic
+    def __await__(self):
+        """Allows `async def` workflows to `await` task, child job and snapshot futures."""
+        if not self.done():
+            yield from asyncio.wait((asyncio.wrap_future(self),)).__await__()
+        return self.result()
+
+
+class _JobContext:
+    """Per-job context, like `threading.local` but also isolated between asyncio tasks.
+
+    Every workflow binds a fresh namespace when it starts, attribute access is then forwarded to the namespace bound in
+    the current thread or asyncio task.
+    """
+
+    def bind(self):
+        _job_namespace.set(SimpleNamespace())
+
+    def __getattr__(self, name):
+        namespace = _job_namespace.get(None)
+        if namespace is None:
+            raise AttributeError(name)
+        return getattr(namespace, name)
+
+    def __setattr__(self, name, value):
+        namespace = _job_namespace.get(None)
+        if namespace is None:
+            namespace = SimpleNamespace()
+            _job_namespace.set(namespace)
+        setattr(namespace, name, value)
 
-# Dictionary to store all futures
-_task_futures = {}
-_task_futures_lock = Lock()  # Lock to protect _task_dictionary logic
+    def __delattr__(self, name):
+        namespace = _job_namespace.get(None)
+        if namespace is None:
+            raise AttributeError(name)
+        delattr(namespace, name)
 
-# Job input parameter
-_job_input = {}
-_job_input_data = {}
-_job_input_lock = Lock()
 
-# Job snapshot state
-_snapshot = {}
-_snapshot_data = {}
-_snapshot_lock = Lock()
+_job_namespace = contextvars.ContextVar("job_namespace")
 
-# Child job result
-_child_job = {}
-_child_job_lock = Lock()
+# Run the pump on an asyncio event loop, this allows `async def` workflows
+_use_asyncio = bool(settings.get("transport.asyncio", False))
+# Upper bound for a single message line read by the asyncio pump
+_PIPE_READ_LIMIT = 1 << 30
 
-_terminate_flag = {}
-_terminate_flag_lock = Lock()
+# Identifier of the thread running the asyncio pump, None in threading mode
+_pump_thread_id = None
 
-_pipe_lock = Lock()
+# Jobs beyond these limits wait in a queue until a running job finishes
+_workflow_pool = WorkflowPool(int(settings.get("transport.max_workflow_threads", 256)), name="workflow")
+_coroutine_workflow_pool = (
+    AsyncWorkflowPool(int(settings.get("transport.max_workflow_coroutines", 10000)), name="coroutine workflow")
+    if _use_asyncio
+    else None
+)
+
+# Dictionary to store all local workflows
+_workflow_functions = {}
+_workflow_functions_lock = Lock()  # Lock to protect _workflow_callbacks logic
+
+# State of every job known to this process: task futures, job input, snapshot, child job and termination flag
+_jobs = JobStateRegistry()
 
 # in-out fifo pipes for communication with Agent
 _in_pipe = (
@@ -110,7 +183,22 @@ _out_pipe = (
     else None
 )
 
-_context = local()
+# Print every message sent to the agent to stdout
+_echo_messages = bool(settings.get("transport.echo_messages", False))
+_write_batch_bytes = int(settings.get("transport.write_batch_bytes", 1 << 20))
+_write_linger = float(settings.get("transport.write_linger", 0.001))
+
+
+def _create_pipe_writer(pipe):
+    writer = PipeWriter(pipe, max_batch_bytes=_write_batch_bytes, linger=_write_linger)
+    # Messages still queued when the interpreter exits would be lost otherwise
+    atexit.register(writer.close, timeout=5)
+    return writer
+
+
+_pipe_writer = _create_pipe_writer(_out_pipe) if _out_pipe is not None else None
+
+_context = _JobContext()
 
 if "CANOTIC_AGENT" in os.environ and "CANOTIC_SERVE" not in os.environ:
     _context.id = int(os.environ["CANOTIC_AGENT"])
@@ -123,58 +211,23 @@ if "CANOTIC_AGENT" in os.environ and "CANOTIC_SERVE" not in os.environ:
     _context.metadata = None
     _context.job_type = None
 
-    with _task_futures_lock:
-        _task_futures[_context.id] = {}
-    with _job_input_lock:
-        _job_input[_context.id] = future()
-        _job_input_data[_context.id] = None
-    with _snapshot_lock:
-        _snapshot[_context.id] = None
-        _snapshot_data[_context.id] = None
-    with _child_job_lock:
-        _child_job[_context.id] = None
-    with _terminate_flag_lock:
-        _terminate_flag[_context.id] = False
+    _context.state = _jobs.create(_context.id, future())
 
 
 def terminate_guard(function):
     @functools.wraps(function)
     def wrapper(*args, **kwargs):
-        with _terminate_flag_lock:
-            if _terminate_flag[_context.id]:
-                raise ValueError(f"Workflow instance {_context.id} terminated")
+        if _context.state.terminated:
+            raise ValueError(f"Workflow instance {_context.id} terminated")
         return function(*args, **kwargs)
 
     return wrapper
 
 
 def writeln_to_pipe_and_flush(text_data):
-    try:
+    if _echo_messages:
         print("Called by " + sys._getframe(1).f_code.co_name + " to pipe :" + text_data)
-        _out_pipe.write(text_data)
-    except TypeError as e:
-        print(e)
-        _out_pipe.write(unicode(text_data))
-        sentry_sdk.capture_exception(e)
-    except Exception as e:
-        print(e)
-        logger.exception("Exception writing text_data to pipe")
-        sentry_sdk.capture_exception(e)
-
-    try:
-        try:
-            _out_pipe.write("\n")
-        except Exception as e:
-            print(e)
-            logger.exception("Exception writing \\n to pipe")
-            sentry_sdk.capture_exception(e)
-        finally:
-            _out_pipe.flush()
-    except BrokenPipeError as bp:
-        sentry_sdk.capture_exception(bp)
-        logger.exception(
-            f"[BrokenPipeError] {str(bp)} \nfilename {bp.filename if bp.filename else None} \nfilename2 {bp.filename2 if bp.filename2 else None} \nstrerror {bp.strerror if bp.strerror else None}"
-        )
+    _pipe_writer.write(text_data)
 
 
 class child_result:
@@ -186,6 +239,23 @@ class child_result:
         self._timestamp = result["timestamp"] if "timestamp" in result else None
         self._data = None
 
+    def to_dict(self) -> dict:
+        fields = {
+            "id": self._id,
+            "status": self._status,
+            "response": self._response,
+            "dataRef": self._data_ref,
+            "timestamp": self._timestamp,
+        }
+        return {key: value for key, value in fields.items() if value is not None}
+
+    def to_json(self) -> str:
+        return _codec.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, data) -> "child_result":
+        return cls(_codec.loads(data))
+
     @terminate_guard
     def id(self):
         return self._id
@@ -210,8 +280,7 @@ class child_result:
         if self._data_ref is None:
             return None
 
-        global _child_job
-        self._data = _child_job[_context.id] = future()
+        self._data = _context.state.child_job = future()
 
         params = {
             "type": "LOAD_CHILD_DATA",
@@ -222,8 +291,7 @@ class child_result:
 
         message_for_agent = message(params)
 
-        with _pipe_lock:
-            writeln_to_pipe_and_flush(message_for_agent.to_json)
+        writeln_to_pipe_and_flush(message_for_agent.to_json)
 
         return self._data.result()
 
@@ -242,11 +310,28 @@ class child_job_future(future):
     def set_result(self, response):
         super(child_job_future, self).set_result(child_result(response))
 
+    def result(self, timeout=None):
+        if self.done():
+            return super().result(timeout)
+        # The child job may be executed by this process, queued behind the workflow waiting for it
+        with _workflow_pool.blocked():
+            return super().result(timeout)
+
 
 class task_result:
     def __init__(self, result):
         self._result = result
 
+    def to_dict(self) -> dict:
+        return self._result
+
+    def to_json(self) -> str:
+        return _codec.dumps(self._result)
+
+    @classmethod
+    def from_json(cls, data) -> "task_result":
+        return cls(_codec.loads(data))
+
     @terminate_guard
     def id(self):
         return self._result["id"] if "id" in self._result else None
@@ -324,6 +409,7 @@ def schedule_task(
     amount=None,
     schema_version=None,
     is_ai=None,
+    worker_type=None,
     qualifier_test_id=None,
 ) -> task_future:
     """Schedules a task for execution by inserting it into the future table."""
@@ -374,7 +460,9 @@ def schedule_task(
     if (amount is None) and (price is None):
         constraints["priceTag"] = "EASY"
 
-    if is_ai:
+    if worker_type is not None:
+        constraints["type"] = worker_type
+    elif is_ai:
         constraints["type"] = "AI"
 
     params = {
@@ -412,17 +500,11 @@ def schedule_task(
 
     params["payload"]["actions"]["showReject"] = show_reject
 
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = task_future()
-
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, task_future)
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
     return f
 
@@ -485,17 +567,11 @@ def schedule_workflow(
     if context:
         params["context"] = context
 
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = child_job_future()
-
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, child_job_future)
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
     return f
 
@@ -524,15 +600,9 @@ def resolve_job(response, data_folder, bill):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = future()
-
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, future)
 
     f.result()
 
@@ -547,15 +617,9 @@ def suspend_job_for_no_combiner():
 
     message_for_agent = message(params, OperationStatus.NO_SUITABLE_COMBINER)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = future()
-
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, future)
 
     f.result()
 
@@ -576,15 +640,9 @@ def fail_job(error):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
-
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = future()
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, future)
 
     f.result()
 
@@ -605,15 +663,9 @@ def internal_error(error):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = future()
-
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, future)
 
     f.result()
 
@@ -634,20 +686,16 @@ def expire_job(error):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
-
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = future()
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, future)
 
     f.result()
 
 
-def _worklow_thread(id, suffix, response):
+def _bind_job(id, response):
+    """Binds the job context of a starting workflow to the job state registered when the job was received."""
+    _context.bind()
     _context.id = id
     _context.uuid = response["uuid"]
     _context.app_id = response.get("appId")
@@ -659,31 +707,43 @@ def _worklow_thread(id, suffix, response):
     _context.metadata = response.get("metadata")
     _context.job_type = response.get("jobType") or None
     _context.priority = response.get("priority")
+    _context.state = _jobs.get(id) or _register_job(id, response)
+
+
+def _register_job(id, response):
+    job_input = future()
+    job_input.set_result(response)
+    return _jobs.create(id, job_input)
+
+
+def _release_job():
+    """Removes the job state of a finished workflow."""
+    _jobs.remove(_context.id)
+
+    del _context.id
+    del _context.sequence
+    del _context.bill
+    del _context.state
 
-    with _task_futures_lock:
-        _task_futures[_context.id] = {}
-    with _job_input_lock:
-        _job_input[_context.id] = future()
-        _job_input[_context.id].set_result(response)
-        _job_input_data[_context.id] = None
-    with _snapshot_lock:
-        _snapshot[_context.id] = None
-        _snapshot_data[_context.id] = None
-    with _child_job_lock:
-        _child_job[_context.id] = None
-    with _terminate_flag_lock:
-        _terminate_flag[_context.id] = False
 
+def _get_workflow_function(suffix):
+    with _workflow_functions_lock:
+        if suffix not in _workflow_functions:
+            raise ValueError(f"Unexpected suffix: {suffix}")
+        return _workflow_functions[suffix]
+
+
+def _resolve_workflow_result(result):
+    resolve_job(*result) if type(result) == tuple else resolve_job(result, None, None)
+
+
+def _report_workflow_error(id, response, error):
+    """Reports a failed workflow to the agent, the outcome depends on the type of `error`.
+
+    Blocks until the agent acknowledged the report, must not be called from the transport event loop.
+    """
     try:
-        subject = response["subject"] if "subject" in response else None
-        context = response["context"] if "context" in response else None
-        function = None
-        with _workflow_functions_lock:
-            if suffix not in _workflow_functions:
-                raise ValueError(f"Unexpected suffix: {suffix}")
-            function = _workflow_functions[suffix]
-        result = function(subject, context)
-        resolve_job(*result) if type(result) == tuple else resolve_job(result, None, None)
+        raise error
     except ValidationError as error:
         internal_error(f"\nSchema validation error: {error}")
         with sentry_sdk.push_scope() as scope:
@@ -759,23 +819,78 @@ def _worklow_thread(id, suffix, response):
             scope.set_level(FATAL)
             sentry_sdk.capture_exception(ex)
         logger.exception("Exception encountered in _workflow_thread")
+
+
+def _worklow_thread(id, suffix, response):
+    _bind_job(id, response)
+    try:
+        if _context.state.terminated:
+            raise concurrent.futures.CancelledError("Job terminated before it started")
+        subject = response["subject"] if "subject" in response else None
+        context = response["context"] if "context" in response else None
+        function = _get_workflow_function(suffix)
+        result = function(subject, context)
+        if inspect.isawaitable(result):
+            # Coroutine workflows get a private event loop when the transport runs in threading mode
+            result = asyncio.run(_await_result(result))
+        _resolve_workflow_result(result)
+    except Exception as error:
+        _report_workflow_error(id, response, error)
     finally:
-        with _task_futures_lock:
-            del _task_futures[_context.id]
-        with _job_input_lock:
-            del _job_input[_context.id]
-            del _job_input_data[_context.id]
-        with _snapshot_lock:
-            del _snapshot[_context.id]
-            del _snapshot_data[_context.id]
-        with _child_job_lock:
-            del _child_job[_context.id]
-        with _terminate_flag_lock:
-            del _terminate_flag[_context.id]
-
-        del _context.id
-        del _context.sequence
-        del _context.bill
+        _release_job()
+
+
+async def _await_result(awaitable):
+    return await awaitable
+
+
+async def _workflow_coroutine(id, suffix, response):
+    """Runs an `async def` workflow on the transport event loop.
+
+    Reporting the outcome waits for the agent acknowledgement, which is delivered by the pump on this very loop, so it
+    is done from a worker thread with a copy of the job context.
+    """
+    _bind_job(id, response)
+    try:
+        if _context.state.terminated:
+            raise concurrent.futures.CancelledError("Job terminated before it started")
+        subject = response["subject"] if "subject" in response else None
+        context = response["context"] if "context" in response else None
+        function = _get_workflow_function(suffix)
+        result = await function(subject, context)
+        await asyncio.to_thread(_resolve_workflow_result, result)
+    except Exception as error:
+        await asyncio.to_thread(_report_workflow_error, id, response, error)
+    finally:
+        _release_job()
+
+
+def _start_workflow(id, suffix, response):
+    """Queues the workflow registered for `suffix` for a job received with an `EXECUTE` message."""
+    with _workflow_functions_lock:
+        function = _workflow_functions.get(suffix)
+
+    # Registered before the job is queued, so a CANCEL arriving at any time finds it
+    _register_job(id, response)
+    if _use_asyncio and inspect.iscoroutinefunction(function):
+        _coroutine_workflow_pool.submit(id, _workflow_coroutine, id, suffix, response, name=f"{suffix}-{id}")
+    else:
+        _workflow_pool.submit(id, _worklow_thread, id, suffix, response, name=f"{suffix}-{id}")
+
+
+def _cancel_queued_workflow(id) -> bool:
+    """Drops a job which is still waiting for a free workflow slot, returns False if it already started."""
+    if _coroutine_workflow_pool is not None and _coroutine_workflow_pool.cancel(id):
+        return True
+    return _workflow_pool.cancel(id)
+
+
+def get_workflow_pool_stats() -> Dict[str, WorkflowPoolStats]:
+    """Returns the backpressure metrics (active and queued jobs, queue wait times) of the workflow pools."""
+    stats = {"threads": _workflow_pool.stats()}
+    if _coroutine_workflow_pool is not None:
+        stats["coroutines"] = _coroutine_workflow_pool.stats()
+    return stats
 
 
 def sentry_capture_fatal_exception(scope, id, response, error):
@@ -792,128 +907,122 @@ def sentry_capture_fatal_exception(scope, id, response, error):
 def _task_pump():
     """This method waits for incoming response and resolves the corresponding task future."""
     while True:
-        line = _in_pipe.readline().rstrip("\n")
-        response = json.loads(line)
-        if "type" not in response:
-            raise ValueError("`type` is missing in response")
-
-        if "id" not in response:
-            raise ValueError("`id` is missing in response")
-
-        id = response["id"]
-
-        if response["type"] == "ERROR":
-            kill_missing_error(response)
-        elif response["type"] == "JOB_PARAMS":
-            if "sequence" in response:
-                raise ValueError("JOB_PARAMS come out of bound and don't expect to contain 'sequence'")
-
-            job_input = None
-            with _job_input_lock:
-                job_input = _job_input[id]
-
-            job_input.set_result(response)
-
-        elif response["type"] == "JOB_DATA":
-            if "sequence" in response:
-                raise ValueError("JOB_DATA come out of bound and don't expect to contain 'sequence'")
-
-            job_input_data = None
-            with _job_input_lock:
-                job_input_data = _job_input_data[id]
-
-            job_input_data.set_result(response["data"] if "data" in response else None)
-
-        elif response["type"] == "SNAPSHOT":
-            snapshot = None
-            with _snapshot_lock:
-                snapshot = _snapshot[id]
-
-            snapshot.set_result(response)
-
-            if "sequence" in response:
-                _context.sequence = response["sequence"]
-
-        elif response["type"] == "SNAPSHOT_DATA":
-            if "sequence" in response:
-                raise ValueError("SNAPSHOT_DATA come out of bound and don't expect to contain 'sequence'")
-
-            with _snapshot_lock:
-                _snapshot_data[id]
-
-            snapshot.set_result(response["data"] if "data" in response else None)
-
-        elif response["type"] == "CHILD_JOB_DATA":
-            if "sequence" in response:
-                raise ValueError("CHILD_JOB_DATA come out of bound and don't expect to contain 'sequence'")
-
-            child_job = None
-            with _child_job_lock:
-                child_job = _child_job[id]
-
-            child_job.set_result(response["data"] if "data" in response else None)
-
-        elif response["type"] == "EXECUTE":
-            if "suffix" not in response:
-                raise ValueError("Response `type` `EXECUTE` expects `suffix` property")
-
-            suffix = response["suffix"]
-
-            thread = Thread(
-                target=_worklow_thread,
-                name=f"{suffix}-{id}",
-                args=(id, suffix, response),
-            )
-            thread.daemon = True
-            thread.start()
-
-        elif response["type"] in ["CANCEL", "SUSPEND"]:
-            with _terminate_flag_lock:
-                _terminate_flag[id] = True
-            with _task_futures_lock:
-                if id in _task_futures:
-                    for seq in _task_futures[id]:
-                        _task_futures[id][seq].cancel()
-            with _job_input_lock:
-                if id in _job_input:
-                    _job_input[id].cancel()
-                    if _job_input_data[id] is not None:
-                        _job_input_data[id].cancel()
-            with _snapshot_lock:
-                if id in _snapshot:
-                    if _snapshot[id] is not None:
-                        _snapshot[id].cancel()
-                    if _snapshot_data[id] is not None:
-                        _snapshot_data[id].cancel()
-            with _child_job_lock:
-                if id in _child_job and _child_job[id] is not None:
-                    _child_job[id].cancel()
-            if response["type"] == "SUSPEND":
-                job_uuid = response["uuid"]
-                forget_memo(None, prefix=f"{job_uuid}/")
+        line = _in_pipe.readline()
+        if not line:
+            logger.warning("Agent closed the input pipe, stopping the pump")
+            return
+        _handle_response(_codec.loads(line))
 
-        else:
-            if "sequence" not in response:
-                raise ValueError("'sequence' expected in inbound message")
-
-            seq = response["sequence"]
-            f = None
-            with _task_futures_lock:
-                if id in _task_futures:
-                    if seq not in _task_futures[id]:
-                        if response["type"] == "CHILD_RESPONSE":
-                            logger.warning(f"CHILD_RESPONSE:missing_child_job_future id {id} seq {seq}")
-                            _task_futures[id][seq] = child_job_future()
-                        else:
-                            _task_futures[id][seq] = future()
-
-                    f = _task_futures[id][seq]
-
-            if f is None:
-                sys.stderr.write(f"Unexpected id/sequence (late response?): {id}/{seq}\n")
-                sys.stderr.flush()
+
+async def _async_task_pump():
+    """Reads incoming responses from the agent pipe without blocking the event loop and resolves the corresponding
+    task future."""
+    global _pump_thread_id
+    _pump_thread_id = get_ident()
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=_PIPE_READ_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), _in_pipe)
+    while True:
+        line = await reader.readline()
+        if not line:
+            logger.warning("Agent closed the input pipe, stopping the pump")
+            return
+        _handle_response(_codec.loads(line))
+
+
+def _handle_response(response):
+    """Dispatches a single message received from the agent."""
+    if "type" not in response:
+        raise ValueError("`type` is missing in response")
+
+    if "id" not in response:
+        raise ValueError("`id` is missing in response")
+
+    id = response["id"]
+
+    if response["type"] == "ERROR":
+        kill_missing_error(response)
+    elif response["type"] == "JOB_PARAMS":
+        if "sequence" in response:
+            raise ValueError("JOB_PARAMS come out of bound and don't expect to contain 'sequence'")
+
+        _jobs.get(id).job_input.set_result(response)
+
+    elif response["type"] == "JOB_DATA":
+        if "sequence" in response:
+            raise ValueError("JOB_DATA come out of bound and don't expect to contain 'sequence'")
+
+        _jobs.get(id).job_input_data.set_result(response["data"] if "data" in response else None)
+
+    elif response["type"] == "SNAPSHOT":
+        snapshot = _jobs.get(id).snapshot
+        snapshot.set_result(response)
+
+        if "sequence" in response:
+            _context.sequence = response["sequence"]
+
+    elif response["type"] == "SNAPSHOT_DATA":
+        if "sequence" in response:
+            raise ValueError("SNAPSHOT_DATA come out of bound and don't expect to contain 'sequence'")
+
+        _jobs.get(id).snapshot_data.set_result(response["data"] if "data" in response else None)
+
+    elif response["type"] == "CHILD_JOB_DATA":
+        if "sequence" in response:
+            raise ValueError("CHILD_JOB_DATA come out of bound and don't expect to contain 'sequence'")
+
+        _jobs.get(id).child_job.set_result(response["data"] if "data" in response else None)
+
+    elif response["type"] == "EXECUTE":
+        if "suffix" not in response:
+            raise ValueError("Response `type` `EXECUTE` expects `suffix` property")
+
+        suffix = response["suffix"]
+
+        _start_workflow(id, suffix, response)
+
+    elif response["type"] in ["CANCEL", "SUSPEND"]:
+        state = _jobs.get(id)
+        if _cancel_queued_workflow(id):
+            _jobs.remove(id)
+            logger.info(f"Job #{id} received {response['type']} while queued, it will not be started")
+        elif state is not None:
+            state.terminate()
+        if response["type"] == "SUSPEND":
+            job_uuid = response["uuid"]
+            # Purges in the background, the pump does not wait for it
+            forget_memo(None, prefix=f"{job_uuid}/")
+
+    else:
+        if "sequence" not in response:
+            raise ValueError("'sequence' expected in inbound message")
+
+        seq = response["sequence"]
+        f = None
+        state = _jobs.get(id)
+        if state is not None:
+            if response["type"] == "CHILD_RESPONSE":
+                f = state.future(seq, _missing_child_job_future(id, seq))
             else:
-                f.set_result(response)
+                f = state.future(seq, future)
+
+        if f is None:
+            sys.stderr.write(f"Unexpected id/sequence (late response?): {id}/{seq}\n")
+            sys.stderr.flush()
+        elif f.cancelled():
+            # The job was cancelled while the agent was answering
+            logger.debug(f"Dropping response for cancelled id/sequence: {id}/{seq}")
+        else:
+            f.set_result(response)
+
+
+def _missing_child_job_future(id, seq):
+    def factory():
+        logger.warning(f"CHILD_RESPONSE:missing_child_job_future id {id} seq {seq}")
+        return child_job_future()
+
+    return factory
 
 
 def kill_missing_error(response):
@@ -930,7 +1039,10 @@ def kill_missing_error(response):
 
 
 if "CANOTIC_AGENT" in os.environ:
-    _task_thread = Thread(target=_task_pump, name="pump")
+    if _use_asyncio:
+        _task_thread = Thread(target=asyncio.run, args=(_async_task_pump(),), name="pump")
+    else:
+        _task_thread = Thread(target=_task_pump, name="pump")
     _task_thread.daemon = "CANOTIC_SERVE" not in os.environ
     _task_thread.start()
 
@@ -938,26 +1050,17 @@ if "CANOTIC_AGENT" in os.environ:
 @terminate_guard
 def get_job_data():
     """Get job data"""
-    global _job_input_data
-    global _job_input_lock
-
-    job_input_data = None
-    with _job_input_lock:
-        if _job_input_data[_context.id] is not None:
-            job_input_data = _job_input_data[_context.id]
-
+    job_input_data = _context.state.job_input_data
     if job_input_data is not None:
         return job_input_data.result()
 
-    with _job_input_lock:
-        _job_input_data[_context.id] = job_input_data = future()
+    _context.state.job_input_data = job_input_data = future()
 
     params = {"type": "LOAD_JOB_DATA", "id": _context.id, "sequence": -1}
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
     return job_input_data.result()
 
@@ -979,8 +1082,7 @@ def save_hero_qualification(hero, qualification, value):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 @terminate_guard
@@ -996,8 +1098,7 @@ def remove_hero_qualification(hero, qualification):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 @terminate_guard
@@ -1016,25 +1117,16 @@ def save_snapshot(snapshot, data_folder):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 @terminate_guard
 def load_snapshot():
-    global _snapshot
-    global _snapshot_lock
-
-    snapshot = None
-    with _snapshot_lock:
-        if _snapshot[_context.id] is not None:
-            snapshot = _snapshot[_context.id]
-
+    snapshot = _context.state.snapshot
     if snapshot is not None:
         return snapshot.result()
 
-    with _snapshot_lock:
-        _snapshot[_context.id] = snapshot = future()
+    _context.state.snapshot = snapshot = future()
 
     params = {
         "type": "RESTORE_SNAPSHOT",
@@ -1044,34 +1136,24 @@ def load_snapshot():
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
     return snapshot.result()
 
 
 @terminate_guard
 def load_snapshot_data():
-    global _snapshot_data
-    global _snapshot_lock
-
-    snapshot_data = None
-    with _snapshot_lock:
-        if _snapshot_data[_context.id] is not None:
-            snapshot_data = _snapshot_data[_context.id]
-
+    snapshot_data = _context.state.snapshot_data
     if snapshot_data is not None:
         return snapshot_data.result()
 
-    with _snapshot_lock:
-        _snapshot_data[_context.id] = snapshot_data = future()
+    _context.state.snapshot_data = snapshot_data = future()
 
     params = {"type": "LOAD_SNAPSHOT_DATA", "id": _context.id, "sequence": -1}
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
     return snapshot_data.result()
 
@@ -1087,18 +1169,18 @@ def send_report(status):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 def run_model_predict(predict_func, port=8080, context=None):
     _in_pipe = io.open("/tmp/canotic.in." + os.environ["CANOTIC_PREDICT"], "r", encoding="utf-8")
     _out_pipe = io.open("/tmp/canotic.out." + os.environ["CANOTIC_PREDICT"], "w", encoding="utf-8")
+    pipe_writer = _create_pipe_writer(_out_pipe)
 
     line = _in_pipe.readline()
     while len(line) != 0:
         line = line.rstrip("\n")
-        request = json.loads(line)
+        request = _codec.loads(line)
         if "type" not in request:
             raise ValueError("Message \`type\` is missing in request")
 
@@ -1116,8 +1198,7 @@ def run_model_predict(predict_func, port=8080, context=None):
 
         message_for_agent = message(params)
 
-        with _pipe_lock:
-            writeln_to_pipe_and_flush(message_for_agent.to_json)
+        pipe_writer.write(message_for_agent.to_json)
 
         line = _in_pipe.readline()
 
@@ -1142,8 +1223,7 @@ def subscribe_workflow(function, prefix, suffix, schema=None, workflow_type: Opt
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 @terminate_guard
@@ -1170,8 +1250,7 @@ def send_reward(task, amount, reason):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 @terminate_guard
@@ -1183,8 +1262,7 @@ def decline_result(task, reason):
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
 
 @terminate_guard
@@ -1295,17 +1373,11 @@ def schedule_mtask(
 
     params["payload"]["actions"]["showReject"] = show_reject
 
-    f = None
-    with _task_futures_lock:
-        if seq not in _task_futures[_context.id]:
-            _task_futures[_context.id][seq] = task_future()
-
-        f = _task_futures[_context.id][seq]
+    f = _context.state.future(seq, task_future)
 
     message_for_agent = message(params)
 
-    with _pipe_lock:
-        writeln_to_pipe_and_flush(message_for_agent.to_json)
+    writeln_to_pipe_and_flush(message_for_agent.to_json)
 
     return f
 
@@ -0,0 +1,271 @@
+"""Bounded execution of the workflow jobs received from the agent.
+
+Jobs beyond the concurrency limit wait in a FIFO queue, where they can still be cancelled before they start.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread, current_thread
+from typing import Any, Callable, Optional
+
+from attr import define
+
+from superai.log import logger
+
+logger = logger.get_logger(__name__)
+
+
+@define
+class WorkflowPoolStats:
+    """Backpressure metrics of a workflow pool, wait times are in seconds."""
+
+    max_workers: int
+    active: int
+    queued: int
+    started: int
+    completed: int
+    cancelled: int
+    total_wait_time: float
+    max_wait_time: float
+    blocked: int = 0
+
+    @property
+    def avg_wait_time(self) -> float:
+        return self.total_wait_time / self.started if self.started else 0.0
+
+
+@define
+class _WorkItem:
+    future: Any
+    fn: Callable
+    args: tuple
+    name: Optional[str]
+    enqueued_at: float
+
+
+class _WorkflowPoolBase:
+    def __init__(self, max_workers: int, name: str):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self._max_workers = max_workers
+        self._name = name
+        self._lock = Lock()
+        self._pending = OrderedDict()  # job id -> _WorkItem, in arrival order
+        self._active = 0
+        self._started = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._saturated = False
+        # Workers waiting for jobs which may be queued behind them, they don't count towards the limit
+        self._blocked = 0
+
+    def _enqueue(self, job_id, item: _WorkItem):
+        """Must be called with the lock held."""
+        if job_id in self._pending:
+            raise ValueError(f"Job {job_id} is already queued in the {self._name} pool")
+        self._pending[job_id] = item
+        if self._active >= self._max_workers and not self._saturated:
+            self._saturated = True
+            logger.warning(f"All {self._max_workers} {self._name} workers are busy, queueing incoming jobs")
+
+    def _dequeue(self):
+        """Must be called with the lock held and a pending job."""
+        job_id, item = self._pending.popitem(last=False)
+        wait_time = time.monotonic() - item.enqueued_at
+        self._active += 1
+        self._started += 1
+        self._total_wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        if self._saturated and not self._pending:
+            self._saturated = False
+            logger.info(f"{self._name.capitalize()} queue drained, last job waited {wait_time:.3f}s")
+        return job_id, item
+
+    def _finish(self):
+        """Must be called with the lock held."""
+        self._active -= 1
+        self._completed += 1
+
+    def cancel(self, job_id) -> bool:
+        """Removes a job from the queue before it started.
+
+        Returns:
+            True if the job was queued, False if it is unknown or already running.
+        """
+        with self._lock:
+            item = self._pending.pop(job_id, None)
+            if item is None:
+                return False
+            self._cancelled += 1
+        item.future.cancel()
+        return True
+
+    def stats(self) -> WorkflowPoolStats:
+        with self._lock:
+            return WorkflowPoolStats(
+                max_workers=self._max_workers,
+                active=self._active,
+                queued=len(self._pending),
+                started=self._started,
+                completed=self._completed,
+                cancelled=self._cancelled,
+                total_wait_time=self._total_wait_time,
+                max_wait_time=self._max_wait_time,
+                blocked=self._blocked,
+            )
+
+
+class WorkflowPool(_WorkflowPoolBase):
+    """Runs synchronous workflow jobs on at most `max_workers` reusable daemon threads.
+
+    Worker threads are started on demand, the thread running a job is renamed after the job for the duration of it.
+    A job waiting inside `blocked()` doesn't count towards the limit, so that the jobs it waits for are not stuck
+    behind it in the queue.
+    """
+
+    def __init__(self, max_workers: int, name: str = "workflow"):
+        super().__init__(max_workers, name)
+        self._condition = Condition(self._lock)
+        self._workers = []
+        self._idle = 0
+        self._shutdown = False
+
+    def submit(self, job_id, fn: Callable, *args, name: Optional[str] = None) -> Future:
+        """Queues `fn(*args)` for execution, the returned future resolves with its result."""
+        item = _WorkItem(future=Future(), fn=fn, args=args, name=name, enqueued_at=time.monotonic())
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError(f"Cannot submit job {job_id} to the {self._name} pool after shutdown")
+            self._enqueue(job_id, item)
+            self._start_worker()
+            self._condition.notify()
+        return item.future
+
+    @contextmanager
+    def blocked(self):
+        """Marks the calling worker as blocked until the jobs it waits for are done, e.g. child jobs received by this
+        very process. A worker is started for the queued jobs if the pool is full, and stopped once idle after the
+        blocked one resumes. Does nothing outside of the workers of the pool."""
+        if current_thread() not in self._workers:
+            yield
+            return
+        with self._condition:
+            self._blocked += 1
+            self._start_worker()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._blocked -= 1
+                # The workers beyond the limit stop
+                self._condition.notify_all()
+
+    def _start_worker(self):
+        """Must be called with the lock held."""
+        if len(self._pending) > self._idle and len(self._workers) < self._max_workers + self._blocked:
+            worker = Thread(target=self._work, name=f"{self._name}-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _surplus(self) -> bool:
+        """Must be called with the lock held."""
+        return len(self._workers) > self._max_workers + self._blocked
+
+    def shutdown(self, wait: bool = True):
+        """Stops the workers once the queued jobs are done."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in list(self._workers):
+                worker.join()
+
+    def _work(self):
+        thread = current_thread()
+        thread_name = thread.name
+        while True:
+            with self._condition:
+                while not self._pending and not self._shutdown and not self._surplus():
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+                if self._surplus():
+                    self._workers.remove(thread)
+                    return
+                if not self._pending:
+                    return
+                job_id, item = self._dequeue()
+
+            if item.future.set_running_or_notify_cancel():
+                thread.name = item.name or thread_name
+                try:
+                    result = item.fn(*item.args)
+                except BaseException as e:
+                    logger.exception(f"Unhandled exception in {self._name} job {job_id}")
+                    item.future.set_exception(e)
+                else:
+                    item.future.set_result(result)
+                finally:
+                    thread.name = thread_name
+
+            with self._condition:
+                self._finish()
+
+
+class AsyncWorkflowPool(_WorkflowPoolBase):
+    """Runs coroutine workflow jobs as tasks on the running event loop, at most `max_workers` at a time.
+
+    `submit` must be called from the event loop thread.
+    """
+
+    def __init__(self, max_workers: int, name: str = "coroutine workflow"):
+        super().__init__(max_workers, name)
+        # Strong references to running tasks, the event loop only keeps weak ones
+        self._tasks = set()
+
+    def submit(self, job_id, fn: Callable, *args, name: Optional[str] = None) -> asyncio.Future:
+        """Queues the coroutine `fn(*args)`, the returned future resolves with its result."""
+        item = _WorkItem(
+            future=asyncio.get_running_loop().create_future(),
+            fn=fn,
+            args=args,
+            name=name,
+            enqueued_at=time.monotonic(),
+        )
+        with self._lock:
+            self._enqueue(job_id, item)
+        self._start_pending()
+        return item.future
+
+    def _start_pending(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if not self._pending or self._active >= self._max_workers:
+                    return
+                job_id, item = self._dequeue()
+            task = loop.create_task(self._run(job_id, item), name=item.name)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id, item: _WorkItem):
+        try:
+            result = await item.fn(*item.args)
+        except asyncio.CancelledError:
+            item.future.cancel()
+            raise
+        except Exception as e:
+            logger.exception(f"Unhandled exception in {self._name} job {job_id}")
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            with self._lock:
+                self._finish()
+            self._start_pending()
@@ -1,19 +1,23 @@
-import concurrent.futures
-from typing import Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from pydantic import BaseModel
 from tqdm import tqdm
 
+from superai.llm.ai.batch import run_batch, run_sync
 from superai.llm.configuration import Configuration
 from superai.llm.data_types import ChatMessage, DataType
 from superai.llm.dataset import Data, Dataset
 from superai.llm.foundation_models import ChatGPT, FoundationModel
 from superai.llm.prompts import Prompt
 from superai.llm.prompts.base import PromptExample
+from superai.llm.utilities.json_stream import iter_json_fields
 from superai.llm.utilities.parser_utils import Parser
+from superai.log import logger
 
 config = Configuration()
 
+log = logger.get_logger(__name__)
+
 # TODO: validate inputs
 # TODO: add from_examples, from_metaprompt, generate_similar, to/from json
 
@@ -56,83 +60,154 @@ class LLM(BaseModel):
     def fine_tune(self, data):
         pass
 
-    def predict(self, input, parallelize=True):
+    def predict(self, input, parallelize=True, max_concurrency: int = None, resume_from: Dataset = None):
+        """Predicts the output of a single input, or of every input of a list of `Data` or a `Dataset`.
+
+        A list or dataset gives a `Dataset` with one entry per input, in order. The inputs which failed have no output
+        and the error in their `metadata["error"]`, see `Dataset.get_errors`.
+
+        Args:
+            parallelize: Whether to run the inputs of a list or dataset concurrently.
+            max_concurrency: Maximum number of inputs run at once, by default what the foundation model rate limits
+                allow, up to `llm.batch.max_concurrency`.
+            resume_from: Result of a previous `predict` on the same inputs, only the inputs which failed are run again.
+        """
         if isinstance(input, list):
             if not all([isinstance(data, Data) for data in input]):
                 raise ValueError("Input must be a list of Data objects.")
-            return self._process_multiple([data.input for data in input], parallelize)
+            return self._process_multiple([data.input for data in input], parallelize, max_concurrency, resume_from)
         if isinstance(input, Data):
             return self._process_single(input.input)
         elif isinstance(input, Dataset):
-            return self._process_multiple([data.input for data in input.data], parallelize)
+            return self._process_multiple(
+                [data.input for data in input.data], parallelize, max_concurrency, resume_from
+            )
         else:
             return self._process_single(input)
 
+    async def apredict(self, input, max_concurrency: int = None, resume_from: Dataset = None):
+        """Async version of `predict`, the inputs of a list or dataset are always run concurrently."""
+        if isinstance(input, list):
+            if not all([isinstance(data, Data) for data in input]):
+                raise ValueError("Input must be a list of Data objects.")
+            return await self._aprocess_multiple([data.input for data in input], max_concurrency, resume_from)
+        if isinstance(input, Data):
+            return await self._aprocess_single(input.input)
+        elif isinstance(input, Dataset):
+            return await self._aprocess_multiple([data.input for data in input.data], max_concurrency, resume_from)
+        else:
+            return await self._aprocess_single(input)
+
+    def stream_predict(self, input) -> Iterator[Tuple[str, Any]]:
+        """Predicts the output of a single input and yields each top-level field of it as soon as it is generated.
+
+        A generation stopped for its length or a runaway repetition is run again with a frequency penalty, like
+        `ChatGPT.predict` does, the fields already yielded are kept and the rerun only yields the missing ones. The last
+        rerun is never stopped early. The fields are not validated against the output schema nor postprocessed.
+        """
+        if isinstance(input, Data):
+            input = input.input
+        _, prompt = self._render_prompt(input)
+        yielded = set()
+        penalties = [None, 0.5, 1.0]
+        for attempt, penalty in enumerate(penalties):
+            stream = self.foundation_model.stream_predict(
+                ChatMessage(content=prompt, role="system"),
+                frequency_penalty=penalty,
+                detect_repetition=attempt < len(penalties) - 1,
+            )
+            for key, value in iter_json_fields(stream):
+                if key not in yielded:
+                    yielded.add(key)
+                    yield key, value
+            if stream.finish_reason not in ("length", "repetition"):
+                break
+            log.info(f"Generated incomplete answer ({stream.finish_reason}). Rerun prompt with a frequency penalty")
+
     def _process_single(self, input):
+        input, prompt = self._render_prompt(input)
+        response = self.foundation_model.predict(ChatMessage(content=prompt, role="system"))
+        return self._parse_response(input, prompt, response)
+
+    async def _aprocess_single(self, input):
+        # The prompt is rendered before the first await, so concurrent inputs don't see each other's prompt
+        input, prompt = self._render_prompt(input)
+        response = await self.foundation_model.apredict(ChatMessage(content=prompt, role="system"))
+        return self._parse_response(input, prompt, response)
+
+    def _render_prompt(self, input):
         self.input = input
         if self.prompt_preprocessing_function is not None:
             input = self.prompt_preprocessing_function(input)
             self.preprocessed_input = input
-        if self.input_schema.validate_value(value=input):
-            if self.prompt is not None:
-                self.prompt.set_input(input=input)
-                retries = 3
-                for _ in range(retries):
-                    # try:
-                    _ = self.generate_prompt()
-                    response = self.foundation_model.predict(
-                        ChatMessage(content=self.prompt.to_string(), role="system")
-                    )
-                    # parse ai response
-                    output_parser = Parser(
-                        use_ai=False,
-                        prompt=self.prompt.to_string(),
-                        prompt_output_format=self.prompt_output_format,
-                        output_schema=self.output_schema.dict(),
-                    )
-                    output = output_parser.get_output(response)
-                    # valid_response = output_parser.to_dict(response)
-                    # parse output from response
-                    self.output_schema.validate_value(value=output)
-                    self.output = output
-                    if self.prompt_postprocessing_function is not None:
-                        self.postprocessed_output = self.prompt_postprocessing_function(self.output)
-                        output = self.postprocessed_output
-                    return Data(input=input, output=output)
-
-                # except Exception as e:
-                #     logger.error(f"{e}")
-                raise ValueError(f"Failed to generate valid output after {retries} retries.")
-            else:
-                raise ValueError("No prompt provided.")
-        else:
+        if not self.input_schema.validate_value(value=input):
             raise ValueError("Invalid input data.")
+        if self.prompt is None:
+            raise ValueError("No prompt provided.")
+        self.prompt.set_input(input=input)
+        _ = self.generate_prompt()
+        return input, self.prompt.to_string()
+
+    def _parse_response(self, input, prompt, response):
+        # parse ai response
+        output_parser = Parser(
+            use_ai=False,
+            prompt=prompt,
+            prompt_output_format=self.prompt_output_format,
+            output_schema=self.output_schema.dict(),
+        )
+        output = output_parser.get_output(response)
+        # parse output from response
+        self.output_schema.validate_value(value=output)
+        self.output = output
+        if self.prompt_postprocessing_function is not None:
+            self.postprocessed_output = self.prompt_postprocessing_function(self.output)
+            output = self.postprocessed_output
+        return Data(input=input, output=output)
 
-    def _process_multiple(self, input_data_list, parallelize):
+    def _process_multiple(self, input_data_list, parallelize, max_concurrency=None, resume_from=None):
         if parallelize:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(self._process_single, input_data) for input_data in input_data_list]
-                results = [None] * len(input_data_list)
-                for future in tqdm(
-                    concurrent.futures.as_completed(futures), total=len(futures), desc="Processing input data points"
-                ):
-                    try:
-                        result = future.result()
-                        index = futures.index(future)
-                        results[index] = result
-                    except Exception as e:
-                        print(f"Error: {e}")
-        else:
-            results = []
-            for input_data in tqdm(input_data_list, desc="Processing input data points"):
-                try:
-                    result = self._process_single(input_data)
-                    results.append(result)
-                except Exception as e:
-                    print(f"Error: {e}")
-
+            return run_sync(self._aprocess_multiple(input_data_list, max_concurrency, resume_from))
+
+        done = self._resumed_results(input_data_list, resume_from)
+        results = []
+        for index, input_data in enumerate(tqdm(input_data_list, desc="Processing input data points")):
+            if index in done:
+                results.append(done[index])
+                continue
+            try:
+                results.append(self._process_single(input_data))
+            except Exception as e:
+                results.append(self._failed(input_data, e))
         return Dataset(input_schema=self.input_schema, output_schema=self.output_schema, data=results)
 
+    async def _aprocess_multiple(self, input_data_list, max_concurrency=None, resume_from=None):
+        done = self._resumed_results(input_data_list, resume_from)
+        max_concurrency = max_concurrency or self.foundation_model.max_concurrency()
+        async with self.foundation_model.session(max_connections=max_concurrency):
+            results = await run_batch(self._aprocess_single, input_data_list, max_concurrency, done)
+        data = [
+            self._failed(input_data, result) if isinstance(result, Exception) else result
+            for input_data, result in zip(input_data_list, results)
+        ]
+        return Dataset(input_schema=self.input_schema, output_schema=self.output_schema, data=data)
+
+    @staticmethod
+    def _resumed_results(input_data_list, resume_from: Optional[Dataset]) -> Dict[int, Data]:
+        if resume_from is None:
+            return {}
+        if len(resume_from) != len(input_data_list):
+            raise ValueError(
+                f"Cannot resume from {len(resume_from)} results, expected one per input ({len(input_data_list)})."
+            )
+        errors = resume_from.get_errors()
+        return {index: data for index, data in enumerate(resume_from.data) if index not in errors}
+
+    @staticmethod
+    def _failed(input, error: Exception) -> Data:
+        log.warning(f"Failed to process input data point: {error!r}")
+        return Data(input=input, metadata={"error": f"{type(error).__name__}: {error}"})
+
     def set_components(
         self,
         name=None,
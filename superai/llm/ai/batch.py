@@ -0,0 +1,58 @@
+"""Ordered, concurrency-limited execution of a coroutine function over a batch of inputs."""
+import asyncio
+import concurrent.futures
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from tqdm import tqdm
+
+
+async def run_batch(
+    function: Callable[[Any], Awaitable[Any]],
+    inputs: Sequence[Any],
+    max_concurrency: int,
+    done: Optional[Dict[int, Any]] = None,
+    desc: str = "Processing input data points",
+) -> List[Any]:
+    """Awaits `function` on every input, with at most `max_concurrency` calls in flight.
+
+    A fixed set of workers takes the inputs in order, so memory doesn't grow with the batch and every result is stored
+    at the index of its input.
+
+    Args:
+        function: Coroutine function called with each input.
+        inputs: Inputs of the batch.
+        max_concurrency: Maximum number of calls awaited at once.
+        done: Results already known by input index, e.g. from an interrupted run, the inputs are not run again.
+        desc: Description of the progress bar.
+
+    Returns:
+        The results in the order of `inputs`, the exception raised by `function` for the inputs which failed.
+    """
+    done = done or {}
+    results: List[Any] = [None] * len(inputs)
+    for index, result in done.items():
+        results[index] = result
+    pending = iter([index for index in range(len(inputs)) if index not in done])
+
+    with tqdm(total=len(inputs), initial=len(done), desc=desc) as progress:
+
+        async def worker():
+            for index in pending:
+                try:
+                    results[index] = await function(inputs[index])
+                except Exception as e:
+                    results[index] = e
+                progress.update()
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(max_concurrency, len(inputs) - len(done))))))
+    return results
+
+
+def run_sync(coroutine: Awaitable[Any]) -> Any:
+    """Runs `coroutine` to completion from synchronous code, on a separate thread when an event loop is running."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -25,6 +25,18 @@ class Configuration(metaclass=Singleton):
         self.smart_foundation_model_engine = settings.get("llm").get("chatgpt").get("smart_foundation_model_engine")
         self.fast_foundation_model_engine = settings.get("llm").get("chatgpt").get("fast_foundation_model_engine")
         self.embedding_model_engine = settings.get("llm").get("chatgpt").get("embedding_model_engine")
+        self.token_cache_size = settings.get("llm").get("tokenizer", {}).get("token_cache_size", 8192)
+        self.batch_max_concurrency = settings.get("llm").get("batch", {}).get("max_concurrency", 32)
+        embedding = settings.get("llm").get("embedding", {})
+        self.embedding_max_batch_size = embedding.get("max_batch_size", 2048)
+        self.embedding_max_batch_tokens = embedding.get("max_batch_tokens", 300000)
+        response_cache = settings.get("llm").get("cache", {})
+        self.response_cache_backend = response_cache.get("backend")
+        self.response_cache_max_size = response_cache.get("max_size", 1024)
+        self.response_cache_ttl = response_cache.get("ttl", 86400)
+        self.response_cache_directory = response_cache.get("directory")
+        self.response_cache_size_limit = response_cache.get("size_limit", 2**28)
+        self.response_cache_semantic_threshold = response_cache.get("semantic_threshold")
         self.pinecone_api_key = settings.get("llm").get("memory").get("pinecone_api_key")
         self.pinecone_region = settings.get("llm").get("memory").get("pinecone_region")
         self.embedding_dimension = settings.get("llm").get("memory").get("embedding_dimension")
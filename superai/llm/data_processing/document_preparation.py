@@ -1,7 +1,13 @@
 import logging
-from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Dict, Iterable, Iterator, List, Optional
 
-import tiktoken
+import regex
+
+from superai.llm.tokenizers import count_tokens, get_encoding
+
+from .spatial_index import BoxIndex, grid_cell_size
 
 
 class DocumentToString:
@@ -16,6 +22,7 @@ class DocumentToString:
         pixels_per_char: int = 4,
         tokenizer_model: str = "gpt-3.5-turbo",
         include_line_number: bool = False,
+        processes: Optional[int] = None,
     ):
         """Creates an instance of a document to string converter.
 
@@ -34,6 +41,8 @@ class DocumentToString:
         :param pixels_per_char: Assumed average width of a character only relevant for whitespace representation
         :param include_line_number: Will add a line number at the beginning of each line in the output representation
         :param tokenizer_model:
+        :param processes: Number of processes rendering the pages of documents with more pages than that, pages are
+            rendered in the calling process by default
         """
         self.format_kv_checkboxes = format_kv_checkboxes
         self.format_tables = format_tables
@@ -44,6 +53,7 @@ class DocumentToString:
         self.pixels_per_char = pixels_per_char
         self.tokenizer_model = tokenizer_model
         self.include_line_number = include_line_number
+        self.processes = processes
 
     def get_document_representation(
         self, ocr_values: list, ocr_key_values: Optional[list], ocr_general_tables: Optional[list]
@@ -65,29 +75,63 @@ class DocumentToString:
         :param ocr_general_tables: List of OCR tables
         :return:
         """
-        doc_iterator = self._get_per_page_representation(ocr_values, ocr_key_values, ocr_general_tables)
-        doc_iterator = doc_iterator[: self.max_pages]
-        return self._get_string_chunks(doc_iterator, page_separation=False)
+        return list(self.iter_document_representation(ocr_values, ocr_key_values, ocr_general_tables))
+
+    def iter_document_representation(
+        self, ocr_values: list, ocr_key_values: Optional[list], ocr_general_tables: Optional[list]
+    ) -> Iterator[str]:
+        """Streaming version of `get_document_representation`, yields each chunk as soon as it is complete.
+
+        Only the first `max_pages` pages are rendered, one at a time or in parallel on `processes` processes, so the
+        first chunk is available before the rest of the document is serialized.
+
+        :param ocr_values: List of OCR tokens
+        :param ocr_key_values:  List of key value pairs
+        :param ocr_general_tables: List of OCR tables
+        :return: Iterator over the chunks
+        """
+        return self._iter_string_chunks(self._iter_page_representation(ocr_values, ocr_key_values, ocr_general_tables))
 
     def _get_per_page_representation(self, ocr_values, ocr_key_values, ocr_general_tables):
-        if self.format_kv_checkboxes:
-            if ocr_key_values is not None:
-                ocr_values = _replace_checkbox_kv_pairs(ocr_values, ocr_key_values)
-            else:
-                logging.info("No key value pairs were provided to be included into document serialization")
+        return list(self._iter_page_representation(ocr_values, ocr_key_values, ocr_general_tables))
+
+    def _iter_page_representation(self, ocr_values, ocr_key_values, ocr_general_tables) -> Iterator[str]:
         if self.format_tables:
             raise NotImplementedError("Table inclusion is not implemented")
-
-        # Combine tokens into String representation
         if self.representation == "line":
-            return get_line_based_representation(ocr_values)
+            render = _render_line_page
         elif self.representation == "whitespace":
-            return get_white_space_representation(
-                ocr_values, pixels_per_line=self.pixels_per_line, pixels_per_char=self.pixels_per_char
+            render = partial(
+                _render_white_space_page, pixels_per_line=self.pixels_per_line, pixels_per_char=self.pixels_per_char
             )
         else:
             raise NotImplementedError(f"There is no document representation of type {self.representation}")
 
+        page_count = 0
+        if self.format_kv_checkboxes:
+            if ocr_key_values is not None:
+                if self.max_pages is not None and self.max_pages >= 0:
+                    # Tokens of the skipped pages are never rendered, but the pages up to `max_pages` are kept
+                    page_count = max((token["pageNumber"] for token in ocr_values), default=0)
+                    ocr_values = [token for token in ocr_values if token["pageNumber"] <= self.max_pages]
+                ocr_values = _replace_checkbox_kv_pairs(ocr_values, ocr_key_values)
+            else:
+                logging.info("No key value pairs were provided to be included into document serialization")
+        pages = _group_by_page(ocr_values, self.max_pages, page_count)
+        if not pages and self.representation == "whitespace":
+            # A document without tokens has a single empty page in the white space representation
+            pages = [[]][: self.max_pages]
+
+        if self.processes and self.processes > 1 and len(pages) > self.processes:
+            executor = ProcessPoolExecutor(self.processes)
+            try:
+                yield from executor.map(render, pages, chunksize=max(1, len(pages) // (4 * self.processes)))
+            finally:
+                # The caller may stop early, the pages not rendered yet are not needed
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            yield from map(render, pages)
+
     def _get_string_chunks(self, per_page_representation, page_separation=False):
         """Splitting mechanism that will fill up chunks line by line until max token length is reached. If
         page_separation is set a new chunk will be created for every page.
@@ -96,18 +140,19 @@ class DocumentToString:
         :param page_separation: Will force splitter to create a new chunk once a new page is processed
         :return: List of chunks with max token length in encoding space
         """
-        encoder = tiktoken.encoding_for_model(self.tokenizer_model)
+        return list(self._iter_string_chunks(per_page_representation, page_separation))
+
+    def _iter_string_chunks(self, per_page_representation: Iterable[str], page_separation=False) -> Iterator[str]:
+        counter = _ChunkTokenCounter(self.tokenizer_model)
 
         included_lines = []
-        document_chunks = []
-        chunk_length = 0
         line_number = 0
         for page in per_page_representation:
             lines = page.split("\n")
             for line in lines:
                 line_number_seq = f"{line_number}:  " if self.include_line_number else ""
                 final_line = line_number_seq + line
-                updated_chunk_length = len(encoder.encode("\n".join(included_lines + [final_line])))
+                updated_chunk_length = counter.count_with(final_line)
                 if updated_chunk_length > self.max_token and not included_lines:
                     raise ValueError(
                         f"Line has {updated_chunk_length} token. This is more than the {self.max_token} per chunk. "
@@ -115,26 +160,21 @@ class DocumentToString:
                     )
 
                 if updated_chunk_length < self.max_token:
-                    chunk_length += updated_chunk_length
                     included_lines.append(final_line)
                 else:
-                    document_chunks.append("\n".join(included_lines))
+                    yield from _non_empty("\n".join(included_lines))
                     included_lines = [final_line]
-                    chunk_length = len(encoder.encode(final_line))
+                    counter.reset()
+                counter.append(final_line)
 
                 line_number += 1
 
             if page_separation:
-                document_chunks.append("\n".join(included_lines))
+                yield from _non_empty("\n".join(included_lines))
                 included_lines = []
-                chunk_length = 0
+                counter.reset()
 
-        document_chunks.append("\n".join(included_lines))
-
-        # Avoid returning empty chunks
-        filtered_document_chunks = [chunk for chunk in document_chunks if len(chunk) > 0]
-
-        return filtered_document_chunks
+        yield from _non_empty("\n".join(included_lines))
 
     def get_white_space_line_dict(self, ocr_values: List[dict]) -> Dict[int, list]:
         """Collects ocr tokens by the line they are assigned to in the white space representation.
@@ -169,10 +209,68 @@ class DocumentToString:
         return line_dict
 
 
+def _non_empty(chunk: str) -> Iterator[str]:
+    # Avoid returning empty chunks
+    if len(chunk) > 0:
+        yield chunk
+
+
+class _ChunkTokenCounter:
+    """Counts the tokens of lines joined with new lines as they are appended, without re-encoding the whole chunk.
+
+    tiktoken splits the text with a regex before applying BPE, so tokens never span two of the resulting pieces, and
+    pieces are found left to right. Once a line start is a piece boundary that no appended text can move, the tokens
+    before it are final and only the text after it is encoded again. That is the case when the line has a character
+    which none of the whitespace or new line runs of the regex can extend into, so chunking encodes each line a couple
+    of times instead of the whole chunk for every line.
+    """
+
+    def __init__(self, tokenizer_model: str):
+        # tiktoken does not expose the pattern publicly, without it every count encodes the whole chunk
+        pat_str = getattr(get_encoding(tokenizer_model), "_pat_str", None)
+        self._pattern = regex.compile(pat_str) if pat_str is not None else None
+        # Each tail is counted twice in a row, keep those in front of the shared cache
+        self._count = lru_cache(maxsize=64)(partial(count_tokens, model=tokenizer_model))
+        self.reset()
+
+    def reset(self):
+        self._empty = True
+        # Tokens before the last stable boundary, and the text after it
+        self._stable_tokens = 0
+        self._tail = ""
+
+    def count_with(self, line: str) -> int:
+        """Returns the number of tokens of the chunk with `line` appended."""
+        return self._stable_tokens + self._count(self._join(line))
+
+    def append(self, line: str):
+        tail = self._join(line)
+        start = len(tail) - len(line)
+        if start and self._is_stable(tail, start):
+            # The pieces after `start` only depend on the text after it
+            self._stable_tokens += self._count(tail) - self._count(line)
+            tail = line
+        self._tail = tail
+        self._empty = False
+
+    def _join(self, line: str) -> str:
+        return line if self._empty else f"{self._tail}\n{line}"
+
+    def _is_stable(self, tail: str, start: int) -> bool:
+        if self._pattern is None or not any(not char.isspace() and char != "/" for char in tail[start:]):
+            return False
+        for match in self._pattern.finditer(tail):
+            if match.start() >= start:
+                return match.start() == start
+        return False
+
+
 def _replace_checkbox_kv_pairs(ocr_values, ocr_key_values):
     kv = [item for item in ocr_key_values if "value" in item]
     kv = [item for item in kv if item["value"]["content"] == ":selected:" or item["value"]["content"] == ":unselected:"]
     kv = _deduplicate_boxes(kv)
+    ocr_values = list(ocr_values)
+    index = BoxIndex.from_boxes([token["boundingBox"] for token in ocr_values], [t["pageNumber"] for t in ocr_values])
     for e in kv:
         page_number = e["value"]["pageNumber"]
         checkbox_bbox = e["key"]["boundingBox"]
@@ -180,25 +278,25 @@ def _replace_checkbox_kv_pairs(ocr_values, ocr_key_values):
         box_str = "[ ]" if e["value"]["content"] == ":unselected:" else "[X]"
         content = f"{e['key']['content']}-{box_str}"
 
-        ocr_values = filter_tokens_by_text_box(ocr_values, checkbox_bbox, page_number)
-        ocr_values = filter_tokens_by_text_box(ocr_values, value_bbox, page_number)
+        # Same as `filter_tokens_by_text_box` with both boxes, only testing the tokens close to them
+        for text_box in (checkbox_bbox, value_bbox):
+            for id in index.covered(text_box, page_number, 0.9):
+                index.remove(id)
 
         ocr_values.append({"content": content, "boundingBox": checkbox_bbox, "pageNumber": page_number})
-    return ocr_values
+        index.add(checkbox_bbox, page_number)
+    return [token for id, token in enumerate(ocr_values) if index.is_alive(id)]
 
 
 def _deduplicate_boxes(kv_list):
+    """Keeps the key-value pairs whose key box does not intersect the key box of an earlier pair on the same page."""
     keep = []
-    matched = []
-    for i, kv_pair in enumerate(kv_list):
-        for j in range(i + 1, len(kv_list)):
-            other_kv = kv_list[j]
-            if intersect(kv_pair["key"]["boundingBox"], other_kv["key"]["boundingBox"]) and (
-                kv_pair["key"]["pageNumber"] == other_kv["key"]["pageNumber"]
-            ):
-                matched.append(j)
-        if i not in matched:
+    index = BoxIndex(grid_cell_size(kv_pair["key"]["boundingBox"] for kv_pair in kv_list))
+    for kv_pair in kv_list:
+        key = kv_pair["key"]
+        if not len(index.intersecting(key["boundingBox"], key["pageNumber"])):
             keep.append(kv_pair)
+        index.add(key["boundingBox"], key["pageNumber"])
     return keep
 
 
@@ -243,7 +341,24 @@ def filter_tokens_by_text_box(tokens, text_box, page_number):
     return kept_tokens
 
 
+def _group_by_page(ocr_values: list, max_pages: Optional[int] = None, page_count: int = 0) -> List[list]:
+    """Groups the tokens by page in one pass, pages without tokens are empty and pages after `max_pages` dropped.
+
+    The document has at least `page_count` pages, even if the last ones have no tokens.
+    """
+    by_page = {}
+    for token in ocr_values:
+        by_page.setdefault(max(token["pageNumber"], 1), []).append(token)
+    page_numbers = range(1, max(max(by_page, default=0), page_count) + 1)[:max_pages]
+    return [by_page.get(page_number, []) for page_number in page_numbers]
+
+
 def get_line_based_representation(ocr_outputs, tolerance=2):
+    return [_render_line_page(page, tolerance) for page in _group_by_page(ocr_outputs)]
+
+
+def _render_line_page(ocr_outputs, tolerance=2) -> str:
+    """Joins the tokens of a page into lines, starting a new line when the vertical middle moves by `tolerance`."""
     sorted_ocr = sorted(
         ocr_outputs,
         key=lambda x: (
@@ -252,30 +367,21 @@ def get_line_based_representation(ocr_outputs, tolerance=2):
             x["boundingBox"]["left"],
         ),
     )
-    pages = []
-    current_page = []
+    lines = []
     current_line = []
     prev_middle_y = None
 
     for ocr in sorted_ocr:
         middle_y = ocr["boundingBox"]["top"] + ocr["boundingBox"]["height"] / 2
         if prev_middle_y is not None and abs(middle_y - prev_middle_y) > tolerance:
-            line_string = " ".join([t["content"] for t in sorted(current_line, key=lambda x: x["boundingBox"]["left"])])
-            current_page.append(line_string)
+            lines.append(" ".join([t["content"] for t in sorted(current_line, key=lambda x: x["boundingBox"]["left"])]))
             current_line = []
-        if ocr["pageNumber"] != len(pages) + 1:
-            pages.append("\n".join(current_page))
-            current_page = []
-
         current_line.append(ocr)
         prev_middle_y = middle_y
 
     if current_line:
-        line_string = " ".join([t["content"] for t in sorted(current_line, key=lambda x: x["boundingBox"]["left"])])
-        current_page.append(line_string)
-    if current_page:
-        pages.append("\n".join(current_page))
-    return pages
+        lines.append(" ".join([t["content"] for t in sorted(current_line, key=lambda x: x["boundingBox"]["left"])]))
+    return "\n".join(lines)
 
 
 def get_white_space_representation(ocr_values, pixels_per_line=10, pixels_per_char=4):
@@ -290,43 +396,41 @@ def get_white_space_representation(ocr_values, pixels_per_line=10, pixels_per_ch
     :param pixels_per_char: Assumed average width of a character
     :return: String representation of the document
     """
+    pages = _group_by_page(ocr_values) or [[]]
+    return [_render_white_space_page(page, pixels_per_line, pixels_per_char) for page in pages]
+
+
+def _render_white_space_page(ocr_values, pixels_per_line=10, pixels_per_char=4) -> str:
+    """Renders the tokens of a page as done by `get_white_space_representation`."""
     # Sort tokens by page number, y-position in grid and x-position in grid
-    ocr_values.sort(
+    ocr_values = sorted(
+        ocr_values,
         key=lambda ocr_token: (
             ocr_token["pageNumber"],
             ocr_token["boundingBox"]["top"] // pixels_per_line,
             ocr_token["boundingBox"]["left"] // pixels_per_char,
-        )
+        ),
     )
 
-    # Initialize the document
-    page_tokens = []
-    doc_pages = []
-
-    # Variables to track the current position
-    current_page = 1
-    current_line = 0
+    # Parts of each line, starting with its new line, and the length of the line
+    lines = []
+    lengths = []
     for token in ocr_values:
-        # Combine all token for a page together and add them to the result.
-        while token["pageNumber"] > current_page:
-            doc_pages.append("".join(page_tokens))
-            page_tokens = []
-            current_page += 1
-            current_line = 0
-
         # Add newlines if necessary
         lines_needed = max(1, token["boundingBox"]["top"] // pixels_per_line)
-        while current_line < lines_needed:
-            page_tokens.append("\n")
-            current_line += 1
+        while len(lines) < lines_needed:
+            lines.append(["\n"])
+            lengths.append(1)
+        current_line = len(lines) - 1
 
         # Add spaces for horizontal position
         char_pos = int(token["boundingBox"]["left"] // pixels_per_char)
-        if len(page_tokens[current_line - 1]) < char_pos:
-            page_tokens[current_line - 1] += " " * (char_pos - len(page_tokens[current_line - 1]))
+        if lengths[current_line] < char_pos:
+            lines[current_line].append(" " * (char_pos - lengths[current_line]))
+            lengths[current_line] = char_pos
 
         # Add the word token. Also add an extra white space to avoid that tokens will be fused together
-        page_tokens[current_line - 1] += token["content"] + " "
-    doc_pages.append("".join(page_tokens))
+        lines[current_line].append(token["content"] + " ")
+        lengths[current_line] += len(token["content"]) + 1
 
-    return doc_pages
+    return "".join("".join(parts) for parts in lines)
@@ -0,0 +1,112 @@
+"""Spatial index over OCR bounding boxes, used to find the tokens and key-value boxes overlapping a box."""
+import math
+from statistics import median
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+import numpy as np
+
+# left, top, width, height, right, bottom
+_COLUMNS = 6
+
+
+def grid_cell_size(boxes: Iterable[dict]) -> float:
+    """Twice the median side of the boxes, so that a typical box spans a couple of cells."""
+    sides = [max(box["width"], box["height"]) for box in boxes if box["width"] > 0 and box["height"] > 0]
+    return 2.0 * median(sides) if sides else 1.0
+
+
+class BoxIndex:
+    """Uniform grid over the bounding boxes of a document, one per page.
+
+    Boxes are added in order and identified by their insertion index, they can be removed while the index is queried.
+    Queries only test the boxes in the grid cells they overlap, the tests themselves are vectorized over those
+    candidates. Boxes without a positive width and height are not put in the grid and are tested by every query on
+    their page, so the results are the same as testing every box.
+
+    Args:
+        cell_size: Side of the grid cells, in the unit of the bounding boxes.
+    """
+
+    def __init__(self, cell_size: float):
+        self._cell_size = cell_size
+        self._boxes = np.empty((64, _COLUMNS))
+        self._alive = np.zeros(64, dtype=bool)
+        self._size = 0
+        self._grid: Dict[Hashable, Dict[Tuple[int, int], List[int]]] = {}
+        self._page_ids: Dict[Hashable, List[int]] = {}
+        self._degenerate: Dict[Hashable, List[int]] = {}
+
+    @classmethod
+    def from_boxes(cls, boxes: List[dict], pages: List[Hashable]) -> "BoxIndex":
+        index = cls(grid_cell_size(boxes))
+        for box, page in zip(boxes, pages):
+            index.add(box, page)
+        return index
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._alive[: self._size]))
+
+    def add(self, box: dict, page: Hashable) -> int:
+        """Adds `box` on `page` and returns its id."""
+        if self._size == len(self._boxes):
+            self._boxes = np.concatenate([self._boxes, np.empty_like(self._boxes)])
+            self._alive = np.concatenate([self._alive, np.zeros_like(self._alive)])
+        id = self._size
+        left, top, width, height = box["left"], box["top"], box["width"], box["height"]
+        self._boxes[id] = (left, top, width, height, left + width, top + height)
+        self._alive[id] = True
+        self._size += 1
+
+        self._page_ids.setdefault(page, []).append(id)
+        if width > 0 and height > 0:
+            grid = self._grid.setdefault(page, {})
+            (x0, x1), (y0, y1) = self._cells(left, left + width), self._cells(top, top + height)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    grid.setdefault((x, y), []).append(id)
+        else:
+            self._degenerate.setdefault(page, []).append(id)
+        return id
+
+    def remove(self, id: int):
+        self._alive[id] = False
+
+    def is_alive(self, id: int) -> bool:
+        return bool(self._alive[id])
+
+    def intersecting(self, box: dict, page: Hashable) -> np.ndarray:
+        """Ids of the boxes on `page` which `intersect` with `box`."""
+        ids, boxes = self._candidates(box, page)
+        right, bottom = box["left"] + box["width"], box["top"] + box["height"]
+        mask = (box["left"] < boxes[:, 4]) & (right > boxes[:, 0]) & (box["top"] < boxes[:, 5]) & (bottom > boxes[:, 1])
+        return ids[mask]
+
+    def covered(self, box: dict, page: Hashable, min_ratio: float = 0.9) -> np.ndarray:
+        """Ids of the boxes on `page` no larger than `box` and with at least `min_ratio` of their area inside it."""
+        ids, boxes = self._candidates(box, page)
+        x1 = np.maximum(boxes[:, 0], box["left"])
+        y1 = np.maximum(boxes[:, 1], box["top"])
+        x2 = np.minimum(boxes[:, 4], box["left"] + box["width"])
+        y2 = np.minimum(boxes[:, 5], box["top"] + box["height"])
+        intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+        area = boxes[:, 2] * boxes[:, 3]
+        mask = (area <= box["width"] * box["height"]) & (intersection >= min_ratio * area)
+        return ids[mask]
+
+    def _cells(self, start: float, end: float) -> Tuple[int, int]:
+        start, end = min(start, end), max(start, end)
+        return math.floor(start / self._cell_size), math.floor(end / self._cell_size)
+
+    def _candidates(self, box: dict, page: Hashable) -> Tuple[np.ndarray, np.ndarray]:
+        page_ids = self._page_ids.get(page, [])
+        (x0, x1) = self._cells(box["left"], box["left"] + box["width"])
+        (y0, y1) = self._cells(box["top"], box["top"] + box["height"])
+        if (x1 - x0 + 1) * (y1 - y0 + 1) >= len(page_ids):
+            candidates = page_ids
+        else:
+            grid = self._grid.get(page, {})
+            candidates = [id for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for id in grid.get((x, y), ())]
+            candidates.extend(self._degenerate.get(page, ()))
+        ids = np.unique(np.asarray(candidates, dtype=np.int64))
+        ids = ids[self._alive[ids]]
+        return ids, self._boxes[ids]
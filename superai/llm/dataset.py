@@ -250,6 +250,10 @@ class Dataset(BaseModel):
     def delete_data(self, index: int):
         del self.data[index]
 
+    def get_errors(self) -> Dict[int, str]:
+        """Errors of the data points which could not be processed, by index."""
+        return {index: data.metadata["error"] for index, data in enumerate(self.data) if "error" in data.metadata}
+
     def from_json(self, data_files: Union[str, Dict[str, str]], field: str = None) -> "Dataset":
         if isinstance(data_files, str):
             data_files = {"": data_files}
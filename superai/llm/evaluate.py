@@ -1,22 +1,153 @@
-from typing import List
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 from tabulate import tabulate
 
+_COUNTS = ("tp", "fp", "tn", "fn", "ip")
+_MISMATCH_COLUMNS = ["index", "field", "kind", "ground_truth", "prediction"]
+
+
+def _columns(records: Sequence[dict], keys: Sequence[str]) -> np.ndarray:
+    """Values of `keys` in `records` as an object array of shape (len(keys), len(records)), "" where missing."""
+    defaults = dict.fromkeys(keys, "")
+    values = itemgetter(*keys) if len(keys) > 1 else lambda record: (record[keys[0]],)
+    # Records are completed with the defaults and flattened in C, rather than read value by value in Python
+    rows = map(values, map(defaults.__or__, records))
+    flat = np.fromiter(chain.from_iterable(rows), dtype=object, count=len(records) * len(keys))
+    return flat.reshape(len(records), len(keys)).T
+
+
+class StreamingEvaluator:
+    """Counts true positives, false positives, true negatives, false negatives, and incorrect positives of multi-field
+    predictions, one chunk of records at a time.
+
+    Each chunk is loaded once into a (fields x records) array, and the counts of all the fields are computed in a few
+    vectorized passes over it. Only the counts, and the positions of the mismatches, are kept between chunks, so
+    evaluation sets which don't fit in memory can be evaluated by chunks. Like `Evaluator`, the fields are the keys of
+    the ground truth, and an empty string is a negative.
+
+    Args:
+        collect_mismatches: Whether to keep the mismatches, returned by `mismatches`.
+    """
+
+    def __init__(self, collect_mismatches: bool = True):
+        self._collect_mismatches = collect_mismatches
+        # Counts of every field seen in the ground truth or the predictions, by field, in the order of _COUNTS
+        self._counts: Dict[str, np.ndarray] = {}
+        self._ground_truth_fields = set()
+        self._mismatches: List[pd.DataFrame] = []
+        self._total = 0
+
+    @property
+    def total(self) -> int:
+        """Number of records evaluated."""
+        return self._total
+
+    def update(self, ground_truth: Sequence[dict], predictions: Sequence[dict]) -> "StreamingEvaluator":
+        """Adds a chunk of records. Records are paired like `zip`, the extra records of the longer list are ignored,
+        except for the fields of the extra ground truth records."""
+        gt_keys = set(chain.from_iterable(ground_truth))
+        self._ground_truth_fields |= gt_keys
+        size = min(len(ground_truth), len(predictions))
+        ground_truth, predictions = ground_truth[:size], predictions[:size]
+        keys = sorted(gt_keys | set(chain.from_iterable(predictions)) | set(self._counts), key=str)
+        for key in keys:
+            if key not in self._counts:
+                # Both values were missing from the records of the previous chunks
+                self._counts[key] = np.array([0, 0, self._total, 0, 0], dtype=np.int64)
+        if not size or not keys:
+            self._total += size
+            return self
+
+        gt = _columns(ground_truth, keys)
+        pred = _columns(predictions, keys)
+        gt_positive = gt != ""
+        pred_positive = pred != ""
+        both = gt_positive & pred_positive
+        equal = both & (gt == pred)
+        masks = {
+            "tp": equal,
+            "fp": ~gt_positive & pred_positive,
+            "tn": ~gt_positive & ~pred_positive,
+            "fn": gt_positive & ~pred_positive,
+            "ip": both & ~equal,
+        }
+        counts = np.stack([masks[name].sum(axis=1) for name in _COUNTS], axis=1)
+        for key, row in zip(keys, counts):
+            self._counts[key] += row
+
+        if self._collect_mismatches:
+            for kind in ("ip", "fn", "fp"):
+                rows, indices = np.nonzero(masks[kind])
+                if len(rows):
+                    self._mismatches.append(
+                        pd.DataFrame(
+                            {
+                                "index": indices + self._total,
+                                "field": np.asarray(keys, dtype=object)[rows],
+                                "kind": kind,
+                                "ground_truth": gt[rows, indices],
+                                "prediction": pred[rows, indices],
+                            }
+                        )
+                    )
+        self._total += size
+        return self
+
+    def counts(self) -> pd.DataFrame:
+        """Counts of each field, with the columns tp, fp, tn, fn, and ip."""
+        fields = sorted(self._ground_truth_fields, key=str)
+        data = np.array([self._counts[field] for field in fields], dtype=np.int64).reshape(len(fields), len(_COUNTS))
+        return pd.DataFrame(data, index=pd.Index(fields, name="field"), columns=list(_COUNTS))
+
+    def results(self) -> Dict[str, dict]:
+        """Performance metrics of each field, see `Evaluator.evaluate`."""
+        return {field: Evaluator._compute_metrics(*map(int, row)) for field, row in self.counts().iterrows()}
+
+    def mismatches(self, kinds: Optional[Iterable[str]] = ("ip", "fn")) -> pd.DataFrame:
+        """Mismatches of the fields, one row per record and field, ordered by record.
+
+        Args:
+            kinds: Kinds of mismatches to return, among "ip" (incorrect positive), "fn" (false negative) and "fp"
+                (false positive), None for all.
+
+        Returns:
+            A dataframe with the columns index (of the record), field, kind, ground_truth, and prediction.
+        """
+        if not self._collect_mismatches:
+            raise ValueError("Mismatches weren't collected, use collect_mismatches=True")
+        if not self._mismatches:
+            return pd.DataFrame(columns=_MISMATCH_COLUMNS)
+        table = pd.concat(self._mismatches, ignore_index=True)
+        # Keys only in the predictions aren't evaluated
+        selected = table["field"].isin(self._ground_truth_fields)
+        if kinds is not None:
+            selected &= table["kind"].isin(list(kinds))
+        table = table[selected].sort_values(["index", "field"], kind="stable", key=lambda c: c.map(str))
+        return table.reset_index(drop=True)
+
 
 class Evaluator:
     """
     A class to evaluate the performance of a model by comparing its predictions against ground truth. The evaluation is
     designed for multi-field predictions of strings. An empty string will interpret as a negative.
 
+    The records are evaluated by chunks of `chunk_size` with a `StreamingEvaluator`, and the mismatches are returned by
+    `mismatches` instead of being printed.
+
     Attributes:
         ground_truth (list of dicts): A list of dictionaries containing ground truth labels.
         predictions (list of dicts): A list of dictionaries containing predicted labels.
+        chunk_size (int): Number of records loaded in memory at once.
     """
 
-    def __init__(self, ground_truth: List[dict], predictions: List[dict]):
+    def __init__(self, ground_truth: List[dict], predictions: List[dict], chunk_size: int = 10000):
         self.ground_truth = ground_truth
         self.predictions = predictions
+        self.chunk_size = chunk_size
 
     @staticmethod
     def _count_metrics(gt, pred):
@@ -30,28 +161,11 @@ class Evaluator:
             tuple: A tuple containing true positives, false positives, true negatives, false negatives, and incorrect
             positives.
         """
-        tp = 0
-        fp = 0
-        tn = 0
-        fn = 0
-        ip = 0
-
-        for i, (g, p) in enumerate(zip(gt, pred)):
-            if g != "" and p != "":
-                if g == p:
-                    tp += 1
-                else:
-                    ip += 1
-                    print(i, g, p)
-            elif g == "" and p != "":
-                fp += 1
-            elif g != "" and p == "":
-                print(i, g, p)
-                fn += 1
-            else:
-                tn += 1
-
-        return tp, fp, tn, fn, ip
+        evaluator = StreamingEvaluator(collect_mismatches=False)
+        evaluator.update([{"value": g} for g in gt], [{"value": p} for p in pred])
+        if not evaluator.total:
+            return 0, 0, 0, 0, 0
+        return tuple(int(count) for count in evaluator.counts().loc["value"])
 
     @staticmethod
     def _compute_metrics(tp, fp, tn, fn, ip):
@@ -73,6 +187,15 @@ class Evaluator:
             "total": (tp + fp + tn + fn + ip),
         }
 
+    def _evaluate(self) -> StreamingEvaluator:
+        evaluator = StreamingEvaluator()
+        # The ground truth records past the predictions are only read for their fields
+        size = len(self.ground_truth)
+        for start in range(0, size, self.chunk_size):
+            end = min(start + self.chunk_size, size)
+            evaluator.update(self.ground_truth[start:end], self.predictions[start:end])
+        return evaluator
+
     def evaluate(self, as_formatted_string=True):
         """Evaluates the performance of a model by comparing its predictions against ground truth for each key in the
         datasets.
@@ -81,18 +204,14 @@ class Evaluator:
             dict: A dictionary containing the performance metrics for each key.
 
         """
-        results = {}
-        keys = set().union(*(d.keys() for d in self.ground_truth))
-
-        for key in keys:
-            gt = [d.get(key, "") for d in self.ground_truth]
-            pred = [d.get(key, "") for d in self.predictions]
-
-            tp, fp, tn, fn, ip = self._count_metrics(gt, pred)
-            metrics = self._compute_metrics(tp, fp, tn, fn, ip)
-            results[key] = metrics
+        results = self._evaluate().results()
         if as_formatted_string:
             df = pd.DataFrame(results).T.sort_index()
             results = tabulate(df, headers=df.columns)
 
         return results
+
+    def mismatches(self, kinds: Optional[Iterable[str]] = ("ip", "fn")) -> pd.DataFrame:
+        """Incorrect positives and false negatives, which were printed by the evaluation, as a dataframe. See
+        `StreamingEvaluator.mismatches`."""
+        return self._evaluate().mismatches(kinds)
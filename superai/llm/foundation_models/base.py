@@ -1,15 +1,16 @@
+import asyncio
 import time
 from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
 from functools import wraps
 
-import tiktoken
 from openai.error import RateLimitError
 from pydantic import BaseModel, Extra
 from requests.exceptions import ConnectionError
-from tiktoken.model import MODEL_TO_ENCODING
 
-# TODO: remove when tiktoken model registry will be updated
-MODEL_TO_ENCODING.setdefault("gpt-35-turbo", "cl100k_base")
+from superai.llm.configuration import Configuration
+from superai.llm.foundation_models.streaming import CompletionStream
+from superai.llm.tokenizers import count_tokens
 
 
 class FoundationModel(ABC, BaseModel):
@@ -27,19 +28,35 @@ class FoundationModel(ABC, BaseModel):
     def predict(self, prompt_instance):
         raise NotImplementedError
 
+    def stream_predict(
+        self, prompt_instance, frequency_penalty: float = None, detect_repetition: bool = True
+    ) -> CompletionStream:
+        """Streams the completion of `prompt_instance`, in a single delta unless the model streams its generations."""
+        return CompletionStream.from_text(self.predict(prompt_instance))
+
+    async def apredict(self, prompt_instance):
+        """Async version of `predict`, runs it in the default executor unless the model has an async client."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.predict, prompt_instance)
+
+    @asynccontextmanager
+    async def session(self, max_connections: int = 100):
+        """Context in which a batch of `apredict` calls is made, e.g. to share connections between them."""
+        yield
+
+    def max_concurrency(self) -> int:
+        """Number of `apredict` calls worth running at once."""
+        return Configuration().batch_max_concurrency
+
     def count_tokens(self, messages):
         # TODO: generalize to other foundation models
         num_tokens = 0
-        encoding = tiktoken.encoding_for_model(self.engine)
         for message in messages:
-            if isinstance(message, str):
-                len(encoding.encode(message))
-            elif isinstance(message, dict):
+            if isinstance(message, dict):
                 for key, value in message.items():
-                    num_tokens += len(encoding.encode(str(value)))
+                    num_tokens += count_tokens(str(value), self.engine)
                     if key == "name":
                         num_tokens += 1
-            num_tokens += len(encoding.encode(str(message)))
+            num_tokens += count_tokens(str(message), self.engine)
         num_tokens += 3  # every reply is prefixed with <|start|>assistant<|message|>
         return num_tokens
 
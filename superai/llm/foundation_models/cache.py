@@ -0,0 +1,321 @@
+"""Caches of foundation model responses, so that the same request doesn't hit the API twice."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import diskcache as dc
+import numpy as np
+from attr import define
+
+from superai.llm.configuration import Configuration
+from superai.log import logger
+
+log = logger.get_logger(__name__)
+
+# Request params which don't change the response
+_IGNORED_PARAMS = {"user", "stream", "request_timeout"}
+
+
+def normalize_params(params: dict) -> dict:
+    """Params of a request reduced to what determines its response.
+
+    Unset and per-caller params are dropped, the Azure deployment and the OpenAI model name are the same key, and the
+    leading and trailing whitespace of the messages is ignored.
+    """
+    normalized = {key: value for key, value in params.items() if value is not None and key not in _IGNORED_PARAMS}
+    if "engine" in normalized:
+        normalized["model"] = normalized.pop("engine")
+    if "messages" in normalized:
+        normalized["messages"] = [
+            {**message, "content": message["content"].strip()} if isinstance(message.get("content"), str) else message
+            for message in normalized["messages"]
+        ]
+    if isinstance(normalized.get("input"), str):
+        normalized["input"] = [normalized["input"]]
+    return normalized
+
+
+def response_cache_key(params: dict) -> str:
+    """Digest of the normalized `params`, identical for requests which get the same response."""
+    encoded = json.dumps(
+        normalize_params(params), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(encoded.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+@define
+class ResponseCacheStats:
+    hits: int
+    semantic_hits: int
+    misses: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.semantic_hits + self.misses
+        return (self.hits + self.semantic_hits) / total if total else 0.0
+
+
+class ResponseCache(ABC):
+    """Cache of API responses keyed by the request params, see `response_cache_key`.
+
+    Responses must be plain JSON-like objects, e.g. `OpenAIObject.to_dict_recursive()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._semantic_hits = 0
+        self._misses = 0
+
+    def get(self, params: dict) -> Optional[dict]:
+        """Returns the cached response to `params`, None when there is none."""
+        response = self._get(response_cache_key(params))
+        self._record(hit=response is not None)
+        return response
+
+    def set(self, params: dict, response: dict):
+        self._set(response_cache_key(params), response)
+
+    @property
+    def stats(self) -> ResponseCacheStats:
+        with self._lock:
+            return ResponseCacheStats(self._hits, self._semantic_hits, self._misses, len(self))
+
+    def clear(self):
+        self._clear()
+        with self._lock:
+            self._hits = self._semantic_hits = self._misses = 0
+
+    def __deepcopy__(self, memo):
+        # Copies of a model, e.g. pydantic field defaults, share its cache
+        return self
+
+    def _record(self, hit: bool, semantic: bool = False):
+        with self._lock:
+            if not hit:
+                self._misses += 1
+            elif semantic:
+                self._semantic_hits += 1
+            else:
+                self._hits += 1
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _set(self, key: str, response: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _clear(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """In-process LRU cache of at most `max_size` responses, each kept for `ttl` seconds, forever when None."""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def _set(self, key: str, response: dict):
+        if self._max_size <= 0:
+            return
+        expires_at = self._clock() + self._ttl if self._ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (expires_at, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def _clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskResponseCache(ResponseCache):
+    """Cache shared by the processes using the same `directory`, evicting the least recently used responses past
+    `size_limit` bytes. Each response is kept for `ttl` seconds, forever when None."""
+
+    def __init__(self, directory: Optional[str] = None, ttl: Optional[float] = None, size_limit: int = 2**28):
+        super().__init__()
+        self._ttl = ttl
+        self._cache = dc.Cache(
+            directory or os.path.join(tempfile.gettempdir(), "llm_responses"),
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+    def _get(self, key: str) -> Optional[dict]:
+        return self._cache.get(key)
+
+    def _set(self, key: str, response: dict):
+        self._cache.set(key, response, expire=self._ttl)
+
+    def _clear(self):
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class SemanticResponseCache(ResponseCache):
+    """Exact-match `cache` which also answers a chat request with the response to a similar one.
+
+    A request missing from `cache` gets the response of the most similar cached request with the same params but the
+    messages, when the cosine similarity of the embeddings of their messages is at least `threshold`. Only use it for
+    deterministic requests, where close prompts are expected to give the same answer. The embeddings are kept in memory,
+    for the last `max_entries` requests of each set of params, and their responses are read from `cache`, so they
+    expire and are evicted with it.
+
+    Args:
+        cache: Cache of the responses.
+        embed: Returns the embedding of a text.
+        threshold: Minimum cosine similarity of a similar request.
+        max_entries: Embeddings kept per set of params.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        embed: Callable[[str], Sequence[float]],
+        threshold: float = 0.97,
+        max_entries: int = 1024,
+    ):
+        super().__init__()
+        self._cache = cache
+        self._embed = embed
+        self._threshold = threshold
+        self._max_entries = max_entries
+        # Embeddings and exact keys of the cached requests, by key of their params without the messages
+        self._index: Dict[str, Tuple[np.ndarray, List[str]]] = {}
+        # Embeddings computed by a missed lookup, kept for the `set` which follows it
+        self._pending: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def get(self, params: dict) -> Optional[dict]:
+        key = response_cache_key(params)
+        response = self._cache._get(key)
+        if response is not None or "messages" not in params:
+            self._record(hit=response is not None)
+            return response
+
+        vector = self._embedding(params)
+        if vector is None:
+            self._record(hit=False)
+            return None
+        with self._lock:
+            self._pending[key] = vector
+            while len(self._pending) > self._max_entries:
+                self._pending.popitem(last=False)
+            vectors, keys = self._index.get(self._scope(params), (np.empty((0, len(vector))), []))
+        if keys:
+            similarities = vectors @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self._threshold:
+                response = self._cache._get(keys[best])
+        self._record(hit=response is not None, semantic=True)
+        return response
+
+    def set(self, params: dict, response: dict):
+        key = response_cache_key(params)
+        self._cache._set(key, response)
+        if "messages" not in params:
+            return
+        with self._lock:
+            vector = self._pending.pop(key, None)
+        if vector is None:
+            vector = self._embedding(params)
+            if vector is None:
+                return
+        with self._lock:
+            scope = self._scope(params)
+            vectors, keys = self._index.get(scope, (np.empty((0, len(vector))), []))
+            if key in keys:
+                return
+            vectors, keys = np.vstack([vectors, vector])[-self._max_entries :], (keys + [key])[-self._max_entries :]
+            self._index[scope] = (vectors, keys)
+
+    def _embedding(self, params: dict) -> Optional[np.ndarray]:
+        text = "\n".join(f"{message['role']}: {message['content']}" for message in normalize_params(params)["messages"])
+        try:
+            vector = np.asarray(self._embed(text), dtype=np.float64)
+        except Exception as e:
+            log.warning(f"Could not embed the request for the semantic cache: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    @staticmethod
+    def _scope(params: dict) -> str:
+        return response_cache_key({key: value for key, value in params.items() if key != "messages"})
+
+    def _get(self, key: str) -> Optional[dict]:
+        return self._cache._get(key)
+
+    def _set(self, key: str, response: dict):
+        self._cache._set(key, response)
+
+    def _clear(self):
+        self._cache.clear()
+        with self._lock:
+            self._index.clear()
+            self._pending.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+@lru_cache(maxsize=None)
+def default_response_cache() -> Optional[ResponseCache]:
+    """Process-wide response cache configured by `llm.cache`, None when it is disabled."""
+    config = Configuration()
+    if config.response_cache_backend == "memory":
+        cache = MemoryResponseCache(config.response_cache_max_size, config.response_cache_ttl)
+    elif config.response_cache_backend == "disk":
+        cache = DiskResponseCache(
+            config.response_cache_directory, config.response_cache_ttl, config.response_cache_size_limit
+        )
+    elif not config.response_cache_backend:
+        return None
+    else:
+        raise ValueError(f"Unknown response cache backend {config.response_cache_backend}, use memory or disk")
+
+    if config.response_cache_semantic_threshold is not None:
+        from superai.llm.foundation_models.openai import OpenAIEmbedding
+
+        embedding_model = OpenAIEmbedding(cache=cache)
+        cache = SemanticResponseCache(
+            cache, embedding_model.predict, config.response_cache_semantic_threshold, config.response_cache_max_size
+        )
+    return cache
@@ -0,0 +1,108 @@
+"""Persistent store of embeddings keyed by content hash, read back through a memory map."""
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+_KEY_SIZE = 16
+
+
+def embedding_key(text: str, model: str) -> bytes:
+    """Digest identifying the embedding of `text` by `model`."""
+    return hashlib.blake2b(f"{model}\0{text}".encode("utf-8", "surrogatepass"), digest_size=_KEY_SIZE).digest()
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class EmbeddingStore:
+    """Append-only store of float32 embeddings in `directory`.
+
+    The embeddings are the rows of a raw `vectors.f32` file, mapped in memory for reading, and `keys.bin` holds their
+    digests in the same order, so opening the store only reads the keys. Rows are written before their keys, a store
+    interrupted while adding embeddings opens with the ones fully written. Only one process should add embeddings to
+    a directory at a time.
+
+    Args:
+        directory: Directory of the store, created if needed.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._keys_path = os.path.join(directory, "keys.bin")
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._lock = threading.Lock()
+        self._dimension: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._map: Optional[np.memmap] = None
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self._dimension = json.load(f)["dimension"]
+            keys = b""
+            if os.path.exists(self._keys_path):
+                with open(self._keys_path, "rb") as f:
+                    keys = f.read()
+            count = min(len(keys) // _KEY_SIZE, _file_size(self._vectors_path) // (4 * self._dimension))
+            self._rows = {keys[i * _KEY_SIZE : (i + 1) * _KEY_SIZE]: i for i in range(count)}
+            # Drop what an interrupted `add` left past the last complete row
+            self._truncate(count)
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._rows
+
+    def get(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """Embeddings of `keys`, None for the keys not in the store."""
+        with self._lock:
+            rows = [self._rows.get(key) for key in keys]
+            found = [row for row in rows if row is not None]
+            if not found:
+                return [None] * len(rows)
+            if self._map is None or len(self._map) < len(self._rows):
+                self._map = np.memmap(
+                    self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._rows), self._dimension)
+                )
+            vectors = iter(np.array(self._map[found]))
+        return [next(vectors) if row is not None else None for row in rows]
+
+    def add(self, keys: Sequence[bytes], vectors: np.ndarray):
+        """Adds the embeddings `vectors`, one row per key, the keys already in the store are skipped."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._dimension is None:
+                self._dimension = vectors.shape[1]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"dimension": self._dimension}, f)
+            elif vectors.shape[1] != self._dimension:
+                raise ValueError(f"Embeddings of dimension {vectors.shape[1]} added to a store of {self._dimension}")
+
+            new = {}
+            for index, key in enumerate(keys):
+                if key not in self._rows and key not in new:
+                    new[key] = index
+            if not new:
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[list(new.values())]).tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(new))
+            for key in new:
+                self._rows[key] = len(self._rows)
+
+    def _truncate(self, count: int):
+        for path, size in ((self._keys_path, count * _KEY_SIZE), (self._vectors_path, count * 4 * self._dimension)):
+            if _file_size(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
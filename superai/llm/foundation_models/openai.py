@@ -1,9 +1,13 @@
+import asyncio
 import json
 import random
 import time
+from contextlib import asynccontextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
 
+import aiohttp
+import numpy as np
 import openai
-import tiktoken
 from openai.error import (
     APIConnectionError,
     APIError,
@@ -13,11 +17,16 @@ from openai.error import (
     Timeout,
     TryAgain,
 )
+from pydantic import Field
 
-from superai.data_program.protocol.transport_factory import compute_api_wait_time
+from superai.data_program.protocol.rate_limit import Limit, rate_limiter
 from superai.llm.configuration import Configuration
 from superai.llm.data_types.message import ChatMessage
 from superai.llm.foundation_models.base import FoundationModel
+from superai.llm.foundation_models.cache import ResponseCache, default_response_cache
+from superai.llm.foundation_models.embedding_store import EmbeddingStore, embedding_key
+from superai.llm.foundation_models.streaming import CompletionStream, RepetitionDetector
+from superai.llm.tokenizers import count_tokens
 from superai.log import logger
 from superai.utils import retry
 
@@ -25,10 +34,36 @@ config = Configuration()
 
 log = logger.get_logger(__name__)
 
+_RETRYABLE_ERRORS = (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+    TryAgain,
+)
+_TRIES = 10
+
+
+def _is_deterministic(params: dict) -> bool:
+    return params.get("temperature") == 0 and params.get("n", 1) == 1 and not params.get("stream")
+
+
+def _cached_params(params: dict) -> dict:
+    # ChatGPT derives `max_tokens` from the length of the prompt, keeping it would give the same prompt with different
+    # whitespace another cache key and the semantically close prompts of other lengths another scope
+    return {key: value for key, value in params.items() if key != "max_tokens"}
+
+
+def _to_dict(response) -> dict:
+    return response.to_dict_recursive() if hasattr(response, "to_dict_recursive") else response
+
 
 class OpenAIFoundation(FoundationModel):
     user: str = None
     api_key: str = config.open_ai_api_key
+    # Responses to requests already made, None unless `llm.cache` is enabled in the settings
+    cache: Optional[ResponseCache] = Field(default_factory=default_response_cache)
 
     def initialize_openai(self):
         openai.api_type = config.openai_api_type
@@ -56,12 +91,126 @@ class ChatGPT(OpenAIFoundation):
     frequency_penalty: float = None
     logit_bias: dict = None
     token_limit: int = 8000 if engine == "gpt-4" else 4096
+    # Streamed generations repeating themselves for this many characters are stopped, None to never stop them. Long
+    # enough for legitimate repetitive output, e.g. a JSON list of a hundred `false`, to not be taken for a loop
+    repetition_window: Optional[int] = 2000
+    max_repetition_period: int = 100
     rpm: dict = {"gpt-4": 200, "gpt-3.5-turbo": 3500, "gpt-35-turbo": 3500}
     tpm: dict = {"gpt-4": 20000, "gpt-3.5-turbo": 240000, "gpt-35-turbo": 240000}
 
     def predict(self, input: ChatMessage):
+        if self.stream:
+            return self._predict_streaming(input)
+        self.initialize_openai()
+        filtered_params, token_count = self._chat_params(input)
+
+        response = self._cached_openai_call(filtered_params, token_count)
+        self._check_response(response)
+
+        # One failure mode is to run out of tokens. In most cases this is caused by
+        # generating infinite loops. In case the generation did not come to a natural
+        # stop we will not be able to parse the result. We will repeat the call with a
+        # presence penalty to decrease the chance constantly repeated tokens.
+        for penalty in [0.5, 1.0]:
+            finish_reason = response["choices"][0].get("finish_reason", "")
+            if finish_reason == "length":
+                log.info(f"Generated incomplete answer. Rerun prompt with presence penalty {penalty}")
+                filtered_params["frequency_penalty"] = penalty
+                response = self._cached_openai_call(filtered_params, token_count)
+                log.info("Raw LLM response (with penalty): " + str(response))
+                self._check_response(response)
+
+        output = response["choices"][0]["message"]["content"]
+        return output
+
+    async def apredict(self, input: ChatMessage):
+        """Async version of `predict`, the request and the rate limit waits don't block the event loop."""
         self.initialize_openai()
+        filtered_params, token_count = self._chat_params(input)
+
+        response = await self._async_cached_openai_call(filtered_params, token_count)
+        self._check_response(response)
+
+        for penalty in [0.5, 1.0]:
+            finish_reason = response["choices"][0].get("finish_reason", "")
+            if finish_reason == "length":
+                log.info(f"Generated incomplete answer. Rerun prompt with presence penalty {penalty}")
+                filtered_params["frequency_penalty"] = penalty
+                response = await self._async_cached_openai_call(filtered_params, token_count)
+                log.info("Raw LLM response (with penalty): " + str(response))
+                self._check_response(response)
 
+        output = response["choices"][0]["message"]["content"]
+        return output
+
+    def stream_predict(
+        self, input: ChatMessage, frequency_penalty: float = None, detect_repetition: bool = True
+    ) -> CompletionStream:
+        """Streams the completion of `input`, the returned `CompletionStream` yields its content as it is generated.
+
+        Unless `detect_repetition` is false, the generation is stopped once its last `repetition_window` characters
+        repeat themselves, instead of running until the token limit. Deterministic completions are read from and
+        written to the response cache.
+        """
+        self.initialize_openai()
+        filtered_params, token_count = self._chat_params(input)
+        filtered_params["stream"] = True
+        if frequency_penalty is not None:
+            filtered_params["frequency_penalty"] = frequency_penalty
+
+        on_finish = None
+        if self.cache is not None and _is_deterministic({**filtered_params, "stream": False}):
+            response = self.cache.get(_cached_params(filtered_params))
+            if response is not None:
+                choice = response["choices"][0]
+                return CompletionStream.from_text(choice["message"]["content"], choice.get("finish_reason") or "stop")
+
+            def on_finish(stream: CompletionStream):
+                message = {"role": "assistant", "content": stream.text}
+                self.cache.set(
+                    _cached_params(filtered_params),
+                    {"choices": [{"message": message, "finish_reason": stream.finish_reason}]},
+                )
+
+        repetition = None
+        if self.repetition_window and detect_repetition:
+            repetition = RepetitionDetector(self.repetition_window, self.max_repetition_period)
+        return CompletionStream(self._openai_call(filtered_params, token_count), repetition, on_finish)
+
+    def _predict_streaming(self, input: ChatMessage):
+        # Same reruns as `predict`, but a runaway generation is stopped as soon as it is detected. The last run is read
+        # to its end, so a generation stopped early is never the answer
+        penalties = [None, 0.5, 1.0]
+        for attempt, penalty in enumerate(penalties):
+            stream = self.stream_predict(
+                input, frequency_penalty=penalty, detect_repetition=attempt < len(penalties) - 1
+            )
+            for _ in stream:
+                pass
+            if stream.finish_reason not in ("length", "repetition"):
+                break
+            log.info(f"Generated incomplete answer ({stream.finish_reason}). Rerun prompt with a frequency penalty")
+        return stream.text
+
+    @asynccontextmanager
+    async def session(self, max_connections: int = 100):
+        """Sends the async requests made in this context over a shared pool of `max_connections` connections, instead
+        of opening a connection per request."""
+        if openai.aiosession.get() is not None:
+            yield
+            return
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_connections)) as session:
+            token = openai.aiosession.set(session)
+            try:
+                yield
+            finally:
+                openai.aiosession.reset(token)
+
+    def max_concurrency(self) -> int:
+        """Number of requests worth running at once, no more than the requests allowed per minute."""
+        return max(1, min(config.batch_max_concurrency, self.rpm.get(self.engine, config.batch_max_concurrency)))
+
+    def _chat_params(self, input) -> Tuple[dict, int]:
         if isinstance(input, ChatMessage):
             messages = [
                 {"role": input.role, "content": input.content},
@@ -105,48 +254,42 @@ class ChatGPT(OpenAIFoundation):
         # Make sure that the max token are limited to the amount of token that a
         # remaining in the context length of the current model.
         log.debug(f"ChatGPT params: {filtered_params}")
-        encoding = tiktoken.encoding_for_model(self.engine)
-        token_count = len(encoding.encode(filtered_params["messages"][0]["content"]))
+        token_count = count_tokens(filtered_params["messages"][0]["content"], self.engine)
         remaining_token = (self.token_limit - 50) - token_count
         filtered_params["max_tokens"] = remaining_token
         log.info(f"Max generation token set to {filtered_params['max_tokens']}")
+        return filtered_params, token_count
 
-        response = self._openai_call(filtered_params, token_count)
-
+    @staticmethod
+    def _check_response(response):
         if "choices" not in response:
             raise Exception("No choices in response")
 
-        # One failure mode is to run out of tokens. In most cases this is caused by
-        # generating infinite loops. In case the generation did not come to a natural
-        # stop we will not be able to parse the result. We will repeat the call with a
-        # presence penalty to decrease the chance constantly repeated tokens.
-        for penalty in [0.5, 1.0]:
-            finish_reason = response["choices"][0].get("finish_reason", "")
-            if finish_reason == "length":
-                log.info(f"Generated incomplete answer. Rerun prompt with presence penalty {penalty}")
-                filtered_params["frequency_penalty"] = penalty
-                response = self._openai_call(filtered_params, token_count)
-                log.info("Raw LLM response (with penalty): " + str(response))
-
-                if "choices" not in response:
-                    raise Exception("No choices in response")
+    def _cached_openai_call(self, openai_params: dict, token_count: int):
+        """`_openai_call` answered from the response cache for deterministic requests."""
+        if self.cache is None or not _is_deterministic(openai_params):
+            return self._openai_call(openai_params, token_count)
+        response = self.cache.get(_cached_params(openai_params))
+        if response is None:
+            response = self._openai_call(openai_params, token_count)
+            if "choices" in response:
+                self.cache.set(_cached_params(openai_params), _to_dict(response))
+        return response
 
-        output = response["choices"][0]["message"]["content"]
-        return output
+    async def _async_cached_openai_call(self, openai_params: dict, token_count: int):
+        """Async version of `_cached_openai_call`, the cache is read and written in the default executor."""
+        if self.cache is None or not _is_deterministic(openai_params):
+            return await self._async_openai_call(openai_params, token_count)
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, self.cache.get, _cached_params(openai_params))
+        if response is None:
+            response = await self._async_openai_call(openai_params, token_count)
+            if "choices" in response:
+                await loop.run_in_executor(None, self.cache.set, _cached_params(openai_params), _to_dict(response))
+        return response
 
-    @retry(
-        (
-            APIConnectionError,
-            APIError,
-            RateLimitError,
-            ServiceUnavailableError,
-            Timeout,
-            TryAgain,
-        ),
-        tries=10,
-        delay=0,
-        backoff=0,
-    )  # no need for backoff, we're sleeping the amount required.
+    # no need for backoff, we're sleeping the amount required.
+    @retry(_RETRYABLE_ERRORS, tries=_TRIES, delay=0, backoff=0)
     def _openai_call(
         self,
         openai_params: dict,
@@ -158,15 +301,61 @@ class ChatGPT(OpenAIFoundation):
         start_time = time.time()
         try:
             response = openai.ChatCompletion.create(**openai_params)
-            azure_response = {
-                "azure_openai_response": {
-                    "elapsed": round(time.time() - start_time, 2),
-                    "response": response.to_dict_recursive(),
-                    "openai_params": openai_params,
-                }
+        except Exception as e:
+            sleep_time = self._on_openai_error(e, openai_params, start_time, min_additional_sleep, max_additional_sleep)
+            if sleep_time:
+                time.sleep(sleep_time)
+            raise e
+        if not openai_params.get("stream"):
+            self._log_openai_response(response, openai_params, start_time)
+        return response
+
+    async def _async_openai_call(
+        self,
+        openai_params: dict,
+        token_count: int,
+        min_additional_sleep: float = 1.0,
+        max_additional_sleep: float = 5.0,
+    ):
+        """Async version of `_openai_call`, with the same retries."""
+        for tries_left in range(_TRIES - 1, -1, -1):
+            await self._async_wait_for_rate_limits(self.engine, token_count)
+            start_time = time.time()
+            try:
+                response = await openai.ChatCompletion.acreate(**openai_params)
+            except Exception as e:
+                sleep_time = self._on_openai_error(
+                    e, openai_params, start_time, min_additional_sleep, max_additional_sleep
+                )
+                if not isinstance(e, _RETRYABLE_ERRORS) or not tries_left:
+                    raise e
+                log.warning(f"{e}, Retrying in {sleep_time} seconds... {tries_left} tries left")
+                await asyncio.sleep(sleep_time)
+            else:
+                self._log_openai_response(response, openai_params, start_time)
+                return response
+
+    @staticmethod
+    def _log_openai_response(response, openai_params: dict, start_time: float):
+        azure_response = {
+            "azure_openai_response": {
+                "elapsed": round(time.time() - start_time, 2),
+                "response": response.to_dict_recursive(),
+                "openai_params": openai_params,
             }
-            log.info(json.dumps(azure_response))
-        except RateLimitError as e:
+        }
+        log.info(json.dumps(azure_response))
+
+    @staticmethod
+    def _on_openai_error(
+        e: Exception,
+        openai_params: dict,
+        start_time: float,
+        min_additional_sleep: float,
+        max_additional_sleep: float,
+    ) -> float:
+        """Logs the error of an OpenAI call and returns the number of seconds to sleep before retrying it."""
+        if isinstance(e, RateLimitError):
             # Maxing out requests in order to block other openai callers
             # self._wait_for_rate_limits(self.engine, self.rpm[self.engine])
 
@@ -174,8 +363,7 @@ class ChatGPT(OpenAIFoundation):
             headers = e.headers
 
             if retry_after := headers.get("Retry-After", None):
-                time.sleep(float(retry_after) + additional_sleep)
-                raise e
+                return float(retry_after) + additional_sleep
 
             reset_rate_header = headers.get("x-ratelimit-reset-requests", "30s")
             sleep_time = 30.0
@@ -190,70 +378,60 @@ class ChatGPT(OpenAIFoundation):
                 "azure_openai_response": {
                     "elapsed": round(time.time() - start_time, 2),
                     "error": e.error,
-                    "headers": e.headers,
+                    "headers": dict(e.headers or {}),
                     "action": "sleep",
                     "duration": sleep_time,
                     "openai_params": openai_params,
                 }
             }
             log.warning(json.dumps(azure_response))
+            return sleep_time
 
-            time.sleep(sleep_time)
-            raise e
-
-        except (APIConnectionError, APIError, ServiceUnavailableError, Timeout, TryAgain) as e:
+        elif isinstance(e, (APIConnectionError, APIError, ServiceUnavailableError, Timeout, TryAgain)):
             azure_response = {
                 "azure_openai_response": {
                     "elapsed": round(time.time() - start_time, 2),
                     "error": e.error,
-                    "headers": e.headers,
+                    "headers": dict(e.headers or {}),
                     "action": "retrying",
                     "openai_params": openai_params,
                 }
             }
             log.warning(json.dumps(azure_response))
-            raise e
 
-        except OpenAIError as e:
+        elif isinstance(e, OpenAIError):
             azure_response = {
                 "azure_openai_response": {
                     "elapsed": round(time.time() - start_time, 2),
                     "error": e.error,
-                    "headers": e.headers,
+                    "headers": dict(e.headers or {}),
                     "action": "stop",
                 }
             }
             log.exception(json.dumps(azure_response))
-            raise e
 
-        except Exception as e:
+        else:
             log.exception(f"Exception in the openai call that wasn't an OpenAiError: {e}")
-            raise e
-        return response
+        return 0.0
 
     def _wait_for_rate_limits(self, model: str, token_on_current_request: int):
-        while True:
-            random_additional_time = random.uniform(0.0, 1.5)
-
-            try:
-                # RPM computation
-                if time_to_wait := compute_api_wait_time(model + "_RPM", self.rpm[model]):
-                    time_to_wait = time_to_wait + random_additional_time
-                    log.info(f"openai max RPM reached, waiting for {time_to_wait} and retrying")
-                    time.sleep(time_to_wait)
-                    continue
-
-                # TPM computation
-                if time_to_wait := compute_api_wait_time(model + "_TPM", self.tpm[model], token_on_current_request):
-                    time_to_wait = time_to_wait + random_additional_time
-                    log.info(f"openai max TPM reached, waiting for {time_to_wait} and retrying")
-                    time.sleep(time_to_wait)
-                    continue
+        try:
+            waited = rate_limiter.acquire(*self._rate_limits(model, token_on_current_request))
+            if waited:
+                log.info(f"openai max RPM or TPM reached, waited for {waited}")
+        except Exception as e:
+            log.error(f"Could not check RPM or TPM due to {e}")
 
-            except Exception as e:
-                log.error(f"Could not check RPM or TPM due to {e}")
+    async def _async_wait_for_rate_limits(self, model: str, token_on_current_request: int):
+        try:
+            waited = await rate_limiter.async_acquire(*self._rate_limits(model, token_on_current_request))
+            if waited:
+                log.info(f"openai max RPM or TPM reached, waited for {waited}")
+        except Exception as e:
+            log.error(f"Could not check RPM or TPM due to {e}")
 
-            return
+    def _rate_limits(self, model: str, token_on_current_request: int) -> Tuple[Limit, Limit]:
+        return Limit(model + "_RPM", self.rpm[model]), Limit(model + "_TPM", self.tpm[model], token_on_current_request)
 
     def check_api_key(self, api_key):
         self.verify_api_key(api_key)
@@ -263,18 +441,65 @@ class OpenAIEmbedding(OpenAIFoundation):
     engine: str = config.embedding_model_engine
     user: str = None
     token_limit: int = 8191 if engine == "gpt-4" else 4096
+    # Inputs and tokens packed in one request
+    max_batch_size: int = config.embedding_max_batch_size
+    max_batch_tokens: int = config.embedding_max_batch_tokens
+    # Embeddings already computed, by content hash, see `EmbeddingStore`
+    store: Optional[EmbeddingStore] = None
 
-    @retry
     def predict(self, input):
-        self.initialize_openai()
+        """Embedding of `input` as a list of floats, or list of embeddings of a list of inputs.
 
+        The floats are those of `embed`, rounded to float32.
+        """
         if isinstance(input, str):
-            input = [input]
+            return self.embed([input])[0].tolist()
+        return self.embed(input).tolist()
 
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embeddings of `texts` as a contiguous float32 matrix, one row per text in order.
+
+        The texts missing from `store` are embedded once each, packed into as few requests as `max_batch_size` and
+        `max_batch_tokens` allow, and added to `store`. Only the requests for a single text use the response cache.
+        """
+        self.initialize_openai()
+        keys = [embedding_key(text, self.engine) for text in texts]
+        vectors = self.store.get(keys) if self.store is not None else [None] * len(texts)
+
+        missing = {}
+        for text, key, vector in zip(texts, keys, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        missing_keys, missing_texts = list(missing), list(missing.values())
+        embedded = {}
+        for batch in self._batches(missing_texts):
+            batch_keys = [missing_keys[i] for i in batch]
+            batch_vectors = self._embed_batch([missing_texts[i] for i in batch])
+            embedded.update(zip(batch_keys, batch_vectors))
+            if self.store is not None:
+                self.store.add(batch_keys, batch_vectors)
+
+        if not texts:
+            return np.empty((0, config.embedding_dimension), dtype=np.float32)
+        return np.stack([vector if vector is not None else embedded[key] for key, vector in zip(keys, vectors)])
+
+    def _batches(self, texts: Sequence[str]) -> Iterator[List[int]]:
+        batch, tokens = [], 0
+        for index, text in enumerate(texts):
+            text_tokens = count_tokens(text, self.engine)
+            if batch and (len(batch) >= self.max_batch_size or tokens + text_tokens > self.max_batch_tokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(index)
+            tokens += text_tokens
+        if batch:
+            yield batch
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
         params = {
             "engine": self.engine if config.openai_api_type == "azure" else None,
             "model": self.engine if config.openai_api_type == "open_ai" else None,
-            "input": input,
+            "input": texts,
             "user": self.user,
         }
 
@@ -282,20 +507,24 @@ class OpenAIEmbedding(OpenAIFoundation):
         filtered_params = {k: v for k, v in params.items() if v is not None}
 
         log.debug(f"OpenAIEmbedding params: {filtered_params}")
-        response = openai.Embedding.create(**filtered_params)
-
-        if "data" in response:
-            output = response["data"][0]["embedding"]
-
-            # Try to parse the output as JSON
-            try:
-                output_json = json.loads(json.dumps(output).replace("'", '"'))
-                return output_json
-            except json.JSONDecodeError:
-                # If the output is not valid JSON, return the original output string
-                return output
-        else:
-            raise Exception("No data in response")
+        # Batches are rarely requested twice and would fill the response cache, `store` keeps their embeddings
+        cache = self.cache if len(texts) == 1 else None
+        response = cache.get(filtered_params) if cache is not None else None
+        if response is None:
+            response = self._embedding_call(filtered_params)
+            if "data" not in response:
+                raise Exception("No data in response")
+            if cache is not None:
+                cache.set(filtered_params, _to_dict(response))
+
+        data = sorted(response["data"], key=lambda item: item.get("index", 0))
+        if len(data) != len(texts):
+            raise Exception(f"Got {len(data)} embeddings for {len(texts)} inputs")
+        return np.array([item["embedding"] for item in data], dtype=np.float32)
+
+    @retry(_RETRYABLE_ERRORS)
+    def _embedding_call(self, params: dict):
+        return openai.Embedding.create(**params)
 
     def check_api_key(self, api_key):
         self.verify_api_key(api_key)
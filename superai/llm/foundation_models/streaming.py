@@ -0,0 +1,84 @@
+"""Streamed completions, with the detection of runaway repetitions while they are generated."""
+from typing import Callable, Iterable, Iterator, List, Optional
+
+
+class RepetitionDetector:
+    """Detects a generation stuck in a loop, whose last `window` characters repeat with a period of at most
+    `max_period` characters.
+
+    Only the last `window + max_period` characters are kept, so each delta is checked in constant time.
+    """
+
+    def __init__(self, window: int = 2000, max_period: int = 100):
+        self._window = window
+        self._max_period = max_period
+        self._tail = ""
+
+    def feed(self, delta: str) -> bool:
+        """Adds `delta` to the generated text and returns whether it ends with a runaway repetition."""
+        self._tail = (self._tail + delta)[-(self._window + self._max_period) :]
+        if len(self._tail) <= self._window:
+            return False
+        end = self._tail[-self._window :]
+        return any(
+            self._tail[-self._window - period : -period] == end
+            for period in range(1, min(self._max_period, len(self._tail) - self._window) + 1)
+        )
+
+
+class CompletionStream:
+    """Content deltas of a streamed chat completion, as they arrive.
+
+    Once iterated, `text` holds the generated text and `finish_reason` why the generation stopped: `stop`, `length`,
+    or `repetition` when `repetition` detected a runaway repetition and the stream was closed early.
+
+    Args:
+        chunks: Chunks of the completion, as returned by `openai.ChatCompletion.create(stream=True)`.
+        repetition: Detector of runaway repetitions, None to read the whole completion.
+        on_finish: Called with the stream once the completion was entirely read.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[dict],
+        repetition: Optional[RepetitionDetector] = None,
+        on_finish: Optional[Callable[["CompletionStream"], None]] = None,
+    ):
+        self._chunks = chunks
+        self._repetition = repetition
+        self._on_finish = on_finish
+        self._parts: List[str] = []
+        self.finish_reason: Optional[str] = None
+
+    @classmethod
+    def from_text(cls, text: str, finish_reason: str = "stop") -> "CompletionStream":
+        """Stream of an already generated `text`, in a single delta."""
+        return cls([{"choices": [{"delta": {"content": text}, "finish_reason": finish_reason}]}])
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self._chunks:
+                if not chunk.get("choices"):
+                    continue
+                choice = chunk["choices"][0]
+                if choice.get("finish_reason"):
+                    self.finish_reason = choice["finish_reason"]
+                delta = (choice.get("delta") or {}).get("content")
+                if not delta:
+                    continue
+                self._parts.append(delta)
+                yield delta
+                if self._repetition is not None and self._repetition.feed(delta):
+                    self.finish_reason = "repetition"
+                    return
+            if self._on_finish is not None:
+                self._on_finish(self)
+        finally:
+            # Closing the response stops the generation, and its billing, on the server
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import List
 
-import tiktoken
+from superai.llm.tokenizers import get_encoding
 
 
 class Splitter(ABC):
@@ -17,7 +17,7 @@ class Splitter(ABC):
 class TextSplitter(Splitter):
     def __init__(self, split_size: int = 10, overlap: int = 1, tokenizer_model="gpt-3.5-turbo"):
         super(TextSplitter, self).__init__(split_size, overlap)
-        self.tokenizer = tiktoken.encoding_for_model(tokenizer_model)
+        self.tokenizer = get_encoding(tokenizer_model)
 
     def split(self, text: str) -> List[str]:
         token_ids = self.tokenizer.encode(text)
@@ -0,0 +1,88 @@
+"""Process-wide tokenizer registry and token count cache shared by the foundation models, splitters and document
+preparation."""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import tiktoken
+from attr import define
+from tiktoken.model import MODEL_TO_ENCODING
+
+from superai.llm.configuration import Configuration
+
+# TODO: remove when tiktoken model registry will be updated
+MODEL_TO_ENCODING.setdefault("gpt-35-turbo", "cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Returns the tokenizer of `model`, loaded once per process."""
+    return tiktoken.encoding_for_model(model)
+
+
+@define
+class TokenCacheStats:
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TokenCounter:
+    """Thread-safe LRU cache of token counts, keyed by tokenizer and content hash.
+
+    Only a digest of each text is kept, so caching long prompts holds little memory.
+    """
+
+    def __init__(self, max_size: int = 8192):
+        self._max_size = max_size
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def count(self, text: str, model: str = "gpt-3.5-turbo") -> int:
+        """Returns the number of tokens of `text` for `model`, as `len(get_encoding(model).encode(text))`."""
+        encoding = get_encoding(model)
+        key = (encoding.name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self._hits += 1
+                return count
+            self._misses += 1
+
+        count = len(encoding.encode(text))
+        if self._max_size > 0:
+            with self._lock:
+                self._counts[key] = count
+                self._counts.move_to_end(key)
+                while len(self._counts) > self._max_size:
+                    self._counts.popitem(last=False)
+        return count
+
+    @property
+    def stats(self) -> TokenCacheStats:
+        with self._lock:
+            return TokenCacheStats(self._hits, self._misses, len(self._counts), self._max_size)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+token_counter = TokenCounter(Configuration().token_cache_size)
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Returns the number of tokens of `text` for `model`, using the process-wide cache."""
+    return token_counter.count(text, model)
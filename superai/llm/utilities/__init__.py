@@ -1,3 +1,5 @@
+from superai.llm.utilities.json_repair import JSONRepair, Repair, repair_json
+from superai.llm.utilities.json_stream import IncrementalJSONParser, iter_json_fields
 from superai.llm.utilities.json_utils import (
     dict_has_valid_key,
     fix_json,
@@ -28,6 +30,11 @@ __all__ = [
     "json_schema_from_dict",
     "is_valid_json",
     "fix_json",
+    "repair_json",
+    "JSONRepair",
+    "Repair",
+    "IncrementalJSONParser",
+    "iter_json_fields",
     "is_valid_schema",
     "dict_has_valid_key",
     "stringify_dict",
@@ -0,0 +1,425 @@
+"""Single-pass repair of the malformed JSON generated by language models."""
+import json
+import re
+from typing import List, Optional
+
+from attr import define
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+# Runs of characters copied as they are into a string quoted by " or '
+_STRING_RUNS = {'"': re.compile(r'[^"\\\x00-\x1f]+'), "'": re.compile(r"[^'\"\\\x00-\x1f]+")}
+_KEY_TOKEN = re.compile(r"[^\s,:\[\]{}\"'/]+(?:[ \t]+[^\s,:\[\]{}\"'/]+)*")
+_VALUE_TOKEN = re.compile(r"[^,\[\]{}\"\x00-\x1f]+")
+_TOKEN_COMMENT = re.compile(r"\s(?://|/\*)")
+_HEX = re.compile(r"[0-9a-fA-F]{1,4}")
+# Well-formed strings and scalars, followed by what can follow them, and runs of well-formed members ending with a
+# comma, copied in one step
+_STRING = r'"[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*"'
+_SCALAR = r"(?:-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)"
+_VALID_STRING = re.compile(_STRING + r"(?=[ \t\n\r]*[,:}\]])")
+_SIMPLE_SINGLE_QUOTED = re.compile(r"'[^'\"\\\x00-\x1f]*'(?=[ \t\n\r]*[,:}\]])")
+_VALID_SCALAR = re.compile(_SCALAR + r"(?=[ \t\n\r]*[,}\]])")
+_MEMBER = rf"{_STRING}[ \t\n\r]*:[ \t\n\r]*(?:{_STRING}|{_SCALAR})[ \t\n\r]*,"
+_ELEMENT = rf"(?:{_STRING}|{_SCALAR})[ \t\n\r]*,"
+_RUN_STARTS = {"{": '"', "[": '"-0123456789tfn'}
+_VALID_RUNS = {
+    "{": re.compile(rf"{_MEMBER}(?:[ \t\n\r]*{_MEMBER})*"),
+    "[": re.compile(rf"{_ELEMENT}(?:[ \t\n\r]*{_ELEMENT})*"),
+}
+_COMMENTS = {"//": re.compile(r"//[^\n]*"), "/*": re.compile(r"/\*.*?(?:\*/|\Z)", re.DOTALL)}
+
+_LITERALS = {"true", "false", "null", "NaN", "Infinity", "-Infinity"}
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_ESCAPES = frozenset('"\\/bfnrt')
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_CLOSERS = {"{": "}", "[": "]"}
+_DECODER = json.JSONDecoder()
+
+# States of an open object or array: nothing read yet, after a comma, after a key, after a colon, after a value
+_START, _NEXT, _COLON, _VALUE, _DONE = range(5)
+
+
+@define
+class Repair:
+    """A repair applied to malformed JSON.
+
+    Attributes:
+        kind: What was repaired, e.g. `trailing_comma`, `single_quotes`, `unquoted_key` or `missing_closing_bracket`.
+        position: Position in the original text where it was repaired.
+    """
+
+    kind: str
+    position: int
+
+
+@define
+class JSONRepair:
+    """Result of `repair_json`.
+
+    Attributes:
+        text: The repaired JSON, or the original text when it is valid or has no object or array to repair.
+        repairs: Repairs applied, in the order of the text.
+    """
+
+    text: str
+    repairs: List[Repair]
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.repairs)
+
+
+class _Container:
+    """An object or array open while repairing."""
+
+    __slots__ = ("opening", "closing", "state", "comma", "key", "key_state", "key_position")
+
+    def __init__(self, opening: str):
+        self.opening = opening
+        self.closing = _CLOSERS[opening]
+        self.state = _START
+        # Indices in the output of the last comma and key, the state before the key, and its position in the text
+        self.comma = 0
+        self.key = 0
+        self.key_state = _START
+        self.key_position = 0
+
+
+class _Repairer:
+    """Tolerant JSON tokenizer which writes the valid JSON closest to the text, in one scan of the text."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+        self.out: List[str] = []
+        self.repairs: List[Repair] = []
+        # Characters the C scanner may read in attempts to parse invalid values, which keeps the repair linear. Failed
+        # attempts also count the lines up to the error for its message, from the start of the text
+        self.budget = 2 * len(text)
+
+    def repair(self, kind: str, position: Optional[int] = None):
+        self.repairs.append(Repair(kind, self.pos if position is None else position))
+
+    def run(self) -> Optional[str]:
+        text, out = self.text, self.out
+        starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+        if not starts:
+            return None
+        self.pos = min(starts)
+        if text[: self.pos].strip():
+            self.repair("leading_text", 0)
+
+        stack: List[_Container] = []
+        size = len(text)
+        while True:
+            whitespace = _WHITESPACE.match(text, self.pos)
+            if whitespace.end() >= size:
+                break
+            if stack:
+                out.append(whitespace.group())
+            self.pos = whitespace.end()
+            char = text[self.pos]
+            if not stack:
+                if out:
+                    # The top-level value is complete, the rest is dropped
+                    self.repair("trailing_text")
+                    break
+                if not self._copy_valid():
+                    out.append(char)
+                    stack.append(_Container(char))
+                    self.pos += 1
+                continue
+
+            frame = stack[-1]
+            is_object = frame.opening == "{"
+            state = frame.state
+            if state in (_START, _NEXT) and char in _RUN_STARTS[frame.opening]:
+                run = _VALID_RUNS[frame.opening].match(text, self.pos)
+                if run:
+                    out.append(run.group()[:-1])
+                    frame.state = _NEXT
+                    frame.comma = len(out)
+                    out.append(",")
+                    self.pos = run.end()
+                    continue
+            if char == "`":
+                # The closing fence of a markdown code block
+                self.repair("trailing_text")
+                break
+            elif char == "/" and text[self.pos : self.pos + 2] in _COMMENTS:
+                self.repair("comment")
+                self.pos = _COMMENTS[text[self.pos : self.pos + 2]].match(text, self.pos).end()
+            elif char in "}]":
+                if char != frame.closing:
+                    if any(opened.closing == char for opened in stack):
+                        # The closer of an enclosing value, the current one is missing its closer
+                        self._close(frame, "missing_closing_bracket")
+                        stack.pop()
+                        self._end_value(stack)
+                    else:
+                        self.repair("extra_closing_bracket")
+                        self.pos += 1
+                    continue
+                self._close(frame)
+                stack.pop()
+                self.pos += 1
+                self._end_value(stack)
+            elif char == ",":
+                if state == _DONE or (is_object and state in (_COLON, _VALUE)):
+                    if state != _DONE:
+                        self._missing_value(frame)
+                    # Written now to keep its place, and removed if it turns out to be a trailing comma
+                    frame.state = _NEXT
+                    frame.comma = len(out)
+                    out.append(",")
+                else:
+                    self.repair("extra_comma")
+                self.pos += 1
+            elif char == ":":
+                if is_object and state == _COLON:
+                    out.append(":")
+                    frame.state = _VALUE
+                else:
+                    self.repair("unexpected_character")
+                self.pos += 1
+            elif ord(char) < 0x20:
+                self.repair("control_character")
+                self.pos += 1
+            elif is_object and state in (_START, _NEXT, _DONE):
+                # A key is expected
+                if char in "{[":
+                    self.repair("unexpected_character")
+                    self.pos += 1
+                    continue
+                if char not in "\"'" and not _KEY_TOKEN.match(text, self.pos):
+                    self.repair("unexpected_character")
+                    self.pos += 1
+                    continue
+                frame.key = len(out)
+                frame.key_state = state
+                frame.key_position = self.pos
+                self._separate(frame)
+                if char in "\"'":
+                    self._string()
+                else:
+                    self._key_token()
+                frame.state = _COLON
+            else:
+                # A value is expected
+                if is_object and state == _COLON:
+                    self.repair("missing_colon")
+                    out.append(":")
+                elif not is_object:
+                    self._separate(frame)
+                frame.state = _DONE
+                if char in "{[":
+                    if self._copy_valid():
+                        continue
+                    out.append(char)
+                    stack.append(_Container(char))
+                    self.pos += 1
+                elif char in "\"'":
+                    self._string()
+                else:
+                    self._value_token()
+
+        if stack:
+            frame = stack[-1]
+            if frame.opening == "{" and frame.state == _COLON:
+                # A key cut by the end of the text is dropped, with the comma before it
+                self.repair("truncated_key", frame.key_position)
+                out[frame.key :] = []
+                if frame.key_state == _NEXT:
+                    out[frame.comma] = ""
+                elif frame.key_state == _DONE and out[-1] == ",":
+                    # The comma added before the key
+                    out.pop()
+                frame.state = _START if frame.key_state == _START else _DONE
+            for frame in reversed(stack):
+                self._close(frame, "missing_closing_bracket")
+        return "".join(out)
+
+    def _copy_valid(self) -> bool:
+        """Copies the object or array at the position as it is if it's valid, as read by the C scanner of `json`."""
+        if self.budget <= 0:
+            return False
+        try:
+            _, end = _DECODER.raw_decode(self.text, self.pos)
+        except json.JSONDecodeError as e:
+            self.budget -= max(e.pos, 1)
+            return False
+        except RecursionError:
+            self.budget = 0
+            return False
+        self.out.append(self.text[self.pos : end])
+        self.pos = end
+        return True
+
+    def _separate(self, frame: _Container):
+        """Adds the comma missing before an element of an object or array."""
+        if frame.state == _DONE:
+            self.repair("missing_comma")
+            if self.out[-1].isspace():
+                self.out.insert(-1, ",")
+            else:
+                self.out.append(",")
+
+    def _missing_value(self, frame: _Container):
+        self.repair("missing_value")
+        self.out.append(":null" if frame.state == _COLON else "null")
+
+    def _close(self, frame: _Container, repair: Optional[str] = None):
+        if frame.state == _NEXT:
+            self.repair("trailing_comma")
+            self.out[frame.comma] = ""
+        elif frame.opening == "{" and frame.state in (_COLON, _VALUE):
+            self._missing_value(frame)
+        if repair is not None:
+            self.repair(repair)
+        self.out.append(frame.closing)
+
+    @staticmethod
+    def _end_value(stack: List[_Container]):
+        if stack:
+            stack[-1].state = _DONE
+
+    def _closes_string(self, position: int) -> bool:
+        """Whether a quote before `position` closes its string, rather than being an unescaped quote inside it."""
+        end = _WHITESPACE.match(self.text, position).end()
+        if end >= len(self.text):
+            return True
+        char = self.text[end]
+        # Elements missing their comma are often on their own lines
+        return char in ",:}]" or (char in "\"'" and "\n" in self.text[position:end])
+
+    def _string(self):
+        text, out = self.text, self.out
+        quote = text[self.pos]
+        valid = (_VALID_STRING if quote == '"' else _SIMPLE_SINGLE_QUOTED).match(text, self.pos)
+        if valid:
+            if quote == "'":
+                self.repair("single_quotes")
+                out.append(f'"{valid.group()[1:-1]}"')
+            else:
+                out.append(valid.group())
+            self.pos = valid.end()
+            return
+        if quote == "'":
+            self.repair("single_quotes")
+        self.pos += 1
+        run = _STRING_RUNS[quote]
+        out.append('"')
+        size = len(text)
+        while True:
+            match = run.match(text, self.pos)
+            if match:
+                out.append(match.group())
+                self.pos = match.end()
+            if self.pos >= size:
+                self.repair("missing_closing_quote")
+                break
+            char = text[self.pos]
+            if char == quote:
+                self.pos += 1
+                if self._closes_string(self.pos):
+                    break
+                self.repair("unescaped_quote", self.pos - 1)
+                out.append('\\"' if quote == '"' else "'")
+            elif char == '"':
+                # Inside a string quoted by '
+                out.append('\\"')
+                self.pos += 1
+            elif char == "\\":
+                self._escape(quote)
+            else:
+                self.repair("control_character")
+                out.append(_CONTROL_ESCAPES.get(char) or f"\\u{ord(char):04x}")
+                self.pos += 1
+        out.append('"')
+
+    def _escape(self, quote: str):
+        text, out = self.text, self.out
+        escaped = text[self.pos + 1 : self.pos + 2]
+        if escaped and escaped in _ESCAPES:
+            out.append(text[self.pos : self.pos + 2])
+            self.pos += 2
+        elif escaped == "u" and _HEX.match(text, self.pos + 2):
+            digits = _HEX.match(text, self.pos + 2).group()
+            if len(digits) < 4:
+                self.repair("invalid_unicode_escape")
+            out.append("\\u" + digits.zfill(4))
+            self.pos += 2 + len(digits)
+        elif escaped == "'":
+            if quote == '"':
+                self.repair("invalid_escape")
+            out.append("'")
+            self.pos += 2
+        else:
+            # A backslash which doesn't escape anything is kept as a character
+            self.repair("invalid_escape")
+            out.append("\\\\")
+            self.pos += 1
+
+    def _key_token(self):
+        match = _KEY_TOKEN.match(self.text, self.pos)
+        self.repair("unquoted_key")
+        key = match.group()
+        simple = key.isprintable() and "\\" not in key
+        self.out.append(f'"{key}"' if simple else json.dumps(key, ensure_ascii=False))
+        self.pos = match.end()
+
+    def _value_token(self):
+        text = self.text
+        valid = _VALID_SCALAR.match(text, self.pos)
+        if valid:
+            self.out.append(valid.group())
+            self.pos = valid.end()
+            return
+        match = _VALUE_TOKEN.match(text, self.pos)
+        token = match.group()
+        end = match.end()
+        comment = _TOKEN_COMMENT.search(token)
+        if comment:
+            token = token[: comment.start()]
+            end = self.pos + comment.start()
+        token = token.rstrip()
+        parts = token.split()
+        if len(parts) > 1 and all(part in _LITERALS or _NUMBER.fullmatch(part) for part in parts):
+            # Numbers missing the comma between them
+            token = parts[0]
+            end = self.pos + len(token)
+        if token in _LITERALS or _NUMBER.fullmatch(token):
+            self.out.append(token)
+        elif token in _PYTHON_LITERALS:
+            self.repair("python_literal")
+            self.out.append(_PYTHON_LITERALS[token])
+        else:
+            if not comment and end < len(text) and text[end] == '"' and token == match.group():
+                # The closing quote of a string missing its opening quote
+                self.repair("missing_opening_quote")
+                end += 1
+            else:
+                self.repair("unquoted_string")
+            self.out.append(json.dumps(token, ensure_ascii=False))
+        self.pos = end
+
+
+def repair_json(json_string: str) -> JSONRepair:
+    """Repairs the JSON object or array in `json_string` in a single scan, and reports the repairs applied.
+
+    Handles the errors of language model outputs fixed by `fix_json`: trailing, extra and missing commas, single
+    quotes, unquoted keys and strings, missing quotes, unescaped quotes inside strings, control characters, invalid
+    escapes, comments, Python literals, unbalanced brackets, and text around the JSON such as markdown fences. Values
+    are kept as they are, the repaired text is valid JSON for any input containing an object or array.
+    """
+    try:
+        json.loads(json_string)
+        return JSONRepair(json_string, [])
+    except json.JSONDecodeError:
+        pass
+    repairer = _Repairer(json_string)
+    repaired = repairer.run()
+    if repaired is None:
+        return JSONRepair(json_string, [])
+    return JSONRepair(repaired, repairer.repairs)
@@ -0,0 +1,116 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from superai.llm.utilities.json_utils import fix_json, is_valid_json
+
+
+class IncrementalJSONParser:
+    """Parses a JSON object as its text is generated, and gives each top-level field as soon as its value is complete.
+
+    Each character is scanned once, tracking strings, escapes and nesting, so a field is known to be complete when the
+    comma or closing brace which follows it at the top level arrives. Fields are parsed with `json.loads`, or repaired
+    with `fix_json` like `Parser.to_dict` does. Text before the opening brace, e.g. a markdown fence, is ignored.
+    """
+
+    def __init__(self):
+        # Whole text, and the deltas since the start of the current field
+        self._deltas: List[str] = []
+        self._pending: List[str] = []
+        self._pending_start = 0
+        self._length = 0
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._field_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._done = False
+        self._fields: Dict[str, Any] = {}
+
+    @property
+    def done(self) -> bool:
+        """Whether the closing brace of the object arrived."""
+        return self._done
+
+    @property
+    def fields(self) -> Dict[str, Any]:
+        """Fields completed so far."""
+        return dict(self._fields)
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        """Adds `delta` to the text and returns the fields it completed, in order."""
+        if self._done:
+            return []
+        offset = self._length
+        self._deltas.append(delta)
+        self._pending.append(delta)
+        self._length += len(delta)
+        completed = []
+        for i, char in enumerate(delta, offset):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                if self._start is not None:
+                    self._in_string = True
+            elif char in "{[":
+                if self._start is None:
+                    if char == "[":
+                        continue
+                    self._start = i
+                    self._field_start = i + 1
+                self._depth += 1
+            elif char in "}]" and self._start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._complete_field(i))
+                    self._done = True
+                    self._end = i + 1
+                    break
+            elif char == "," and self._depth == 1:
+                completed.extend(self._complete_field(i))
+        return completed
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """The whole object, repaired like `Parser.to_dict` if needed, None if it can't be parsed."""
+        text = "".join(self._deltas)
+        if self._start is not None:
+            text = text[self._start : self._end]
+        # An unfinished object is closed by the repair
+        text = fix_json(text.strip())
+        if not is_valid_json(text)[0]:
+            return None
+        value = json.loads(text)
+        return value if isinstance(value, dict) else None
+
+    def _complete_field(self, end: int) -> List[Tuple[str, Any]]:
+        text = "".join(self._pending)
+        member = text[self._field_start - self._pending_start : end - self._pending_start].strip()
+        self._pending = [text[end + 1 - self._pending_start :]]
+        self._pending_start = self._field_start = end + 1
+        if not member:
+            return []
+        candidate = "{" + member + "}"
+        if not is_valid_json(candidate)[0]:
+            candidate = fix_json(candidate)
+            if not is_valid_json(candidate)[0]:
+                return []
+        value = json.loads(candidate)
+        if not isinstance(value, dict):
+            return []
+        fields = list(value.items())
+        self._fields.update(fields)
+        return fields
+
+
+def iter_json_fields(
+    deltas: Iterable[str], parser: Optional[IncrementalJSONParser] = None
+) -> Iterator[Tuple[str, Any]]:
+    """Top-level fields of the JSON object streamed as `deltas`, each as soon as its value is complete."""
+    parser = parser or IncrementalJSONParser()
+    for delta in deltas:
+        yield from parser.feed(delta)
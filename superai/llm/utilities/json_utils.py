@@ -6,6 +6,8 @@ from typing import Dict, Optional
 import jsonschema
 from jsonschema import validate
 
+from superai.llm.utilities.json_repair import repair_json
+
 
 def json_schema_from_dict(data, required=True):
     if isinstance(data, dict):
@@ -232,37 +234,6 @@ def fix_invalid_unicode_characters(json_string: str) -> str:
 
 
 def fix_json(json_string: str) -> str:
-    fixing_methods = [
-        fix_trailing_comma,
-        add_missing_comma,
-        fix_single_quotes,
-        balance_square_brackets,
-        replace_invalid_characters,
-        replace_control_characters,
-        fix_unquoted_strings,
-        fix_double_quotes_inside_values,
-        fix_missing_closing_quotes,
-        fix_missing_opening_quotes,
-        remove_comments,
-        fix_boolean_values_in_quotes,
-        fix_number_values_in_quotes,
-        fix_null_values_in_quotes,
-        fix_extra_commas,
-        remove_invalid_string_values,
-        fix_invalid_unicode_characters,
-    ]
-
-    is_valid, error = is_valid_json(json_string)
-
-    if not is_valid:
-        for method in fixing_methods:
-            fixed_json_string = method(json_string)
-
-            is_valid, error = is_valid_json(fixed_json_string)
-
-            if is_valid:
-                return fixed_json_string
-
-            json_string = fixed_json_string
-
-    return json_string
+    """Repairs malformed JSON in a single scan with `repair_json`, the string is returned unchanged when it is valid or
+    has no object or array to repair."""
+    return repair_json(json_string).text
@@ -9,6 +9,7 @@ from urllib.parse import urlparse
 
 import boto3
 import botocore
+import requests
 from boto3.s3.transfer import TransferConfig
 from rich.progress import (
     BarColumn,
@@ -19,6 +20,9 @@ from rich.progress import (
     TransferSpeedColumn,
 )
 
+from superai.apis.http_session import default_session
+from superai.apis.transfer import download_file
+from superai.exceptions import SuperAIStorageError
 from superai.log import logger
 
 log = logger.get_logger(__name__)
@@ -26,7 +30,8 @@ log = logger.get_logger(__name__)
 
 def download_file_to_directory(url: str, filename: str, path: Union[Path, str]) -> str:
     """
-    Download a file from a url to a path
+    Download a file from a url to a path. HTTP(S) files are fetched in parts in parallel, and an interrupted download is
+    resumed when called again with the same destination. Files of other URLs, e.g. `file://`, are copied in one go.
 
     Parameters
     ----------
@@ -41,7 +46,6 @@ def download_file_to_directory(url: str, filename: str, path: Union[Path, str])
     path = Path(path)
     destination = path / filename
     destination.parent.mkdir(exist_ok=True)
-    destination.touch()
     progress = Progress(
         TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
         BarColumn(bar_width=None),
@@ -57,16 +61,20 @@ def download_file_to_directory(url: str, filename: str, path: Union[Path, str])
     normalized_filename = unicodedata.normalize("NFC", filename)
     t = progress.add_task("Downloading", filename=normalized_filename, start=False)
 
-    def update(blocknum, bs, size):
-        progress.update(t, completed=blocknum * bs, total=size)
+    def update(completed, size):
+        progress.update(t, completed=completed, total=size)
 
     try:
         with progress:
             progress.start_task(t)
-            urllib.request.urlretrieve(url, destination, update)
-    except urllib.error.HTTPError as e:
-        destination.unlink()
-        raise RuntimeError(f"Could not download file. Status code {e.code}.")
+            if urlparse(url).scheme in ("http", "https"):
+                download_file(default_session(), url, destination, progress=update)
+            else:
+                urllib.request.urlretrieve(url, destination, lambda blocknum, bs, size: update(blocknum * bs, size))
+    except SuperAIStorageError as e:
+        raise RuntimeError(f"Could not download file. {e.message}.")
+    except (requests.RequestException, urllib.error.URLError) as e:
+        raise RuntimeError(f"Could not download file. {e}.")
 
     return str(destination)
 
@@ -0,0 +1,165 @@
+import asyncio
+import inspect
+import io
+import json
+import zipfile
+
+import pytest
+from aiohttp import web
+
+from superai.apis.data import DataApiMixin
+from superai.apis.ground_truth import GroundTruthApiMixin
+from superai.apis.jobs import JobsApiMixin
+from superai.apis.pagination import AsyncPageIterator
+from superai.apis.tasks import TasksApiMixin
+from superai.async_client import AsyncClient
+from superai.exceptions import SuperAIError
+
+
+class MockApi:
+    """API answering `GET jobs/{id}` after `delay` seconds, with the statuses queued in `statuses` first."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.statuses = []
+        self.calls = []
+        self.in_flight = self.max_in_flight = 0
+        self.app = web.Application()
+        self.app.router.add_route("*", "/jobs/{job_id}", self.job)
+        self.app.router.add_post("/jobs/{job_id}/cancel", self.job)
+        self.app.router.add_get("/apps/{app_id}/jobs", self.list_jobs)
+        self.app.router.add_post("/apps/{app_id}/job_responses", self.download)
+        self.app.router.add_get("/operations/{app_id}/{operation_id}", self.operation)
+        self.app.router.add_post("/operations/{app_id}/{operation_id}/download-url", self.download_url)
+        self.app.router.add_get("/files/jobs.zip", self.zip)
+        self.polls = 0
+
+    async def job(self, request):
+        self.calls.append((request.method, request.headers.get("AUTH-TOKEN"), list(request.query.items())))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if request.headers.get("AUTH-TOKEN") == "expired":
+            return web.json_response({"message": "Token is expired."}, status=401)
+        if self.statuses:
+            return web.json_response({"message": "busy"}, status=self.statuses.pop(0))
+        return web.json_response({"id": request.match_info["job_id"]})
+
+    async def list_jobs(self, request):
+        page = int(request.query["page"])
+        return web.json_response({"pages": 3, "jobs": [{"id": page * 10 + i} for i in range(2)]})
+
+    async def download(self, request):
+        return web.json_response({"operationId": 7})
+
+    async def operation(self, request):
+        self.polls += 1
+        return web.json_response({"id": 7, "status": "COMPLETED" if self.polls > 1 else "RUNNING"})
+
+    async def download_url(self, request):
+        return web.json_response({"downloadUrl": f"{request.url.origin()}/files/jobs.zip"})
+
+    async def zip(self, request):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("jobs.json", json.dumps([{"id": 1}]))
+        return web.Response(body=buffer.getvalue())
+
+
+def run(api: MockApi, test, **kwargs):
+    async def main():
+        runner = web.AppRunner(api.app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncClient("TEST_API_KEY", base_url=f"http://127.0.0.1:{port}", **kwargs) as client:
+                client.backoff_factor = 0
+                return await test(client)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_async_client_mirrors_the_mixins():
+    client = AsyncClient("TEST_API_KEY", base_url="http://localhost")
+    coroutine = object()
+    client.request = lambda *args, **kwargs: coroutine
+    for mixin in [JobsApiMixin, DataApiMixin, GroundTruthApiMixin, TasksApiMixin]:
+        for name, method in inspect.getmembers(mixin, inspect.isfunction):
+            if name.startswith("_") or name == "request":
+                continue
+            overridden = getattr(AsyncClient, name)
+            parameters = list(inspect.signature(method).parameters.values())[1:]
+            args = [[] for parameter in parameters if parameter.default is parameter.empty]
+            if name.startswith("get_all_"):
+                assert isinstance(getattr(client, name)(*args), AsyncPageIterator), name
+            elif name == "bulk_create_jobs":
+                submission = getattr(client, name)(*args)
+                assert inspect.iscoroutine(submission), name
+                submission.close()
+            elif overridden is method:
+                # The inherited methods return the coroutine of `AsyncClient.request`
+                kwargs = {"correct": True} if name == "review_job" else {}
+                assert getattr(client, name)(*args, **kwargs) is coroutine, name
+            else:
+                assert inspect.iscoroutinefunction(overridden), name
+
+
+def test_concurrency_limit():
+    api = MockApi(delay=0.02)
+    jobs = run(api, lambda client: asyncio.gather(*(client.fetch_job(str(i)) for i in range(40))), max_concurrency=5)
+    assert jobs == [{"id": str(i)} for i in range(40)]
+    assert api.max_in_flight == 5
+
+
+def test_expired_token_refreshed_once(mocker):
+    refresh = mocker.patch("superai.async_client.update_cognito_credentials", return_value=("fresh", "id"))
+    api = MockApi(delay=0.01)
+
+    async def test(client):
+        client.auth_token = "expired"
+        return await asyncio.gather(*(client.request(f"jobs/{i}", required_auth_token=True) for i in range(20)))
+
+    assert run(api, test) == [{"id": str(i)} for i in range(20)]
+    refresh.assert_called_once()
+    assert sum(token == "fresh" for _, token, _ in api.calls) == 20
+
+
+def test_retries_and_errors():
+    api = MockApi()
+
+    async def test(client):
+        api.statuses = [503, 502]
+        assert await client.fetch_job("1") == {"id": "1"}
+        assert len(api.calls) == 3
+
+        # A POST which may have been processed isn't retried, unless it was rate limited
+        api.calls, api.statuses = [], [503]
+        with pytest.raises(SuperAIError) as error:
+            await client.cancel_job("1")
+        assert error.value.error_code == 503 and len(api.calls) == 1
+        api.calls, api.statuses = [], [429]
+        assert await client.cancel_job("1") == {"id": "1"} and len(api.calls) == 2
+
+        await client.request("jobs/1", query_params={"statusIn": ["COMPLETED", "FAILED"], "flag": True, "page": None})
+        assert api.calls[-1][2] == [("statusIn", "COMPLETED"), ("statusIn", "FAILED"), ("flag", "True")]
+
+    run(api, test)
+
+
+def test_pages_and_operations():
+    api = MockApi()
+
+    async def test(client):
+        jobs = [job["id"] async for job in client.get_all_jobs("app")]
+        assert jobs == [0, 1, 10, 11, 20, 21]
+        assert await client.download_jobs_full_flow("app", poll_interval=0) == [{"id": 1}]
+        assert api.polls == 2
+
+    run(api, test)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from superai.apis.bulk import Checkpoint, SubmittedJob, pack_batches, read_inputs
+from superai.async_client import AsyncClient
+from superai.client import Client
+from superai.exceptions import SuperAIError
+
+
+class JobsApi:
+    """`create_jobs` of an API which fails once on the batches holding an input of `failures`."""
+
+    def __init__(self, failures=()):
+        self.failures = set(failures)
+        self.submitted = []
+        self.lock = threading.Lock()
+
+    def create_jobs(self, app_id, callback_url=None, inputs=None, **kwargs):
+        with self.lock:
+            values = [input["value"] for input in inputs]
+            if self.failures.intersection(values):
+                self.failures.difference_update(values)
+                raise SuperAIError("Service Unavailable", 503)
+            self.submitted.extend(values)
+            batch_id = f"batch-{values[0]}"
+        return {"batchId": batch_id, "uuid": f"job-{values[0]}"}
+
+    async def async_create_jobs(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        return self.create_jobs(*args, **kwargs)
+
+
+def test_pack_batches():
+    inputs = [{"value": "x" * size} for size in [10, 10, 10, 100, 10, 10]]
+    batches = list(pack_batches(inputs, max_batch_inputs=2, max_batch_bytes=60))
+    assert [batch.indices for batch in batches] == [[0, 1], [2], [3], [4, 5]]
+    assert batches[3].inputs == inputs[4:]
+
+    skipped = list(pack_batches(inputs, 10, 1000, skip={1: SubmittedJob(), 2: SubmittedJob()}))
+    assert [batch.indices for batch in skipped] == [[0, 3, 4, 5]]
+
+
+def test_read_inputs(tmp_path):
+    inputs = [{"a": "1", "b": "x"}, {"a": "2", "b": "y"}]
+    (tmp_path / "inputs.jsonl").write_text("\n".join(json.dumps(input) for input in inputs) + "\n\n")
+    (tmp_path / "inputs.csv").write_text("a,b\n1,x\n2,y\n")
+    (tmp_path / "inputs.json").write_text(json.dumps(inputs))
+    for name in ["inputs.jsonl", "inputs.csv", "inputs.json"]:
+        assert list(read_inputs(tmp_path / name)) == inputs
+    assert list(read_inputs(iter(inputs))) == inputs
+
+
+def test_checkpoint_of_blank_lines(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_bytes(b"\n  ")
+    checkpoint = Checkpoint(path)
+    assert checkpoint.load() == {}
+    checkpoint.record(next(pack_batches([{"value": 1}], 1, 100)), SubmittedJob("batch", "job"))
+    assert checkpoint.load() == {0: SubmittedJob("batch", "job")}
+
+
+def test_bulk_create_jobs_resumes_from_checkpoint(tmp_path, mocker):
+    inputs = tmp_path / "inputs.jsonl"
+    inputs.write_text("".join(json.dumps({"value": i}) + "\n" for i in range(100)))
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    api = JobsApi(failures=[45])
+    client = Client("TEST_API_KEY")
+    mocker.patch.object(client, "create_jobs", side_effect=api.create_jobs)
+
+    options = dict(max_batch_inputs=10, max_concurrency=3, checkpoint=str(checkpoint))
+    with pytest.raises(SuperAIError):
+        client.bulk_create_jobs("app", inputs, **options)
+    assert 40 <= len(api.submitted) < 100 and len(Checkpoint(checkpoint).load()) == len(api.submitted)
+    # A record cut by a crash is ignored
+    with open(checkpoint, "a") as file:
+        file.write('{"ranges": [[9')
+
+    submitted = client.bulk_create_jobs("app", inputs, **options)
+    assert sorted(api.submitted) == list(range(100))
+    assert sorted(submitted) == list(range(100))
+    assert submitted[45].batch_id is not None and submitted[45].job_id is None
+    assert Checkpoint(checkpoint).load() == submitted
+
+    single = client.bulk_create_jobs("app", [{"value": 7}], max_batch_inputs=1)
+    assert single == {0: SubmittedJob("batch-7", "job-7")}
+
+
+def test_async_bulk_create_jobs(tmp_path, mocker):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    api = JobsApi(failures=[33])
+    client = AsyncClient("TEST_API_KEY")
+    mocker.patch.object(client, "create_jobs", side_effect=api.async_create_jobs)
+    inputs = [{"value": i} for i in range(60)]
+
+    async def main():
+        options = dict(max_batch_inputs=7, max_concurrency=2, max_batches_per_second=1000, checkpoint=checkpoint)
+        with pytest.raises(SuperAIError):
+            await client.bulk_create_jobs("app", inputs, **options)
+        return await client.bulk_create_jobs("app", inputs, **options)
+
+    submitted = asyncio.run(main())
+    assert sorted(api.submitted) == list(range(60)) and sorted(submitted) == list(range(60))
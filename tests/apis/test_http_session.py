@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+from superai.apis.http_session import JitteredRetry, create_session
+from superai.client import Client
+from superai.exceptions import SuperAIError
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_request(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        server.calls.append(self.command)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        body = json.dumps({"path": self.path, "message": "error"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_request
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.connections, server.calls, server.statuses, server.delay = set(), [], [], 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, **kwargs) -> Client:
+    session = create_session(backoff_factor=0, **kwargs)
+    return Client("TEST_API_KEY", base_url=f"http://127.0.0.1:{server.server_port}", session=session)
+
+
+def test_session_keeps_connections_alive(server):
+    api = client(server)
+    for i in range(5):
+        assert api.request(f"jobs/{i}", required_api_key=True) == {"path": f"/jobs/{i}", "message": "error"}
+    assert len(server.connections) == 1
+    # The mixins share the session of the client
+    assert api.session is api._session
+    assert isinstance(api.session.get_adapter("http://x").max_retries, JitteredRetry)
+
+
+def test_session_retries_only_safe_requests(server):
+    api = client(server)
+    server.statuses = [503, 502, 200]
+    assert api.request("jobs", method="GET")
+    assert server.calls == ["GET"] * 3
+
+    server.calls, server.statuses = [], [503, 200]
+    with pytest.raises(SuperAIError) as error:
+        api.request("jobs", method="POST", body_params={"a": 1})
+    assert error.value.error_code == 503 and server.calls == ["POST"]
+
+    # A rate limited request wasn't processed, it is retried whatever its method
+    server.calls, server.statuses = [], [429, 429, 200]
+    assert api.request("jobs", method="POST", body_params={"a": 1})
+    assert server.calls == ["POST"] * 3
+
+    # Once the retries are exhausted, the last response is reported
+    server.calls, server.statuses = [], [503] * 5
+    with pytest.raises(SuperAIError):
+        client(server, retries=2).request("jobs")
+    assert server.calls == ["GET"] * 3
+
+
+def test_session_default_timeout(server):
+    server.delay = 0.5
+    session = create_session(timeout=(1, 0.1), retries=0)
+    with pytest.raises(requests.exceptions.RequestException):
+        session.get(f"http://127.0.0.1:{server.server_port}/slow")
+    assert session.get(f"http://127.0.0.1:{server.server_port}/slow", timeout=2).ok
+
+
+def test_jittered_backoff():
+    retry = JitteredRetry(total=10, backoff_factor=1)
+    for attempt in range(1, 5):
+        retry = retry.increment("GET", "/", error=ConnectTimeoutError())
+        backoff = 0 if attempt == 1 else 2 ** (attempt - 1)
+        assert backoff / 2 <= retry.get_backoff_time() <= backoff
@@ -0,0 +1,112 @@
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+from superai.apis.pagination import AsyncPageIterator, PageCursor, PageIterator
+from superai.client import Client
+from superai.exceptions import SuperAIError
+
+
+class Listing:
+    """Paginated endpoint of `pages` pages of `size` items, which fails once on the pages of `failures`."""
+
+    def __init__(self, pages=10, size=3, total_key="pages", failures=()):
+        self.pages, self.size, self.total_key = pages, size, total_key
+        self.failures = set(failures)
+        self.requested = []
+        self.consumed = 0
+        self.lock = threading.Lock()
+
+    def response(self, page):
+        with self.lock:
+            self.requested.append(page)
+            # Pages requested ahead of the consumed items
+            assert page <= self.consumed // self.size + 1 + 2
+            if page in self.failures:
+                self.failures.discard(page)
+                raise SuperAIError("Service Unavailable", 503)
+        items = [page * 100 + i for i in range(self.size)] if page < self.pages else []
+        response = {"items": items, "last": page >= self.pages - 1}
+        if self.total_key:
+            response[self.total_key] = self.pages
+        return response
+
+    def fetch_page(self, page):
+        time.sleep(random.uniform(0, 0.005))
+        return self.response(page)
+
+    async def async_fetch_page(self, page):
+        await asyncio.sleep(random.uniform(0, 0.005))
+        return self.response(page)
+
+    def expected(self):
+        return [page * 100 + i for page in range(self.pages) for i in range(self.size)]
+
+
+def consume(listing, iterator, items):
+    for item in iterator:
+        items.append(item)
+        listing.consumed += 1
+
+
+@pytest.mark.parametrize("total_key", ["pages", "totalPages", None])
+def test_page_iterator_in_order(total_key):
+    listing = Listing(total_key=total_key)
+    items = []
+    consume(listing, PageIterator(listing.fetch_page, "items", prefetch=2), items)
+    assert items == listing.expected()
+    assert sorted(listing.requested) == list(range(10))
+
+
+def test_page_iterator_resumes_from_cursor():
+    listing = Listing(failures=[4, 7])
+    items, cursor = [], None
+    for _ in range(3):
+        iterator = PageIterator(listing.fetch_page, "items", prefetch=2, cursor=cursor)
+        try:
+            consume(listing, iterator, items)
+            break
+        except SuperAIError:
+            cursor = iterator.cursor
+            iterator.close()
+    assert items == listing.expected()
+
+    # A cursor in the middle of a page skips the items already yielded
+    assert list(PageIterator(listing.fetch_page, "items", cursor=PageCursor(9, 2))) == [902]
+    assert list(PageIterator(listing.fetch_page, "items", cursor=PageCursor(10))) == []
+
+
+def test_async_page_iterator():
+    listing = Listing(failures=[5])
+
+    async def main():
+        items, cursor = [], None
+        while True:
+            iterator = AsyncPageIterator(listing.async_fetch_page, "items", prefetch=2, cursor=cursor)
+            try:
+                async for item in iterator:
+                    items.append(item)
+                    listing.consumed += 1
+                return items
+            except SuperAIError:
+                cursor = iterator.cursor
+                await iterator.aclose()
+
+    assert asyncio.run(main()) == listing.expected()
+
+
+def test_get_all_data_prefetches_pages(mocker):
+    listing = Listing(pages=5, total_key="totalPages")
+    client = Client("TEST_API_KEY")
+    list_data = mocker.patch.object(
+        client,
+        "list_data",
+        side_effect=lambda page, **kwargs: {"content": listing.fetch_page(page)["items"], "totalPages": 5},
+    )
+    items = []
+    consume(listing, client.get_all_data(paths=["data://1/dir"], prefetch=2), items)
+    assert items == listing.expected()
+    assert list_data.call_count == 5 and list_data.call_args.kwargs["paths"] == ["data://1/dir"]
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from superai.apis.http_session import create_session
+from superai.apis.transfer import TransferOptions, download_file, upload_file
+from superai.client import Client
+from superai.exceptions import SuperAIStorageError
+
+
+class Storage(BaseHTTPRequestHandler):
+    """Object store serving `content` with ranges, unless `ranges` is false, and storing the uploads in `uploads`."""
+
+    content = b""
+    ranges = True
+    # Requests to serve before cutting the connection of a response in its middle, `None` to never cut one
+    cut_after = None
+    # ETag sent instead of the MD5 of the content, and headers added to the responses
+    etag = None
+    extra_headers = {}
+    requests = []
+    uploads = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(self.headers.get("Range"))
+        etag = cls.etag or f'"{hashlib.md5(cls.content).hexdigest()}"'
+        if self.headers.get("If-Match") not in (None, etag):
+            self.send_response(412)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body, status = cls.content, 200
+        if cls.ranges and self.headers.get("Range"):
+            start, end = (int(bound) for bound in self.headers["Range"][len("bytes=") :].split("-"))
+            if start >= len(cls.content):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            end = min(end, len(cls.content) - 1)
+            body, status = cls.content[start : end + 1], 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        for name, value in cls.extra_headers.items():
+            self.send_header(name, value)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(cls.content)}")
+        self.end_headers()
+        if cls.cut_after is not None:
+            cls.cut_after -= 1
+            if cls.cut_after < 0:
+                cls.cut_after = None
+                self.wfile.write(body[: len(body) // 2])
+                self.close_connection = True
+                return
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        assert "chunked" not in self.headers.get("Transfer-Encoding", "")
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        cls = type(self)
+        cls.uploads.append((self.headers["Content-Type"], body))
+        self.send_response(200)
+        self.send_header("ETag", cls.etag or f'"{hashlib.md5(body).hexdigest()}"')
+        for name, value in cls.extra_headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def storage():
+    handler = type("Handler", (Storage,), {"requests": [], "uploads": [], "content": os.urandom(100000)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    handler.url = f"http://127.0.0.1:{server.server_address[1]}/object"
+    yield handler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session():
+    return create_session(retries=0)
+
+
+def test_download_in_parallel_parts(storage, session, tmp_path):
+    destination = tmp_path / "object.bin"
+    progress = []
+    options = TransferOptions(part_size=16384, max_concurrency=4)
+    path = download_file(session, storage.url, destination, options, progress=lambda done, size: progress.append(done))
+
+    assert path == str(destination) and destination.read_bytes() == storage.content
+    assert len(storage.requests) == 7 and storage.requests[0] == "bytes=0-16383"
+    assert max(progress) == len(storage.content)
+    assert not os.path.exists(f"{destination}.part") and not os.path.exists(f"{destination}.part.json")
+
+
+def test_download_retries_a_cut_part_and_resumes(storage, session, tmp_path):
+    destination = tmp_path / "object.bin"
+    options = TransferOptions(part_size=16384, max_concurrency=1, part_retries=0)
+    storage.cut_after = 3
+    with pytest.raises(Exception):
+        download_file(session, storage.url, destination, options)
+    assert not destination.exists() and len(storage.requests) == 4
+
+    # Parts 0 to 2 were saved, part 3 was cut
+    storage.requests.clear()
+    download_file(session, storage.url, destination, options)
+    assert destination.read_bytes() == storage.content
+    assert storage.requests == ["bytes=49152-65535", "bytes=65536-81919", "bytes=81920-98303", "bytes=98304-99999"]
+
+    storage.cut_after = 1
+    download_file(session, storage.url, tmp_path / "retried.bin", TransferOptions(part_size=16384, part_retries=1))
+    assert (tmp_path / "retried.bin").read_bytes() == storage.content
+
+
+def test_download_restarts_when_the_object_changed(storage, session, tmp_path):
+    destination = tmp_path / "object.bin"
+    options = TransferOptions(part_size=16384, max_concurrency=1, part_retries=0)
+    storage.cut_after = 2
+    with pytest.raises(Exception):
+        download_file(session, storage.url, destination, options)
+
+    storage.content = os.urandom(50000)
+    download_file(session, storage.url, destination, options)
+    assert destination.read_bytes() == storage.content
+
+
+def test_download_checksum_and_fallbacks(storage, session, tmp_path):
+    with pytest.raises(SuperAIStorageError):
+        download_file(session, storage.url, tmp_path / "object.bin", md5="0" * 32)
+    assert not os.listdir(tmp_path)
+
+    storage.ranges = False
+    download_file(session, storage.url, tmp_path / "streamed.bin", TransferOptions(part_size=16384))
+    assert (tmp_path / "streamed.bin").read_bytes() == storage.content and storage.requests[-1] == "bytes=0-16383"
+
+    storage.ranges, storage.content = True, b""
+    download_file(session, storage.url, tmp_path / "empty.bin")
+    assert (tmp_path / "empty.bin").read_bytes() == b""
+
+
+def test_upload_streams_the_file(storage, session, tmp_path):
+    path = tmp_path / "upload.pdf"
+    path.write_bytes(storage.content)
+    upload_file(session, storage.url, path, "application/pdf")
+    with open(path, "rb") as file:
+        upload_file(session, storage.url, file, "application/pdf")
+    assert storage.uploads == 2 * [("application/pdf", storage.content)]
+
+
+@pytest.mark.parametrize(
+    "encryption",
+    [{"x-amz-server-side-encryption": "aws:kms"}, {"x-amz-server-side-encryption-customer-algorithm": "AES256"}],
+)
+def test_etag_of_encrypted_objects_is_not_a_checksum(storage, session, tmp_path, encryption):
+    # The ETag of an object encrypted with KMS or a customer key looks like an MD5 but isn't one
+    storage.etag, storage.extra_headers = f'"{"0" * 32}"', encryption
+    download_file(session, storage.url, tmp_path / "object.bin", TransferOptions(part_size=16384))
+    assert (tmp_path / "object.bin").read_bytes() == storage.content
+    upload_file(session, storage.url, tmp_path / "object.bin", "application/pdf")
+
+    storage.extra_headers = {}
+    with pytest.raises(SuperAIStorageError):
+        download_file(session, storage.url, tmp_path / "unencrypted.bin")
+    # Only the ETag doesn't match, the data is kept
+    assert (tmp_path / "unencrypted.bin").read_bytes() == storage.content
+    assert sorted(os.listdir(tmp_path)) == ["object.bin", "unencrypted.bin"]
+
+
+def test_upload_from_the_file_position(storage, session, tmp_path):
+    path = tmp_path / "upload.pdf"
+    path.write_bytes(b"header" + storage.content)
+    with open(path, "rb") as file:
+        file.read(6)
+        upload_file(session, storage.url, file, "application/pdf")
+    assert storage.uploads == [("application/pdf", storage.content)]
+
+
+def test_upload_checksum_mismatch(storage, session, mocker, tmp_path):
+    mocker.patch("superai.apis.transfer._etag_md5", return_value="0" * 32)
+    path = tmp_path / "upload.pdf"
+    path.write_bytes(b"content")
+    with pytest.raises(SuperAIStorageError):
+        upload_file(session, storage.url, path, "application/pdf")
+
+
+def test_data_api_transfers(storage, mocker, tmp_path):
+    client = Client("TEST_API_KEY")
+    mocker.patch.object(client, "get_signed_url", return_value={"signedUrl": storage.url})
+    mocker.patch.object(client, "request", return_value={"path": "data://1/report.pdf", "uploadUrl": storage.url})
+
+    destination = tmp_path / "report.pdf"
+    assert client.download_data_to_file("data://1/report.pdf", destination, part_size=30000) == str(destination)
+    assert destination.read_bytes() == storage.content
+    assert client.upload_data("report.pdf", "Report", "application/pdf", destination) == {"path": "data://1/report.pdf"}
+    assert storage.uploads == [("application/pdf", storage.content)]
@@ -0,0 +1,83 @@
+"""Benchmark of `superai.async_client.AsyncClient` fetching many jobs at once.
+
+A mock of the API runs in its own process and answers `GET jobs/{id}` after `--latency` seconds, like a remote server.
+`--jobs` jobs are fetched with the synchronous `Client`, sequentially and from `--threads` threads, and with
+`AsyncClient` limited to `--concurrency` requests in flight.
+
+Run with `python -m tests.benchmarks.bench_async_client [--jobs 1000] [--latency 0.02] [--concurrency 64]`.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from superai.apis.http_session import create_session
+from superai.async_client import AsyncClient
+from superai.client import Client
+
+
+def serve(latency, port, ready):
+    async def job(request):
+        await asyncio.sleep(latency)
+        return web.json_response({"id": request.match_info["job_id"], "status": "COMPLETED"})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/jobs/{job_id}", job)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port.value = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def timed(fn, jobs: int) -> str:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return f"{elapsed:6.2f}s, {jobs / elapsed:6.0f} jobs/s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    port, ready = multiprocessing.Value("i", 0), multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.latency, port, ready), daemon=True)
+    server.start()
+    ready.wait()
+    base_url = f"http://127.0.0.1:{port.value}"
+    job_ids = [str(i) for i in range(args.jobs)]
+
+    client = Client("TEST_API_KEY", base_url=base_url, session=create_session(pool_maxsize=args.threads))
+
+    def threaded():
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(client.fetch_job, job_ids))
+
+    async def fan_out():
+        async with AsyncClient("TEST_API_KEY", base_url=base_url, max_concurrency=args.concurrency) as async_client:
+            await asyncio.gather(*(async_client.fetch_job(job_id) for job_id in job_ids))
+
+    try:
+        print(f"{args.jobs} jobs fetched from {base_url}, {args.latency * 1000:.0f} ms of latency")
+        print(f"{'Client, sequential':>28}: {timed(lambda: [client.fetch_job(i) for i in job_ids], args.jobs)}")
+        print(f"{f'Client, {args.threads} threads':>28}: {timed(threaded, args.jobs)}")
+        print(f"{f'AsyncClient, {args.concurrency} in flight':>28}: {timed(lambda: asyncio.run(fan_out()), args.jobs)}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark of the submission of a large JSON lines file of inputs with `JobsApiMixin.bulk_create_jobs`.
+
+A mock of the API runs in its own process and acknowledges `POST apps/{app_id}/jobs` after `--latency` seconds plus
+the time to parse the inputs. `--inputs` inputs are submitted with the former single `create_jobs` call on the whole
+file loaded in memory, with batches of `--batch-size` inputs sent one after the other, and with `bulk_create_jobs`
+sending `--concurrency` batches at once. The peak memory allocated by the client is traced in each case.
+
+Run with `python -m tests.benchmarks.bench_bulk_jobs [--inputs 100000] [--batch-size 500] [--concurrency 8]`.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import web
+
+from superai.apis.bulk import pack_batches, read_inputs
+from superai.client import Client
+
+
+def serve(latency, port, ready):
+    async def create_jobs(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return web.json_response({"batchId": f"batch-{len(body['inputs'])}", "message": "Jobs submitted"})
+
+    async def main():
+        app = web.Application(client_max_size=2**31)
+        app.router.add_post("/apps/{app_id}/jobs", create_jobs)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port.value = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def measured(fn) -> str:
+    """Time of a run of `fn`, and peak memory of a second run, as tracing the allocations slows it down."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return f"{elapsed:6.2f}s, {peak / 2**20:7.1f} MiB peak"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    port, ready = multiprocessing.Value("i", 0), multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.latency, port, ready), daemon=True)
+    server.start()
+    ready.wait()
+    client = Client("TEST_API_KEY", base_url=f"http://127.0.0.1:{port.value}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "inputs.jsonl")
+        with open(path, "w") as file:
+            for i in range(args.inputs):
+                file.write(json.dumps({"image_url": f"https://cdn.example.com/images/{i:08d}.jpg", "row": i}) + "\n")
+        print(f"{args.inputs} inputs, {os.path.getsize(path) / 2**20:.1f} MiB of JSON lines")
+
+        def single_request():
+            client.create_jobs("app", inputs=list(read_inputs(path)))
+
+        def sequential_batches():
+            for batch in pack_batches(read_inputs(path), args.batch_size, 2**30):
+                client.create_jobs("app", inputs=batch.inputs)
+
+        def bulk():
+            submitted = client.bulk_create_jobs(
+                "app",
+                path,
+                max_batch_inputs=args.batch_size,
+                max_concurrency=args.concurrency,
+                checkpoint=os.path.join(directory, f"checkpoint-{time.monotonic()}.jsonl"),
+            )
+            assert len(submitted) == args.inputs
+
+        try:
+            print(f"{'single request':>26}: {measured(single_request)}")
+            print(f"{'sequential batches':>26}: {measured(sequential_batches)}")
+            print(f"{f'bulk, {args.concurrency} batches at once':>26}: {measured(bulk)}")
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
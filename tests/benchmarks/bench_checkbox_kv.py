@@ -0,0 +1,69 @@
+"""Benchmark of the checkbox normalization of `DocumentToString` on large synthetic forms.
+
+Every page holds `--tokens` OCR tokens and `--checkboxes` checkbox key-value pairs, some of them overlapping. With
+`--reference` the former implementation, testing every token for every checkbox and every pair of key boxes, is timed
+as well and must give the same tokens, it takes minutes past a few dozen pages.
+
+Run with `python -m tests.benchmarks.bench_checkbox_kv [--pages 200] [--tokens 1000] [--checkboxes 40] [--reference]`.
+"""
+import argparse
+import random
+import time
+
+from superai.llm.data_processing.document_preparation import _replace_checkbox_kv_pairs
+from tests.llm.test_document_preparation import reference_replace_checkbox_kv_pairs
+
+
+def form(pages: int, tokens: int, checkboxes: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    def box(width):
+        return {"left": rng.randint(0, 2400), "top": rng.randint(0, 3200), "width": width, "height": 24}
+
+    ocr_values = [
+        {"content": f"t{i}", "boundingBox": box(rng.randint(10, 120)), "pageNumber": page}
+        for page in range(1, pages + 1)
+        for i in range(tokens)
+    ]
+    ocr_key_values = [
+        {
+            "key": {"content": f"key{i}", "boundingBox": box(24), "pageNumber": page},
+            "value": {
+                "content": rng.choice([":selected:", ":unselected:"]),
+                "boundingBox": box(24),
+                "pageNumber": page,
+            },
+        }
+        for page in range(1, pages + 1)
+        for i in range(checkboxes)
+    ]
+    return ocr_values, ocr_key_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--checkboxes", type=int, default=40)
+    parser.add_argument("--reference", action="store_true")
+    args = parser.parse_args()
+
+    ocr_values, ocr_key_values = form(args.pages, args.tokens, args.checkboxes)
+    print(f"{len(ocr_values)} tokens, {len(ocr_key_values)} checkboxes")
+
+    start = time.perf_counter()
+    result = _replace_checkbox_kv_pairs(ocr_values, ocr_key_values)
+    indexed = time.perf_counter() - start
+    print(f"{'indexed':>10}: {indexed:8.3f}s")
+    if not args.reference:
+        return
+
+    start = time.perf_counter()
+    expected = reference_replace_checkbox_kv_pairs(ocr_values, ocr_key_values)
+    reference = time.perf_counter() - start
+    print(f"{'reference':>10}: {reference:8.3f}s, {reference / indexed:5.1f}x")
+    assert result == expected
+
+
+if __name__ == "__main__":
+    main()
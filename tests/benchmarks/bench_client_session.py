@@ -0,0 +1,96 @@
+"""Benchmark of the request throughput of `superai.client.Client` against a local mock of the API.
+
+The mock server runs in its own process and answers every request with a small JSON document, over HTTP/1.1 keep-alive.
+`--requests` calls of `Client.request` are sent sequentially, then from `--threads` threads, with the pooled session of
+the client and with the former `requests.request` call, which opens a new connection for each request. The server is
+local and doesn't use TLS, the handshakes saved on the real API are more expensive.
+
+Run with `python -m tests.benchmarks.bench_client_session [--requests 2000] [--threads 16]`.
+"""
+import argparse
+import json
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+from superai.apis.http_session import create_session
+from superai.client import Client
+
+BODY = json.dumps({"id": 1, "status": "COMPLETED", "response": {"label": "cat"}}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def setup(self):
+        super().setup()
+        with self.server.connections.get_lock():
+            self.server.connections.value += 1
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, connections, ready):
+    server = ThreadingHTTPServer(("127.0.0.1", port.value), Handler)
+    server.daemon_threads = True
+    server.connections = connections
+    port.value = server.server_port
+    ready.set()
+    server.serve_forever()
+
+
+def run(client: Client, requests_count: int, threads: int) -> float:
+    start = time.perf_counter()
+    if threads == 1:
+        for i in range(requests_count):
+            client.request(f"jobs/{i}", required_api_key=True)
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(lambda i: client.request(f"jobs/{i}", required_api_key=True), range(requests_count)))
+    return requests_count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    port, connections, ready = multiprocessing.Value("i", 0), multiprocessing.Value("i", 0), multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(port, connections, ready), daemon=True)
+    server.start()
+    ready.wait()
+    base_url = f"http://127.0.0.1:{port.value}"
+
+    # The former client, sending every request with `requests.request`
+    legacy = Client("TEST_API_KEY", base_url=base_url, session=mock.Mock(request=requests.request))
+    pooled = Client("TEST_API_KEY", base_url=base_url, session=create_session(pool_maxsize=args.threads))
+    try:
+        print(f"{args.requests} requests to {base_url}")
+        for threads in [1, args.threads]:
+            for name, client in [("requests.request", legacy), ("pooled session", pooled)]:
+                connections.value = 0
+                throughput = run(client, args.requests, threads)
+                print(
+                    f"{threads:3} thread(s) {name:>16}: {throughput:8.0f} requests/s,"
+                    f" {connections.value:5} connections opened"
+                )
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
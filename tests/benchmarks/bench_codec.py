@@ -0,0 +1,92 @@
+"""Microbenchmark of the agent message codecs on realistic EVALUATE_TASK payloads.
+
+Every payload carries an OCR-like input of `--tokens` words with bounding boxes, roughly what document workflows send
+to the agent. Encoding covers `message(...).to_json` as done by `schedule_task`, decoding covers the TASK_RESPONSE lines
+read by the pump. The former `jsonpickle.encode` path is included as reference.
+
+Run with `python -m tests.benchmarks.bench_codec [--tokens 5000] [--messages 200]`.
+"""
+import argparse
+import random
+import time
+
+import jsonpickle
+
+from superai.data_program.protocol import codec as codec_module
+from superai.data_program.protocol.transport import _flatten
+
+
+def evaluate_task_payload(id: int, tokens: int) -> dict:
+    rng = random.Random(id)
+    words = [
+        {
+            "text": "".join(rng.choices("abcdefghijklmnopqrstuvwxyzéü0123456789", k=rng.randint(1, 12))),
+            "confidence": rng.random(),
+            "page": i // 500,
+            "box": {"x1": rng.random(), "y1": rng.random(), "x2": rng.random(), "y2": rng.random()},
+        }
+        for i in range(tokens)
+    ]
+    return {
+        "type": "EVALUATE_TASK",
+        "id": id,
+        "sequence": 1,
+        "name": "extract_fields",
+        "humans": [],
+        "price": None,
+        "input": {"ocr": words, "url": f"s3://bucket/documents/{id}.pdf"},
+        "output": {"type": "object", "properties": {"fields": {"type": "array", "items": {"type": "string"}}}},
+        "title": "Extract the fields",
+        "description": "Extract all fields from the document",
+        "paragraphs": ["Some instructions"] * 5,
+        "tags": ["document", "ocr"],
+        "timeToResolveSec": None,
+        "timeToUpdateSec": None,
+        "timeToExpireSec": 3600,
+        "qualifications": [],
+    }
+
+
+def message_dict(body: dict) -> dict:
+    return {"meta_info": {"version": 0.1, "operation_status": "SUCCEEDED"}, "body": body}
+
+
+def bench(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    messages = [message_dict(evaluate_task_payload(i, args.tokens)) for i in range(args.messages)]
+    size = len(codec_module.JsonCodec().dumps(messages[0]))
+    print(f"{args.messages} EVALUATE_TASK messages of {size / 1024:.0f} KiB, best of {args.repeat}")
+
+    best = max(bench(lambda m: jsonpickle.encode(m, unpicklable=False), messages) for _ in range(args.repeat))
+    print(f"{'jsonpickle':>10}: encode {best:8.0f} msg/s")
+
+    for name in codec_module.CODECS:
+        try:
+            codec = codec_module.get_codec(name, default=_flatten)
+        except ImportError:
+            print(f"{name:>10}: not installed")
+            continue
+        lines = [codec.dumps(m) for m in messages]
+        encode = max(bench(codec.dumps, messages) for _ in range(args.repeat))
+        decode = max(bench(codec.loads, lines) for _ in range(args.repeat))
+        decode_bytes = max(bench(codec.loads, [line.encode("utf-8") for line in lines]) for _ in range(args.repeat))
+        print(
+            f"{name:>10}: encode {encode:8.0f} msg/s, decode {decode:8.0f} msg/s (str) {decode_bytes:8.0f} msg/s"
+            " (bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark of `DocumentToString` chunking on large synthetic OCR documents.
+
+Every page holds `--lines` lines of words laid out on a grid, serialized with the whitespace or line representation
+and split into chunks of `--max-token` tokens. The former chunker, which encodes the whole chunk again for every line,
+is included as reference and must give the same chunks. The end-to-end serialization from OCR tokens is timed as well,
+with the pages rendered in the calling process and on `--processes` processes, up to the first chunk and in full.
+
+Run with `python -m tests.benchmarks.bench_document_chunks [--pages 100] [--lines 60] [--processes 4]`.
+"""
+import argparse
+import random
+import time
+
+from superai.llm.data_processing.document_preparation import DocumentToString
+from tests.llm.test_document_preparation import reference_string_chunks
+
+
+def ocr_document(pages: int, lines: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    tokens = []
+    for page in range(1, pages + 1):
+        for line in range(lines):
+            left = rng.randint(0, 40)
+            for _ in range(rng.randint(0, 12)):
+                content = "".join(rng.choices("abcdefghijklmnopqrstuvwxyzABCDEF0123456789$.,:/-", k=rng.randint(1, 10)))
+                width = 4 * len(content)
+                tokens.append(
+                    {
+                        "content": content,
+                        "pageNumber": page,
+                        "boundingBox": {"top": 10 + 12 * line, "left": left, "height": 8, "width": width},
+                    }
+                )
+                left += width + 4 * rng.randint(1, 8)
+    return tokens
+
+
+def bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--lines", type=int, default=60)
+    parser.add_argument("--max-token", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    ocr = ocr_document(args.pages, args.lines)
+    for representation in ("whitespace", "line"):
+        for include_line_number in (False, True):
+            extractor = DocumentToString(
+                False, False, representation, None, args.max_token, include_line_number=include_line_number
+            )
+            pages = extractor._get_per_page_representation(list(ocr), None, None)
+            chunks = extractor._get_string_chunks(pages)
+            assert chunks == reference_string_chunks(extractor, pages)
+
+            reference = bench(lambda: reference_string_chunks(extractor, pages), args.repeat)
+            incremental = bench(lambda: extractor._get_string_chunks(pages), args.repeat)
+            print(
+                f"{representation:>10} line numbers={include_line_number!s:5}: {len(chunks):3} chunks, "
+                f"reference {reference:7.3f}s, incremental {incremental:7.3f}s, {reference / incremental:5.1f}x"
+            )
+
+        for processes in (None, args.processes):
+            extractor = DocumentToString(False, False, representation, None, args.max_token, processes=processes)
+            first = bench(lambda: next(extractor.iter_document_representation(ocr, None, None)), args.repeat)
+            full = bench(lambda: extractor.get_document_representation(ocr, None, None), args.repeat)
+            print(f"{representation:>10} processes={processes!s:5}: first chunk {first:7.3f}s, document {full:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark of `superai.llm.evaluate.Evaluator` on a large multi-field evaluation set.
+
+Ground truth and predictions are `--documents` records of `--fields` string fields, with a fraction of empty, missing
+and wrong values. The former per-key, per-record loop, which printed every mismatch, is included as reference with its
+output discarded.
+
+Run with `python -m tests.benchmarks.bench_evaluate [--documents 100000] [--fields 40]`.
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from superai.llm.evaluate import Evaluator, StreamingEvaluator
+
+
+def records(documents: int, fields: int, seed: int = 0):
+    rng = random.Random(seed)
+    ground_truth, predictions = [], []
+    for _ in range(documents):
+        gt = {
+            f"field_{k}": rng.choice(["", f"value {rng.randint(0, 50)}"]) for k in range(fields) if rng.random() < 0.95
+        }
+        pred = {}
+        for key, value in gt.items():
+            draw = rng.random()
+            pred[key] = value if draw < 0.8 else "" if draw < 0.9 else f"value {rng.randint(0, 50)}"
+        ground_truth.append(gt)
+        predictions.append(pred)
+    return ground_truth, predictions
+
+
+def reference_evaluate(ground_truth, predictions):
+    results = {}
+    for key in set().union(*(d.keys() for d in ground_truth)):
+        gt = [d.get(key, "") for d in ground_truth]
+        pred = [d.get(key, "") for d in predictions]
+        tp = fp = tn = fn = ip = 0
+        for i, (g, p) in enumerate(zip(gt, pred)):
+            if g != "" and p != "":
+                if g == p:
+                    tp += 1
+                else:
+                    ip += 1
+                    print(i, g, p)
+            elif g == "" and p != "":
+                fp += 1
+            elif g != "" and p == "":
+                print(i, g, p)
+                fn += 1
+            else:
+                tn += 1
+        results[key] = Evaluator._compute_metrics(tp, fp, tn, fn, ip)
+    return results
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--fields", type=int, default=40)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    ground_truth, predictions = records(args.documents, args.fields)
+    print(f"{args.documents} documents of {args.fields} fields")
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        expected, elapsed = timed(lambda: reference_evaluate(ground_truth, predictions))
+    print(f"{'reference':>10}: {elapsed:6.2f}s, {output.getvalue().count(chr(10))} lines printed")
+
+    evaluator = Evaluator(ground_truth, predictions, chunk_size=args.chunk_size)
+    results, elapsed = timed(lambda: evaluator.evaluate(as_formatted_string=False))
+    assert results == expected
+    print(f"{'columnar':>10}: {elapsed:6.2f}s")
+
+    def streamed():
+        streaming = StreamingEvaluator()
+        for start in range(0, args.documents, args.chunk_size):
+            end = start + args.chunk_size
+            streaming.update(ground_truth[start:end], predictions[start:end])
+        return streaming.mismatches()
+
+    mismatches, elapsed = timed(streamed)
+    print(f"{'mismatches':>10}: {elapsed:6.2f}s, {len(mismatches)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Microbenchmark of the transport job state bookkeeping under high job churn.
+
+Compares the former layout, six module dicts each behind its own global lock, with the sharded `JobStateRegistry`.
+Every simulated job is registered, schedules a few tasks, resolves them from a "pump" lookup and is torn down.
+
+Run with `python -m tests.benchmarks.bench_job_state [--threads 16] [--jobs 20000]`.
+"""
+import argparse
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+from superai.data_program.protocol.job_state import JobStateRegistry
+
+TASKS_PER_JOB = 4
+
+
+class LegacyJobState:
+    def __init__(self):
+        self.task_futures, self.task_futures_lock = {}, Lock()
+        self.job_input, self.job_input_data, self.job_input_lock = {}, {}, Lock()
+        self.snapshot, self.snapshot_data, self.snapshot_lock = {}, {}, Lock()
+        self.child_job, self.child_job_lock = {}, Lock()
+        self.terminate_flag, self.terminate_flag_lock = {}, Lock()
+
+    def run_job(self, id):
+        with self.task_futures_lock:
+            self.task_futures[id] = {}
+        with self.job_input_lock:
+            self.job_input[id] = Future()
+            self.job_input_data[id] = None
+        with self.snapshot_lock:
+            self.snapshot[id] = None
+            self.snapshot_data[id] = None
+        with self.child_job_lock:
+            self.child_job[id] = None
+        with self.terminate_flag_lock:
+            self.terminate_flag[id] = False
+
+        for seq in range(TASKS_PER_JOB):
+            with self.terminate_flag_lock:
+                assert not self.terminate_flag[id]
+            with self.task_futures_lock:
+                if seq not in self.task_futures[id]:
+                    self.task_futures[id][seq] = Future()
+            with self.task_futures_lock:
+                f = self.task_futures[id][seq]
+            f.set_result(seq)
+
+        with self.task_futures_lock:
+            del self.task_futures[id]
+        with self.job_input_lock:
+            del self.job_input[id]
+            del self.job_input_data[id]
+        with self.snapshot_lock:
+            del self.snapshot[id]
+            del self.snapshot_data[id]
+        with self.child_job_lock:
+            del self.child_job[id]
+        with self.terminate_flag_lock:
+            del self.terminate_flag[id]
+
+
+class RegistryJobState:
+    def __init__(self):
+        self.jobs = JobStateRegistry()
+
+    def run_job(self, id):
+        state = self.jobs.create(id, Future())
+        for seq in range(TASKS_PER_JOB):
+            assert not state.terminated
+            state.future(seq, Future)
+            self.jobs.get(id).future(seq, Future).set_result(seq)
+        self.jobs.remove(id)
+
+
+def bench(implementation, threads: int, jobs: int) -> float:
+    per_thread = jobs // threads
+
+    def worker(offset):
+        for id in range(offset, offset + per_thread):
+            implementation.run_job(id)
+
+    workers = [Thread(target=worker, args=(i * per_thread,)) for i in range(threads)]
+    start = time.perf_counter()
+    [w.start() for w in workers]
+    [w.join() for w in workers]
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, implementation in (("legacy dicts", LegacyJobState), ("sharded registry", RegistryJobState)):
+        best = max(bench(implementation(), args.threads, args.jobs) for _ in range(args.repeat))
+        print(f"{name:>16}: {best:10.0f} jobs/s ({args.threads} threads, {args.jobs} jobs, best of {args.repeat})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark of the JSON repair of malformed language model outputs.
+
+The corpus holds document extraction outputs of `--items` line items, with the errors language models make: markdown
+fences and prose around the JSON, Python dict syntax, trailing commas, missing commas, unescaped quotes, comments,
+unquoted keys and outputs cut by the token limit. `fix_json` repairs them in one scan, the former chain of regex fixers
+is included as reference. A repair is correct when it parses to the intended value, or to a prefix of it for the
+truncated outputs.
+
+Run with `python -m tests.benchmarks.bench_json_repair [--items 50] [--repeat 5]`.
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from superai.llm.utilities import json_utils
+from superai.llm.utilities.json_utils import fix_json, is_valid_json
+
+LEGACY_FIXERS = [
+    json_utils.fix_trailing_comma,
+    json_utils.add_missing_comma,
+    json_utils.fix_single_quotes,
+    json_utils.balance_square_brackets,
+    json_utils.replace_invalid_characters,
+    json_utils.replace_control_characters,
+    json_utils.fix_unquoted_strings,
+    json_utils.fix_double_quotes_inside_values,
+    json_utils.fix_missing_closing_quotes,
+    json_utils.fix_missing_opening_quotes,
+    json_utils.remove_comments,
+    json_utils.fix_boolean_values_in_quotes,
+    json_utils.fix_number_values_in_quotes,
+    json_utils.fix_null_values_in_quotes,
+    json_utils.fix_extra_commas,
+    json_utils.remove_invalid_string_values,
+    json_utils.fix_invalid_unicode_characters,
+]
+
+
+def legacy_fix_json(json_string: str) -> str:
+    is_valid, _ = is_valid_json(json_string)
+    if not is_valid:
+        for method in LEGACY_FIXERS:
+            json_string = method(json_string)
+            if is_valid_json(json_string)[0]:
+                break
+    return json_string
+
+
+def extraction(rng: random.Random, items: int) -> dict:
+    words = ["steel", "bolt", "washer", "M8", "zinc", "plated", "hex", "nut", "bracket", "galvanized", "10mm"]
+    return {
+        "vendor": {"name": "Acme Supplies Ltd", "address": "12 Industrial Way\nSpringfield", "vat": "GB123456789"},
+        "invoice_number": f"INV-{rng.randint(1000, 9999)}",
+        "date": "2023-05-17",
+        "currency": "EUR",
+        "paid": False,
+        "line_items": [
+            {
+                "description": " ".join(rng.choices(words, k=rng.randint(3, 12))),
+                "quantity": rng.randint(1, 500),
+                "unit_price": round(rng.uniform(0.1, 300), 2),
+                "sku": f"SKU-{rng.randint(10000, 99999)}",
+                "notes": None,
+            }
+            for _ in range(items)
+        ],
+        "total": round(rng.uniform(100, 100000), 2),
+        "summary": "Invoice for fasteners and brackets, delivered in two shipments. " * 3,
+    }
+
+
+def corpus(items: int, seed: int = 0):
+    """Malformed outputs, as (error class, text, intended value)."""
+    rng = random.Random(seed)
+    outputs = []
+    for _ in range(20):
+        value = extraction(rng, items)
+        text = json.dumps(value, indent=2)
+        quoted = dict(value, summary='Invoice for "fasteners" and brackets')
+        outputs += [
+            (
+                "fenced",
+                f"Sure! Here is the extracted data:\n```json\n{text}\n```\nLet me know if you need more.",
+                value,
+            ),
+            ("python_dict", repr(value), value),
+            ("trailing_comma", re.sub(r'("notes": null)', r"\1,", text), value),
+            ("missing_comma", text.replace("},\n    {", "}\n    {"), value),
+            ("unescaped_quote", json.dumps(quoted, indent=2).replace('\\"', '"'), quoted),
+            ("comments", text.replace('"currency": "EUR",', '"currency": "EUR", // from the header'), value),
+            ("unquoted_keys", re.sub(r'"(\w+)":', r"\1:", text), value),
+        ]
+        cut = rng.randint(len(text) // 2, len(text) - 10)
+        outputs.append(("truncated", text[:cut], value))
+    return outputs
+
+
+def is_prefix(repaired, value) -> bool:
+    """Whether the repair of a truncated output only holds values of `value`, the last one possibly cut."""
+    if isinstance(repaired, dict) and isinstance(value, dict):
+        return all(key in value and (is_prefix(v, value[key]) or v is None) for key, v in repaired.items())
+    if isinstance(repaired, list) and isinstance(value, list):
+        return len(repaired) <= len(value) and all(is_prefix(r, v) for r, v in zip(repaired, value))
+    if isinstance(repaired, str) and isinstance(value, str):
+        return value.startswith(repaired)
+    return repaired == value or isinstance(value, (int, float)) and isinstance(repaired, (int, float))
+
+
+def evaluate(fix, outputs, repeat: int):
+    times, correct = {}, {}
+    for kind, text, value in outputs:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            repaired = fix(text)
+        times[kind] = times.get(kind, 0) + (time.perf_counter() - start) / repeat
+        try:
+            parsed = json.loads(repaired)
+            ok = is_prefix(parsed, value) if kind == "truncated" else parsed == value
+        except json.JSONDecodeError:
+            ok = False
+        correct[kind] = correct.get(kind, 0) + ok
+    return times, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    outputs = corpus(args.items)
+    per_kind = len(outputs) // len({kind for kind, _, _ in outputs})
+    size = sum(len(text) for _, text, _ in outputs) / len(outputs)
+    print(f"{len(outputs)} malformed outputs of {size / 1024:.1f} KiB on average, {per_kind} per error class")
+
+    legacy_times, legacy_correct = evaluate(legacy_fix_json, outputs, args.repeat)
+    times, correct = evaluate(fix_json, outputs, args.repeat)
+    print(f"{'error class':>16} | {'regex chain':>20} | {'single pass':>20}")
+    for kind in times:
+        print(
+            f"{kind:>16} | {legacy_times[kind] / per_kind * 1000:7.2f} ms {legacy_correct[kind]:3}/{per_kind} correct"
+            f" | {times[kind] / per_kind * 1000:7.2f} ms {correct[kind]:3}/{per_kind} correct"
+        )
+    print(
+        f"{'all':>16} | {sum(legacy_times.values()) / len(outputs) * 1000:7.2f} ms"
+        f" {sum(legacy_correct.values()):3}/{len(outputs)} correct"
+        f" | {sum(times.values()) / len(outputs) * 1000:7.2f} ms {sum(correct.values()):3}/{len(outputs)} correct"
+    )
+
+
+if __name__ == "__main__":
+    main()
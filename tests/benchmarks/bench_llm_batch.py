@@ -0,0 +1,116 @@
+"""Benchmark of `LLM.predict` on a batch of inputs against a local fake OpenAI server.
+
+The server answers every chat completion after `--latency` seconds, and fails one request in `--fail-every` with a 400
+error. The former implementation, running `ChatGPT.predict` on a default thread pool and looking up every finished
+future in the list of futures, is timed as reference, then the async engine with `--concurrency` requests in flight,
+without response cache. The batch is then run twice with an empty response cache, the second run is answered from it.
+
+Run with `python -m tests.benchmarks.bench_llm_batch [--inputs 1000] [--latency 0.2] [--concurrency 64]`.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import re
+import threading
+import time
+
+from aiohttp import web
+
+from superai.llm.ai import LLM
+from superai.llm.data_types import Any
+from superai.llm.dataset import Data
+from superai.llm.foundation_models import ChatGPT
+from superai.llm.foundation_models import openai as openai_models
+from superai.llm.foundation_models.cache import MemoryResponseCache
+
+
+def start_server(latency: float, fail_every: int) -> str:
+    async def chat_completions(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        question = re.search(r"question (\d+)", body["messages"][0]["content"]).group(1)
+        if fail_every and int(question) % fail_every == 0:
+            error = {"message": "Invalid request", "type": "invalid_request_error", "param": None, "code": None}
+            return web.json_response({"error": error}, status=400)
+        message = {"role": "assistant", "content": json.dumps({"answer": question})}
+        return web.json_response(
+            {
+                "id": f"chatcmpl-{question}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        )
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def reference_process_multiple(llm, input_data_list):
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [executor.submit(llm._process_single, input_data) for input_data in input_data_list]
+        results = [None] * len(input_data_list)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+                index = futures.index(future)
+                results[index] = result
+            except Exception:
+                pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--fail-every", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    openai_models.config.openai_api_type = "open_ai"
+    openai_models.config.openai_api_base = start_server(args.latency, args.fail_every)
+    openai_models.log.setLevel(logging.CRITICAL)
+    logging.getLogger("openai").setLevel(logging.WARNING)
+    engine = "gpt-3.5-turbo"
+    model = ChatGPT(engine=engine, rpm={engine: 10**9}, tpm={engine: 10**12}, cache=None)
+    llm = LLM(input_schema=Any(), output_schema=Any(), foundation_model=model)
+    llm.set_components(role="Answer the question.", prompt_output_format='{"answer": "<number>"}')
+    inputs = [Data(input=f"question {i}") for i in range(args.inputs)]
+
+    start = time.perf_counter()
+    expected = reference_process_multiple(llm, [data.input for data in inputs])
+    reference = time.perf_counter() - start
+    print(f"{'reference':>10}: {reference:7.3f}s, {sum(r is None for r in expected)} dropped")
+
+    start = time.perf_counter()
+    result = llm.predict(inputs, max_concurrency=args.concurrency)
+    engine_time = time.perf_counter() - start
+    print(
+        f"{'async':>10}: {engine_time:7.3f}s, {len(result.get_errors())} errors, "
+        f"{reference / engine_time:5.1f}x, {args.inputs / engine_time:7.1f} inputs/s"
+    )
+    assert [data.output for data in result.data] == [r.output if r is not None else None for r in expected]
+
+    llm.foundation_model.cache = MemoryResponseCache(max_size=args.inputs)
+    for run in ("cold", "cached"):
+        start = time.perf_counter()
+        llm.predict(inputs, max_concurrency=args.concurrency)
+        elapsed = time.perf_counter() - start
+        print(f"{run:>10}: {elapsed:7.3f}s, hit rate {llm.foundation_model.cache.stats.hit_rate:4.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark of the listing of all the jobs of an application with `JobsApiMixin.get_all_jobs`.
+
+A mock of the API runs in its own process and answers the pages of 500 jobs of `GET apps/{app_id}/jobs` after
+`--latency` seconds, like a remote server. `--pages` pages are listed with the former sequential loop over `list_jobs`,
+then with the page iterator prefetching `--prefetch` pages, with `Client` and `AsyncClient`.
+
+Run with `python -m tests.benchmarks.bench_pagination [--pages 40] [--latency 0.05] [--prefetch 8]`.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from aiohttp import web
+
+from superai.async_client import AsyncClient
+from superai.client import Client
+
+
+def serve(pages, latency, port, ready):
+    async def list_jobs(request):
+        await asyncio.sleep(latency)
+        page, size = int(request.query["page"]), int(request.query["size"])
+        jobs = [{"id": page * size + i, "status": "COMPLETED", "tags": ["a", "b"]} for i in range(size)]
+        return web.json_response({"jobs": jobs, "pages": pages, "total": pages * size})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/apps/{app_id}/jobs", list_jobs)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port.value = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def sequential_jobs(client: Client, app_id: str):
+    """The former `get_all_jobs` loop."""
+    page = 0
+    paginated_jobs = {"pages": 1}
+    while page <= paginated_jobs["pages"] - 1:
+        paginated_jobs = client.list_jobs(app_id, page=page, size=500)
+        yield from paginated_jobs["jobs"]
+        page += 1
+
+
+def timed(fn) -> str:
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    return f"{elapsed:6.2f}s, {count / elapsed:8.0f} jobs/s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--prefetch", type=int, default=8)
+    args = parser.parse_args()
+
+    port, ready = multiprocessing.Value("i", 0), multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.pages, args.latency, port, ready), daemon=True)
+    server.start()
+    ready.wait()
+    base_url = f"http://127.0.0.1:{port.value}"
+    client = Client("TEST_API_KEY", base_url=base_url)
+
+    async def async_listing():
+        async with AsyncClient("TEST_API_KEY", base_url=base_url) as async_client:
+            return len([job async for job in async_client.get_all_jobs("app", prefetch=args.prefetch)])
+
+    try:
+        print(f"{args.pages} pages of 500 jobs listed from {base_url}, {args.latency * 1000:.0f} ms of latency")
+        print(f"{'sequential':>24}: {timed(lambda: sum(1 for _ in sequential_jobs(client, 'app')))}")
+        print(
+            f"{f'Client, prefetch {args.prefetch}':>24}:"
+            f" {timed(lambda: sum(1 for _ in client.get_all_jobs('app', prefetch=args.prefetch)))}"
+        )
+        print(f"{f'AsyncClient, prefetch {args.prefetch}':>24}: {timed(lambda: asyncio.run(async_listing()))}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
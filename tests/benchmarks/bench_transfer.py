@@ -0,0 +1,111 @@
+"""Benchmark of the download of a large data object with `superai.apis.transfer.download_file`.
+
+A mock object store runs in its own process and serves a `--size` MiB object after `--latency` seconds, with ranges,
+streaming each response at `--bandwidth` MiB/s like a remote store throttling every connection. The object is
+downloaded with the former single GET loaded in memory, then in parts of `--part-size` MiB fetched one at a time and
+`--concurrency` at once. The peak memory allocated by the client is traced in each case.
+
+Run with `python -m tests.benchmarks.bench_transfer [--size 256] [--bandwidth 32] [--concurrency 8]`.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import web
+
+from superai.apis.http_session import create_session
+from superai.apis.transfer import TransferOptions, download_file
+
+
+def serve(size, latency, bandwidth, port, ready):
+    content = os.urandom(size)
+    chunk_size = 65536
+
+    async def get_object(request):
+        await asyncio.sleep(latency)
+        start, end, status = 0, size - 1, 200
+        if "Range" in request.headers:
+            start, end = (int(bound) for bound in request.headers["Range"][len("bytes=") :].split("-"))
+            end, status = min(end, size - 1), 206
+        response = web.StreamResponse(
+            status=status, headers={"ETag": '"object"', "Content-Length": str(end - start + 1)}
+        )
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        await response.prepare(request)
+        for offset in range(start, end + 1, chunk_size):
+            await response.write(content[offset : min(offset + chunk_size, end + 1)])
+            await asyncio.sleep(chunk_size / bandwidth)
+        return response
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/object", get_object)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port.value = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def measured(fn, size) -> str:
+    """Time of a run of `fn`, and peak memory of a second run, as tracing the allocations slows it down."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return f"{elapsed:6.2f}s, {size / 2**20 / elapsed:7.1f} MiB/s, {peak / 2**20:7.1f} MiB peak"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=256, help="MiB")
+    parser.add_argument("--bandwidth", type=float, default=32, help="MiB/s per connection")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--part-size", type=int, default=8, help="MiB")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    size = args.size * 2**20
+
+    port, ready = multiprocessing.Value("i", 0), multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=serve, args=(size, args.latency, args.bandwidth * 2**20, port, ready), daemon=True
+    )
+    server.start()
+    ready.wait()
+    url = f"http://127.0.0.1:{port.value}/object"
+    session = create_session(pool_maxsize=args.concurrency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        destination = os.path.join(directory, "object.bin")
+
+        def single_request():
+            with open(destination, "wb") as file:
+                file.write(session.get(url).content)
+
+        def parts(concurrency):
+            options = TransferOptions(part_size=args.part_size * 2**20, max_concurrency=concurrency)
+            return lambda: download_file(session, url, destination, options)
+
+        try:
+            print(f"{args.size} MiB object at {args.bandwidth:.0f} MiB/s per connection from {url}")
+            print(f"{'single request':>24}: {measured(single_request, size)}")
+            print(f"{'parts, one at a time':>24}: {measured(parts(1), size)}")
+            print(f"{f'parts, {args.concurrency} at once':>24}: {measured(parts(args.concurrency), size)}")
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
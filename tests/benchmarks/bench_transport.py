@@ -0,0 +1,68 @@
+"""End-to-end throughput benchmark of the data program transport, driven by the local stand-in agent.
+
+Each scenario stresses one part of the runtime with the workflows of `tests.benchmarks.transport_workflows`:
+
+    pump           all jobs at once, tasks answered immediately: pipe reading, dispatch and writing
+    scheduler      Poisson arrivals and exponential task latencies: workflow pool and future bookkeeping
+    wait_tasks_OR  fan out of 8 tasks per job answered with jittered latencies
+    snapshot       store and restore a snapshot before each task
+    cancel         half of the jobs cancelled while waiting on their task
+    async          `async def` workflow, only meaningful with --asyncio
+
+Every scenario runs `--repeat` times on the same data program after a warm-up, the median run is reported. Random
+draws are seeded, so the same arguments replay the same load.
+
+Run with `python -m tests.benchmarks.bench_transport [--jobs 2000] [--asyncio] [--scenario pump ...]`.
+"""
+import argparse
+import sys
+
+from superai.data_program.protocol.local_agent import Latency, LoadProfile, LocalAgent
+
+SCENARIOS = {
+    "pump": lambda jobs: LoadProfile(suffixes=["single"], jobs=jobs),
+    "scheduler": lambda jobs: LoadProfile(
+        suffixes=["single"], jobs=jobs, rate=jobs, poisson=True, task_latency=Latency(0.05, "exponential")
+    ),
+    "wait_tasks_OR": lambda jobs: LoadProfile(
+        suffixes=["fanout"], jobs=jobs // 4, task_latency=Latency(0.01, "uniform", spread=0.01)
+    ),
+    "snapshot": lambda jobs: LoadProfile(suffixes=["snapshot"], jobs=jobs, snapshot_latency=Latency(0.001)),
+    "cancel": lambda jobs: LoadProfile(
+        suffixes=["single"],
+        jobs=jobs,
+        task_latency=Latency(0.2),
+        cancel_ratio=0.5,
+        cancel_after=Latency(0.05, "exponential"),
+    ),
+    "async": lambda jobs: LoadProfile(suffixes=["single_async"], jobs=jobs),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--asyncio", action="store_true", help="run the transport in asyncio mode")
+    parser.add_argument("--scenario", nargs="*", choices=list(SCENARIOS), default=list(SCENARIOS)[:-1])
+    args = parser.parse_args()
+
+    env = {"SUPERAI_TRANSPORT__ASYNCIO": "true" if args.asyncio else "false"}
+    with LocalAgent() as agent:
+        agent.start([sys.executable, "-m", "tests.benchmarks.transport_workflows"], env=env)
+        agent.run(LoadProfile(suffixes=["single"], jobs=100))
+
+        for name in args.scenario:
+            reports = []
+            for _ in range(args.repeat):
+                profile = SCENARIOS[name](args.jobs)
+                profile.seed = args.seed
+                reports.append(agent.run(profile))
+            reports.sort(key=lambda report: report.jobs_per_second)
+            median = reports[(len(reports) - 1) // 2]
+            print(f"{name:>13}: {median.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Data program driven by the local agent of `bench_transport`.
+
+Run by the benchmark as `python -m tests.benchmarks.transport_workflows`, its workflows subscribe through `@workflow`.
+"""
+from superai.data_program.protocol import transport
+from superai.data_program.protocol.task import (
+    restore_snapshot,
+    store_snapshot,
+    task,
+    wait_tasks_OR,
+    workflow,
+)
+
+FANOUT = 8
+
+
+@workflow("single")
+def single(subject):
+    return task(input=[subject], output=[]).result().values()
+
+
+@workflow("fanout")
+def fanout(subject):
+    pending = {task(input=[subject, i], output=[]) for i in range(FANOUT)}
+    values = []
+    while pending:
+        results = wait_tasks_OR(pending)
+        values.extend(f.result().values() for f in results.done)
+        pending = results.not_done
+    return values
+
+
+@workflow("snapshot")
+def snapshot(subject):
+    store_snapshot({"subject": subject})
+    return task(input=[restore_snapshot()], output=[]).result().values()
+
+
+@workflow("single_async")
+async def single_async(subject):
+    return (await task(input=[subject], output=[])).values()
+
+
+if __name__ == "__main__":
+    transport._task_thread.join()
@@ -0,0 +1,47 @@
+import json
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from superai import Client
+from superai.apis.bulk import SubmittedJob
+from superai.cli import create_jobs
+
+
+def test_create_jobs_from_local_file(tmp_path):
+    inputs = tmp_path / "inputs.jsonl"
+    inputs.write_text('{"url": "a"}\n{"url": "b"}\n')
+    output = tmp_path / "jobs.jsonl"
+    submitted = {0: SubmittedJob("batch", None), 1: SubmittedJob("batch", None)}
+    with patch("superai.apis.jobs.JobsApiMixin.bulk_create_jobs", return_value=submitted) as mocked_method:
+        result = CliRunner().invoke(
+            create_jobs,
+            ["--app_id", "app", "--inputs_file", str(inputs), "--batch_size", "100", "--output", str(output)],
+            obj={"client": Client(api_key="test_key")},
+        )
+
+    assert result.exit_code == 0
+    mocked_method.assert_called_once_with(
+        "app", str(inputs), None, max_batch_inputs=100, max_concurrency=None, checkpoint=None
+    )
+    assert [json.loads(line) for line in output.read_text().splitlines()] == [
+        {"index": 0, "batch_id": "batch", "job_id": None},
+        {"index": 1, "batch_id": "batch", "job_id": None},
+    ]
+
+
+def test_create_jobs_rejects_conflicting_options(tmp_path):
+    inputs = tmp_path / "inputs.jsonl"
+    inputs.write_text('{"url": "a"}\n')
+    with patch("superai.apis.jobs.JobsApiMixin.bulk_create_jobs") as bulk, patch(
+        "superai.apis.jobs.JobsApiMixin.create_jobs"
+    ) as single:
+        for args in [
+            ["--inputs_file", str(inputs), "--inputs", '[{"url": "b"}]'],
+            ["--inputs_file", "https://example.com/inputs.json", "--checkpoint", str(tmp_path / "checkpoint.jsonl")],
+            ["--inputs", '[{"url": "b"}]', "--batch_size", "10", "--concurrency", "2"],
+        ]:
+            result = CliRunner().invoke(create_jobs, ["--app_id", "app"] + args, obj={"client": Client(api_key="key")})
+            assert result.exit_code == 2 and "Usage" in result.output
+    assert "--batch_size, --concurrency only apply" in result.output
+    assert not bulk.called and not single.called
@@ -0,0 +1,111 @@
+import datetime
+import enum
+import json
+import uuid
+
+import jsonpickle
+import pytest
+
+from superai.data_program.protocol import codec as codec_module
+from superai.data_program.protocol import transport
+from superai.data_program.protocol.codec import get_codec
+
+CODECS = [
+    "json",
+    pytest.param("orjson", marks=pytest.mark.skipif(codec_module.orjson is None, reason="orjson is not installed")),
+    pytest.param("msgspec", marks=pytest.mark.skipif(codec_module.msgspec is None, reason="msgspec is not installed")),
+]
+
+
+class Payload:
+    def __init__(self):
+        self.values = {"ids": (1, 2)}
+
+
+class Color(enum.Enum):
+    RED = "red"
+
+
+class Level(enum.IntEnum):
+    HIGH = 2
+
+
+def flatten(obj):
+    return jsonpickle.Pickler(unpicklable=False).flatten(obj)
+
+
+def jsonpickle_encode(obj) -> str:
+    """The encoding of the agent messages before the codecs, compact."""
+    return jsonpickle.encode(obj, unpicklable=False, separators=(",", ":"))
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    data = {"type": "TASK_RESPONSE", "id": 1, "values": [{"text": "é", "box": [0.1, 2, None, True]}], "n": 2**40}
+
+    encoded = codec.dumps(data)
+    assert isinstance(encoded, str)
+    assert " " not in encoded
+    assert codec.loads(encoded) == data
+    assert codec.loads(encoded.encode("utf-8")) == data
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_codec_default_and_fallback(name):
+    codec = get_codec(name, default=flatten)
+    data = {"payload": Payload(), "tags": {"a"}, "big": 2**70, 1: "int key"}
+    assert codec.loads(codec.dumps(data)) == json.loads(jsonpickle.encode(data, unpicklable=False))
+
+
+@pytest.mark.parametrize("name", CODECS)
+@pytest.mark.parametrize(
+    "value",
+    [
+        Color.RED,
+        Level.HIGH,
+        uuid.UUID(int=5),
+        float("nan"),
+        float("-inf"),
+        datetime.datetime(2020, 1, 2, 3, 4, 5),
+        {(1, 2): "tuple key", True: "bool key", None: "none key", Color.RED: "enum key"},
+        [{"ok": 1.5, "nested": {"id": uuid.UUID(int=6), "colors": (Color.RED, Level.HIGH)}}],
+    ],
+)
+def test_codec_matches_jsonpickle(name, value):
+    codec = get_codec(name, default=flatten)
+    message = {"type": "EVALUATE_TASK", "payload": {"value": value}}
+    encoded = codec.dumps(message)
+    assert encoded == jsonpickle_encode(message)
+    assert codec.dumps(codec.loads(encoded)) == encoded
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+def test_auto_codec_prefers_installed_fast_codec(monkeypatch):
+    monkeypatch.setattr(codec_module, "orjson", None)
+    monkeypatch.setattr(codec_module, "msgspec", None)
+    assert get_codec("auto").name == "json"
+
+
+def test_message_round_trip():
+    msg = transport.message({"type": "RESOLVE_JOB", "id": 3}, transport.OperationStatus.JOB_EXPIRED, version=0.2)
+    decoded = transport.message.from_json(msg.to_json)
+    assert decoded.to_dict() == msg.to_dict()
+    assert decoded.meta_info.operation_status == "JOB_EXPIRED"
+
+
+def test_task_and_child_result_round_trip():
+    task = transport.task_result({"id": 1, "sequence": 2, "values": {"a": 1}, "workerId": 7})
+    assert transport.task_result.from_json(task.to_json()).to_dict() == task.to_dict()
+
+    child = transport.child_result({"id": 1, "status": "COMPLETED", "response": {"a": 1}, "dataRef": "s3://x"})
+    assert transport.child_result.from_json(child.to_json()).to_dict() == {
+        "id": 1,
+        "status": "COMPLETED",
+        "response": {"a": 1},
+        "dataRef": "s3://x",
+    }
@@ -0,0 +1,35 @@
+from concurrent.futures import Future
+
+from superai.data_program.protocol.job_state import JobStateRegistry
+
+
+def test_registry_lifecycle():
+    registry = JobStateRegistry(shards=4)
+    states = [registry.create(i, Future()) for i in range(10)]
+    assert len(registry) == 10
+    assert registry.get(3) is states[3]
+    assert 3 in registry
+
+    assert registry.remove(3) is states[3]
+    assert registry.get(3) is None
+    assert registry.remove(3) is None
+    assert len(registry) == 9
+
+
+def test_future_is_created_once():
+    state = JobStateRegistry().create(1, Future())
+    f = state.future(0, Future)
+    assert state.future(0, Future) is f
+    assert state.future(1, Future) is not f
+
+
+def test_terminate_cancels_all_futures():
+    state = JobStateRegistry().create(1, Future())
+    tasks = [state.future(i, Future) for i in range(3)]
+    state.snapshot = Future()
+    state.child_job = Future()
+
+    state.terminate()
+
+    assert state.terminated
+    assert all(f.cancelled() for f in tasks + [state.job_input, state.snapshot, state.child_job])
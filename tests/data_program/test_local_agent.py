@@ -0,0 +1,75 @@
+import random
+import sys
+import textwrap
+
+import pytest
+
+from superai.data_program.protocol.local_agent import Latency, LoadProfile, LocalAgent
+
+DATA_PROGRAM = """
+from superai.data_program.protocol import transport
+from superai.data_program.protocol.task import restore_snapshot, store_snapshot, task, wait_tasks_OR, workflow
+
+
+@workflow("echo")
+def echo(subject):
+    store_snapshot({"subject": subject})
+    pending = {task(input=[restore_snapshot()["subject"], i], output=[]) for i in range(3)}
+    values = []
+    while pending:
+        results = wait_tasks_OR(pending)
+        values.extend(f.result().values() for f in results.done)
+        pending = results.not_done
+    return len(values)
+
+
+@workflow("slow")
+def slow(subject):
+    return task(input=[subject], output=[]).result().values()
+
+
+transport._task_thread.join()
+"""
+
+
+@pytest.fixture
+def agent(tmp_path):
+    script = tmp_path / "data_program.py"
+    script.write_text(textwrap.dedent(DATA_PROGRAM))
+    with LocalAgent() as agent:
+        agent.start([sys.executable, str(script)])
+        yield agent
+
+
+def test_latency_sample():
+    assert Latency(0.5).sample(random.Random(0)) == 0.5
+    assert Latency().sample(random.Random(0)) == 0.0
+    assert 0.4 <= Latency(0.5, "uniform", spread=0.1).sample(random.Random(0)) <= 0.6
+    assert Latency(0.5, "exponential").sample(random.Random(1)) == Latency(0.5, "exponential").sample(random.Random(1))
+    with pytest.raises(ValueError):
+        Latency(0.5, "normal")
+
+
+def test_local_agent_runs_workflows(agent):
+    report = agent.run(LoadProfile(suffixes=["echo"], jobs=20, rate=200, task_latency=Latency(0.005, "exponential")))
+
+    assert report.outcomes == {"RESOLVE_JOB": 20}
+    assert report.unfinished == 0
+    assert report.tasks == 60
+    assert len(report.latencies) == 20
+    assert report.percentile(50) <= report.percentile(99)
+    assert report.jobs_per_second > 0
+
+
+def test_local_agent_cancels_jobs(agent):
+    profile = LoadProfile(
+        suffixes=["slow"], jobs=10, task_latency=Latency(30), cancel_ratio=1, cancel_after=Latency(0.05), timeout=10
+    )
+    report = agent.run(profile)
+
+    assert report.outcomes == {"CANCEL": 10}
+    assert report.latencies == []
+
+    # The data program is still serving after the cancellations
+    report = agent.run(LoadProfile(suffixes=["slow"], jobs=5))
+    assert report.outcomes == {"RESOLVE_JOB": 5}
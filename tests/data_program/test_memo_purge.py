@@ -0,0 +1,111 @@
+import threading
+from concurrent.futures import Future
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from superai import settings
+from superai.data_program.experimental import (
+    delete_all_objects,
+    forget_memo,
+    memoization,
+)
+from superai.data_program.experimental.memo_purge import PrefixPurger
+from superai.data_program.experimental.memo_tiers import S3WriteBehind
+
+BUCKET = "purge-test"
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+    """Mocked AWS Credentials for moto."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SECURITY_TOKEN", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+
+
+@pytest.fixture
+def s3(aws_credentials, monkeypatch):
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        for bucket in (BUCKET, settings.memo_bucket):
+            client.create_bucket(Bucket=bucket)
+            client.put_bucket_versioning(Bucket=bucket, VersioningConfiguration={"Status": "Enabled"})
+        monkeypatch.setattr(memoization, "_s3_client", client)
+        yield client
+
+
+def count_versions(client, bucket, prefix):
+    count = 0
+    for page in client.get_paginator("list_object_versions").paginate(Bucket=bucket, Prefix=prefix):
+        count += len(page.get("Versions", [])) + len(page.get("DeleteMarkers", []))
+    return count
+
+
+def test_purge_follows_pagination(s3):
+    for i in range(1100):
+        s3.put_object(Bucket=BUCKET, Key=f"job/{i}", Body=b"")
+    for i in range(200):
+        s3.put_object(Bucket=BUCKET, Key=f"job/{i}", Body=b"v2")
+    for i in range(50):
+        s3.delete_object(Bucket=BUCKET, Key=f"job/{1000 + i}")
+    s3.put_object(Bucket=BUCKET, Key="other/1", Body=b"")
+
+    # The moto backend is not thread-safe, serialize the requests
+    lock = threading.Lock()
+    calls = []
+
+    def before_call(model, **kwargs):
+        lock.acquire()
+        if model.name == "DeleteObjects":
+            calls.append(1)
+
+    s3.meta.events.register("before-call.s3", before_call)
+    s3.meta.events.register("after-call.s3", lambda **kwargs: lock.release())
+
+    purger = PrefixPurger(lambda: s3, max_workers=2)
+    result = purger.purge(BUCKET, "job/", page_size=300)
+
+    assert isinstance(result, Future)
+    assert result.result(60) == 1350
+    assert len(calls) == 2
+    assert count_versions(s3, BUCKET, "job/") == 0
+    assert count_versions(s3, BUCKET, "other/") == 1
+
+
+def test_purge_reports_listing_errors(s3):
+    result = PrefixPurger(lambda: s3).purge("missing-bucket", "job/")
+    with pytest.raises(s3.exceptions.NoSuchBucket):
+        result.result(10)
+
+
+def test_forget_memo_prefix(s3):
+    folder = f"memo/{settings.name}"
+    for i in range(3):
+        s3.put_object(Bucket=settings.memo_bucket, Key=f"{folder}/job-uuid/{i}", Body=b"")
+    s3.put_object(Bucket=settings.memo_bucket, Key=f"{folder}/job-uuid-2/0", Body=b"")
+
+    assert forget_memo(None, prefix="job-uuid").result(10) == 3
+    assert count_versions(s3, settings.memo_bucket, f"{folder}/job-uuid/") == 0
+    assert delete_all_objects(Bucket=settings.memo_bucket, Prefix=f"{folder}/") == 1
+
+
+def test_forget_memo_prefix_waits_for_started_upload(s3, monkeypatch):
+    folder = f"memo/{settings.name}"
+    started, release = threading.Event(), threading.Event()
+
+    def upload(bucket, key, data):
+        started.set()
+        release.wait(5)
+        s3.put_object(Bucket=bucket, Key=key, Body=data)
+
+    monkeypatch.setattr(memoization, "_s3_writer", S3WriteBehind(upload, max_workers=1))
+    memoization._s3_writer.put(settings.memo_bucket, f"{folder}/job-uuid/late", b"memo")
+    started.wait(5)
+
+    result = forget_memo(None, prefix="job-uuid")
+    threading.Timer(0.05, release.set).start()
+    assert result.result(10) == 1
+    assert count_versions(s3, settings.memo_bucket, f"{folder}/job-uuid/") == 0
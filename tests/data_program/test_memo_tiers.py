@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from superai.data_program.experimental.memo_tiers import (
+    MISSING,
+    LRUCache,
+    S3WriteBehind,
+    SingleFlight,
+)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = LRUCache(2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is MISSING
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+
+    lru.pop_prefix("a")
+    assert lru.get("a", None) is None
+    assert len(lru) == 1
+
+
+def test_single_flight_shares_result_and_error():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def load():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        raise KeyError("missing")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", load)
+        except KeyError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    [t.start() for t in followers]
+    [t.join() for t in [leader, *followers]]
+
+    assert len(calls) == 1
+    assert len(errors) == 4
+    assert flight.do("key", lambda: "loaded") == "loaded"
+
+
+def test_write_behind_coalesces_and_retries():
+    attempts = {}
+    uploaded = []
+    release = threading.Event()
+
+    def upload(bucket, key, data):
+        release.wait(5)
+        attempts[key] = attempts.get(key, 0) + 1
+        if key == "flaky" and attempts[key] < 3:
+            raise ConnectionError("throttled")
+        uploaded.append((key, data))
+
+    writer = S3WriteBehind(upload, max_workers=2, backoff=0.01)
+    writer.put("bucket", "flaky", b"1")
+    writer.put("bucket", "key", b"1")
+    writer.put("bucket", "key", b"2")
+    writer.put("bucket", "key", b"3")
+    assert writer.get("bucket", "key") in (b"2", b"3")
+    release.set()
+
+    assert writer.flush(5)
+    assert ("flaky", b"1") in uploaded
+    assert [data for key, data in uploaded if key == "key"][-1] == b"3"
+    assert attempts["flaky"] == 3
+    assert writer.failed == 0
+
+
+def test_write_behind_gives_up():
+    def upload(bucket, key, data):
+        raise ConnectionError("down")
+
+    writer = S3WriteBehind(upload, max_attempts=2, backoff=0.01)
+    writer.put("bucket", "key", b"")
+    assert writer.flush(5)
+    assert writer.failed == 1
+
+
+def test_write_behind_flush_times_out():
+    writer = S3WriteBehind(lambda *args: time.sleep(1))
+    writer.put("bucket", "key", b"")
+    assert not writer.flush(0.01)
+    assert writer.flush(5)
+
+
+@pytest.mark.parametrize("prefix, remaining", [("a/", ["b/1"]), ("b/", ["a/1", "a/2"])])
+def test_write_behind_discard_prefix(prefix, remaining):
+    release = threading.Event()
+    uploaded = []
+    writer = S3WriteBehind(lambda bucket, key, data: release.wait(5) and uploaded.append(key), max_workers=1)
+    writer.put("bucket", "blocking", b"")
+    for key in ("a/1", "a/2", "b/1"):
+        writer.put("bucket", key, b"")
+    while writer.get("bucket", "blocking") is not None:
+        time.sleep(0.01)
+    writer.discard_prefix("bucket", prefix)
+    release.set()
+    assert writer.flush(5)
+    assert uploaded == ["blocking"] + remaining
+
+
+def test_write_behind_flush_prefix_waits_for_started_uploads():
+    release = threading.Event()
+    uploaded = []
+    writer = S3WriteBehind(lambda bucket, key, data: release.wait(5) and uploaded.append(key), max_workers=1)
+    writer.put("bucket", "a/1", b"")
+    writer.put("bucket", "a/2", b"")
+    while writer.get("bucket", "a/1") is not None:
+        time.sleep(0.01)
+
+    assert not writer.flush_prefix("bucket", "a/", timeout=0.01)
+    threading.Timer(0.05, release.set).start()
+    assert writer.flush_prefix("bucket", "a/", timeout=5)
+    assert uploaded == ["a/1"]
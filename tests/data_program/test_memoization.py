@@ -1,7 +1,24 @@
+import asyncio
 import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import boto3
+import joblib
+import pytest
+from moto import mock_s3
 
 from superai import settings
-from superai.data_program.experimental import memo, memoization
+from superai.data_program.experimental import (
+    async_memo,
+    flush_memo,
+    forget_memo,
+    memo,
+    memoization,
+)
+from superai.data_program.experimental.memo_tiers import LRUCache, S3WriteBehind
 
 
 def method():
@@ -24,3 +41,173 @@ def test_memo(monkeypatch, tmp_path):
     cache[filepath] = method()
     result = memo(method, filename)
     assert result == method()
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+    """Mocked AWS Credentials for moto."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SECURITY_TOKEN", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+
+
+@pytest.fixture
+def s3(aws_credentials, monkeypatch):
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=settings.memo_bucket)
+        monkeypatch.setattr(memoization, "_s3_client", client)
+        yield client
+
+
+@pytest.fixture
+def local_tiers(monkeypatch, tmp_path):
+    monkeypatch.setattr(memoization, "cache_settings", dict(directory=str(tmp_path), size_limit=1 << 20))
+    monkeypatch.setattr(memoization, "cache", None)
+    monkeypatch.setattr(memoization, "_lru", LRUCache(16))
+    memoization._init_cache()
+
+
+def clear_local_tiers():
+    memoization._lru.clear()
+    memoization.cache.clear()
+
+
+def test_memo_tiers(s3, local_tiers):
+    calls = []
+
+    def method():
+        calls.append(1)
+        return {"status": "COMPLETE", "result": len(calls)}
+
+    filepath = os.path.join("memo", settings.name, "tiers/1")
+    assert memo(method, "tiers/1") == {"status": "COMPLETE", "result": 1}
+    assert memo(method, "tiers/1") == {"status": "COMPLETE", "result": 1}
+    assert memoization.cache[filepath] == {"status": "COMPLETE", "result": 1}
+
+    # The S3 write happens in the background
+    assert flush_memo(10)
+    body = s3.get_object(Bucket=settings.memo_bucket, Key=filepath)["Body"].read()
+    assert joblib.load(BytesIO(body)) == {"status": "COMPLETE", "result": 1}
+
+    # A fresh process finds the entry in S3
+    clear_local_tiers()
+    assert memo(method, "tiers/1") == {"status": "COMPLETE", "result": 1}
+    assert len(calls) == 1
+
+    assert memo(method, "tiers/1", refresh=True) == {"status": "COMPLETE", "result": 2}
+    assert memo(method, "tiers/1") == {"status": "COMPLETE", "result": 2}
+
+
+def test_memo_results_are_not_shared(s3, local_tiers):
+    result = memo(lambda: {"values": [1]}, "tiers/2")
+    result["values"].append(2)
+    assert memo(lambda: None, "tiers/2") == {"values": [1]}
+    assert flush_memo(10)
+
+
+def test_memo_loads_once_for_concurrent_callers(s3, local_tiers):
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def method():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    def call():
+        barrier.wait()
+        return memo(method, "tiers/3")
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: call(), range(8)))
+
+    assert results == ["result"] * 8
+    assert len(calls) == 1
+    assert flush_memo(10)
+
+
+def test_memo_gives_concurrent_callers_their_own_result(s3, local_tiers):
+    barrier = threading.Barrier(2)
+
+    def method():
+        time.sleep(0.2)
+        return {"values": [1]}
+
+    def call():
+        barrier.wait()
+        return memo(method, "tiers/6")
+
+    with ThreadPoolExecutor(2) as executor:
+        first, second = executor.map(lambda _: call(), range(2))
+
+    assert first == second == {"values": [1]} and first is not second
+    first["values"].append(2)
+    assert second == {"values": [1]}
+    assert flush_memo(10)
+
+
+def test_async_memo_gives_concurrent_callers_their_own_result(s3, local_tiers):
+    async def method():
+        await asyncio.sleep(0.1)
+        return {"values": [1]}
+
+    async def main():
+        return await asyncio.gather(*(async_memo(method, "async/shared") for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert all(result == {"values": [1]} for result in results)
+    assert len({id(result) for result in results}) == 3
+    assert flush_memo(10)
+
+
+def test_forget_memo_drops_pending_write(s3, local_tiers, monkeypatch):
+    release = threading.Event()
+    uploads = []
+
+    def upload(s3_bucket, filename, data):
+        release.wait(5)
+        uploads.append(filename)
+
+    monkeypatch.setattr(memoization, "_s3_writer", S3WriteBehind(upload, max_workers=1))
+
+    memo(lambda: "blocking", "tiers/4")
+    memo(lambda: "forgotten", "tiers/5")
+    forget_memo("tiers/5")
+    release.set()
+
+    assert flush_memo(5)
+    assert uploads == [os.path.join("memo", settings.name, "tiers/4")]
+    assert memo(lambda: "recomputed", "tiers/5") == "recomputed"
+
+
+def test_async_memo_shares_tiers(s3, local_tiers, monkeypatch):
+    monkeypatch.setattr(boto3.session, "Session", None)  # must reuse the module client
+    calls = []
+
+    async def method():
+        calls.append(1)
+        result = {"result": len(calls)}
+        await asyncio.sleep(0.1)
+        return result
+
+    async def main():
+        return await asyncio.gather(*(async_memo(method, f"async/{i % 10}") for i in range(100)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 10
+    assert sorted({result["result"] for result in results}) == list(range(1, 11))
+
+    # Entries are visible to the sync memo and reach S3
+    filepath = os.path.join("memo", settings.name, "async/0")
+    assert memo(lambda: None, "async/0") == results[0]
+    assert flush_memo(10)
+    body = s3.get_object(Bucket=settings.memo_bucket, Key=filepath)["Body"].read()
+    assert joblib.load(BytesIO(body)) == results[0]
+
+    clear_local_tiers()
+    assert asyncio.run(async_memo(method, "async/0")) == results[0]
+    assert len(calls) == 10
+    assert asyncio.run(async_memo(method, "async/0", refresh=True)) == {"result": 11}
+    assert flush_memo(10)
@@ -0,0 +1,51 @@
+import io
+import threading
+
+from superai.data_program.protocol.pipe_writer import PipeWriter
+
+
+class RecordingPipe(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_pipe_writer_preserves_order():
+    pipe = RecordingPipe()
+    writer = PipeWriter(pipe, linger=0)
+    for i in range(100):
+        writer.write(f'{{"sequence": {i}}}')
+    assert writer.flush(5)
+    assert pipe.getvalue().splitlines() == [f'{{"sequence": {i}}}' for i in range(100)]
+    writer.close(5)
+
+
+def test_pipe_writer_coalesces_messages():
+    pipe = RecordingPipe()
+    writer = PipeWriter(pipe, linger=0.2)
+    threads = [threading.Thread(target=writer.write, args=(str(i),)) for i in range(50)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    writer.close(5)
+    assert sorted(pipe.getvalue().splitlines(), key=int) == [str(i) for i in range(50)]
+    assert pipe.writes < 50
+    assert pipe.writes == pipe.flushes
+
+
+def test_pipe_writer_respects_batch_size():
+    pipe = RecordingPipe()
+    writer = PipeWriter(pipe, max_batch_bytes=10, linger=1)
+    writer.write("0123456789")
+    writer.write("abc")
+    assert writer.flush(5)
+    assert pipe.getvalue() == "0123456789\nabc\n"
+    assert pipe.writes == 2
+    writer.close(5)
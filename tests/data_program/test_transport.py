@@ -0,0 +1,187 @@
+import asyncio
+import json
+import threading
+import time
+
+import jsonpickle
+import pytest
+
+from superai.data_program.protocol import transport
+from superai.data_program.protocol.workflow_pool import WorkflowPool
+
+EXECUTE_RESPONSE = {
+    "type": "EXECUTE",
+    "id": 42,
+    "uuid": "job-uuid",
+    "suffix": "test",
+    "projectId": "project",
+    "child": False,
+    "subject": {"value": 1},
+}
+
+
+@pytest.fixture
+def resolved(monkeypatch):
+    results = []
+
+    def resolve_job(response, data_folder, bill):
+        results.append((transport._context.id, response))
+
+    monkeypatch.setattr(transport, "resolve_job", resolve_job)
+    return results
+
+
+def test_job_context_is_isolated_between_threads():
+    seen = {}
+
+    def job(id):
+        transport._context.bind()
+        transport._context.id = id
+        barrier.wait()
+        seen[id] = transport._context.id
+
+    barrier = threading.Barrier(2)
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(2)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert seen == {0: 0, 1: 1}
+
+
+def test_job_context_is_isolated_between_tasks():
+    async def job(id):
+        transport._context.bind()
+        transport._context.id = id
+        await asyncio.sleep(0)
+        return transport._context.id
+
+    async def main():
+        return await asyncio.gather(*(job(i) for i in range(5)))
+
+    assert asyncio.run(main()) == list(range(5))
+
+
+def test_future_is_awaitable():
+    f = transport.future()
+
+    async def main():
+        asyncio.get_running_loop().call_later(0.01, f.set_result, {"id": 1, "values": "done"})
+        return await f
+
+    assert asyncio.run(main()) == {"id": 1, "values": "done"}
+
+
+def test_cancelled_future_raises_on_await():
+    f = transport.future()
+    f.cancel()
+
+    async def main():
+        return await f
+
+    with pytest.raises(transport.concurrent.futures.CancelledError):
+        asyncio.run(main())
+
+
+def test_workflow_thread(monkeypatch, resolved):
+    monkeypatch.setitem(transport._workflow_functions, "test", lambda subject, context: subject["value"] + 1)
+    transport._worklow_thread(42, "test", EXECUTE_RESPONSE)
+    assert resolved == [(42, 2)]
+    assert 42 not in transport._jobs
+
+
+def test_coroutine_workflow_in_thread(monkeypatch, resolved):
+    async def workflow(subject, context):
+        await asyncio.sleep(0)
+        return subject["value"] + 2
+
+    monkeypatch.setitem(transport._workflow_functions, "test", workflow)
+    transport._worklow_thread(42, "test", EXECUTE_RESPONSE)
+    assert resolved == [(42, 3)]
+
+
+def test_workflow_coroutine(monkeypatch, resolved):
+    async def workflow(subject, context):
+        f = transport._context.state.future(0, transport.task_future)
+        asyncio.get_running_loop().call_later(0.01, f.set_result, {"values": subject["value"]})
+        return (await f).values()
+
+    monkeypatch.setitem(transport._workflow_functions, "test", workflow)
+    asyncio.run(transport._workflow_coroutine(42, "test", EXECUTE_RESPONSE))
+    assert resolved == [(42, 1)]
+    assert 42 not in transport._jobs
+
+
+def test_message_to_json_matches_jsonpickle():
+    class Payload:
+        def __init__(self):
+            self.values = {"ids": (1, 2)}
+
+    body = {"type": "EVALUATE_TASK", "id": 1, "payload": {"input": Payload(), "tags": {"a"}, "text": "é"}}
+    message = transport.message(body, transport.OperationStatus.FAILED)
+    assert json.loads(message.to_json) == json.loads(jsonpickle.encode(message, unpicklable=False))
+
+
+def test_cancel_terminates_running_job(monkeypatch, resolved):
+    started = threading.Event()
+    monkeypatch.setattr(transport, "_report_workflow_error", lambda id, response, error: errors.append(error))
+    errors = []
+
+    def workflow(subject, context):
+        f = transport._context.state.future(0, transport.task_future)
+        started.set()
+        return f.result()
+
+    monkeypatch.setitem(transport._workflow_functions, "test", workflow)
+    thread = threading.Thread(target=transport._worklow_thread, args=(42, "test", EXECUTE_RESPONSE))
+    thread.start()
+    started.wait(5)
+    transport._handle_response({"type": "CANCEL", "id": 42})
+    thread.join(5)
+
+    assert resolved == []
+    assert isinstance(errors[0], transport.concurrent.futures.CancelledError)
+    assert 42 not in transport._jobs
+
+
+def test_nested_schedule_workflow_on_a_single_worker(monkeypatch, resolved):
+    """A parent workflow waiting for its child job can't starve the child of the only worker."""
+    monkeypatch.setattr(transport, "_workflow_pool", WorkflowPool(max_workers=1))
+    child_response = dict(EXECUTE_RESPONSE, id=43, uuid="child-uuid", suffix="child", child=True)
+
+    def agent(line):
+        # The agent executes the scheduled child in this process, and answers the parent once it is resolved
+        body = json.loads(line)["body"]
+        if body["type"] == "EXECUTE_JOB":
+            transport._handle_response(dict(child_response, subject=body["subject"], parent_sequence=body["sequence"]))
+
+    def resolve_job(response, data_folder, bill):
+        resolved.append((transport._context.id, response))
+        if transport._context.id == 43:
+            child = {"type": "CHILD_RESPONSE", "id": 42, "sequence": 0, "response": {"value": response}}
+            threading.Thread(target=transport._handle_response, args=(child,)).start()
+
+    def parent(subject, context):
+        child = transport.schedule_workflow("child", subject, None, None, None, None, "child", None, None, None)
+        return child.result(5).response()["value"]
+
+    monkeypatch.setattr(transport, "writeln_to_pipe_and_flush", agent)
+    monkeypatch.setattr(transport, "resolve_job", resolve_job)
+    monkeypatch.setitem(transport._workflow_functions, "test", parent)
+    monkeypatch.setitem(transport._workflow_functions, "child", lambda subject, context: subject["value"] * 10)
+    transport._handle_response(EXECUTE_RESPONSE)
+
+    deadline = time.monotonic() + 5
+    while len(resolved) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert resolved == [(43, 10), (42, 10)]
+
+
+def test_to_json_with_non_string_keys_matches_jsonpickle():
+    body = {"type": "EVALUATE_TASK", "id": 1, "payload": {"cells": {(1, 2): "x", (3, 4): {"ok": True}}}}
+    message = transport.message(body)
+    assert json.loads(message.to_json) == json.loads(jsonpickle.encode(message, unpicklable=False))
+    assert json.loads(message.to_json)["body"]["payload"]["cells"] == {"(1, 2)": "x", "(3, 4)": {"ok": True}}
+
+    task = transport.task_result({"id": 1, "values": {(0, 1): "cell"}})
+    assert json.loads(task.to_json()) == {"id": 1, "values": {"(0, 1)": "cell"}}
+    child = transport.child_result({"id": 1, "response": {(0, 1): "cell"}})
+    assert json.loads(child.to_json())["response"] == {"(0, 1)": "cell"}
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from superai.data_program.protocol.workflow_pool import AsyncWorkflowPool, WorkflowPool
+
+
+def test_workflow_pool_bounds_concurrency():
+    pool = WorkflowPool(max_workers=2)
+    release = threading.Event()
+    running = []
+
+    def job(i):
+        running.append(i)
+        release.wait(5)
+        return i * 2
+
+    futures = [pool.submit(i, job, i, name=f"job-{i}") for i in range(5)]
+    while len(running) < 2:
+        pass
+
+    stats = pool.stats()
+    assert stats.active == 2
+    assert stats.queued == 3
+    assert len(running) == 2
+
+    release.set()
+    assert [f.result(5) for f in futures] == [0, 2, 4, 6, 8]
+    pool.shutdown()
+
+    stats = pool.stats()
+    assert stats.started == stats.completed == 5
+    assert stats.queued == stats.active == 0
+    assert stats.max_wait_time > 0
+    assert len(pool._workers) == 2
+
+
+def test_workflow_pool_cancels_queued_jobs():
+    pool = WorkflowPool(max_workers=1)
+    release = threading.Event()
+    first = pool.submit(1, release.wait, 5)
+    second = pool.submit(2, lambda: pytest.fail("cancelled job must not run"))
+
+    assert pool.cancel(2)
+    assert not pool.cancel(2)
+    assert second.cancelled()
+
+    release.set()
+    assert first.result(5)
+    pool.shutdown()
+    assert pool.stats().cancelled == 1
+    assert pool.stats().started == 1
+
+
+def test_workflow_pool_rejects_duplicate_queued_job():
+    pool = WorkflowPool(max_workers=1)
+    release = threading.Event()
+    pool.submit(1, release.wait, 5)
+    pool.submit(2, lambda: None)
+    with pytest.raises(ValueError):
+        pool.submit(2, lambda: None)
+    release.set()
+    pool.shutdown()
+
+
+def test_async_workflow_pool():
+    async def main():
+        pool = AsyncWorkflowPool(max_workers=3)
+        running = 0
+        peak = 0
+
+        async def job(i):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return i
+
+        futures = [pool.submit(i, job, i) for i in range(10)]
+        assert pool.cancel(9)
+        results = await asyncio.gather(*futures[:9])
+        return pool.stats(), peak, results
+
+    stats, peak, results = asyncio.run(main())
+    assert results == list(range(9))
+    assert peak == 3
+    assert stats.completed == 9
+    assert stats.cancelled == 1
+
+
+def test_workflow_pool_runs_jobs_queued_behind_a_blocked_worker():
+    pool = WorkflowPool(max_workers=1)
+
+    def parent():
+        child = pool.submit("child", lambda: "done")
+        with pool.blocked():
+            return child.result(5)
+
+    assert pool.submit("parent", parent).result(5) == "done"
+    stats = pool.stats()
+    assert stats.completed == 2 and stats.blocked == 0
+    # The worker started for the child stops once the parent resumed
+    deadline = time.monotonic() + 5
+    while len(pool._workers) > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(pool._workers) == 1
+    pool.shutdown()
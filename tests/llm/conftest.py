@@ -0,0 +1,12 @@
+import pytest
+
+from superai.llm.foundation_models.cache import default_response_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Tests don't see the responses cached by the previous ones."""
+    cache = default_response_cache()
+    if cache is not None:
+        cache.clear()
+    yield
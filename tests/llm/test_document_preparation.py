@@ -1,12 +1,17 @@
+import copy
 import json
+import random
 from pathlib import Path
 
 import pytest
 import tiktoken
 
+from superai.llm.data_processing import document_preparation
 from superai.llm.data_processing.document_preparation import (
     DocumentToString,
     _replace_checkbox_kv_pairs,
+    filter_tokens_by_text_box,
+    intersect,
 )
 
 
@@ -83,6 +88,22 @@ def test_line_numbers(form_ocr):
     assert serialized_doc[0].split("\n")[3][0] == "3"
 
 
+def test_empty_document():
+    extractor = DocumentToString(False, False, "whitespace", None, 4000, include_line_number=True)
+    assert extractor.get_document_representation([], None, None) == ["0:  "]
+    extractor.representation = "line"
+    assert extractor.get_document_representation([], None, None) == []
+
+
+def test_kv_keeps_empty_pages_before_max_pages(form_ocr):
+    # Tokens on pages 1 and 4 only, pages 2 and 3 are empty
+    ocr_values = [token for token in form_ocr["__ocr_values__"] if token["pageNumber"] in (1, 4)]
+    extractor = DocumentToString(False, False, "whitespace", 3, 4000, include_line_number=True)
+    expected = extractor.get_document_representation(ocr_values, None, None)
+    extractor.format_kv_checkboxes = True
+    assert extractor.get_document_representation(ocr_values, [], None) == expected
+
+
 def test_get_white_space_line_dict(invoice_ocr):
     extractor = DocumentToString(False, False, "whitespace", None, 4000, include_line_number=True)
     serialized_doc = extractor.get_document_representation(invoice_ocr["__ocr_values__"], None, None)
@@ -112,3 +133,153 @@ def test_replace_checkbox_kv_pairs(form_ocr):
     ]
     ocr_values = _replace_checkbox_kv_pairs(ocr_values, ocr_key_values)
     assert ocr_values[0]["content"] == "Box-[X]"
+
+
+def reference_string_chunks(extractor, per_page_representation, page_separation=False):
+    """The former chunker, encoding the whole chunk again for every line."""
+    encoder = tiktoken.encoding_for_model(extractor.tokenizer_model)
+    included_lines = []
+    document_chunks = []
+    line_number = 0
+    for page in per_page_representation:
+        for line in page.split("\n"):
+            final_line = (f"{line_number}:  " if extractor.include_line_number else "") + line
+            updated_chunk_length = len(encoder.encode("\n".join(included_lines + [final_line])))
+            if updated_chunk_length > extractor.max_token and not included_lines:
+                raise ValueError(f"Line has {updated_chunk_length} token")
+            if updated_chunk_length < extractor.max_token:
+                included_lines.append(final_line)
+            else:
+                document_chunks.append("\n".join(included_lines))
+                included_lines = [final_line]
+            line_number += 1
+        if page_separation:
+            document_chunks.append("\n".join(included_lines))
+            included_lines = []
+    document_chunks.append("\n".join(included_lines))
+    return [chunk for chunk in document_chunks if len(chunk) > 0]
+
+
+@pytest.mark.parametrize("representation", ["line", "whitespace"])
+@pytest.mark.parametrize("include_line_number", [False, True])
+@pytest.mark.parametrize("max_token", [60, 300, 4000])
+def test_string_chunks_match_reference(form_ocr, invoice_ocr, representation, include_line_number, max_token):
+    extractor = DocumentToString(False, False, representation, None, max_token, include_line_number=include_line_number)
+    for ocr in (form_ocr, invoice_ocr):
+        pages = extractor._get_per_page_representation(ocr["__ocr_values__"], None, None)
+        for page_separation in (False, True):
+            assert extractor._get_string_chunks(pages, page_separation) == reference_string_chunks(
+                extractor, pages, page_separation
+            )
+
+
+def test_string_chunks_match_reference_on_edge_cases():
+    # Whitespace, new line and punctuation runs across line boundaries change the tokenization of the joined text
+    rng = random.Random(0)
+    atoms = ["", " ", "  ", "\t", "\r", "/", "a/b", ".", "...", "!!", ":", "|", "foo", "Bar", "123", "4567", "'s", "日本"]
+    for _ in range(300):
+        pages = [
+            "\n".join("".join(rng.choices(atoms, k=rng.randint(0, 6))) for _ in range(rng.randint(1, 30)))
+            for _ in range(rng.randint(1, 3))
+        ]
+        extractor = DocumentToString(
+            False, False, "line", None, rng.choice([8, 20, 60]), include_line_number=rng.random() < 0.3
+        )
+        try:
+            expected = reference_string_chunks(extractor, pages)
+        except ValueError:
+            with pytest.raises(ValueError):
+                extractor._get_string_chunks(pages)
+            continue
+        assert extractor._get_string_chunks(pages) == expected
+
+
+def reference_replace_checkbox_kv_pairs(ocr_values, ocr_key_values):
+    """The former checkbox normalization, testing every token and every pair of key boxes."""
+    kv = [item for item in ocr_key_values if "value" in item]
+    kv = [item for item in kv if item["value"]["content"] in (":selected:", ":unselected:")]
+    matched = [
+        j
+        for i in range(len(kv))
+        for j in range(i + 1, len(kv))
+        if intersect(kv[i]["key"]["boundingBox"], kv[j]["key"]["boundingBox"])
+        and kv[i]["key"]["pageNumber"] == kv[j]["key"]["pageNumber"]
+    ]
+    for i, e in enumerate(kv):
+        if i in matched:
+            continue
+        page_number = e["value"]["pageNumber"]
+        ocr_values = filter_tokens_by_text_box(ocr_values, e["key"]["boundingBox"], page_number)
+        ocr_values = filter_tokens_by_text_box(ocr_values, e["value"]["boundingBox"], page_number)
+        box_str = "[ ]" if e["value"]["content"] == ":unselected:" else "[X]"
+        ocr_values.append(
+            {
+                "content": f"{e['key']['content']}-{box_str}",
+                "boundingBox": e["key"]["boundingBox"],
+                "pageNumber": page_number,
+            }
+        )
+    return ocr_values
+
+
+def test_replace_checkbox_kv_pairs_matches_reference(form_ocr):
+    assert _replace_checkbox_kv_pairs(form_ocr["__ocr_values__"], form_ocr["__key_values__"]) == (
+        reference_replace_checkbox_kv_pairs(form_ocr["__ocr_values__"], form_ocr["__key_values__"])
+    )
+
+    # Dense forms with overlapping checkboxes across pages
+    rng = random.Random(0)
+
+    def box():
+        return {"left": rng.randint(0, 500), "top": rng.randint(0, 500), "width": rng.randint(0, 30), "height": 10}
+
+    ocr_values = [{"content": str(i), "boundingBox": box(), "pageNumber": rng.randint(1, 3)} for i in range(2000)]
+    ocr_key_values = [
+        {
+            "key": {"content": f"key{i}", "boundingBox": box(), "pageNumber": page},
+            "value": {
+                "content": rng.choice([":selected:", ":unselected:", "text"]),
+                "boundingBox": box(),
+                "pageNumber": page,
+            },
+        }
+        for i, page in enumerate(rng.randint(1, 3) for _ in range(300))
+    ]
+    assert _replace_checkbox_kv_pairs(ocr_values, ocr_key_values) == reference_replace_checkbox_kv_pairs(
+        ocr_values, ocr_key_values
+    )
+
+
+def test_iter_document_representation_streams_pages(form_ocr, monkeypatch):
+    rendered = []
+    render = document_preparation._render_white_space_page
+
+    def render_page(page, *args, **kwargs):
+        rendered.append(page)
+        return render(page, *args, **kwargs)
+
+    monkeypatch.setattr(document_preparation, "_render_white_space_page", render_page)
+    ocr_values = copy.deepcopy(form_ocr["__ocr_values__"])
+    extractor = DocumentToString(False, False, "whitespace", None, 100)
+
+    chunks = extractor.iter_document_representation(ocr_values, None, None)
+    assert not rendered
+    assert next(chunks)
+    assert len(rendered) == 1
+    assert [next(chunks)] + list(chunks) == extractor.get_document_representation(ocr_values, None, None)[1:]
+    # The caller's tokens are left untouched
+    assert ocr_values == form_ocr["__ocr_values__"]
+
+    rendered.clear()
+    extractor.max_pages = 1
+    assert extractor.get_document_representation(ocr_values, None, None)
+    assert len(rendered) == 1
+    assert {token["pageNumber"] for token in rendered[0]} == {1}
+
+
+@pytest.mark.parametrize("representation", ["line", "whitespace"])
+def test_iter_document_representation_in_processes(form_ocr, representation):
+    serial = DocumentToString(True, False, representation, None, 200, include_line_number=True)
+    parallel = DocumentToString(True, False, representation, None, 200, include_line_number=True, processes=2)
+    args = (form_ocr["__ocr_values__"], form_ocr["__key_values__"], None)
+    assert list(parallel.iter_document_representation(*args)) == serial.get_document_representation(*args)
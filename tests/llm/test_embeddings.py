@@ -0,0 +1,119 @@
+import random
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from superai.llm.foundation_models import OpenAIEmbedding
+from superai.llm.foundation_models.cache import MemoryResponseCache
+from superai.llm.foundation_models.embedding_store import EmbeddingStore, embedding_key
+from superai.llm.tokenizers import count_tokens
+
+
+def vector(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 97), 0.5]
+
+
+@pytest.fixture()
+def create(monkeypatch):
+    def fake_create(model, input, **kwargs):
+        data = [{"object": "embedding", "index": i, "embedding": vector(text)} for i, text in enumerate(input)]
+        # The API doesn't guarantee the order of the embeddings
+        random.Random(len(input)).shuffle(data)
+        return {"object": "list", "data": data}
+
+    create = Mock(side_effect=fake_create)
+    monkeypatch.setattr("openai.Embedding.create", create)
+    return create
+
+
+def texts(n):
+    return [f"document number {i} " * (1 + i % 5) for i in range(n)]
+
+
+def test_embed_batches_in_order(create):
+    model = OpenAIEmbedding(cache=None, max_batch_size=8, max_batch_tokens=10**6)
+    corpus = texts(50)
+    vectors = model.embed(corpus)
+
+    assert vectors.dtype == np.float32 and vectors.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(vectors, np.array([vector(text) for text in corpus], dtype=np.float32))
+    assert create.call_count == 7
+    assert all(len(call.kwargs["input"]) <= 8 for call in create.call_args_list)
+
+
+def test_embed_respects_token_budget(create):
+    corpus = texts(40)
+    budget = 60
+    model = OpenAIEmbedding(cache=None, max_batch_size=2048, max_batch_tokens=budget)
+    model.embed(corpus)
+
+    batches = [call.kwargs["input"] for call in create.call_args_list]
+    assert [text for batch in batches for text in batch] == corpus
+    assert all(sum(count_tokens(text, model.engine) for text in batch) <= budget for batch in batches)
+    # Batches are only cut when the next text doesn't fit
+    for batch, following in zip(batches, batches[1:]):
+        assert sum(count_tokens(text, model.engine) for text in batch + following[:1]) > budget
+
+
+def test_embed_deduplicates_and_predict(create):
+    model = OpenAIEmbedding(cache=None)
+    vectors = model.embed(["a", "b", "a", "a"])
+    assert create.call_args.kwargs["input"] == ["a", "b"]
+    np.testing.assert_array_equal(vectors[0], vectors[2])
+
+    assert model.predict("abc") == pytest.approx(vector("abc"))
+    assert model.predict(["abc", "d"]) == [pytest.approx(vector("abc")), pytest.approx(vector("d"))]
+    assert model.embed([]).shape == (0, 1536)
+
+
+def test_embed_caches_single_texts_only(create):
+    cache = MemoryResponseCache()
+    model = OpenAIEmbedding(cache=cache)
+    model.embed(texts(20))
+    assert len(cache) == 0
+
+    assert model.predict("abc") == model.predict("abc") == pytest.approx(vector("abc"))
+    assert len(cache) == 1 and create.call_count == 2
+
+
+def test_embed_with_store(create, tmp_path):
+    corpus = texts(30)
+    model = OpenAIEmbedding(cache=None, store=EmbeddingStore(str(tmp_path)))
+    expected = model.embed(corpus)
+    assert create.call_count == 1
+
+    # Re-embedding the corpus from a new process only reads the store
+    model = OpenAIEmbedding(cache=None, store=EmbeddingStore(str(tmp_path)))
+    np.testing.assert_array_equal(model.embed(corpus), expected)
+    assert create.call_count == 1
+
+    vectors = model.embed(corpus[:5] + ["something new"] + corpus[5:])
+    assert create.call_args.kwargs["input"] == ["something new"]
+    np.testing.assert_array_equal(vectors[6:], expected[5:])
+    assert len(model.store) == 31
+
+
+def test_store_recovers_interrupted_add(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    keys = [embedding_key(str(i), "model") for i in range(3)]
+    store.add(keys, np.arange(12, dtype=np.float32).reshape(3, 4))
+    store.add(keys[:1], np.zeros((1, 4)))
+    assert len(store) == 3
+
+    # A row written without its key, as if the process died in between
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.ones(4, dtype=np.float32).tobytes())
+    store = EmbeddingStore(str(tmp_path))
+    assert len(store) == 3 and store.dimension == 4
+    np.testing.assert_array_equal(store.get(keys[1:2])[0], [4, 5, 6, 7])
+    assert store.get([embedding_key("3", "model")]) == [None]
+
+    with pytest.raises(ValueError):
+        store.add([embedding_key("3", "model")], np.zeros((1, 5)))
+
+    store.add([embedding_key("3", "model")], np.ones((1, 4)))
+    assert [v.tolist() for v in EmbeddingStore(str(tmp_path)).get(keys[2:] + [embedding_key("3", "model")])] == [
+        [8, 9, 10, 11],
+        [1, 1, 1, 1],
+    ]
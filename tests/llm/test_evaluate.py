@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from superai.llm.evaluate import Evaluator, StreamingEvaluator
+
+
+def reference_counts(gt, pred):
+    """Counts of the per-record evaluation loop the vectorized one replaced."""
+    tp = fp = tn = fn = ip = 0
+    for g, p in zip(gt, pred):
+        if g != "" and p != "":
+            if g == p:
+                tp += 1
+            else:
+                ip += 1
+        elif g == "" and p != "":
+            fp += 1
+        elif g != "" and p == "":
+            fn += 1
+        else:
+            tn += 1
+    return tp, fp, tn, fn, ip
+
+
+def records(n, seed):
+    rng = random.Random(seed)
+    values = ["", "", "a", "b", "c", None, 1]
+    ground_truth, predictions = [], []
+    for _ in range(n):
+        ground_truth.append({f"field_{k}": rng.choice(values) for k in range(6) if rng.random() < 0.9})
+        predictions.append({f"field_{k}": rng.choice(values) for k in range(7) if rng.random() < 0.9})
+    return ground_truth, predictions
+
+
+def test_evaluate_matches_reference():
+    ground_truth, predictions = records(500, seed=0)
+    results = Evaluator(ground_truth, predictions, chunk_size=64).evaluate(as_formatted_string=False)
+
+    keys = set().union(*(d.keys() for d in ground_truth))
+    assert set(results) == keys
+    for key in keys:
+        gt = [d.get(key, "") for d in ground_truth]
+        pred = [d.get(key, "") for d in predictions]
+        assert results[key] == Evaluator._compute_metrics(*reference_counts(gt, pred))
+        assert Evaluator._count_metrics(gt, pred) == reference_counts(gt, pred)
+
+    assert "correct_positive" in Evaluator(ground_truth, predictions).evaluate()
+
+
+def test_streaming_evaluator_chunks():
+    ground_truth, predictions = records(300, seed=1)
+    # A field which only appears in the ground truth of the last chunk, but in predictions before
+    ground_truth[-1]["late"] = "x"
+    predictions[3]["late"] = "y"
+    expected = StreamingEvaluator().update(ground_truth, predictions)
+
+    streaming = StreamingEvaluator()
+    for start in range(0, 300, 37):
+        streaming.update(ground_truth[start : start + 37], predictions[start : start + 37])
+    assert streaming.total == 300
+    assert streaming.results() == expected.results()
+    assert streaming.counts().loc["late"].tolist() == [0, 1, 298, 1, 0]
+    assert streaming.mismatches(None).equals(expected.mismatches(None))
+
+
+def test_fields_of_ground_truth_without_predictions():
+    ground_truth, predictions = records(100, seed=2)
+    ground_truth.append({"late": "x"})
+    results = Evaluator(ground_truth, predictions, chunk_size=32).evaluate(as_formatted_string=False)
+    assert set(results) == set().union(*(d.keys() for d in ground_truth))
+    assert results["late"] == Evaluator._compute_metrics(*reference_counts([""] * 100, [""] * 100))
+
+    streaming = StreamingEvaluator().update(ground_truth, predictions)
+    assert streaming.total == 100 and streaming.counts().loc["late"].tolist() == [0, 0, 100, 0, 0]
+
+
+def test_mismatches_table():
+    ground_truth = [{"a": "1", "b": "x"}, {"a": "2", "b": ""}, {"a": "", "b": "y"}]
+    predictions = [{"a": "1", "b": "z"}, {"a": "", "b": "w", "extra": "e"}, {"a": "3"}]
+    evaluator = Evaluator(ground_truth, predictions)
+
+    table = evaluator.mismatches()
+    assert list(table.columns) == ["index", "field", "kind", "ground_truth", "prediction"]
+    assert table.values.tolist() == [[0, "b", "ip", "x", "z"], [1, "a", "fn", "2", ""], [2, "b", "fn", "y", ""]]
+    assert evaluator.mismatches(["fp"]).values.tolist() == [[1, "b", "fp", "", "w"], [2, "a", "fp", "", "3"]]
+
+    assert Evaluator(ground_truth[:1], ground_truth[:1]).mismatches().empty
+    with pytest.raises(ValueError):
+        StreamingEvaluator(collect_mismatches=False).mismatches()
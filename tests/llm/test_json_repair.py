@@ -0,0 +1,98 @@
+import json
+import random
+
+import pytest
+
+from superai.llm.utilities import fix_json, json_repair, repair_json
+
+
+@pytest.mark.parametrize(
+    "text, expected, repairs",
+    [
+        ('{"a": 1, "b": [1, 2,],}', {"a": 1, "b": [1, 2]}, ["trailing_comma", "trailing_comma"]),
+        ('{"a": 1,, "b": 2}', {"a": 1, "b": 2}, ["extra_comma"]),
+        ('{"items": [{"x": 1}{"x": 2}]}', {"items": [{"x": 1}, {"x": 2}]}, ["missing_comma"]),
+        ('{"a": "x"\n"b": [1 2]}', {"a": "x", "b": [1, 2]}, ["missing_comma", "missing_comma"]),
+        (
+            "{'a': 'it's', 'b': \"x\"}",
+            {"a": "it's", "b": "x"},
+            ["single_quotes"] * 2 + ["unescaped_quote"] + ["single_quotes"],
+        ),
+        ("{name: John Smith, ok: True, none: None}", {"name": "John Smith", "ok": True, "none": None}, None),
+        ('{"a": "He said "hi" to me"}', {"a": 'He said "hi" to me'}, ["unescaped_quote", "unescaped_quote"]),
+        ('{"a": foo", "b": }', {"a": "foo", "b": None}, ["missing_opening_quote", "missing_value"]),
+        ('{"a": "line\nbreak", "b": "\\x \\u12"}', {"a": "line\nbreak", "b": "\\x \x12"}, None),
+        ('{"a": 1 // comment\n, /* note */ "b": 2}', {"a": 1, "b": 2}, ["comment", "comment"]),
+        ('{"a": {"b": [1, 2}, "c": 3}', {"a": {"b": [1, 2]}, "c": 3}, ["missing_closing_bracket"]),
+        ('{"a": "truncated', {"a": "truncated"}, ["missing_closing_quote", "missing_closing_bracket"]),
+        ('{"a": [1, 2], "trunc', {"a": [1, 2]}, ["missing_closing_quote", "truncated_key", "missing_closing_bracket"]),
+        ('{"a": 1}}', {"a": 1}, ["trailing_text"]),
+        (
+            'Here is the output:\n```json\n{"answer": "Paris", "confidence": 0.9\n```',
+            {"answer": "Paris", "confidence": 0.9},
+            ["leading_text", "trailing_text", "missing_closing_bracket"],
+        ),
+    ],
+)
+def test_repair_json(text, expected, repairs):
+    result = repair_json(text)
+    assert json.loads(result.text) == expected
+    assert fix_json(text) == result.text
+    if repairs is not None:
+        assert [repair.kind for repair in result.repairs] == repairs
+    assert all(0 <= repair.position <= len(text) for repair in result.repairs)
+
+
+def test_repair_json_keeps_valid_and_unrepairable_text():
+    text = '{"a": [1, 2], "b": "\\"x\\""}'
+    result = repair_json(text)
+    assert result.text == text and not result.changed
+    assert repair_json("no json here").text == "no json here"
+    # The layout is kept, only the errors are changed
+    assert repair_json('{\n  "a": 1,\n  "b": 2,\n}').text == '{\n  "a": 1,\n  "b": 2\n}'
+
+
+def test_repair_json_always_gives_valid_json():
+    rng = random.Random(0)
+    value = {
+        "name": 'Jane "JD" Doe',
+        "items": [{"sku": "A-1", "qty": 2, "price": 9.5}, {"sku": "B", "qty": None}],
+        "notes": "line1\nline2 \\ back",
+        "valid": True,
+        "empty": {},
+    }
+    texts = [json.dumps(value), json.dumps(value, indent=2)]
+    alphabet = list("{}[]\",:'\\/ \n\tab01-.`*") + ["\x00", "True", "//", "/*"]
+    for _ in range(3000):
+        text = rng.choice(texts)
+        for _ in range(rng.randint(1, 5)):
+            position = rng.randrange(len(text) + 1)
+            operation = rng.random()
+            if operation < 0.4:
+                text = text[:position] + text[position + 1 :]
+            elif operation < 0.8:
+                text = text[:position] + rng.choice(alphabet) + text[position:]
+            else:
+                text = text[:position]
+        if "{" in text or "[" in text:
+            json.loads(repair_json(text).text)
+
+
+def test_repair_json_stays_linear(monkeypatch):
+    # Each failed attempt of the scanner counts the lines from the start of the text up to its error
+    decoder, error_positions = json_repair._DECODER, []
+
+    class Decoder:
+        @staticmethod
+        def raw_decode(text, position):
+            try:
+                return decoder.raw_decode(text, position)
+            except json.JSONDecodeError as e:
+                error_positions.append(e.pos)
+                raise
+
+    monkeypatch.setattr(json_repair, "_DECODER", Decoder)
+    text = "[" + '{"a": [1 2], "b": {"c": 3,}},\n' * 2000 + "]"
+    assert json.loads(repair_json(text).text) == [{"a": [1, 2], "b": {"c": 3}}] * 2000
+    # The budget of 2 characters per character of text, overrun by the last attempt
+    assert sum(error_positions) <= 3 * len(text)
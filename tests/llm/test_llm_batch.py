@@ -0,0 +1,142 @@
+import asyncio
+import json
+import re
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from superai.data_program.protocol.rate_limit import Limit
+from superai.llm.ai import LLM
+from superai.llm.ai.batch import run_batch
+from superai.llm.data_types import Any
+from superai.llm.dataset import Data, Dataset
+from superai.llm.foundation_models import ChatGPT
+from superai.llm.foundation_models.base import FoundationModel
+
+
+class EchoModel(FoundationModel):
+    """Answers with the question number found in the prompt, fails on the questions in `failing`."""
+
+    failing: set = set()
+    calls: list = []
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    def check_api_key(self, api_key):
+        pass
+
+    def predict(self, prompt_instance):
+        return self._answer(prompt_instance.content)
+
+    async def apredict(self, prompt_instance):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            return self._answer(prompt_instance.content)
+        finally:
+            self.in_flight -= 1
+
+    def _answer(self, prompt):
+        question = re.search(r"question (\d+)", prompt).group(1)
+        self.calls.append(question)
+        if question in self.failing:
+            raise RuntimeError(f"question {question} failed")
+        return json.dumps({"answer": question})
+
+
+@pytest.fixture()
+def llm():
+    llm = LLM(input_schema=Any(), output_schema=Any(), foundation_model=EchoModel(failing={"3", "7"}, calls=[]))
+    llm.set_components(role="Answer the question.", prompt_output_format='{"answer": "<number>"}')
+    return llm
+
+
+def questions(n):
+    return [Data(input=f"question {i}") for i in range(n)]
+
+
+@pytest.mark.parametrize("parallelize", [True, False])
+def test_predict_keeps_order_and_errors(llm, parallelize):
+    result = llm.predict(questions(20), parallelize=parallelize, max_concurrency=4)
+
+    assert isinstance(result, Dataset)
+    assert [data.input for data in result.data] == [f"question {i}" for i in range(20)]
+    assert [data.output for data in result.data] == [None if i in (3, 7) else {"answer": str(i)} for i in range(20)]
+    assert result.get_errors() == {3: "RuntimeError: question 3 failed", 7: "RuntimeError: question 7 failed"}
+    if parallelize:
+        assert 1 < llm.foundation_model.max_in_flight <= 4
+
+
+def test_predict_resumes_failed_inputs(llm):
+    inputs = Dataset(input_schema=Any(), output_schema=Any(), data=questions(10))
+    first = llm.predict(inputs)
+    assert sorted(first.get_errors()) == [3, 7]
+
+    llm.foundation_model.calls = []
+    llm.foundation_model.failing = set()
+    second = llm.predict(inputs, resume_from=first)
+
+    assert sorted(llm.foundation_model.calls) == ["3", "7"]
+    assert second.get_errors() == {}
+    assert [data.output for data in second.data] == [{"answer": str(i)} for i in range(10)]
+
+    with pytest.raises(ValueError):
+        llm.predict(questions(3), resume_from=first)
+
+
+def test_apredict_within_running_loop(llm):
+    async def main():
+        single = await llm.apredict(Data(input="question 5"))
+        batch = await llm.apredict(questions(5), max_concurrency=2)
+        # The sync api can still be used from a coroutine, it runs on its own loop
+        sync = llm.predict(questions(2))
+        return single, batch, sync
+
+    single, batch, sync = asyncio.run(main())
+    assert single.output == {"answer": "5"}
+    assert sorted(batch.get_errors()) == [3]
+    assert [data.output for data in sync.data] == [{"answer": "0"}, {"answer": "1"}]
+
+
+def test_run_batch_skips_done_inputs():
+    seen = []
+
+    async def double(x):
+        seen.append(x)
+        if x == 4:
+            raise ValueError("four")
+        return 2 * x
+
+    results = asyncio.run(run_batch(double, list(range(6)), max_concurrency=3, done={0: "kept", 2: "kept"}))
+    assert results[:4] == ["kept", 2, "kept", 6]
+    assert isinstance(results[4], ValueError) and results[5] == 10
+    assert sorted(seen) == [1, 3, 4, 5]
+
+
+class OpenAIMockResponse(dict):
+    def to_dict_recursive(self):
+        return dict(self)
+
+
+def test_chat_gpt_apredict(monkeypatch):
+    limiter = Mock()
+    limiter.async_acquire = AsyncMock(return_value=0)
+    monkeypatch.setattr("superai.llm.foundation_models.openai.rate_limiter", limiter)
+    acreate = AsyncMock(
+        side_effect=[
+            OpenAIMockResponse({"choices": [{"finish_reason": "length", "message": {"content": "no penalty"}}]}),
+            OpenAIMockResponse({"choices": [{"finish_reason": "stop", "message": {"content": "penalty 0.5"}}]}),
+        ]
+    )
+    monkeypatch.setattr("openai.ChatCompletion.acreate", acreate)
+
+    model = ChatGPT(engine="gpt-3.5-turbo")
+    assert asyncio.run(model.apredict("test")) == "penalty 0.5"
+    assert acreate.call_args.kwargs["frequency_penalty"] == 0.5
+    limiter.async_acquire.assert_called_with(Limit("gpt-3.5-turbo_RPM", 3500), Limit("gpt-3.5-turbo_TPM", 240000, 1))
+
+
+def test_chat_gpt_max_concurrency():
+    assert ChatGPT(engine="gpt-4", rpm={"gpt-4": 5}).max_concurrency() == 5
+    assert ChatGPT(engine="gpt-4").max_concurrency() == 32
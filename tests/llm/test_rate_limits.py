@@ -1,10 +1,19 @@
-import datetime
+import asyncio
+import multiprocessing
+import threading
+import time
 from unittest.mock import Mock, patch
 
+import diskcache as dc
 import pytest
 from openai.error import RateLimitError
 
-from superai.data_program.protocol.rate_limit import compute_api_wait_time
+from superai.data_program.protocol import rate_limit
+from superai.data_program.protocol.rate_limit import (
+    Limit,
+    RateLimiter,
+    compute_api_wait_time,
+)
 from superai.llm.foundation_models.openai import ChatGPT
 
 
@@ -66,34 +75,125 @@ def test_rate_exceeding_handling(chat_gpt_model):
 
 
 def test_wait_for_rate_limits(monkeypatch, chat_gpt_model):
-    # RPM call, retrial, TPM call, RPM retrial, TPM retrial
-    return_data = [0.5, 0, 0.1, 0, 0]
-    test_mock = Mock(side_effect=return_data)
-    monkeypatch.setattr(
-        "superai.llm.foundation_models.openai.compute_api_wait_time",
-        test_mock,
-    )
+    limiter = Mock()
+    limiter.acquire.return_value = 0.5
+    monkeypatch.setattr("superai.llm.foundation_models.openai.rate_limiter", limiter)
 
     chat_gpt_model._wait_for_rate_limits("gpt-3.5-turbo", 50)
-    assert test_mock.call_count == len(return_data)
+    limiter.acquire.assert_called_once_with(Limit("gpt-3.5-turbo_RPM", 3500), Limit("gpt-3.5-turbo_TPM", 240000, 50))
 
 
-@patch("superai.data_program.protocol.rate_limit.datetime")
-def test_compute_api_wait_time(datetime_mock):
-    model_name = "fancy_model"
-    passed_secs = 3
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
 
-    # Fixes time, to make tests consistent
-    datetime_mock.datetime.now = Mock(return_value=datetime.datetime(2023, 2, 26, 0, 10, passed_secs, 0))
+
+@pytest.fixture()
+def limiter(tmp_path, clock, monkeypatch):
+    limiter = RateLimiter(dc.Cache(str(tmp_path)), clock=clock)
+    monkeypatch.setattr(rate_limit, "rate_limiter", limiter)
+    return limiter
+
+
+def test_compute_api_wait_time(limiter, clock):
+    model_name = "fancy_model"
 
     # First call, tests fresh key
     assert compute_api_wait_time(model_name, 30, 25) == 0
     # Seconds call should't exceed threshold
     assert compute_api_wait_time(model_name, 30, 1) == 0
-    # Third call should exceed.
-    assert compute_api_wait_time(model_name, 30, 10) == 60 - passed_secs
+    # Third call should exceed, and wait until enough tokens are refilled, 2 every 4 seconds
+    assert compute_api_wait_time(model_name, 30, 10) == pytest.approx(12)
+    # Nothing was reserved
+    assert compute_api_wait_time(model_name, 30, 10) == pytest.approx(12)
     # New model call shouldn't exceed
     assert compute_api_wait_time(model_name + "_NEW", 30, 10) == 0
-    # New minute should reset rates
-    datetime_mock.datetime.now = Mock(return_value=datetime.datetime(2023, 2, 26, 0, 11, passed_secs, 0))
-    assert compute_api_wait_time(model_name, 30, 1) == 0
+    # Tokens are refilled continuously, not at the next minute
+    clock.now += 12
+    assert compute_api_wait_time(model_name, 30, 10) == 0
+    clock.now += 60
+    assert compute_api_wait_time(model_name, 30, 30) == 0
+
+
+def test_rate_limiter_reserves_all_limits_at_once(limiter, clock):
+    rpm = Limit("model_RPM", 60)
+    assert limiter.reserve(rpm, Limit("model_TPM", 100, 100)) == 0
+    # The tokens are exhausted, the request is scheduled once 50 tokens are back, 30 seconds later
+    assert limiter.reserve(rpm, Limit("model_TPM", 100, 50)) == pytest.approx(30)
+    # The request counts for both limits from the time it is sent
+    assert limiter.reserve(Limit("model_RPM", 60, 59)) == pytest.approx(30)
+    assert limiter.reserve(Limit("model_TPM", 100, 1)) == pytest.approx(30.6)
+
+
+def test_rate_limiter_burst(limiter):
+    limit = Limit("burst", 60, burst=2)
+    assert limiter.reserve(limit) == 0
+    assert limiter.reserve(limit) == 0
+    assert limiter.reserve(limit) == pytest.approx(1)
+    assert limiter.reserve(limit) == pytest.approx(2)
+    # Requests above the burst wait for a full bucket
+    assert limiter.reserve(Limit("burst", 60, 10, burst=2)) == pytest.approx(4)
+
+
+def test_rate_limiter_async_acquire(limiter, monkeypatch):
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+    async def main():
+        return await asyncio.gather(*(limiter.async_acquire(Limit("async", 60, burst=1)) for _ in range(3)))
+
+    assert sorted(asyncio.run(main())) == pytest.approx([0, 1, 2])
+    assert sorted(sleeps) == pytest.approx([1, 2])
+
+
+RATE = 40
+BURST = 10
+PERIOD = 1.0
+
+
+def _caller(directory, calls, results):
+    limiter = RateLimiter(dc.Cache(directory), period=PERIOD)
+
+    def call():
+        for _ in range(calls):
+            limiter.acquire(Limit("shared", RATE, burst=BURST))
+            results.put(time.time())
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_rate_limiter_concurrent_callers(tmp_path):
+    """Several processes with several threads each share the limit through the cache directory."""
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=_caller, args=(str(tmp_path), 5, results)) for _ in range(3)]
+    start = time.time()
+    for process in processes:
+        process.start()
+    times = sorted(results.get(timeout=30) for _ in range(60))
+    for process in processes:
+        process.join(10)
+
+    # 60 requests, the first BURST right away, then RATE per PERIOD
+    assert time.time() - start >= (60 - BURST) / RATE * PERIOD - 0.05
+    # No window holds more than the bucket allows, with some slack for the scheduling of the threads
+    slack = 0.05
+    for i, first in enumerate(times):
+        for j in range(i, len(times)):
+            assert j - i + 1 <= BURST + RATE * (times[j] - first + slack) / PERIOD + 1
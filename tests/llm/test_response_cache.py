@@ -0,0 +1,170 @@
+import asyncio
+import re
+from collections import Counter
+from unittest.mock import Mock
+
+import pytest
+
+from superai.llm.configuration import Configuration
+from superai.llm.foundation_models import ChatGPT, OpenAIEmbedding
+from superai.llm.foundation_models.cache import (
+    DiskResponseCache,
+    MemoryResponseCache,
+    SemanticResponseCache,
+    default_response_cache,
+    response_cache_key,
+)
+
+
+def chat(content, **params):
+    return {"model": "gpt-4", "messages": [{"role": "system", "content": content}], "temperature": 0, **params}
+
+
+def answer(content):
+    return {"choices": [{"finish_reason": "stop", "message": {"content": content}}]}
+
+
+def test_response_cache_key_normalization():
+    key = response_cache_key(chat("What is the capital of France?"))
+    assert response_cache_key(chat("  What is the capital of France?\n", user="someone", stream=None)) == key
+    azure = chat("What is the capital of France?")
+    azure["engine"] = azure.pop("model")
+    assert response_cache_key(azure) == key
+    assert response_cache_key(chat("What is the capital of Italy?")) != key
+    assert response_cache_key(chat("What is the capital of France?", temperature=0.5)) != key
+    assert response_cache_key({"model": "ada", "input": "text"}) == response_cache_key(
+        {"model": "ada", "input": ["text"]}
+    )
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_cache_evicts_and_expires():
+    clock = FakeClock()
+    cache = MemoryResponseCache(max_size=2, ttl=60, clock=clock)
+    cache.set(chat("a"), answer("A"))
+    cache.set(chat("b"), answer("B"))
+    assert cache.get(chat("a")) == answer("A")
+    # b is the least recently used
+    cache.set(chat("c"), answer("C"))
+    assert cache.get(chat("b")) is None
+    assert cache.get(chat("c")) == answer("C")
+
+    clock.now += 61
+    assert cache.get(chat("a")) is None
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.size) == (2, 2, 1)
+    assert stats.hit_rate == 0.5
+
+
+def test_disk_cache_is_shared(tmp_path):
+    DiskResponseCache(str(tmp_path)).set(chat("a"), answer("A"))
+    cache = DiskResponseCache(str(tmp_path), ttl=60)
+    assert cache.get(chat("a")) == answer("A")
+    assert cache.get(chat("b")) is None
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0 and cache.stats.hits == 0
+
+
+def bag_of_words(text):
+    words = Counter(re.findall(r"[a-z]+", text.lower()))
+    return [words[word] for word in ("capital", "france", "italy", "the", "of", "what", "is", "paris")]
+
+
+def test_semantic_cache():
+    embed = Mock(side_effect=bag_of_words)
+    cache = SemanticResponseCache(MemoryResponseCache(), embed, threshold=0.95)
+
+    assert cache.get(chat("What is the capital of France?")) is None
+    cache.set(chat("What is the capital of France?"), answer("Paris"))
+    # The embedding of the missed lookup is reused by `set`
+    assert embed.call_count == 1
+
+    assert cache.get(chat("what is the capital of france")) == answer("Paris")
+    assert cache.get(chat("What is the capital of Italy?")) is None
+    # Only requests with the same params are compared
+    assert cache.get(chat("what is the capital of france", max_tokens=10)) is None
+    assert cache.get(chat("What is the capital of France?")) == answer("Paris")
+
+    stats = cache.stats
+    assert (stats.hits, stats.semantic_hits, stats.misses) == (1, 1, 3)
+
+
+def test_semantic_cache_embedding_failure():
+    cache = SemanticResponseCache(MemoryResponseCache(), Mock(side_effect=RuntimeError("down")))
+    assert cache.get(chat("a")) is None
+    cache.set(chat("a"), answer("A"))
+    assert cache.get(chat("a")) == answer("A")
+
+
+def fake_openai_call(filtered_params, token_count):
+    return answer(f"temperature {filtered_params['temperature']}")
+
+
+def test_chat_gpt_caches_deterministic_requests():
+    cache = MemoryResponseCache()
+    model = ChatGPT(cache=cache)
+    model._openai_call = Mock(side_effect=fake_openai_call)
+
+    assert model.predict("test") == "temperature 0"
+    assert model.predict("test") == "temperature 0"
+    assert model._openai_call.call_count == 1
+    assert asyncio.run(model.apredict("test")) == "temperature 0"
+
+    model.temperature = 0.7
+    assert model.predict("test") == "temperature 0.7"
+    assert model.predict("test") == "temperature 0.7"
+    assert model._openai_call.call_count == 3
+    assert (cache.stats.hits, cache.stats.misses) == (2, 1)
+
+
+def test_chat_gpt_cache_ignores_the_derived_max_tokens():
+    # The prompts have different token counts, so ChatGPT requests different `max_tokens` for them
+    cache = SemanticResponseCache(MemoryResponseCache(), Mock(side_effect=bag_of_words), threshold=0.95)
+    model = ChatGPT(cache=cache)
+    model._openai_call = Mock(return_value=answer("Paris"))
+
+    assert model.predict("What is the capital of France?") == "Paris"
+    assert model.predict("  What is the capital of France?\n\n") == "Paris"
+    assert model.predict("what is the capital of france") == "Paris"
+    assert model._openai_call.call_count == 1
+    assert (cache.stats.hits, cache.stats.semantic_hits) == (1, 1)
+
+
+def test_chat_gpt_default_cache_is_opt_in(monkeypatch):
+    assert ChatGPT().cache is None
+
+    config = Configuration()
+    config.response_cache_backend = "memory"
+    monkeypatch.setattr("superai.llm.foundation_models.cache.Configuration", lambda: config)
+    default_response_cache.cache_clear()
+    try:
+        assert ChatGPT().cache is ChatGPT().cache is not None
+        assert ChatGPT(cache=None).cache is None
+    finally:
+        default_response_cache.cache_clear()
+
+
+def test_embedding_cache(monkeypatch):
+    create = Mock(return_value={"data": [{"embedding": [0.1, 0.2]}]})
+    monkeypatch.setattr("openai.Embedding.create", create)
+    model = OpenAIEmbedding(cache=MemoryResponseCache())
+
+    assert model.predict("text") == pytest.approx([0.1, 0.2])
+    assert model.predict(["text"]) == [pytest.approx([0.1, 0.2])]
+    assert create.call_count == 1
+
+
+@pytest.mark.parametrize("max_size", [0, 1])
+def test_memory_cache_size(max_size):
+    cache = MemoryResponseCache(max_size=max_size)
+    for i in range(3):
+        cache.set(chat(str(i)), answer(str(i)))
+    assert len(cache) == max_size
@@ -0,0 +1,42 @@
+import random
+
+from superai.llm.data_processing.document_preparation import (
+    filter_tokens_by_text_box,
+    intersect,
+)
+from superai.llm.data_processing.spatial_index import BoxIndex
+
+
+def random_box(rng, size=100):
+    return {
+        "left": rng.choice([rng.randint(0, 1000), rng.uniform(0, 1000)]),
+        "top": rng.randint(0, 1000),
+        # Includes empty and inverted boxes
+        "width": rng.choice([0, -5, rng.randint(1, size), rng.uniform(0, size)]),
+        "height": rng.choice([0, rng.randint(1, size)]),
+    }
+
+
+def test_box_index_matches_brute_force():
+    rng = random.Random(0)
+    tokens = [{"boundingBox": random_box(rng), "pageNumber": rng.randint(1, 3)} for _ in range(500)]
+    index = BoxIndex.from_boxes([token["boundingBox"] for token in tokens], [token["pageNumber"] for token in tokens])
+    alive = set(range(len(tokens)))
+    for _ in range(200):
+        box, page = random_box(rng, size=rng.choice([20, 300, 2000])), rng.randint(1, 3)
+        expected = [
+            id for id in sorted(alive) if tokens[id]["pageNumber"] == page and intersect(box, tokens[id]["boundingBox"])
+        ]
+        assert list(index.intersecting(box, page)) == expected
+
+        remaining = filter_tokens_by_text_box([tokens[id] for id in sorted(alive)], box, page)
+        covered = set(alive) - {id for id in alive if any(tokens[id] is token for token in remaining)}
+        assert set(index.covered(box, page, 0.9)) == covered
+
+        for id in rng.sample(sorted(covered), min(len(covered), 3)):
+            index.remove(id)
+            alive.discard(id)
+        token = {"boundingBox": random_box(rng), "pageNumber": page}
+        tokens.append(token)
+        alive.add(index.add(token["boundingBox"], page))
+    assert len(index) == len(alive)
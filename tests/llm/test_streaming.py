@@ -0,0 +1,169 @@
+import json
+import random
+
+import pytest
+
+from superai.llm.ai import LLM
+from superai.llm.data_types import Any
+from superai.llm.foundation_models import ChatGPT
+from superai.llm.foundation_models.cache import MemoryResponseCache
+from superai.llm.foundation_models.streaming import CompletionStream, RepetitionDetector
+from superai.llm.utilities.json_stream import IncrementalJSONParser, iter_json_fields
+
+
+def deltas(text, seed=0):
+    """Splits `text` in random deltas, like the tokens of a streamed completion."""
+    rng = random.Random(seed)
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        yield text[i : i + size]
+        i += size
+
+
+class FakeStream:
+    """Chunks of a streamed completion, counting how many were read and whether the stream was closed."""
+
+    def __init__(self, parts, finish_reason="stop"):
+        self.parts = list(parts)
+        self.finish_reason = finish_reason
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        yield {"choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]}
+        for part in self.parts:
+            self.read += 1
+            yield {"choices": [{"delta": {"content": part}, "finish_reason": None}]}
+        yield {"choices": [{"delta": {}, "finish_reason": self.finish_reason}]}
+
+    def close(self):
+        self.closed = True
+
+
+def test_incremental_parser_yields_fields_when_complete():
+    output = {
+        "name": 'Jane "JD" Doe, {not a brace}',
+        "address": {"street": "1 Main St", "lines": [1, [2, 3]]},
+        "tags": ["a,b", "c]"],
+        "score": 0.5,
+        "valid": True,
+        "note": None,
+    }
+    text = "```json\n" + json.dumps(output, indent=2) + "\n```"
+    parser = IncrementalJSONParser()
+    seen = []
+    for delta in deltas(text):
+        for key, value in parser.feed(delta):
+            seen.append(key)
+            assert value == output[key]
+            # The field is given as soon as the text following it arrives
+            assert key in parser.fields
+    assert seen == list(output)
+    assert parser.done
+    assert parser.result() == output
+
+
+def test_incremental_parser_repairs_fields():
+    parser = IncrementalJSONParser()
+    fields = list(iter_json_fields(deltas('{\'a\': 1, "b": [1, 2,], "c": "x"}'), parser))
+    assert fields == [("a", 1), ("b", [1, 2]), ("c", "x")]
+
+    parser = IncrementalJSONParser()
+    assert list(iter_json_fields(deltas('{"a": 1, "b": {"c": '), parser)) == [("a", 1)]
+    assert not parser.done
+    # The unfinished object is closed by the repair
+    assert parser.result() == {"a": 1, "b": {"c": None}}
+    assert IncrementalJSONParser().result() is None
+
+
+def test_repetition_detector():
+    detector = RepetitionDetector(window=60, max_period=20)
+    text = '{"summary": "The invoice lists the following items: chair, table, lamp. ' + "and more, " * 20
+    detected = next((i for i, delta in enumerate(text) if detector.feed(delta)), None)
+    assert detected is not None and detected < len(text) - 60
+
+    detector = RepetitionDetector(window=60, max_period=20)
+    text = json.dumps({"items": [f"item {i}" for i in range(100)]})
+    assert not any(detector.feed(delta) for delta in deltas(text))
+
+    # Legitimately repetitive output is not a runaway for the default window
+    detector = RepetitionDetector()
+    text = json.dumps({"flags": [False] * 200, "values": [0] * 200})
+    assert not any(detector.feed(delta) for delta in deltas(text))
+
+
+def test_completion_stream():
+    chunks = FakeStream(deltas('{"a": 1}'))
+    finished = []
+    stream = CompletionStream(chunks, on_finish=finished.append)
+    assert "".join(stream) == '{"a": 1}'
+    assert stream.text == '{"a": 1}' and stream.finish_reason == "stop"
+    assert finished == [stream] and chunks.closed
+
+    chunks = FakeStream(['{"a": "'] + ["ab"] * 1000)
+    stream = CompletionStream(chunks, RepetitionDetector(window=40, max_period=10), on_finish=finished.append)
+    list(stream)
+    assert stream.finish_reason == "repetition"
+    assert chunks.read < 30 and chunks.closed
+    assert len(finished) == 1
+
+
+@pytest.fixture()
+def create(monkeypatch):
+    streams = []
+
+    def fake_create(**params):
+        assert params["stream"]
+        if params.get("frequency_penalty"):
+            stream = FakeStream(deltas(json.dumps({"answer": "Paris", "confidence": 0.9})))
+        else:
+            stream = FakeStream(['{"answer": "Paris", "explanation": "'] + ["Paris is the capital. "] * 500)
+        streams.append(stream)
+        return stream
+
+    monkeypatch.setattr("openai.ChatCompletion.create", fake_create)
+    monkeypatch.setattr("superai.llm.foundation_models.openai.ChatGPT._wait_for_rate_limits", lambda *args: None)
+    return streams
+
+
+def test_chat_gpt_stream_predict_stops_runaway_generation(create):
+    model = ChatGPT(stream=True, cache=MemoryResponseCache())
+    assert json.loads(model.predict("What is the capital of France?")) == {"answer": "Paris", "confidence": 0.9}
+    assert len(create) == 2
+    assert create[0].closed and create[0].read < 150
+
+    # The complete answer is cached, the runaway one is not
+    stream = model.stream_predict("What is the capital of France?", frequency_penalty=0.5)
+    assert json.loads("".join(stream)) == {"answer": "Paris", "confidence": 0.9}
+    assert len(create) == 2
+    assert model.cache.stats.size == 1
+
+
+def test_chat_gpt_stream_predict_never_returns_a_stopped_generation(monkeypatch):
+    answer = {"answer": "Paris", "explanation": "Paris is the capital. " * 200}
+    streams = []
+
+    def fake_create(**params):
+        streams.append(FakeStream(deltas(json.dumps(answer))))
+        return streams[-1]
+
+    monkeypatch.setattr("openai.ChatCompletion.create", fake_create)
+    monkeypatch.setattr("superai.llm.foundation_models.openai.ChatGPT._wait_for_rate_limits", lambda *args: None)
+    model = ChatGPT(stream=True, cache=None)
+    assert json.loads(model.predict("What is the capital of France?")) == answer
+    # The first runs are stopped as runaways, the last one is read to its end
+    assert len(streams) == 3 and streams[0].read < len(streams[0].parts)
+    assert streams[2].read == len(streams[2].parts)
+
+
+def test_llm_stream_predict(create):
+    llm = LLM(input_schema=Any(), output_schema=Any(), foundation_model=ChatGPT(stream=True, cache=None))
+    llm.set_components(role="Answer the question.", prompt_output_format='{"answer": "<city>", "confidence": "<0-1>"}')
+
+    fields = llm.stream_predict("What is the capital of France?")
+    assert next(fields) == ("answer", "Paris")
+    # The first field arrives while the first generation is still running
+    assert len(create) == 1 and create[0].read == 1
+    assert list(fields) == [("confidence", 0.9)]
+    assert len(create) == 2
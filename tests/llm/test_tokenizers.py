@@ -0,0 +1,43 @@
+import tiktoken
+
+from superai.llm.foundation_models import ChatGPT
+from superai.llm.tokenizers import TokenCounter, get_encoding, token_counter
+
+
+def test_get_encoding_is_shared():
+    assert get_encoding("gpt-3.5-turbo") is get_encoding("gpt-3.5-turbo")
+    assert get_encoding("gpt-35-turbo").name == "cl100k_base"
+
+
+def test_token_counter_caches_counts():
+    counter = TokenCounter(max_size=2)
+    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    texts = ["You are a helpful assistant.", "What is the capital of Jordan?", "Amman"]
+
+    assert counter.count(texts[0]) == len(encoding.encode(texts[0]))
+    assert counter.count(texts[0]) == len(encoding.encode(texts[0]))
+    assert (counter.stats.hits, counter.stats.misses, counter.stats.size) == (1, 1, 1)
+
+    # The least recently used count is evicted
+    counter.count(texts[1])
+    counter.count(texts[0])
+    counter.count(texts[2])
+    assert counter.stats.size == 2
+    counter.count(texts[1])
+    assert (counter.stats.hits, counter.stats.misses) == (2, 4)
+    assert counter.stats.hit_rate == 2 / 6
+
+    counter.clear()
+    assert (counter.stats.hits, counter.stats.misses, counter.stats.size) == (0, 0, 0)
+
+
+def test_count_tokens_reuses_repeated_prompts():
+    model = ChatGPT(engine="gpt-3.5-turbo")
+    system = {"role": "system", "content": "You extract fields from invoices. " * 50}
+    token_counter.clear()
+
+    counts = [model.count_tokens([system, {"role": "user", "content": f"Invoice {i}"}]) for i in range(10)]
+    assert len(set(counts)) == 1
+    # Every message is counted as a whole and per value, only the first system prompt is encoded
+    assert token_counter.stats.misses == 6 + 9 * 2
+    assert token_counter.stats.hits == 9 * 4
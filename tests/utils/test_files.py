@@ -1,9 +1,15 @@
 import os
 
 import boto3
+import pytest
+import requests
 from moto import mock_s3
 
-from superai.utils.files import pull_s3_folder, s3_download_file
+from superai.utils.files import (
+    download_file_to_directory,
+    pull_s3_folder,
+    s3_download_file,
+)
 
 # Define the parameters for the test
 bucket_name = "test-bucket"
@@ -50,3 +56,18 @@ def test_pull_s3_folder(tmp_path):
     file2 = tmp_path / "file2"
     assert file1.exists()
     assert file2.exists()
+
+
+def test_download_file_to_directory_errors_and_file_urls(tmp_path, mocker):
+    source = tmp_path / "source.txt"
+    source.write_text("content")
+    destination = download_file_to_directory(source.as_uri(), "copy.txt", tmp_path / "out")
+    assert (
+        destination == str(tmp_path / "out" / "copy.txt") and (tmp_path / "out" / "copy.txt").read_text() == "content"
+    )
+    with pytest.raises(RuntimeError):
+        download_file_to_directory((tmp_path / "missing.txt").as_uri(), "missing.txt", tmp_path / "out")
+
+    mocker.patch("superai.utils.files.download_file", side_effect=requests.ConnectionError("refused"))
+    with pytest.raises(RuntimeError, match="refused"):
+        download_file_to_directory("https://example.com/file.txt", "file.txt", tmp_path / "out")